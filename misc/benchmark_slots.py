@@ -0,0 +1,95 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#*** benchmark_slots - Memory and allocation cost of per-packet objects
+
+"""
+This code measures the memory per object of the objects that nmeta
+builds for each packet-in and identity harvest (Flow.Packet,
+Identities.Identity, Identities.DHCPMessage), as slot-based
+classes compared with equivalent __dict__ based classes, and the
+rate at which each can be allocated and serialised to a database
+document (the per packet-in cost).
+
+Does not need MongoDB. Run from the misc directory:
+
+    python benchmark_slots.py [iterations]
+
+Do not use this code for production deployments - it is proof of concept code
+and carries no warrantee whatsoever. You have been warned.
+"""
+
+import sys
+import timeit
+
+#*** Run against nmeta code:
+sys.path.insert(0, '../nmeta')
+
+#*** Ryu imports:
+from ryu.base import app_manager  # To suppress cyclic import
+
+#*** nmeta imports:
+import flows
+import identities
+
+CLASSES = [('Flow.Packet', flows.Flow.Packet),
+           ('Identities.Identity', identities.Identities.Identity),
+           ('Identities.DHCPMessage', identities.Identities.DHCPMessage)]
+
+def dict_class(cls):
+    """
+    Return an equivalent class to a slot-based class that stores
+    its attributes in a per-instance __dict__
+    """
+    def dbdict(self):
+        """
+        Return a copy of the instance __dict__
+        """
+        return dict(self.__dict__)
+    return type('Dict' + cls.__name__, (object,),
+                {'__init__': cls.__init__.im_func, 'dbdict': dbdict})
+
+def object_size(obj):
+    """
+    Return bytes used by an object, including its __dict__ if it has one
+    """
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+def allocation_rate(cls, iterations):
+    """
+    Return objects per second that can be allocated and serialised
+    """
+    elapsed = timeit.timeit(lambda: cls().dbdict(), number=iterations)
+    return iterations / elapsed
+
+def main():
+    """
+    Print memory per object and allocation rate for each class
+    """
+    iterations = 100000
+    if len(sys.argv) > 1:
+        iterations = int(sys.argv[1])
+    print "%-24s %12s %12s %14s %14s" % ('class', 'slots bytes', 'dict bytes',
+                                            'slots alloc/s', 'dict alloc/s')
+    for name, cls in CLASSES:
+        _dict_class = dict_class(cls)
+        print "%-24s %12s %12s %14.0f %14.0f" % (name, object_size(cls()),
+                                object_size(_dict_class()),
+                                allocation_rate(cls, iterations),
+                                allocation_rate(_dict_class, iterations))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#*** dashboard_load - Load test the External API with polling dashboards
+
+"""
+This code simulates WebUI dashboards (one thread each) polling the
+External API resources that the WebUI polls on timers, with the
+response cache disabled and then enabled. Dashboards send the ETag
+of their last response in If-None-Match, as browsers do.
+It prints requests per second, 304 Not Modified responses and
+computations (response cache misses) for each.
+
+Requests go to the Eve app in-process (Flask test client) rather than
+over HTTP, so that the numbers are for the API code.
+
+Requires MongoDB running, as per nmeta. Overwrites the nmeta database
+collections, so don't run it against a live nmeta. Run from the misc
+directory:
+
+    python dashboard_load.py [dashboards] [polls]
+
+Do not use this code for production deployments - it is proof of concept code
+and carries no warrantee whatsoever. You have been warned.
+"""
+
+import sys
+import time
+import datetime
+import threading
+
+#*** Run against nmeta code:
+sys.path.insert(0, '../nmeta')
+
+#*** nmeta imports:
+import config
+import flows
+import telemetry
+import api_external
+
+#*** Resources that the WebUI dashboards poll:
+URLS = ['/v1/infrastructure/controllers/summary/',
+        '/v1/infrastructure/controllers/pi_rate/',
+        '/v1/infrastructure/controllers/pi_time/',
+        '/v1/infrastructure/switches/stats/connected_switches',
+        '/v1/flows_removed/stats/src_bytes_sent',
+        '/v1/flows_removed/stats/src_bytes_received',
+        '/v1/flows_removed/stats/dst_bytes_sent',
+        '/v1/flows_removed/stats/dst_bytes_received']
+
+#*** Records to populate collections that are read by the resources
+#*** (packet-in processing times are published in intervals):
+PI_TIME_RECORDS = 5000
+PI_TIME_INTERVALS = 10
+PACKET_IN_RECORDS = 5000
+
+def populate(_config):
+    """
+    Recreate the nmeta database collections and populate the
+    collections that dashboards read with recent records
+    """
+    flow = flows.Flow(_config)
+    now = datetime.datetime.now()
+    #*** Packet-in processing time stats, as published by nmeta:
+    pi_telemetry = telemetry.Telemetry(_config)
+    for _ in range(PI_TIME_INTERVALS):
+        for index in range(PI_TIME_RECORDS // PI_TIME_INTERVALS):
+            pi_telemetry.record(0.001, 0.002 + index * 1e-6, not index % 10)
+        pi_telemetry.publish(1, 'normal')
+    flow.packet_ins.insert_many([{'timestamp': now, 'flow_hash': str(index)}
+                                for index in range(PACKET_IN_RECORDS)])
+
+def dashboard(client, polls, results):
+    """
+    Poll the resources, sending the ETag of the last response for
+    each resource in If-None-Match
+    """
+    etags = {}
+    not_modified = 0
+    for _ in range(polls):
+        for url in URLS:
+            headers = {}
+            if url in etags:
+                headers['If-None-Match'] = etags[url]
+            response = client.get(url, headers=headers)
+            if response.status_code == 304:
+                not_modified += 1
+            if 'ETag' in response.headers:
+                etags[url] = response.headers['ETag']
+    results.append(not_modified)
+
+def load(_config, dashboards, polls, cache_enabled):
+    """
+    Run dashboards concurrently, returning a tuple of seconds taken,
+    304 responses and response cache misses
+    """
+    api = api_external.ExternalAPI(_config)
+    api.response_cache_enabled = cache_enabled
+    api.setup_app()
+    results = []
+    threads = [threading.Thread(target=dashboard,
+                        args=(api.app.test_client(), polls, results))
+                        for _ in range(dashboards)]
+    start_time = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - start_time, sum(results), api.response_cache.misses
+
+def main():
+    """
+    Main function
+    """
+    dashboards = 50
+    polls = 10
+    if len(sys.argv) > 1:
+        dashboards = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        polls = int(sys.argv[2])
+    _config = config.Config()
+    populate(_config)
+    requests = dashboards * polls * len(URLS)
+    print "dashboards=%s polls=%s requests=%s" % (dashboards, polls, requests)
+    for name, cache_enabled in (('uncached', 0), ('cached', 1)):
+        seconds, not_modified, misses = load(_config, dashboards, polls,
+                                                            cache_enabled)
+        print "%-8s requests_per_sec=%.1f not_modified=%s computations=%s " \
+                "seconds=%.2f" % (name, requests / seconds, not_modified,
+                misses if cache_enabled else requests, seconds)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#*** recovery_time - Measure time for packet-in rate to recover after start
+
+"""
+This code measures how long after nmeta starts the packet-in rate
+takes to settle back to steady state, to compare a cold start with
+a warm start (see warm_start in config.yaml).
+
+Run it once traffic has been running for a while after nmeta starts.
+It reads the packet-in records in the pi_time database collection
+(which is recreated when nmeta starts), counts packet-ins per second,
+takes the steady state rate as the median of the last seconds, and
+prints the seconds from the first packet-in until the smoothed rate
+stays within a tolerance of steady state.
+
+Recovery time depends on the switches, topology and traffic mix of the
+network, so no reference figures are kept with the code; compare runs
+on the same lab build (see Build a Lab in the user guide).
+
+Requires MongoDB running, as per nmeta. Run from the misc directory:
+
+    python recovery_time.py [steady_seconds] [tolerance]
+
+Do not use this code for production deployments - it is proof of concept code
+and carries no warrantee whatsoever. You have been warned.
+"""
+
+import sys
+
+#*** Run against nmeta code:
+sys.path.insert(0, '../nmeta')
+
+#*** mongodb Database Import:
+from pymongo import MongoClient
+
+#*** nmeta imports:
+import config
+
+#*** Seconds of per second rates averaged to smooth out bursts:
+SMOOTHING = 5
+
+def rates(timestamps):
+    """
+    Passed a sorted list of datetimes and return a list of counts
+    per second since the first one
+    """
+    first = timestamps[0]
+    counts = [0] * (int((timestamps[-1] - first).total_seconds()) + 1)
+    for timestamp in timestamps:
+        counts[int((timestamp - first).total_seconds())] += 1
+    return counts
+
+def recovery_time(counts, steady_seconds, tolerance):
+    """
+    Passed packet-in counts per second, return a tuple of the steady
+    state rate and seconds until the smoothed rate stays within
+    tolerance (a fraction) of it
+    """
+    steady = sorted(counts[-steady_seconds:])[len(counts[-steady_seconds:])
+                                                                        // 2]
+    recovered = 0
+    for second in range(len(counts)):
+        window = counts[max(0, second - SMOOTHING + 1):second + 1]
+        smoothed = float(sum(window)) / len(window)
+        if abs(smoothed - steady) > tolerance * steady:
+            recovered = second + 1
+    return steady, recovered
+
+def main():
+    """
+    Read packet-in timestamps and print recovery time
+    """
+    steady_seconds = 30
+    tolerance = 0.2
+    if len(sys.argv) > 1:
+        steady_seconds = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        tolerance = float(sys.argv[2])
+    _config = config.Config()
+    mongo_client = MongoClient(_config.get_value("mongo_addr"),
+                                    _config.get_value("mongo_port"))
+    pi_time = mongo_client[_config.get_value("mongo_dbname")].pi_time
+    timestamps = [record['timestamp'] for record in
+                    pi_time.find({}, {'timestamp': 1}).sort('timestamp', 1)]
+    if len(timestamps) < 2:
+        print "Not enough packet-ins recorded"
+        return
+    counts = rates(timestamps)
+    if len(counts) < 2 * steady_seconds:
+        print "Warning: fewer than %s seconds of packet-ins, steady state " \
+                    "may not have been reached" % (2 * steady_seconds)
+    steady, recovered = recovery_time(counts, steady_seconds, tolerance)
+    print "packet_ins=%s seconds=%s" % (len(timestamps), len(counts))
+    print "peak_rate=%s steady_rate=%s" % (max(counts), steady)
+    print "recovery_seconds=%s" % recovered
+
+if __name__ == '__main__':
+    main()
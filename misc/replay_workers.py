@@ -0,0 +1,110 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#*** replay_workers - Replay packets through packet-in worker processes
+
+"""
+This code replays the test packet captures (tests/packets_*.py)
+through the nmeta packet-in worker pool (ingest, identity harvest
+and policy check) with 1, 2, 4 and 8 worker processes and prints
+packets per second for each, to measure how packet-in processing
+scales with cores.
+
+Requires MongoDB running, as per nmeta. Run from the misc directory:
+
+    python replay_workers.py [repeats]
+
+Do not use this code for production deployments - it is proof of concept code
+and carries no warrantee whatsoever. You have been warned.
+"""
+
+import sys
+import os
+import glob
+import time
+
+#*** Run against nmeta code and test packets:
+sys.path.insert(0, '../nmeta')
+sys.path.insert(0, '../tests')
+
+#*** Ryu imports:
+from ryu.base import app_manager  # To suppress cyclic import
+
+#*** nmeta imports:
+import config
+import policy
+import flows
+import identities
+import workers
+
+#*** Worker counts to measure:
+WORKERS = [1, 2, 4, 8]
+
+def load_packets():
+    """
+    Return a list of raw packets from all test packet modules
+    """
+    raws = []
+    for filename in sorted(glob.glob('../tests/packets_*.py')):
+        module = __import__(os.path.basename(filename)[:-3])
+        raws.extend(module.RAW)
+    return raws
+
+def replay(_config, raws, num_workers, repeats):
+    """
+    Replay raw packets through a pool of worker processes and
+    return packets per second
+    """
+    #*** Fresh database collections for workers to attach to:
+    _policy = policy.Policy(_config)
+    flows.Flow(_config)
+    identities.Identities(_config, _policy)
+    pool = workers.WorkerPool(_config)
+    pool.workers = num_workers
+    pool.start()
+    seq = 0
+    received = 0
+    start_time = time.time()
+    for repeat in range(repeats):
+        for raw in raws:
+            seq += 1
+            #*** Vary DPID so repeats are not deduplicated as same packet:
+            request = (repeat + 1, 1, raw, time.time(), False, True)
+            received += len(pool.submit(seq, workers.flow_key(raw), request))
+            received += len(pool.results())
+    while received < seq:
+        received += len(pool.results())
+    elapsed = time.time() - start_time
+    pool.stop()
+    return seq / elapsed
+
+def main():
+    """
+    Replay packets for each worker count and print results
+    """
+    repeats = 100
+    if len(sys.argv) > 1:
+        repeats = int(sys.argv[1])
+    _config = config.Config()
+    raws = load_packets()
+    print "Replaying %s packets x %s repeats" % (len(raws), repeats)
+    baseline = 0
+    for num_workers in WORKERS:
+        rate = replay(_config, raws, num_workers, repeats)
+        if not baseline:
+            baseline = rate
+        print "workers=%s packets/sec=%.1f speedup=%.2f" % (num_workers, rate,
+                                                            rate / baseline)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#*** suppress_aggregate - Compare fine-grained and aggregated suppression
+
+"""
+This code replays synthetic TCP flows (clients each opening several
+flows to a few server ports, half of them to TCP port 1234) through
+nmeta policy and the switch flow table abstraction, with fine-grained
+suppression flow entries and then with aggregated suppression
+(suppress_aggregate).
+Flow mods are applied to a simulated flow table, and packets that
+no flow entry matches are counted as packet-ins. It prints
+packet-ins and flow table occupancy for each.
+
+Uses the main policy, as per nmeta (the default policy depends on
+TCP port 1234 only). Flow entry timeouts are not simulated.
+
+Requires MongoDB running, as per nmeta. Run from the misc directory:
+
+    python suppress_aggregate.py [flows] [packets_per_flow]
+
+Do not use this code for production deployments - it is proof of concept code
+and carries no warrantee whatsoever. You have been warned.
+"""
+
+import sys
+import time
+import datetime
+
+#*** Run against nmeta code:
+sys.path.insert(0, '../nmeta')
+
+#*** Ryu imports:
+from ryu.base import app_manager  # To suppress cyclic import
+from ryu.ofproto import ofproto_v1_3
+from ryu.ofproto import ofproto_v1_3_parser
+from ryu.lib.packet import packet
+from ryu.lib.packet import ethernet
+from ryu.lib.packet import ipv4
+from ryu.lib.packet import tcp
+
+#*** nmeta imports:
+import config
+import policy
+import flows
+import identities
+import switches
+
+#*** Router MAC that servers are behind, and ports of clients and router:
+ROUTER_MAC = '52:54:00:12:35:02'
+CLIENT_PORT = 1
+ROUTER_PORT = 2
+
+#*** Server addresses and ports that flows go to:
+SERVERS = ['192.0.2.%s' % host for host in range(1, 5)]
+SERVER_PORTS = [1234, 1234, 80, 443]
+
+#*** Flows that each client opens:
+FLOWS_PER_CLIENT = 10
+
+class FakeDatapath(object):
+    """
+    Stands in for a Ryu datapath, applying flow mods to a
+    simulated flow table
+    """
+    def __init__(self):
+        self.id = 1
+        self.ofproto = ofproto_v1_3
+        self.ofproto_parser = ofproto_v1_3_parser
+        #*** Flow table keyed by (priority, match items):
+        self.table = {}
+
+    def send_msg(self, msg):
+        """
+        Apply a flow mod to the flow table
+        """
+        key = (msg.priority, tuple(sorted(msg.match.items())))
+        self.table[key] = msg
+
+    def lookup(self, values):
+        """
+        Return True if a flow entry matches the packet values
+        """
+        for priority, match in self.table:
+            if all(values.get(field) == value for field, value in match):
+                return True
+        return False
+
+def make_packet(eth_src, eth_dst, ip_src, ip_dst, tp_src, tp_dst, seq):
+    """
+    Return raw packet data and match values for a TCP packet
+    """
+    pkt = packet.Packet()
+    pkt.add_protocol(ethernet.ethernet(dst=eth_dst, src=eth_src,
+                                                        ethertype=0x0800))
+    pkt.add_protocol(ipv4.ipv4(src=ip_src, dst=ip_dst, proto=6))
+    pkt.add_protocol(tcp.tcp(src_port=tp_src, dst_port=tp_dst, seq=seq,
+                                                    bits=tcp.TCP_ACK))
+    pkt.serialize()
+    values = {'eth_type': 0x0800, 'eth_src': eth_src, 'eth_dst': eth_dst,
+                'ipv4_src': ip_src, 'ipv4_dst': ip_dst, 'ip_proto': 6,
+                'tcp_src': tp_src, 'tcp_dst': tp_dst}
+    return str(pkt.data), values
+
+def flow_packets(num_flows, packets_per_flow):
+    """
+    Return a list of (in_port, out_port, raw data, values) for
+    packets of flows, in both directions, interleaved across flows.
+    Each client opens FLOWS_PER_CLIENT flows
+    """
+    flows_list = []
+    num_clients = max(1, num_flows // FLOWS_PER_CLIENT)
+    for index in range(num_flows):
+        client = index % num_clients
+        client_mac = '08:00:27:%02x:%02x:%02x' % (client >> 16 & 255,
+                                            client >> 8 & 255, client & 255)
+        client_ip = '10.%s.%s.%s' % (client >> 16 & 255, client >> 8 & 255,
+                                                                client & 255)
+        server_ip = SERVERS[index % len(SERVERS)]
+        server_port = SERVER_PORTS[index % len(SERVER_PORTS)]
+        client_port = 32768 + index // num_clients
+        flows_list.append((client_mac, client_ip, client_port, server_ip,
+                                                                server_port))
+    packets = []
+    for seq in range(packets_per_flow):
+        for client_mac, client_ip, client_port, server_ip, server_port \
+                                                            in flows_list:
+            if seq % 2:
+                raw, values = make_packet(ROUTER_MAC, client_mac, server_ip,
+                                    client_ip, server_port, client_port, seq)
+                packets.append((ROUTER_PORT, CLIENT_PORT, raw, values))
+            else:
+                raw, values = make_packet(client_mac, ROUTER_MAC, client_ip,
+                                    server_ip, client_port, server_port, seq)
+                packets.append((CLIENT_PORT, ROUTER_PORT, raw, values))
+    return packets
+
+def replay(_config, packets, aggregate_enabled):
+    """
+    Replay packets, returning a tuple of packet-ins, flow entries
+    in the simulated flow table and seconds taken
+    """
+    _policy = policy.Policy(_config)
+    flow = flows.Flow(_config)
+    ident = identities.Identities(_config, _policy)
+    datapath = FakeDatapath()
+    flowtables = switches.FlowTables(_config, datapath,
+                        _config.get_value("flow_mod_cookie_reverse_offset"))
+    packet_ins = 0
+    start_time = time.time()
+    for in_port, out_port, raw, values in packets:
+        values['in_port'] = in_port
+        if datapath.lookup(values):
+            continue
+        packet_ins += 1
+        context = flow.ingest_packet(datapath.id, in_port, raw,
+                                                    datetime.datetime.now())
+        classification = context.classification
+        if not classification.classified:
+            _policy.check_policy(context, ident)
+            classification.commit()
+        if not classification.classified:
+            continue
+        aggregate = None
+        if aggregate_enabled:
+            aggregate = _policy.aggregate_fields(context.packet,
+                                                    classification.actions)
+        out_queue = 0
+        if 'qos_treatment' in classification.actions:
+            out_queue = _policy.qos(classification.actions['qos_treatment'])
+        msg = type('Msg', (object,), {'data': raw,
+                                            'match': {'in_port': in_port}})
+        if flow.not_suppressed(datapath.id, 'suppress'):
+            result = flowtables.suppress_flow(msg, in_port, out_port,
+                                                        out_queue, aggregate)
+            flow.record_suppression(datapath.id, 'suppress', result)
+    return packet_ins, len(datapath.table), time.time() - start_time
+
+def main():
+    """
+    Main function
+    """
+    num_flows = 2000
+    packets_per_flow = 10
+    if len(sys.argv) > 1:
+        num_flows = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        packets_per_flow = int(sys.argv[2])
+    _config = config.Config()
+    packets = flow_packets(num_flows, packets_per_flow)
+    print "flows=%s packets=%s" % (num_flows, len(packets))
+    for name, aggregate_enabled in (('fine-grained', 0), ('aggregated', 1)):
+        packet_ins, entries, seconds = replay(_config, packets,
+                                                        aggregate_enabled)
+        print "%-12s packet_ins=%s flow_entries=%s seconds=%.2f" % (name,
+                                                packet_ins, entries, seconds)
+
+if __name__ == '__main__':
+    main()
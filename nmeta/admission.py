@@ -0,0 +1,226 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+The admission module is part of the nmeta suite
+
+It provides admission control for packet-in events, so that
+when the controller is overloaded optional work is shed and
+forwarding is preserved.
+
+The mode is driven by the time packet-in events spend queued in
+Ryu before reaching nmeta (smoothed), and by per-switch and
+per-source packet-in rates:
+
+    normal
+      All packet-in processing is done
+
+    shed
+      Optional work is shed: harvesting of ARP identities from
+      sources that have recently been harvested (DHCP, DNS and LLDP
+      carry identities that aren't keyed on the source MAC, so are
+      always harvested), custom classifiers (flows stay unclassified
+      and are inspected again later) and database writes of
+      packet-in telemetry and of packet-ins that custom classifiers
+      won't need
+
+    overload
+      Packets are only forwarded (no ingest, harvest, policy or
+      flow suppression)
+
+The controller-wide mode and smoothed queue delay are recorded in the
+admission_col database collection when the mode changes, and at
+intervals, so that they can be accessed via the external API.
+"""
+
+#*** For timestamps:
+import datetime
+import time
+
+#*** mongodb Database Import:
+from pymongo import MongoClient
+
+#*** For logging configuration:
+from baseclass import BaseClass
+
+#*** Admission modes in order of severity:
+NORMAL = 'normal'
+SHED = 'shed'
+OVERLOAD = 'overload'
+MODES = [NORMAL, SHED, OVERLOAD]
+
+#*** Smoothing factor for exponentially weighted moving average delay:
+EWMA_ALPHA = 0.2
+
+#*** Fraction of threshold that delay must fall below to leave a mode:
+HYSTERESIS = 0.5
+
+class Admission(BaseClass):
+    """
+    An object that decides how much work to do for each packet-in
+
+    Main methods (assumes class instantiated as an object called
+    'admission'):
+
+        admission.admit(dpid, eth_src, queue_delay)
+          Update state with a packet-in and return the mode to
+          process it in (normal|shed|overload)
+
+        admission.harvest_known(eth_src)
+          True if an ARP identity has recently been harvested from
+          the source MAC address
+
+        admission.harvested(eth_src)
+          Record that an ARP identity has been harvested from the
+          source MAC address
+
+        admission.record()
+          Record the controller-wide mode and smoothed queue delay
+          to the database, for the external API
+    """
+    def __init__(self, config):
+        """
+        Initialise an instance of the Admission class
+        """
+        #*** Required for BaseClass:
+        self.config = config
+        #*** Set up Logging with inherited base class method:
+        self.configure_logging(__name__, "admission_logging_level_s",
+                                       "admission_logging_level_c")
+        #*** Get parameters from config:
+        self.enabled = config.get_value("admission_enabled")
+        self.delay_shed = config.get_value("admission_delay_shed")
+        self.delay_overload = config.get_value("admission_delay_overload")
+        self.switch_rate_shed = config.get_value("admission_switch_rate_shed")
+        self.source_rate_shed = config.get_value("admission_source_rate_shed")
+        self.known_time = config.get_value("admission_known_time")
+        self.meter_rate = config.get_value("admission_meter_rate")
+        #*** Controller-wide mode and smoothed queue delay:
+        self.mode = NORMAL
+        self.queue_delay = 0
+        #*** Packet-in counts in current one second window:
+        self.window = 0
+        self.switch_counts = {}
+        self.source_counts = {}
+        #*** Time identities last harvested, keyed by eth_src:
+        self.known = {}
+        self.last_prune = 0
+
+        #*** Set up database collection for admission mode:
+        mongo_addr = config.get_value("mongo_addr")
+        mongo_port = config.get_value("mongo_port")
+        mongo_dbname = config.get_value("mongo_dbname")
+        #*** Start mongodb:
+        self.logger.info("Connecting to MongoDB database...")
+        mongo_client = MongoClient(mongo_addr, mongo_port)
+        #*** Connect to MongoDB nmeta database:
+        db_nmeta = mongo_client[mongo_dbname]
+        #*** Delete (drop) previous admission collection if it exists:
+        self.logger.debug("Deleting previous admission MongoDB collection...")
+        db_nmeta.admission_col.drop()
+        #*** Create the admission collection:
+        self.admission_col = db_nmeta.create_collection('admission_col')
+        self.record()
+
+    def admit(self, dpid, eth_src, queue_delay, now=0):
+        """
+        Passed the DPID and source MAC of a packet-in, and the time
+        in seconds that it was queued before reaching nmeta. Update
+        the controller-wide mode and return the mode that this
+        packet-in should be processed in
+        """
+        if not now:
+            now = time.time()
+        #*** Update smoothed queue delay and controller-wide mode:
+        self.queue_delay += EWMA_ALPHA * (queue_delay - self.queue_delay)
+        if self.queue_delay > self.delay_overload:
+            mode = OVERLOAD
+        elif self.queue_delay > self.delay_shed:
+            if self.mode == OVERLOAD and \
+                    self.queue_delay > self.delay_overload * HYSTERESIS:
+                mode = OVERLOAD
+            else:
+                mode = SHED
+        elif self.mode != NORMAL and \
+                    self.queue_delay > self.delay_shed * HYSTERESIS:
+            mode = SHED
+        else:
+            mode = NORMAL
+        if mode != self.mode:
+            self.logger.info("Admission mode changed from=%s to=%s "
+                        "queue_delay=%s", self.mode, mode, self.queue_delay)
+            self.mode = mode
+            self.record()
+        #*** Count packet-in rates per switch and source:
+        if int(now) != self.window:
+            self.window = int(now)
+            self.switch_counts = {}
+            self.source_counts = {}
+        switch_count = self.switch_counts.get(dpid, 0) + 1
+        self.switch_counts[dpid] = switch_count
+        source_count = self.source_counts.get(eth_src, 0) + 1
+        self.source_counts[eth_src] = source_count
+        #*** Shed optional work for busy switches and sources:
+        if mode == NORMAL and (switch_count > self.switch_rate_shed or
+                                    source_count > self.source_rate_shed):
+            return SHED
+        return mode
+
+    def harvest_known(self, eth_src, now=0):
+        """
+        Return True if identities were harvested from the source
+        MAC address within the known time
+        """
+        if not now:
+            now = time.time()
+        return now - self.known.get(eth_src, 0) < self.known_time
+
+    def harvested(self, eth_src, now=0):
+        """
+        Record that identities have been harvested from the
+        source MAC address
+        """
+        if not now:
+            now = time.time()
+        if now - self.last_prune >= self.known_time:
+            self._prune(now)
+        self.known[eth_src] = now
+
+    def record(self):
+        """
+        Record the controller-wide mode and smoothed queue delay
+        into the admission_col database collection
+        """
+        self.admission_col.update_one({'controller': 'nmeta'},
+                                {
+                                "$set":
+                                    {
+                                    'controller': 'nmeta',
+                                    'mode': self.mode,
+                                    'queue_delay': self.queue_delay,
+                                    'timestamp': datetime.datetime.now()
+                                }
+                        }, upsert=True)
+
+    def _prune(self, now):
+        """
+        Delete sources that identities were harvested from longer
+        ago than the known time, as they are no longer known anyway
+        """
+        expired = [eth_src for eth_src, harvested in self.known.items()
+                                    if harvested <= now - self.known_time]
+        for eth_src in expired:
+            del self.known[eth_src]
+        self.last_prune = now
+        if expired:
+            self.logger.debug("Pruned harvested sources=%s", len(expired))
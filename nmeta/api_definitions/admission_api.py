@@ -0,0 +1,38 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#*** nmeta - Network Metadata - API definition file
+
+#*** This API provides the packet-in admission control mode of the
+#*** controller (normal|shed|overload)
+
+admission_schema = {
+        'controller': {
+            'type': 'string'
+        },
+        'mode': {
+            'type': 'string'
+        },
+        'queue_delay': {
+            'type': 'float'
+        },
+        'timestamp': {
+            'type': 'datetime'
+        }
+    }
+
+admission_settings = {
+    'url': 'infrastructure/controllers/admission',
+    'item_title': 'Packet-In Admission Control Mode',
+    'schema': admission_schema
+}
@@ -31,6 +31,12 @@ controller_summary_schema = {
         },
         'pi_time_records': {
             'type': 'float'
+        },
+        'pi_dedup_ratio': {
+            'type': 'float'
+        },
+        'admission_mode': {
+            'type': 'string'
         }
     }
 
@@ -110,7 +110,8 @@ flows_removed_src_bytes_sent_schema = {
     '_items': {
         '_id': 'string',
         'identity': 'string',
-        'total_bytes_sent': 'integer'
+        'total_bytes_sent': 'integer',
+        'total_packets_sent': 'integer'
     }
 }
 
@@ -125,7 +126,8 @@ flows_removed_src_bytes_received_schema = {
     '_items': {
         '_id': 'string',
         'identity': 'string',
-        'total_bytes_received': 'integer'
+        'total_bytes_received': 'integer',
+        'total_packets_received': 'integer'
     }
 }
 
@@ -140,7 +142,8 @@ flows_removed_dst_bytes_sent_schema = {
     '_items': {
         '_id': 'string',
         'identity': 'string',
-        'total_bytes_sent': 'integer'
+        'total_bytes_sent': 'integer',
+        'total_packets_sent': 'integer'
     }
 }
 
@@ -155,7 +158,8 @@ flows_removed_dst_bytes_received_schema = {
     '_items': {
         '_id': 'string',
         'identity': 'string',
-        'total_bytes_received': 'integer'
+        'total_bytes_received': 'integer',
+        'total_packets_received': 'integer'
     }
 }
 
@@ -13,8 +13,8 @@
 
 #*** nmeta - Network Metadata - API definition file
 
-#*** This API provides min/avg/max telemetry on processing times for Packet-In
-#*** events in Ryu and nmeta
+#*** This API provides min/avg/max and percentile telemetry on processing
+#*** times for Packet-In events in Ryu and nmeta
 
 pi_time_schema = {
         'timestamp': {
@@ -49,6 +49,24 @@ pi_time_schema = {
         },
         'pi_time_records': {
             'type': 'float'
+        },
+        'ryu_time_p50': {
+            'type': 'float'
+        },
+        'ryu_time_p95': {
+            'type': 'float'
+        },
+        'ryu_time_p99': {
+            'type': 'float'
+        },
+        'pi_time_p50': {
+            'type': 'float'
+        },
+        'pi_time_p95': {
+            'type': 'float'
+        },
+        'pi_time_p99': {
+            'type': 'float'
         }
     }
 
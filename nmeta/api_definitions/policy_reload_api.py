@@ -0,0 +1,61 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#*** nmeta - Network Metadata - API definition file
+
+#*** This API requests a reload of policy (POST) and returns the
+#*** outcome of policy reloads (GET). Status is one of
+#*** requested|running|done|failed
+
+policy_reload_schema = {
+        'status': {
+            'type': 'string',
+            'allowed': ['requested'],
+            'default': 'requested'
+        },
+        'source': {
+            'type': 'string',
+            'allowed': ['api'],
+            'default': 'api'
+        },
+        'timestamp': {
+            'type': 'datetime',
+            'readonly': True
+        },
+        'flows_changed': {
+            'type': 'integer',
+            'readonly': True
+        },
+        'flows_requeued': {
+            'type': 'integer',
+            'readonly': True
+        },
+        'suppressions_revoked': {
+            'type': 'integer',
+            'readonly': True
+        },
+        'suppressions_updated': {
+            'type': 'integer',
+            'readonly': True
+        }
+    }
+
+policy_reload_settings = {
+    'url': 'policy/reloads',
+    'item_title': 'Policy Reload',
+    'schema': policy_reload_schema,
+    'resource_methods': ['GET', 'POST'],
+    'datasource': {
+        'source': 'policy_reloads'
+    }
+}
@@ -27,6 +27,9 @@ from __future__ import division
 
 import os
 
+#*** For escaping filter strings in database regular expressions:
+import re
+
 #*** Import Eve for REST API Framework:
 from eve import Eve
 
@@ -34,10 +37,16 @@ from eve import Eve
 from baseclass import BaseClass
 
 #*** mongodb Database Import:
+import pymongo
 from pymongo import MongoClient
 
 #*** nmeta imports
 import config
+from response_cache import ResponseCache
+from telemetry import TelemetryFeed
+from telemetry import aggregate_buckets
+from telemetry import PERCENTILES
+from state_snapshot import StateSnapshotReader
 #*** import from api_definitions subdirectory:
 from api_definitions import switches_api
 from api_definitions import pi_rate
@@ -50,19 +59,80 @@ from api_definitions import flows_removed_api
 from api_definitions import flows_ui
 from api_definitions import flow_mods_api
 from api_definitions import classifications_api
+from api_definitions import admission_api
+from api_definitions import policy_reload_api
 
 #*** For timestamps:
 import datetime
 
+#*** For selecting top talkers:
+import heapq
+
+#*** For copying cached responses:
+import copy
+
+#*** For streaming telemetry events:
+import json
+import Queue
+
+#*** For compressing exports:
+import zlib
+
 #*** To get request parameters:
 from flask import request
 
+#*** For passing ETags of cached responses between request hooks:
+from flask import g
+
+#*** For streaming responses:
+from flask import Response
+from flask import stream_with_context
+
 #*** Amount of time (seconds) to go back for to calculate Packet-In rate:
 PACKET_IN_RATE_INTERVAL = 10
 
 #*** Amount of time (seconds) to go back for to calculate Packet-In rate:
 PACKET_TIME_PERIOD = 10
 
+#*** Seconds to cache responses of polled (i.e. WebUI dashboard) resources
+#*** for, keyed by Eve resource name:
+RESPONSE_CACHE_TTL = {
+        'controller_summary': 1,
+        'pi_rate': 1,
+        'pi_time': 1,
+        'switches_count_col': 2,
+        'flows_removed_stats_count': 5,
+        'flows_removed_src_bytes_sent': 5,
+        'flows_removed_src_bytes_received': 5,
+        'flows_removed_dst_bytes_sent': 5,
+        'flows_removed_dst_bytes_received': 5
+        }
+
+#*** URL (after API version) of the telemetry Server-Sent Events stream:
+TELEMETRY_STREAM_URL = '/infrastructure/controllers/telemetry/stream'
+#*** Seconds between heartbeats (comments) on an idle telemetry stream,
+#*** so that proxies keep it open and closed clients are noticed:
+TELEMETRY_HEARTBEAT = 15
+#*** URL (after API version) of the controller state snapshot:
+CONTROLLER_STATE_URL = '/infrastructure/controllers/state'
+
+#*** Resources that can be exported as newline delimited JSON (NDJSON),
+#*** at URL (after API version) /export/<resource>, to their database
+#*** collection (ExternalAPI attribute) and indexed time field that
+#*** exports are ranged on:
+EXPORTS = {
+        'flows': ('packet_ins', 'timestamp'),
+        'flows_removed': ('flow_rems', 'removal_time'),
+        'identities': ('identities', 'valid_from')
+        }
+#*** Default seconds back in time to export from:
+EXPORT_WINDOW = 3600
+#*** Format of start and end times of exports:
+EXPORT_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+#*** Records per database batch, and bytes per chunk of response:
+EXPORT_BATCH_SIZE = 1000
+EXPORT_CHUNK_SIZE = 65536
+
 #*** Used for WebUI:
 FLOW_SEARCH_LIMIT = 600
 FLOW_RESULT_LIMIT = 100
@@ -72,6 +142,34 @@ FLOW_FILTER_ANY = ['src', 'src_hover', 'dst', 'dst_hover', 'proto',
 FLOW_FILTER_SRC = ['src', 'src_hover']
 FLOW_FILTER_DST = ['dst', 'dst_hover']
 FLOW_FILTER_SRC_OR_DST = ['src', 'src_hover', 'dst', 'dst_hover']
+#*** Fixed text in FlowUI hover attributes. Filter strings that could match
+#*** this text aren't pushed down to the database query:
+FLOW_FILTER_HOVER_TEXT = ['IP Address: ', 'IP Protocol: ', 'Ethernet Type: ',
+                            ' (decimal)']
+#*** Most recently started flow summaries first, as per flows module
+#*** FLOW_SUMMARY_SORT (used for cursor pagination):
+FLOW_SUMMARY_SORT = [('first_timestamp', pymongo.DESCENDING),
+                     ('flow_hash', pymongo.DESCENDING)]
+#*** Most recent classification first, as per flows module
+#*** CLASSIFICATION_SORT:
+CLASSIFICATION_SORT = [('classification_time', pymongo.DESCENDING),
+                       ('_id', pymongo.DESCENDING)]
+#*** Format of timestamp in pagination cursors:
+CURSOR_TIME_FORMAT = '%Y%m%d%H%M%S%f'
+
+#*** Largest first, for top talkers of a removed flow stat, as per flows
+#*** module FLOW_REMS_ROLLUP_SORT:
+FLOW_REMS_ROLLUP_SORT = [('stat', pymongo.ASCENDING),
+                         ('period', pymongo.ASCENDING),
+                         ('bucket', pymongo.ASCENDING),
+                         ('bytes', pymongo.DESCENDING)]
+
+#*** Max number of identities returned in a page of identities/ui:
+IDENTITY_RESULT_LIMIT = 1000
+#*** Most recently harvested identities first, as per identities module
+#*** IDENTITIES_CURRENT_SORT (used for cursor pagination):
+IDENTITIES_CURRENT_SORT = [('harvest_time', pymongo.DESCENDING),
+                           ('id_hash', pymongo.DESCENDING)]
 
 #*** Number of previous IP identity records to search for a hostname before
 #*** giving up. Used for augmenting flows with identity metadata:
@@ -130,8 +228,31 @@ class ExternalAPI(BaseClass):
         self.identities = db_nmeta.identities
         self.classifications = db_nmeta.classifications
         self.flow_rems = db_nmeta.flow_rems
-        self.db_pi_time = db_nmeta.pi_time
+        self.flow_summary = db_nmeta.flow_summary
+        self.flow_rems_rollups = db_nmeta.flow_rems_rollups
+        self.identities_current = db_nmeta.identities_current
+        self.pi_time_stats = db_nmeta.pi_time_stats
         self.switches_col = db_nmeta.switches_col
+        self.admission_col = db_nmeta.admission_col
+
+        #*** Seconds that per minute removed flow rollups are kept for:
+        self.rollup_minute_time_limit = \
+                    self.config.get_value("flow_rems_rollup_minute_time_limit")
+
+        #*** Cache of responses to polled resources (see RESPONSE_CACHE_TTL):
+        self.response_cache_enabled = \
+                    self.config.get_value("external_api_response_cache")
+        self.response_cache = ResponseCache()
+        self.app = None
+
+        #*** Telemetry published by nmeta, fanned out to stream clients:
+        self.telemetry_feed = TelemetryFeed(db_nmeta.telemetry, self.logger)
+
+        #*** Snapshot of nmeta in-memory state, from memory-mapped file:
+        self.state_snapshot = StateSnapshotReader(
+                        self.config.get_value("state_snapshot_file"),
+                        self.config.get_value("state_snapshot_stale_time"),
+                        self.logger)
 
     class FlowUI(object):
         """
@@ -177,6 +298,30 @@ class ExternalAPI(BaseClass):
     def run(self):
         """
         Run the External API instance
+        """
+        self.setup_app()
+
+        #*** Get necessary parameters from config:
+        eve_port = self.config.get_value('external_api_port')
+        eve_debug = self.config.get_value('external_api_debug')
+        eve_host = self.config.get_value('external_api_host')
+
+        #*** Run Eve. Threaded so that requests run concurrently:
+        self.logger.info("Starting Eve Python REST API Framework")
+        self.app.run(port=eve_port, debug=eve_debug, host=eve_host,
+                                                                threaded=True)
+
+        @self.app.route('/')
+        def serve_static():
+            """
+            Serve static content for WebUI
+            """
+            return 1
+
+    def setup_app(self):
+        """
+        Set up the Eve app (self.app) for the External API, with
+        hooks for responses.
 
         Note that API definitions are from previously imported
         files from api_definitions subdirectory
@@ -200,7 +345,9 @@ class ExternalAPI(BaseClass):
             'flows_removed_dst_bytes_received': flows_removed_api.flows_removed_dst_bytes_received_settings,
             'flows_ui': flows_ui.flows_ui_settings,
             'flow_mods': flow_mods_api.flow_mods_settings,
-            'classifications': classifications_api.classifications_settings
+            'classifications': classifications_api.classifications_settings,
+            'admission_col': admission_api.admission_settings,
+            'policy_reloads': policy_reload_api.policy_reload_settings
         }
 
         #*** Set up a settings dictionary for starting Eve app:datasource
@@ -235,14 +382,17 @@ class ExternalAPI(BaseClass):
         self.logger.debug("static_folder=%s", static_folder)
 
         #*** Hook for adding pi_rate to returned resource:
-        self.app.on_fetched_resource_pi_rate += self.response_pi_rate
+        self.app.on_fetched_resource_pi_rate += \
+                            self.cached('pi_rate', self.response_pi_rate)
 
         #*** Hook for adding pi_time to returned resource:
-        self.app.on_fetched_resource_pi_time += self.response_pi_time
+        self.app.on_fetched_resource_pi_time += \
+                            self.cached('pi_time', self.response_pi_time)
 
         #*** Hook for adding controller_summary to returned resource:
         self.app.on_fetched_resource_controller_summary += \
-                                               self.response_controller_summary
+                            self.cached('controller_summary',
+                                            self.response_controller_summary)
 
         #*** Hook for filtered identities response:
         self.app.on_fetched_resource_identities_ui += \
@@ -250,23 +400,28 @@ class ExternalAPI(BaseClass):
 
         #*** Hook for flows removed stats count response:
         self.app.on_fetched_resource_flows_removed_stats_count += \
-                                        self.response_flows_removed_stats_count
+                            self.cached('flows_removed_stats_count',
+                                    self.response_flows_removed_stats_count)
 
         #*** Hook for flows removed src bytes sent response:
         self.app.on_fetched_resource_flows_removed_src_bytes_sent += \
-                                     self.response_flows_removed_src_bytes_sent
+                            self.cached('flows_removed_src_bytes_sent',
+                                    self.response_flows_removed_src_bytes_sent)
 
         #*** Hook for flows removed src bytes received response:
         self.app.on_fetched_resource_flows_removed_src_bytes_received += \
-                                 self.response_flows_removed_src_bytes_received
+                            self.cached('flows_removed_src_bytes_received',
+                                self.response_flows_removed_src_bytes_received)
 
         #*** Hook for flows removed dst bytes sent response:
         self.app.on_fetched_resource_flows_removed_dst_bytes_sent += \
-                                     self.response_flows_removed_dst_bytes_sent
+                            self.cached('flows_removed_dst_bytes_sent',
+                                    self.response_flows_removed_dst_bytes_sent)
 
         #*** Hook for flows removed dst bytes received response:
         self.app.on_fetched_resource_flows_removed_dst_bytes_received += \
-                                 self.response_flows_removed_dst_bytes_received
+                            self.cached('flows_removed_dst_bytes_received',
+                                self.response_flows_removed_dst_bytes_received)
 
         #*** Hook for filtered flows response:
         self.app.on_fetched_resource_flows_ui += \
@@ -274,23 +429,196 @@ class ExternalAPI(BaseClass):
 
         #*** Hook for switch count:
         self.app.on_fetched_resource_switches_count_col += \
-                                                self.response_switches_count
-
-        #*** Get necessary parameters from config:
-        eve_port = self.config.get_value('external_api_port')
-        eve_debug = self.config.get_value('external_api_debug')
-        eve_host = self.config.get_value('external_api_host')
-
-        #*** Run Eve:
-        self.logger.info("Starting Eve Python REST API Framework")
-        self.app.run(port=eve_port, debug=eve_debug, host=eve_host)
-
-        @self.app.route('/')
-        def serve_static():
+                            self.cached('switches_count_col',
+                                                self.response_switches_count)
+
+        #*** Route for streaming telemetry (not an Eve resource):
+        self.app.add_url_rule('/' + eve_settings['API_VERSION'] +
+                                TELEMETRY_STREAM_URL, 'telemetry_stream',
+                                self.response_telemetry_stream)
+
+        #*** Route for controller state snapshot (not an Eve resource):
+        self.app.add_url_rule('/' + eve_settings['API_VERSION'] +
+                                CONTROLLER_STATE_URL, 'controller_state',
+                                self.response_controller_state)
+
+        #*** Route for bulk exports (not Eve resources):
+        self.app.add_url_rule('/' + eve_settings['API_VERSION'] +
+                                '/export/<resource>', 'export',
+                                self.response_export)
+
+        #*** Hooks for conditional GET of cached responses:
+        if self.response_cache_enabled:
+            self.app.before_request(self.response_not_modified)
+            self.app.after_request(self.response_add_etag)
+
+    def cached(self, resource, hook):
+        """
+        Passed an Eve resource name and its on_fetched_resource hook.
+        Return a hook that populates the response from the response
+        cache, keyed by resource and URL parameters, so that the hook
+        only runs when the cached response has expired (after
+        RESPONSE_CACHE_TTL seconds for the resource), and only once
+        for concurrent requests.
+
+        If the response cache is disabled, return the hook unchanged
+        """
+        if not self.response_cache_enabled:
+            return hook
+        ttl = RESPONSE_CACHE_TTL[resource]
+        def cached_hook(items):
             """
-            Serve static content for WebUI
+            Populate the response from the response cache
             """
-            return 1
+            key = response_cache_key(resource)
+            def compute():
+                """
+                Run the hook on a copy of the response
+                """
+                response = copy.deepcopy(items)
+                hook(response)
+                return response
+            response, etag = self.response_cache.get(key, ttl, compute)
+            items.clear()
+            items.update(copy.deepcopy(response))
+            g.response_etag = etag
+        return cached_hook
+
+    def response_not_modified(self):
+        """
+        If the request is a conditional GET (If-None-Match) of a
+        cached resource and the cached response has the ETag, return
+        a 304 Not Modified response, otherwise None so that the request
+        is processed as normal. Hooked from Flask before_request
+        """
+        resource, _, endpoint_type = (request.endpoint or '').partition('|')
+        if (request.method != 'GET' or endpoint_type != 'resource' or
+                resource not in RESPONSE_CACHE_TTL):
+            return None
+        etag = self.response_cache.etag(response_cache_key(resource))
+        if etag and etag in request.if_none_match:
+            response = self.app.make_response(('', 304))
+            response.set_etag(etag)
+            return response
+        return None
+
+    def response_add_etag(self, response):
+        """
+        Add the ETag of a cached response to the response, with
+        caching by clients allowed only if they check the ETag is
+        still current. If the request is a conditional GET with the
+        ETag (i.e. the response was recomputed but hasn't changed)
+        the response becomes 304 Not Modified.
+        Hooked from Flask after_request
+        """
+        etag = getattr(g, 'response_etag', None)
+        if etag and response.status_code == 200:
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            response.make_conditional(request)
+        return response
+
+    def response_telemetry_stream(self):
+        """
+        Return a Server-Sent Events (text/event-stream) response that
+        sends a telemetry event each time nmeta publishes telemetry,
+        starting with the latest. Event data is JSON with keys as per
+        the controller_summary, pi_rate, pi_time and connected_switches
+        responses.
+
+        Events are from the telemetry feed, which reads the database
+        once per publish for all clients
+        """
+        queue = self.telemetry_feed.subscribe()
+        def events():
+            """
+            Yield events from the queue, with heartbeats when idle
+            """
+            try:
+                while True:
+                    try:
+                        record = queue.get(timeout=TELEMETRY_HEARTBEAT)
+                    except Queue.Empty:
+                        yield ': heartbeat\n\n'
+                        continue
+                    yield sse_event('telemetry', record)
+            finally:
+                #*** Client closed stream:
+                self.telemetry_feed.unsubscribe(queue)
+        response = Response(stream_with_context(events()),
+                                            mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    def response_controller_state(self):
+        """
+        Return the snapshot of nmeta in-memory state (connected
+        switches, MAC tables, latest telemetry, admission control,
+        scheduler metrics and flow counts) as JSON, read from the
+        memory-mapped state snapshot file rather than the database.
+        Returns 503 if there is no current snapshot (i.e. nmeta not
+        running or state snapshot disabled)
+        """
+        state = self.state_snapshot.read()
+        if not state:
+            return Response(json.dumps({'_error':
+                                'No current controller state snapshot'}),
+                                status=503, mimetype='application/json')
+        return Response(json.dumps(state), mimetype='application/json')
+
+    def response_export(self, resource):
+        """
+        Return a streamed response of the records of an exportable
+        resource (see EXPORTS) in a time range, as newline delimited
+        JSON (one record per line, times in ISO 8601 format), in time
+        order. Records are read with a database cursor and sent in
+        chunks as they are read, so memory use doesn't depend on the
+        number of records. Compressed with gzip if the client accepts
+        it (Accept-Encoding)
+
+        Optional URL parameters:
+         - start: Time to export from (EXPORT_TIME_FORMAT). Default is
+           EXPORT_WINDOW seconds ago
+         - end: Time to export to (EXPORT_TIME_FORMAT). Default is now
+         - fields: Comma separated fields to return (default all
+           except _id)
+        """
+        if resource not in EXPORTS:
+            return export_error('Unknown export resource=' + resource, 404)
+        collection, time_field = EXPORTS[resource]
+        now = datetime.datetime.now()
+        try:
+            start = now - datetime.timedelta(seconds=EXPORT_WINDOW)
+            end = now
+            if 'start' in request.args:
+                start = datetime.datetime.strptime(request.args['start'],
+                                                        EXPORT_TIME_FORMAT)
+            if 'end' in request.args:
+                end = datetime.datetime.strptime(request.args['end'],
+                                                        EXPORT_TIME_FORMAT)
+        except ValueError:
+            return export_error('Invalid start or end, format is ' +
+                                                    EXPORT_TIME_FORMAT, 400)
+        projection = {'_id': False}
+        if 'fields' in request.args:
+            fields = [field for field in request.args['fields'].split(',')
+                                                                if field]
+            projection = dict((field, True) for field in fields)
+            if '_id' not in fields:
+                projection['_id'] = False
+        self.logger.debug("Exporting resource=%s start=%s end=%s "
+                        "projection=%s", resource, start, end, projection)
+        cursor = getattr(self, collection).find(
+                        {time_field: {'$gte': start, '$lte': end}},
+                        projection).sort(time_field, pymongo.ASCENDING) \
+                        .batch_size(EXPORT_BATCH_SIZE)
+        chunks = export_chunks(cursor)
+        headers = {'Cache-Control': 'no-cache'}
+        if request.accept_encodings['gzip']:
+            chunks = gzip_chunks(chunks)
+            headers['Content-Encoding'] = 'gzip'
+        return Response(stream_with_context(chunks), headers=headers,
+                                        mimetype='application/x-ndjson')
 
     def response_pi_rate(self, items):
         """
@@ -327,6 +655,8 @@ class ExternalAPI(BaseClass):
         - pi_time_avg
         - pi_time_period
         - pi_time_records
+        - ryu_time_p<percentile> and pi_time_p<percentile> for
+          percentiles in PERCENTILES (i.e. pi_time_p99)
 
         If no data found within time period then returns without
         key/values
@@ -350,6 +680,10 @@ class ExternalAPI(BaseClass):
             items['pi_time_avg'] = results['pi_time_avg']
             items['pi_time_period'] = results['pi_time_period']
             items['pi_time_records'] = results['pi_time_records']
+            for percentile in PERCENTILES:
+                for prefix in ('ryu_time_p', 'pi_time_p'):
+                    key = prefix + str(percentile)
+                    items[key] = results[key]
 
     def response_controller_summary(self, items):
         """
@@ -368,6 +702,8 @@ class ExternalAPI(BaseClass):
             del items['_items']
         #*** pi_rate:
         items['pi_rate'] = self.get_pi_rate()
+        #*** Admission control mode:
+        items['admission_mode'] = self.get_admission_mode()
         #*** pi_time:
         results = self.get_pi_time()
         if results:
@@ -383,6 +719,7 @@ class ExternalAPI(BaseClass):
             items['pi_time_avg'] = round(results['pi_time_avg'], places)
             items['pi_time_period'] = results['pi_time_period']
             items['pi_time_records'] = results['pi_time_records']
+            items['pi_dedup_ratio'] = round(results['pi_dedup_ratio'], places)
         else:
             items['timestamp'] = 'unknown'
             items['ryu_time_max'] = 'unknown'
@@ -395,17 +732,22 @@ class ExternalAPI(BaseClass):
             items['pi_time_avg'] = 'unknown'
             items['pi_time_period'] = 'unknown'
             items['pi_time_records'] = 'unknown'
+            items['pi_dedup_ratio'] = 'unknown'
 
     def response_identities_ui(self, items):
         """
-        Populate the response with identities that are filtered:
+        Populate the response with a page of identities that are
+        filtered:
          - Reverse sort by harvest time
-         - Deduplicate by id_hash, only returning most recent per id_hash
+         - Most recent identity per id_hash, from the identities_current
+           collection which is maintained by nmeta
          - Includes possibly stale records
-         - Check DNS A records to see if they are from a CNAME
+         - DNS CNAME records have the IP address of their DNS A record
+         - Paged with a cursor. The cursor for the next page (if there
+           may be more identities) is returned in _next_cursor, and is
+           passed back in the cursor URL parameter
         Hooked from on_fetched_resource_<name>
         """
-        known_hashes = []
         self.logger.debug("Hooked on_fetched_resource items=%s ", items)
 
         #*** Get URL parameters:
@@ -413,30 +755,41 @@ class ExternalAPI(BaseClass):
             filter_dns = request.args['filter_dns']
         else:
             filter_dns = 0
-        self.logger.debug("filter_dns=%s", filter_dns)
+        page_size = IDENTITY_RESULT_LIMIT
+        if 'pageSize' in request.args:
+            try:
+                page_size = min(max(int(request.args['pageSize']), 1),
+                                                    IDENTITY_RESULT_LIMIT)
+            except ValueError:
+                self.logger.warning("Invalid pageSize=%s",
+                                                    request.args['pageSize'])
+        if 'cursor' in request.args:
+            page_cursor = request.args['cursor']
+        else:
+            page_cursor = ''
+        self.logger.debug("filter_dns=%s page_size=%s cursor=%s", filter_dns,
+                                                    page_size, page_cursor)
+
+        db_data = {}
+        #*** Skip DNS results if filter_dns enabled:
+        if filter_dns:
+            db_data['harvest_type'] = {'$nin': ['DNS_CNAME', 'DNS_A']}
+        if page_cursor:
+            after = cursor_query(page_cursor, IDENTITIES_CURRENT_SORT)
+            if after is None:
+                self.logger.warning("Invalid cursor=%s", page_cursor)
+                return
+            db_data = {'$and': [db_data, after]}
 
         #*** Get database and query it:
-        identities = self.app.data.driver.db['identities']
-        #*** Reverse sort:
-        packet_cursor = identities.find().sort('$natural', -1)
-        #*** Iterate, adding only new id_hashes to the response:
-        for record in packet_cursor:
-            if not record['id_hash'] in known_hashes:
-                #*** Skip DNS results if filter_dns enabled:
-                if filter_dns and (record['harvest_type'] == 'DNS_CNAME' or
-                            record['harvest_type'] == 'DNS_A'):
-                    continue
-                #*** Get IP for DNS CNAME:
-                if record['harvest_type'] == 'DNS_CNAME':
-                    #*** Check if A record exists, and if so update response:
-                    record['ip_address'] = \
-                                       self.get_dns_ip(record['service_alias'])
-                #*** Add to items dictionary which is returned in response:
-                self.logger.debug("Appending _items with record=%s", record)
-                items['_items'].append(record)
-                #*** Add hash so we don't do it again:
-                self.logger.debug("Storing id_hash=%s ", record['id_hash'])
-                known_hashes.append(record['id_hash'])
+        identities = self.app.data.driver.db['identities_current']
+        #*** One more than the page, to find out if there's a next page:
+        records = list(identities.find(db_data).sort(IDENTITIES_CURRENT_SORT)
+                                                        .limit(page_size + 1))
+        items['_items'].extend(records[:page_size])
+        if len(records) > page_size:
+            items['_next_cursor'] = cursor_token(records[page_size - 1],
+                                                    IDENTITIES_CURRENT_SORT)
 
     def response_flows_removed_stats_count(self, items):
         """
@@ -447,176 +800,135 @@ class ExternalAPI(BaseClass):
             del items['_items']
         if '_meta' in items:
             del items['_meta']
-        items['flows_removed'] = self.flow_rems.count()
+        #*** From collection metadata, rather than counting records:
+        items['flows_removed'] = self.flow_rems.estimated_document_count()
 
     def response_flows_removed_src_bytes_sent(self, items):
         """
         Returns removed flow bytes sent by session source IP (deduplicated
         for flows crossing multiple switches), enriched with identity metadata.
         """
-        #*** Get rid of superfluous keys in response:
-        if '_meta' in items:
-            del items['_meta']
-        #*** MongoDB aggregate counting bytes forward by src IP, dedup
-        #***  first occurrence of byte_count per flow_hash and reverse sorted:
-        cursor = self.flow_rems.aggregate([
-                        {'$match': {
-                            'direction': 'forward'
-                            }
-                        },
-                        {'$group': {
-                            '_id': {
-                                'src': '$ip_A',
-                                'flow_hash': '$flow_hash'
-                            },
-                            'bytes_sent': {
-                                '$first': '$byte_count'
-                            }
-                        }},
-                        {'$group': {
-                            '_id': '$_id.src',
-                            'total_bytes_sent': {
-                                '$sum': '$bytes_sent'
-                            }
-                        }},
-                        {'$sort' : {
-                            'total_bytes_sent' : -1 
-                        }}
-                    ])
-        #*** Add aggregate into _items for response:
-        items['_items'] = list(cursor)
-        #*** Enrich with identity metadata:
-        for item in items['_items']:
-            item['identity'] = self.get_id(item['_id'])
+        self.flows_removed_top_talkers(items, 'src_sent', 'sent')
 
     def response_flows_removed_src_bytes_received(self, items):
         """
         Returns removed flow bytes received by session source IP (deduplicated
         for flows crossing multiple switches), enriched with identity metadata.
         """
-        #*** Get rid of superfluous keys in response:
-        if '_meta' in items:
-            del items['_meta']
-        #*** MongoDB aggregate counting bytes reverse by dst IP,
-        #***  dedup first occurrence of byte_count per flow_hash and reverse
-        #***  sorted:
-        cursor = self.flow_rems.aggregate([
-                        {'$match': {
-                            'direction': 'reverse'
-                            }
-                        },
-                        {'$group': {
-                            '_id': {
-                                'dst': '$ip_B',
-                                'flow_hash': '$flow_hash'
-                            },
-                            'bytes_received': {
-                                '$first': '$byte_count'
-                            }
-                        }},
-                        {'$group': {
-                            '_id': '$_id.dst',
-                            'total_bytes_received': {
-                                '$sum': '$bytes_received'
-                            }
-                        }},
-                        {'$sort' : {
-                            'total_bytes_received' : -1 
-                        }}
-                    ])
-        #*** Add aggregate into _items for response:
-        items['_items'] = list(cursor)
-        #*** Enrich with identity metadata:
-        for item in items['_items']:
-            item['identity'] = self.get_id(item['_id'])
+        self.flows_removed_top_talkers(items, 'src_received', 'received')
 
     def response_flows_removed_dst_bytes_sent(self, items):
         """
         Returns removed flow bytes sent by session destination IP (deduplicated
         for flows crossing multiple switches), enriched with identity metadata.
         """
-        #*** Get rid of superfluous keys in response:
-        if '_meta' in items:
-            del items['_meta']
-        #*** MongoDB aggregate counting bytes reverse by src IP, dedup
-        #***  first occurrence of byte_count per flow_hash and reverse sorted:
-        cursor = self.flow_rems.aggregate([
-                        {'$match': {
-                            'direction': 'reverse'
-                            }
-                        },
-                        {'$group': {
-                            '_id': {
-                                'src': '$ip_A',
-                                'flow_hash': '$flow_hash'
-                            },
-                            'bytes_sent': {
-                                '$first': '$byte_count'
-                            }
-                        }},
-                        {'$group': {
-                            '_id': '$_id.src',
-                            'total_bytes_sent': {
-                                '$sum': '$bytes_sent'
-                            }
-                        }},
-                        {'$sort' : {
-                            'total_bytes_sent' : -1 
-                        }}
-                    ])
-        #*** Add aggregate into _items for response:
-        items['_items'] = list(cursor)
-        #*** Enrich with identity metadata:
-        for item in items['_items']:
-            item['identity'] = self.get_id(item['_id'])
+        self.flows_removed_top_talkers(items, 'dst_sent', 'sent')
 
     def response_flows_removed_dst_bytes_received(self, items):
         """
         Returns removed flow bytes received by session destination IP (dedup
         for flows crossing multiple switches), enriched with identity metadata.
         """
+        self.flows_removed_top_talkers(items, 'dst_received', 'received')
+
+    def flows_removed_top_talkers(self, items, stat, xfer):
+        """
+        Populate the response with IP addresses reverse sorted by bytes
+        for a removed flow stat (i.e. src_sent), from the flow_rems_rollups
+        collection that is maintained by nmeta, so removed flows don't
+        need to be aggregated per request.
+
+        Passed xfer (sent|received) for naming of response keys.
+
+        Optional URL parameters:
+         - top: Number of IP addresses to return (default all)
+         - window: Seconds back in time to total bytes over (default
+           since nmeta started). Totalled from per minute time buckets
+           if they are kept for that long, otherwise per hour time buckets,
+           so includes all of the oldest bucket
+        """
         #*** Get rid of superfluous keys in response:
         if '_meta' in items:
             del items['_meta']
-        #*** MongoDB aggregate counting bytes forward by dst IP,
-        #***  dedup first occurrence of byte_count per flow_hash and reverse
-        #***  sorted:
-        cursor = self.flow_rems.aggregate([
-                        {'$match': {
-                            'direction': 'forward'
-                            }
-                        },
-                        {'$group': {
-                            '_id': {
-                                'dst': '$ip_B',
-                                'flow_hash': '$flow_hash'
-                            },
-                            'bytes_received': {
-                                '$first': '$byte_count'
-                            }
-                        }},
-                        {'$group': {
-                            '_id': '$_id.dst',
-                            'total_bytes_received': {
-                                '$sum': '$bytes_received'
-                            }
-                        }},
-                        {'$sort' : {
-                            'total_bytes_received' : -1 
-                        }}
-                    ])
-        #*** Add aggregate into _items for response:
-        items['_items'] = list(cursor)
-        #*** Enrich with identity metadata:
-        for item in items['_items']:
-            item['identity'] = self.get_id(item['_id'])
+        top = 0
+        window = 0
+        try:
+            if 'top' in request.args:
+                top = max(int(request.args['top']), 0)
+            if 'window' in request.args:
+                window = max(int(request.args['window']), 0)
+        except ValueError:
+            self.logger.warning("Invalid top or window in args=%s",
+                                                                request.args)
+        if window:
+            talkers = self.top_talkers_window(stat, top, window)
+        else:
+            talkers = self.top_talkers_total(stat, top)
+        items['_items'] = []
+        for ip_addr, total_bytes, total_packets in talkers:
+            items['_items'].append({'_id': ip_addr,
+                            'total_bytes_' + xfer: total_bytes,
+                            'total_packets_' + xfer: total_packets,
+                            'identity': self.get_id(ip_addr)})
+
+    def top_talkers_total(self, stat, top):
+        """
+        Passed a removed flow stat and number of IP addresses to return
+        (0 for all). Return a list of (ip, bytes, packets) tuples for
+        the IP addresses with largest bytes for the stat since nmeta
+        started. The rollups index is in order of bytes, so only the
+        top records are read
+        """
+        db_data = {'stat': stat, 'period': 'total', 'bucket': None}
+        cursor = self.flow_rems_rollups.find(db_data).sort(
+                                                        FLOW_REMS_ROLLUP_SORT)
+        if top:
+            cursor = cursor.limit(top)
+        return [(record['ip'], record['bytes'], record['packets'])
+                                                        for record in cursor]
+
+    def top_talkers_window(self, stat, top, window):
+        """
+        Passed a removed flow stat, number of IP addresses to return
+        (0 for all) and seconds back in time. Return a list of
+        (ip, bytes, packets) tuples for the IP addresses with largest
+        bytes for the stat in time buckets from that time onwards.
+        Uses a heap to select the top IP addresses from the totals
+        """
+        start = datetime.datetime.now() - datetime.timedelta(seconds=window)
+        if window <= self.rollup_minute_time_limit:
+            period = 'minute'
+            start = start.replace(second=0, microsecond=0)
+        else:
+            period = 'hour'
+            start = start.replace(minute=0, second=0, microsecond=0)
+        db_data = {'stat': stat, 'period': period, 'bucket': {'$gte': start}}
+        totals = {}
+        for record in self.flow_rems_rollups.find(db_data,
+                                    {'ip': 1, 'bytes': 1, 'packets': 1}):
+            total = totals.setdefault(record['ip'], [0, 0])
+            total[0] += record['bytes']
+            total[1] += record['packets']
+        if not top:
+            top = len(totals)
+        return [(ip_addr, total[0], total[1]) for ip_addr, total in
+                heapq.nlargest(top, totals.iteritems(), key=lambda x: x[1][0])]
 
     def response_flows_ui(self, items):
         """
-        Populate the response with flow entries that are filtered:
-         - Reverse sort by initial ingest time
-         - Deduplicate by flow_hash, only returning most recent per flow_hash
-         - Enrich with TBD
+        Populate the response with a page of flow entries that are
+        filtered:
+         - Reverse sort by time of first packet (which, unlike the
+           time of the most recent packet, is stable while paging)
+         - One entry per flow, from the flow_summary collection which
+           is maintained by nmeta with the flow direction normalised,
+           classification, actions and data transfer
+         - Filters are translated into a database query, then checked
+           against each enriched flow (see flow_filter_query)
+         - Enrich with identity metadata
+         - Paged with a cursor. The cursor for the next page (if there
+           may be more flows) is returned in _next_cursor, and is
+           passed back in the cursor URL parameter
         Hooked from on_fetched_resource_<name>
         """
         self.logger.debug("Hooked on_fetched_resource items=%s ", items)
@@ -634,53 +946,165 @@ class ExternalAPI(BaseClass):
             filter_string = request.args['filterString']
         else:
             filter_string = ''
+        page_size = FLOW_RESULT_LIMIT
+        if 'pageSize' in request.args:
+            try:
+                page_size = min(max(int(request.args['pageSize']), 1),
+                                                        FLOW_RESULT_LIMIT)
+            except ValueError:
+                self.logger.warning("Invalid pageSize=%s",
+                                                    request.args['pageSize'])
+        if 'cursor' in request.args:
+            flow_cursor = request.args['cursor']
+        else:
+            flow_cursor = ''
         self.logger.debug("Parameters are flows_filterlogicselector=%s "
-                        "flows_filtertypeselector=%s filter_string=%s",
-                        flows_filterlogicselector, flows_filtertypeselector,
-                        filter_string)
-
-        #*** Connect to packet_ins database and run general query:
-        flows = self.app.data.driver.db['packet_ins']
-        packet_cursor = flows.find().limit(FLOW_SEARCH_LIMIT) \
-                                                         .sort('timestamp', -1)
-
-        #*** Iterate through results, ignoring known hashes:
-        known_hashes = []
-        for record in packet_cursor:
-            #*** Only return unique flow records:
-            if not record['flow_hash'] in known_hashes:
-                #*** Normalise the direction of the flow:
-                record = self.flow_normalise_direction(record)
-
-                #*** Create identity-augmented FlowUI instance:
-                flow = self.flow_augment_record(record)
-
-                #*** Apply any filters:
-                match = self.flow_match(flow, flows_filterlogicselector,
-                                    flows_filtertypeselector, filter_string)
+                        "flows_filtertypeselector=%s filter_string=%s "
+                        "page_size=%s cursor=%s", flows_filterlogicselector,
+                        flows_filtertypeselector, filter_string, page_size,
+                        flow_cursor)
 
-                if match:
-                    #*** Add to result:
-                    #*** Add to items dictionary, which is returned in response:
-                    items['_items'].append(flow.response())
-
-                #*** Add hash so we don't do it again:
-                known_hashes.append(record['flow_hash'])
-
-                #*** If we've filled the bucket then return result:
-                if len(items['_items']) >= FLOW_RESULT_LIMIT:
-                    return
+        #*** Translate filter into a database query:
+        db_data = self.flow_filter_query(flows_filterlogicselector,
+                                    flows_filtertypeselector, filter_string)
+        if db_data is None:
+            #*** No flows can match:
+            return
+        if flow_cursor:
+            after = cursor_query(flow_cursor, FLOW_SUMMARY_SORT)
+            if after is None:
+                self.logger.warning("Invalid cursor=%s", flow_cursor)
+                return
+            db_data = {'$and': [db_data, after]}
+
+        #*** Connect to flow_summary database and run query. Results are
+        #***  fetched in batches of the page size as they are consumed:
+        flows = self.app.data.driver.db['flow_summary']
+        summary_cursor = flows.find(db_data).sort(FLOW_SUMMARY_SORT) \
+                            .limit(FLOW_SEARCH_LIMIT).batch_size(page_size)
+
+        #*** Identity lookups for this response, keyed by IP or MAC,
+        #***  as the same hosts appear in many flows:
+        id_cache = {}
+        record = None
+        searched = 0
+        for record in summary_cursor:
+            searched += 1
+            #*** Create identity-augmented FlowUI instance:
+            flow = self.flow_augment_record(record, id_cache)
+
+            #*** Check filters against the enriched flow:
+            match = self.flow_match(flow, flows_filterlogicselector,
+                                flows_filtertypeselector, filter_string)
+
+            if match:
+                #*** Add to items dictionary, which is returned in response:
+                items['_items'].append(flow.response())
+
+            #*** If we've filled the page then stop:
+            if len(items['_items']) >= page_size:
+                break
+        summary_cursor.close()
+
+        #*** Cursor to continue from, unless we've run out of flows:
+        if record and (len(items['_items']) >= page_size or
+                                            searched >= FLOW_SEARCH_LIMIT):
+            items['_next_cursor'] = cursor_token(record, FLOW_SUMMARY_SORT)
+
+    def flow_filter_query(self, flows_filterlogicselector,
+                                    flows_filtertypeselector, filter_string):
+        """
+        Passed a logic selector, filter type and filter string, as
+        per flow_match. Return a flow_summary database query that
+        selects a superset of the flows that match (so that flow_match
+        only needs to check the flows that are returned), or None if
+        no flows can match.
+
+        Addresses, protocols and identity names are matched in the
+        database against the normalised fields that flow_match checks
+        (via the FlowUI attributes made from them). Identity names are
+        found in the identities collection, so the query includes flows
+        to and from IP addresses that have, or have had, a matching
+        name. For excludes logic, only matches on addresses and
+        protocols are excluded in the query, as these always match
+        in flow_match too
+        """
+        if flows_filtertypeselector == 'any' or flows_filtertypeselector == '':
+            sides = ('src', 'dst')
+        elif flows_filtertypeselector == 'src':
+            sides = ('src',)
+        elif flows_filtertypeselector == 'dst':
+            sides = ('dst',)
+        elif flows_filtertypeselector == 'src_or_dst':
+            sides = ('src', 'dst')
+        else:
+            self.logger.warning("unsupported flows_filtertypeselector=%s",
+                                                    flows_filtertypeselector)
+            return None
+        if flows_filterlogicselector not in ('', 'includes', 'excludes'):
+            self.logger.error("Unsupported flows_filterlogicselector=%s",
+                                                    flows_filterlogicselector)
+            return None
+        if not filter_string:
+            if flows_filterlogicselector == 'excludes':
+                #*** Empty string matches every flow so excludes them all:
+                return None
+            return {}
+        if ' ' in filter_string or ':' in filter_string or \
+                    [text for text in FLOW_FILTER_HOVER_TEXT
+                                                if filter_string in text]:
+            #*** Could match fixed hover text, so check every flow:
+            return {}
+        #*** Filter strings match anywhere in an address (as in
+        #***  flow_match), so the regex can't be anchored and the address
+        #***  indexes are scanned in full, although without fetching
+        #***  flow_summary records that don't match:
+        regex = {'$regex': re.escape(filter_string)}
+        conditions = []
+        for side in sides:
+            conditions.append({'eth_type': 2048, 'ip_' + side: regex})
+            conditions.append({'eth_type': {'$ne': 2048},
+                                                    'eth_' + side: regex})
+        if flows_filtertypeselector in ('any', ''):
+            protos = [proto for proto in
+                            self.flow_summary.distinct('proto',
+                                            {'eth_type': 2048})
+                            if filter_string in str(enumerate_ip_proto(proto))
+                            or filter_string in str(proto)]
+            if protos:
+                conditions.append({'eth_type': 2048, 'proto': {'$in': protos}})
+            eth_types = [eth_type for eth_type in
+                            self.flow_summary.distinct('eth_type',
+                                            {'eth_type': {'$ne': 2048}})
+                            if filter_string in
+                                            str(enumerate_eth_type(eth_type))
+                            or filter_string in str(eth_type)]
+            if eth_types:
+                conditions.append({'eth_type': {'$in': eth_types}})
+        if flows_filterlogicselector == 'excludes':
+            return {'$nor': conditions}
+        ip_addrs = self.get_ips_by_name(filter_string)
+        if ip_addrs:
+            for side in sides:
+                conditions.append({'eth_type': 2048,
+                                            'ip_' + side: {'$in': ip_addrs}})
+        return {'$or': conditions}
 
     def response_switches_count(self, items):
         """
-        Populate the response with number of connected switches.
+        Populate the response with number of connected switches, from
+        the controller state snapshot if current, otherwise the database
         """
         #*** Get rid of superfluous keys in response:
         if '_items' in items:
             del items['_items']
         if '_meta' in items:
             del items['_meta']
-        items['connected_switches'] = self.switches_col.count()
+        state = self.state_snapshot.read()
+        if state:
+            items['connected_switches'] = len(state['switches'])
+        else:
+            items['connected_switches'] = self.switches_col.count()
 
     def flow_match(self, flow, flows_filterlogicselector,
                                     flows_filtertypeselector, filter_string):
@@ -721,10 +1145,11 @@ class ExternalAPI(BaseClass):
             #*** Didn't match anything and excludes logic so that's a 1!
             return 1
 
-    def flow_augment_record(self, record):
+    def flow_augment_record(self, record, id_cache=None):
         """
-        Passed a record of a single flow from the packet_ins
-        database collection.
+        Passed a record of a single flow from the flow_summary
+        database collection, and optionally a dictionary to cache
+        identity lookups in across records.
 
         Create FlowUI class instance, add in known data and
         augment with identity data. Logic is specific to the
@@ -732,19 +1157,27 @@ class ExternalAPI(BaseClass):
 
         Return the FlowUI class instance
         """
+        if id_cache is None:
+            id_cache = {}
         #*** Instantiate an instance of FlowUI class:
         flow = self.FlowUI()
         flow.timestamp = record['timestamp']
         flow.flow_hash = record['flow_hash']
         #*** Augment with source logical location:
-        flow.src_location_logical = self.get_location_by_mac(record['eth_src'])
+        if record['eth_src'] not in id_cache:
+            id_cache[record['eth_src']] = \
+                                    self.get_location_by_mac(record['eth_src'])
+        flow.src_location_logical = id_cache[record['eth_src']]
         #*** Mangle src/dest and their hovers dependent on type:
         if record['eth_type'] == 2048:
             #*** It's IPv4, see if we can augment with identity:
-            flow.src = self.get_id(record['ip_src'])
+            for ip_addr in (record['ip_src'], record['ip_dst']):
+                if ip_addr not in id_cache:
+                    id_cache[ip_addr] = self.get_id(ip_addr)
+            flow.src = id_cache[record['ip_src']]
             if flow.src != record['ip_src']:
                 flow.src_hover = hovertext_ip_addr(record['ip_src'])
-            flow.dst = self.get_id(record['ip_dst'])
+            flow.dst = id_cache[record['ip_dst']]
             if flow.dst != record['ip_dst']:
                 flow.dst_hover = hovertext_ip_addr(record['ip_dst'])
             flow.proto = enumerate_ip_proto(record['proto'])
@@ -763,27 +1196,25 @@ class ExternalAPI(BaseClass):
                                  hovertext_eth_type(record['eth_type'])
         flow.tp_src = record['tp_src']
         flow.tp_dst = record['tp_dst']
-        #*** Enrich with classification and action(s):
-        classification = self.get_classification(record['flow_hash'])
-        flow.classification = classification['classification_tag']
+        #*** Classification and action(s) from the flow summary:
+        flow.classification = record.get('classification_tag', '')
         #*** Turn actions dictionary into a human-readable string:
-        actions_dict = classification['actions']
+        actions_dict = record.get('actions', {})
         actions = ''
         for key in actions_dict:
             actions += str(key) + "=" + str(actions_dict[key]) + " "
         flow.actions = actions
-        #*** Enrich with data xfer (only applies to flows that
+        #*** Data xfer from the flow summary (only applies to flows that
         #***  have had idle timeout)
-        data_xfer = self.get_flow_data_xfer(record)
-        if data_xfer['tx_found']:
-            flow.data_sent = data_xfer['tx_bytes']
-            flow.data_sent_hover = data_xfer['tx_pkts']
-        if data_xfer['rx_found']:
-            flow.data_received = data_xfer['rx_bytes']
-            flow.data_received_hover = data_xfer['rx_pkts']
+        if record.get('tx_found'):
+            flow.data_sent = record['tx_bytes']
+            flow.data_sent_hover = record['tx_pkts']
+        if record.get('rx_found'):
+            flow.data_received = record['rx_bytes']
+            flow.data_received_hover = record['rx_pkts']
         return flow
 
-    def get_flow_data_xfer(self, record):
+    def get_flow_data_xfer(self, record, test=0):
         """
         Passed a record of a single flow from the packet_ins
         database collection.
@@ -794,6 +1225,9 @@ class ExternalAPI(BaseClass):
 
         Note that the data sent (tx) and received (rx) records
         will have different flow hashes.
+
+        Setting test=1 returns database query execution statistics
+        for the tx and rx queries, as a tuple
         """
         self.logger.debug("In get_flow_data_xfer")
         #*** Set blank result:
@@ -808,8 +1242,10 @@ class ExternalAPI(BaseClass):
         db_data_rx = {'flow_hash': flow_hash, 'ip_B': ip_A,
               'removal_time': {'$gte': datetime.datetime.now() -
                                     FLOW_REM_TIME_LIMIT}}
-        tx = self.flow_rems.find(db_data_tx).sort('$natural', -1).limit(1)
-        rx = self.flow_rems.find(db_data_rx).sort('$natural', -1).limit(1)
+        tx = self.flow_rems.find(db_data_tx).sort('removal_time', -1).limit(1)
+        rx = self.flow_rems.find(db_data_rx).sort('removal_time', -1).limit(1)
+        if test:
+            return (tx.explain(), rx.explain())
         #*** Analyse database results and update result:
         if tx.count():
             result['tx_found'] = 1
@@ -825,17 +1261,21 @@ class ExternalAPI(BaseClass):
             result['rx_pkts'] = rx_result['packet_count']
         return result
 
-    def get_classification(self, flow_hash):
+    def get_classification(self, flow_hash, test=0):
         """
         Passed flow_hash and return a dictionary
         of a classification object for the flow_hash (if found), otherwise
         a dictionary of an empty classification object.
+
+        Setting test=1 returns database query execution statistics
         """
         db_data = {'flow_hash': flow_hash,
               'classification_time': {'$gte': datetime.datetime.now() -
                                     CLASSIFICATION_TIME_LIMIT}}
         results = self.classifications.find(db_data). \
-                                                  sort('$natural', -1).limit(1)
+                                            sort(CLASSIFICATION_SORT).limit(1)
+        if test:
+            return results.explain()
         if results.count():
             return list(results)[0]
         else:
@@ -879,17 +1319,21 @@ class ExternalAPI(BaseClass):
                         record['ip_dst'])
             return record
 
-    def get_flow_client_ip(self, flow_hash):
+    def get_flow_client_ip(self, flow_hash, test=0):
         """
         Find the IP that is the originator of a flow searching
         forward by flow_hash
 
         Finds first packet seen for the flow_hash within the time
         limit and returns the source IP, otherwise 0,
+
+        Setting test=1 returns database query execution statistics
         """
         db_data = {'flow_hash': flow_hash,
               'timestamp': {'$gte': datetime.datetime.now() - FLOW_TIME_LIMIT}}
-        packets = self.packet_ins.find(db_data).sort('$natural', 1).limit(1)
+        packets = self.packet_ins.find(db_data).sort('timestamp', 1).limit(1)
+        if test:
+            return packets.explain()
         if packets.count():
             return list(packets)[0]['ip_src']
         else:
@@ -913,16 +1357,20 @@ class ExternalAPI(BaseClass):
         else:
             return ip_addr
 
-    def get_dns_ip(self, service_name):
+    def get_dns_ip(self, service_name, test=0):
         """
         Use this to get an IP address for a DNS lookup that returned a CNAME
         Passed a DNS CNAME and look this up in identities
         collection to see if there is a DNS A record, and if so return the
         IP address, otherwise return an empty string.
+
+        Setting test=1 returns database query execution statistics
         """
         db_data = {'service_name': service_name}
         #*** Run db search:
-        result = self.identities.find(db_data).sort('$natural', -1).limit(1)
+        result = self.identities.find(db_data).sort('valid_from', -1).limit(1)
+        if test:
+            return result.explain()
         if result.count():
             result0 = list(result)[0]
             self.logger.debug("found result=%s len=%s", result0, len(result0))
@@ -932,47 +1380,81 @@ class ExternalAPI(BaseClass):
                                                                   service_name)
             return ""
 
-    def get_host_by_ip(self, ip_addr):
+    def get_ips_by_name(self, name_part):
+        """
+        Passed part of a name. Return a list of IP addresses from
+        the identities db collection that have a host or service name
+        containing it, or that are for a service whose alias contains
+        it (see get_service_by_ip)
+        """
+        regex = {'$regex': re.escape(name_part)}
+        ip_addrs = set(self.identities.distinct('ip_address',
+                        {'$or': [{'host_name': regex},
+                                {'service_name': regex}]}))
+        aliases = self.identities.distinct('service_alias',
+                        {'service_name': regex,
+                        'service_alias': {'$nin': ['', None]}})
+        if aliases:
+            ip_addrs.update(self.identities.distinct('ip_address',
+                        {'service_name': {'$in': aliases}}))
+        ip_addrs.discard('')
+        return sorted(ip_addrs)
+
+    def get_host_by_ip(self, ip_addr, test=0):
         """
         Passed an IP address. Look this up in the identities db collection
         and return a host name if present, otherwise an empty string
+
+        Setting test=1 returns database query execution statistics
         """
         db_data = {'ip_address': ip_addr}
         #*** Run db search:
         cursor = self.identities.find(db_data).limit(HOST_LIMIT) \
-                                                          .sort('$natural', -1)
+                                                        .sort('valid_from', -1)
+        if test:
+            return cursor.explain()
         for record in cursor:
             self.logger.debug("record is %s", record)
             if record['host_name'] != "":
                 return str(record['host_name'])
         return ""
 
-    def get_location_by_mac(self, mac_addr):
+    def get_location_by_mac(self, mac_addr, test=0):
         """
         Passed a MAC address. Look this up in the identities db collection
         and return a source logical location if present,
         otherwise an empty string
+
+        Setting test=1 returns database query execution statistics
         """
         db_data = {'mac_address': mac_addr}
         #*** Run db search:
         cursor = self.identities.find(db_data).limit(HOST_LIMIT) \
-                                                         .sort('timestamp', -1)
+                                                        .sort('valid_from', -1)
+        if test:
+            return cursor.explain()
         for record in cursor:
             self.logger.debug("record is %s", record)
             if record['location_logical'] != "":
                 return str(record['location_logical'])
         return ""
 
-    def get_service_by_ip(self, ip_addr, alias=1):
+    def get_service_by_ip(self, ip_addr, alias=1, test=0):
         """
         Passed an IP address. Look this up in the identities db collection
         and return a service name if present, otherwise an empty string.
 
         If alias is set, do additional lookup on success to see if service
         name is an alias for another name, and if so return that.
+
+        Setting test=1 returns database query execution statistics for
+        the IP address query, or if test=2 for the alias query
         """
         db_data = {'ip_address': ip_addr, "service_name": {'$ne':""}}
-        db_result = self.identities.find(db_data).sort('$natural', -1).limit(1)
+        db_result = self.identities.find(db_data).sort('valid_from', -1) \
+                                                                    .limit(1)
+        if test == 1:
+            return db_result.explain()
         if db_result.count():
             service_result = list(db_result)[0]
             service = service_result['service_name']
@@ -983,8 +1465,10 @@ class ExternalAPI(BaseClass):
         if alias:
             #*** Look up service name as alias:
             db_data = {"service_alias": service}
-            db_result = self.identities.find(db_data).sort('$natural', -1). \
+            db_result = self.identities.find(db_data).sort('valid_from', -1). \
                                                                        limit(1)
+            if test == 2:
+                return db_result.explain()
             if db_result.count():
                 service_result = list(db_result)[0]
                 service = service_result['service_name']
@@ -1007,47 +1491,134 @@ class ExternalAPI(BaseClass):
         self.logger.debug("pi_rate=%s", pi_rate)
         return pi_rate
 
-    def get_pi_time(self):
+    def get_admission_mode(self):
         """
-        Calculate packet processing time statistics by querying
-        the pi_time database collection.
+        Return the packet-in admission control mode of the controller
+        from the controller state snapshot if current, otherwise the
+        admission_col database collection, or 'unknown'
+        """
+        state = self.state_snapshot.read()
+        if state:
+            return state['admission']['mode']
+        result = self.admission_col.find_one({'controller': 'nmeta'})
+        if result:
+            return result['mode']
+        return 'unknown'
+
+    def get_pi_time(self, test=0):
+        """
+        Calculate packet processing time statistics (min, avg, max and
+        percentiles) over PACKET_TIME_PERIOD by merging the per interval
+        records in the pi_time_stats database collection that nmeta
+        maintains.
+
+        Setting test=1 returns database query execution statistics
         """
-        #*** Set default result values for certain keys:
-        result = dict.fromkeys(['ryu_time_max', 'ryu_time_min', 'ryu_time_avg',
-                    'ryu_time_records', 'pi_time_max', 'pi_time_min',
-                    'pi_time_avg', 'pi_time_records', 'timestamp'], 0)
-        result['ryu_time_period'] = PACKET_TIME_PERIOD
-        result['pi_time_period'] = PACKET_TIME_PERIOD
         db_data = {'timestamp': {'$gte': datetime.datetime.now() - \
                           datetime.timedelta(seconds=PACKET_TIME_PERIOD)}}
-        pi_time_cursor = self.db_pi_time.find(db_data).sort('timestamp', -1)
-        ryu_time_list = []
-        pi_time_list = []
+        if test:
+            return self.pi_time_stats.find(db_data).explain()
+        result = aggregate_buckets(list(self.pi_time_stats.find(db_data)))
+        del result['pi_rate']
+        result['ryu_time_period'] = PACKET_TIME_PERIOD
+        result['pi_time_period'] = PACKET_TIME_PERIOD
         #*** Timestamp:
         result['timestamp'] = datetime.datetime.now().strftime("%H:%M:%S")
-        #*** Accumulate database records into lists:
-        for record in pi_time_cursor:
-            #*** Elapsed time in Ryu:
-            ryu_delta = record['ryu_delta']
-            self.logger.debug("ryu_delta=%s", ryu_delta)
-            ryu_time_list.append(ryu_delta)
-            #*** Elapsed time in nmeta:
-            pi_delta = record['pi_delta']
-            self.logger.debug("pi_delta=%s", pi_delta)
-            pi_time_list.append(pi_delta)
-        #*** Calculate min/avg/max values from lists:
-        if len(ryu_time_list):
-            result['ryu_time_max'] = max(ryu_time_list)
-            result['ryu_time_min'] = min(ryu_time_list)
-            result['ryu_time_avg'] = sum(ryu_time_list)/len(ryu_time_list)
-            result['ryu_time_records'] = len(ryu_time_list)
-        if len(pi_time_list):
-            result['pi_time_max'] = max(pi_time_list)
-            result['pi_time_min'] = min(pi_time_list)
-            result['pi_time_avg'] = sum(pi_time_list)/len(pi_time_list)
-            result['pi_time_records'] = len(pi_time_list)
         return result
 
+def response_cache_key(resource):
+    """
+    Passed an Eve resource name and return the response cache key for
+    the current request, made up of resource and URL parameters
+    """
+    return (resource, tuple(sorted(request.args.items(multi=True))))
+
+def sse_event(event, record):
+    """
+    Passed an event name and a record and return them formatted as a
+    Server-Sent Event, with the record sequence number (if any) as the
+    event id
+    """
+    lines = ['event: ' + event]
+    if 'seq' in record:
+        lines.append('id: ' + str(record['seq']))
+    lines.append('data: ' + json.dumps(record, default=str))
+    return '\n'.join(lines) + '\n\n'
+
+def export_error(message, status):
+    """
+    Passed an error message and HTTP status and return a JSON error
+    response for an export request
+    """
+    return Response(json.dumps({'_error': message}), status=status,
+                                                mimetype='application/json')
+
+def export_default(value):
+    """
+    Passed a value from a database record that isn't JSON serialisable
+    and return a value that is, for exports: datetimes in ISO 8601
+    format, otherwise as a string (i.e. ObjectId)
+    """
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return str(value)
+
+def export_chunks(cursor):
+    """
+    Passed a database cursor and yield its records as newline delimited
+    JSON, in chunks of around EXPORT_CHUNK_SIZE bytes
+    """
+    lines = []
+    size = 0
+    for record in cursor:
+        line = json.dumps(record, default=export_default,
+                                                separators=(',', ':')) + '\n'
+        lines.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_SIZE:
+            yield ''.join(lines)
+            lines = []
+            size = 0
+    if lines:
+        yield ''.join(lines)
+
+def gzip_chunks(chunks):
+    """
+    Passed an iterable of chunks of data and yield them compressed
+    as one gzip stream
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def cursor_token(record, sort):
+    """
+    Passed a database record and the sort (a timestamp key then a
+    unique string key, both descending) of the query it came from,
+    and return a pagination cursor that continues after it
+    """
+    (time_key, _), (key, _) = sort
+    return record[time_key].strftime(CURSOR_TIME_FORMAT) + '_' + record[key]
+
+def cursor_query(token, sort):
+    """
+    Passed a pagination cursor and the sort (a timestamp key then a
+    unique string key, both descending) of the query it is for, and
+    return a database query for records that come after it, or None
+    if the cursor is not valid
+    """
+    (time_key, _), (key, _) = sort
+    try:
+        timestamp, value = token.split('_', 1)
+        timestamp = datetime.datetime.strptime(timestamp, CURSOR_TIME_FORMAT)
+    except ValueError:
+        return None
+    return {'$or': [{time_key: {'$lt': timestamp}},
+                    {time_key: timestamp, key: {'$lt': value}}]}
+
 def enumerate_eth_type(eth_type):
     """
     Passed an eth_type (in decimal) and return an enumerated version,
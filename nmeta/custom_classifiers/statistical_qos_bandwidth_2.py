@@ -0,0 +1,105 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module is part of the nmeta suite
+.
+It defines a custom traffic classifier
+.
+Unlike statistical_qos_bandwidth_1, this classifier does not
+accumulate packets through the controller. It matches on the first
+packet of a TCP flow so that the flow is suppressed straight away,
+then makes its classification decision from the switch flow entry
+counters returned by flow stats polling (see flowstats.py).
+.
+Classifiers with the class attribute flowstats set must implement
+a flowstats_classifier method in addition to the classifier method.
+.
+"""
+
+class Classifier(object):
+    """
+    A custom classifier module for import by nmeta
+    """
+    #*** Classification is finalised from flow stats counters:
+    flowstats = 1
+
+    def __init__(self, logger):
+        """
+        Initialise the classifier
+        """
+        self.logger = logger
+
+    def classifier(self, classifier_result, flow, ident):
+        """
+        Called per packet. Match TCP flows so that they are
+        suppressed with default QoS treatment while counters accrue
+        on the switch.
+        .
+        This method is passed:
+        * A TCClassifierResult class object
+        * A Flow class object holding the current flow context
+        * An Identities class object
+        .
+        Only works on TCP.
+        """
+        if flow.packet.proto != 6:
+            classifier_result.match = False
+            return
+        classifier_result.match = True
+        classifier_result.continue_to_inspect = False
+        classifier_result.actions['qos_treatment'] = 'default_priority'
+        classifier_result.classification_tag = "Pending flow stats"
+
+    def flowstats_classifier(self, classifier_result, rates):
+        """
+        Called with live flow counters after each flow stats poll
+        for flows matched by the classifier method, to differentiate
+        'bandwidth hog' flows from ones that are more interactive.
+        .
+        This method is passed:
+        * A TCClassifierResult class object
+        * A dictionary of flow rates (see FlowStats.flow_rates)
+        .
+        It updates the TCClassifierResult class object with actions and
+        classification_tag, or sets continue_to_inspect if there
+        isn't enough data yet to decide.
+        """
+        #*** Minimum packets in flow before making a classification:
+        _min_packets = 20
+        #*** Thresholds used in calculations:
+        _avg_packet_size_threshold = 600
+        _byte_rate_threshold = 125000
+        packets = rates['packet_count']
+
+        if packets < _min_packets:
+            self.logger.debug("Continuing to inspect flow_hash=%s "
+                                "packets=%s", rates['flow_hash'], packets)
+            classifier_result.match = True
+            classifier_result.continue_to_inspect = True
+            return
+        _avg_packet_size = float(rates['byte_count']) / packets
+        self.logger.debug("avg_packet_size=%s byte_rate=%s",
+                                    _avg_packet_size, rates['byte_rate'])
+        classifier_result.match = True
+        classifier_result.continue_to_inspect = False
+        if (_avg_packet_size > _avg_packet_size_threshold and
+                            rates['byte_rate'] > _byte_rate_threshold):
+            #*** This traffic looks like a bandwidth hog so constrain it:
+            classifier_result.actions['qos_treatment'] = 'constrained_bw'
+            classifier_result.classification_tag = "Bandwidth hog flow"
+        else:
+            #*** Doesn't look like bandwidth hog so default priority:
+            classifier_result.actions['qos_treatment'] = 'default_priority'
+            classifier_result.classification_tag = "Normal flow"
+        self.logger.debug("Decided on results %s", classifier_result.__dict__)
@@ -0,0 +1,205 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+The floodcontrol module is part of the nmeta suite
+
+It provides control of broadcast and multicast packet-ins, which
+are flooded by the controller and so come back as further
+packet-ins from each neighbouring switch.
+
+A short-window dedup set keyed on a hash of the frame recognises
+the same broadcast arriving from another switch (which still needs
+flooding, but not ingesting, harvesting or policy checking) and the
+same broadcast arriving back at a switch it has already been seen
+on, on a different port (a loop, which is dropped). The same
+broadcast arriving again on the same port of the same switch is a
+retransmission by the source (e.g. ARP), so is rate limited and
+flooded as for a duplicate.
+
+New broadcasts are rate limited per source MAC address with a
+token bucket. Sources that are repeatedly rate limited can
+optionally have a temporary drop flow entry installed on the
+switch so that their broadcasts stop raising packet-ins at all.
+
+Token buckets of sources that have been idle long enough for their
+bucket to refill are pruned, so that broadcasts from many (possibly
+spoofed) source MACs don't grow state without bound.
+"""
+
+#*** For timestamps:
+import time
+
+#*** For time-ordered frame hash dedup set:
+from collections import OrderedDict
+
+#*** For logging configuration:
+from baseclass import BaseClass
+
+#*** nmeta imports:
+import nethash
+
+#*** Verdicts returned by FloodControl.check:
+FLOOD = 'flood'
+DUPLICATE = 'duplicate'
+LOOP = 'loop'
+RATE_LIMITED = 'rate_limited'
+NOISY = 'noisy'
+
+class FloodControl(BaseClass):
+    """
+    An object that decides how to treat broadcast and multicast
+    packet-ins
+
+    Main methods (assumes class instantiated as an object called
+    'floodcontrol'):
+
+        floodcontrol.check(dpid, in_port, eth_src, frame)
+          Return a verdict for a broadcast/multicast packet-in, one of:
+          - flood (new broadcast, process as normal)
+          - duplicate (already seen from another switch, or
+            retransmitted on the same port, flood only)
+          - loop (already seen on this switch on another port, drop)
+          - rate_limited (source over its broadcast rate, drop)
+          - noisy (as rate_limited, and a drop entry should be installed)
+
+        floodcontrol.avoided()
+          Return the number of packet-ins that were not fully processed
+
+        floodcontrol.stats()
+          Return a dictionary of verdict counters and packet-ins avoided
+    """
+    def __init__(self, config):
+        """
+        Initialise an instance of the FloodControl class
+        """
+        #*** Required for BaseClass:
+        self.config = config
+        #*** Set up Logging with inherited base class method:
+        self.configure_logging(__name__, "floodcontrol_logging_level_s",
+                                       "floodcontrol_logging_level_c")
+        #*** Get parameters from config:
+        self.enabled = config.get_value("flood_control_enabled")
+        self.dedup_window = config.get_value("flood_dedup_window")
+        self.rate = config.get_value("flood_rate")
+        self.burst = config.get_value("flood_burst")
+        self.drop_enabled = config.get_value("flood_drop_enabled")
+        self.drop_threshold = config.get_value("flood_drop_threshold")
+        self.drop_timeout = config.get_value("flood_drop_timeout")
+        #*** Recent frames, frame_hash: (time first seen, {dpid: in_port}),
+        #***  in order of arrival so that expired entries are at the front:
+        self.frames = OrderedDict()
+        #*** Token buckets, eth_src: [tokens, time last updated]:
+        self.buckets = {}
+        #*** Consecutive rate limited broadcasts by eth_src:
+        self.rate_limited = {}
+        #*** Seconds for an empty token bucket to refill, after which
+        #***  an idle source's bucket is the same as a new one:
+        self.idle_time = float(self.burst) / self.rate
+        self.last_prune = 0
+        #*** Counters:
+        self.counters = dict.fromkeys([FLOOD, DUPLICATE, LOOP, RATE_LIMITED,
+                                                                NOISY], 0)
+
+    def check(self, dpid, in_port, eth_src, frame, now=0):
+        """
+        Passed the DPID, ingress port and source MAC of a broadcast
+        or multicast packet-in and the raw frame, and return a
+        verdict (see class docstring)
+        """
+        if not now:
+            now = time.time()
+        frame_hash = nethash.hash_frame(frame)
+        #*** Expire old entries from front of the time-ordered dict:
+        while self.frames:
+            oldest = next(iter(self.frames))
+            if self.frames[oldest][0] >= now - self.dedup_window:
+                break
+            del self.frames[oldest]
+        if now - self.last_prune >= self.idle_time:
+            self._prune(now)
+        seen = self.frames.get(frame_hash)
+        if seen and dpid not in seen[1]:
+            seen[1][dpid] = in_port
+            verdict = DUPLICATE
+        elif seen and seen[1][dpid] != in_port:
+            verdict = LOOP
+        elif not self._take_token(eth_src, now):
+            count = self.rate_limited.get(eth_src, 0) + 1
+            if self.drop_enabled and count >= self.drop_threshold:
+                self.logger.info("Noisy broadcast source eth_src=%s "
+                                    "dpid=%s", eth_src, dpid)
+                self.rate_limited[eth_src] = 0
+                verdict = NOISY
+            else:
+                self.rate_limited[eth_src] = count
+                verdict = RATE_LIMITED
+        elif seen:
+            #*** Retransmission on the same port, already processed:
+            self.rate_limited.pop(eth_src, None)
+            verdict = DUPLICATE
+        else:
+            self.frames[frame_hash] = (now, {dpid: in_port})
+            self.rate_limited.pop(eth_src, None)
+            verdict = FLOOD
+        self.counters[verdict] += 1
+        self.logger.debug("dpid=%s eth_src=%s verdict=%s", dpid, eth_src,
+                                                                    verdict)
+        return verdict
+
+    def avoided(self):
+        """
+        Return the number of broadcast packet-ins that were not
+        ingested, harvested and policy checked
+        """
+        return self.counters[DUPLICATE] + self.counters[LOOP] + \
+                    self.counters[RATE_LIMITED] + self.counters[NOISY]
+
+    def stats(self):
+        """
+        Return a dictionary of counters of verdicts, packet-ins
+        avoided and source MACs being rate limited
+        """
+        result = dict(self.counters)
+        result['avoided'] = self.avoided()
+        result['sources'] = len(self.buckets)
+        return result
+
+    def _prune(self, now):
+        """
+        Delete token buckets (and rate limited counts) of source MACs
+        that haven't broadcast for long enough for their bucket to
+        refill, as they would start again with a full bucket anyway
+        """
+        idle = [eth_src for eth_src, bucket in self.buckets.items()
+                                    if bucket[1] < now - self.idle_time]
+        for eth_src in idle:
+            del self.buckets[eth_src]
+            self.rate_limited.pop(eth_src, None)
+        self.last_prune = now
+        if idle:
+            self.logger.debug("Pruned idle broadcast sources=%s", len(idle))
+
+    def _take_token(self, eth_src, now):
+        """
+        Refill the token bucket for a source MAC at the configured
+        rate (up to burst size) and take a token from it.
+        Return True if a token was available, otherwise False
+        """
+        bucket = self.buckets.setdefault(eth_src, [self.burst, now])
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return True
+        return False
@@ -35,6 +35,9 @@ import socket
 #*** For timestamps:
 import datetime
 
+#*** For time-ordered packet hash dedup set:
+from collections import OrderedDict
+
 #*** Import dpkt for packet parsing:
 import dpkt
 
@@ -51,6 +54,32 @@ import nethash
 #*** Seconds to wait before resuppressing a flow on a particular switch:
 FLOW_SUPPRESSION_STANDDOWN = datetime.timedelta(seconds=5)
 
+#*** Sort for most recent classification first. Classifications of a flow
+#***  can share a classification_time (stored to the millisecond), so
+#***  break ties by _id (insertion order):
+CLASSIFICATION_SORT = [('classification_time', pymongo.DESCENDING),
+                       ('_id', pymongo.DESCENDING)]
+
+#*** Sort for most recently started flow summary first. This is on the
+#***  time of the first packet, as it doesn't change while the flow is
+#***  active, so pages are stable. Flows can share a first_timestamp,
+#***  so break ties by flow_hash (unique per summary):
+FLOW_SUMMARY_SORT = [('first_timestamp', pymongo.DESCENDING),
+                     ('flow_hash', pymongo.DESCENDING)]
+
+#*** Removed flow rollup statistics incremented per session direction, as
+#***  (stat, RemovedFlow IP attribute). Source is the IP that started the
+#***  session (ip_A of forward flow entries):
+FLOW_REMS_ROLLUP_STATS = {
+    'forward': (('src_sent', 'ip_A'), ('dst_received', 'ip_B')),
+    'reverse': (('dst_sent', 'ip_A'), ('src_received', 'ip_B'))
+    }
+#*** Largest first, for top talkers of a stat (total or per time bucket):
+FLOW_REMS_ROLLUP_SORT = [('stat', pymongo.ASCENDING),
+                         ('period', pymongo.ASCENDING),
+                         ('bucket', pymongo.ASCENDING),
+                         ('bytes', pymongo.DESCENDING)]
+
 class Flow(BaseClass):
     """
     An object that represents a flow that we are classifying
@@ -64,8 +93,13 @@ class Flow(BaseClass):
     out of order or missing packets.
 
     Read a packet_in event into flows (assumes class instantiated as
-    an object called 'flow'):
-        flow.ingest_packet(dpid, in_port, pkt, timestamp)
+    an object called 'flow'), returning a FlowContext object for the
+    packet:
+        context = flow.ingest_packet(dpid, in_port, pkt, timestamp)
+
+    The variables below are available on the FlowContext object
+    (pass it to policy and classifiers), and on the flow object for
+    the most recently ingested packet.
 
     Variables available for Classifiers (assumes class instantiated as
     an object called 'flow'):
@@ -93,6 +127,10 @@ class Flow(BaseClass):
           The time in datetime format that the current packet was
           received at the controller
 
+        flow.packet.duplicate
+          True if the current packet has already been received
+          from a different switch within the packet dedup window
+
         flow.packet.length
           Length in bytes of the current packet on wire
 
@@ -190,15 +228,25 @@ class Flow(BaseClass):
     The Flow class also includes the record_removal method
     that records a flow removal message from a switch to database
 
+    A summary of each flow (normalised to the direction of the first
+    packet, with latest classification, suppression and data
+    transfer) is kept up to date in the flow_summary database
+    collection as packets are ingested, flows are classified,
+    suppressed and removed, so that API consumers such as the WebUI
+    don't need to assemble it from the other collections
+
     Challenges (not handled - yet):
      - duplicate packets due to retransmissions
      - IP fragments
      - Flow reuse - TCP source port reused
     """
 
-    def __init__(self, config):
+    def __init__(self, config, attach=0):
         """
-        Initialise an instance of the Flow class
+        Initialise an instance of the Flow class.
+        Set attach=1 to use database collections already set up by
+        another instance (i.e. in a worker process) rather than
+        recreating them
         """
         #*** Required for BaseClass:
         self.config = config
@@ -206,6 +254,7 @@ class Flow(BaseClass):
         self.configure_logging(__name__, "flows_logging_level_s",
                                        "flows_logging_level_c")
         self.flow_hash = 0
+        self.context = None
 
         #*** Get parameters from config:
         mongo_addr = config.get_value("mongo_addr")
@@ -217,11 +266,32 @@ class Flow(BaseClass):
                                   config.get_value("classifications_max_bytes")
         flow_rems_max_bytes = config.get_value("flow_rems_max_bytes")
         flow_mods_max_bytes = config.get_value("flow_mods_max_bytes")
+        #*** Seconds after last update that flow summaries expire:
+        flow_summary_time_limit = config.get_value("flow_summary_time_limit")
+        #*** Seconds to keep per minute and per hour removed flow rollups:
+        self.rollup_time_limits = {
+            'minute': datetime.timedelta(seconds=config.get_value(
+                                "flow_rems_rollup_minute_time_limit")),
+            'hour': datetime.timedelta(seconds=config.get_value(
+                                "flow_rems_rollup_hour_time_limit"))
+            }
         #*** How far back in time to go back looking for packets in flow:
         self.flow_time_limit = datetime.timedelta \
                                 (seconds=config.get_value("flow_time_limit"))
         self.classification_time_limit = datetime.timedelta \
                         (seconds=config.get_value("classification_time_limit"))
+        #*** How long to remember packet hashes for cross-switch dedup:
+        self.packet_dedup_window = datetime.timedelta \
+                        (seconds=config.get_value("packet_dedup_window"))
+        #*** In-memory packet dedup set, packet_hash: (dpid, timestamp),
+        #***  in order of arrival so that expired entries are at the front:
+        self.packet_hashes = OrderedDict()
+        #*** In-memory cache of flow origins, flow_hash: (ip_src, dpid,
+        #***  timestamp), so that flow features query them once per flow:
+        self.origins = OrderedDict()
+        #*** Counters for dedup ratio metric:
+        self.packets_ingested = 0
+        self.packets_duplicate = 0
 
         #*** Flow mod cookie value offset indicates flow session direction:
         self.offset = config.get_value("flow_mod_cookie_reverse_offset")
@@ -233,6 +303,15 @@ class Flow(BaseClass):
         #*** Connect to MongoDB nmeta database:
         db_nmeta = mongo_client[mongo_dbname]
 
+        if attach:
+            self.packet_ins = db_nmeta.packet_ins
+            self.classifications = db_nmeta.classifications
+            self.flow_rems = db_nmeta.flow_rems
+            self.flow_mods = db_nmeta.flow_mods
+            self.flow_summary = db_nmeta.flow_summary
+            self.flow_rems_rollups = db_nmeta.flow_rems_rollups
+            return
+
         #*** packet_ins collection:
         self.logger.debug("Deleting packet_ins MongoDB collection...")
         db_nmeta.packet_ins.drop()
@@ -260,9 +339,11 @@ class Flow(BaseClass):
         #*** Index flow_hash and classification_time of classifications
         #***  collection to improve look-up performance:
 
-        #*** Index classifications to improve look-up performance:
+        #*** Index classifications to improve look-up performance, in
+        #***  order of CLASSIFICATION_SORT so that sorts don't need memory:
         self.classifications.create_index([('flow_hash', pymongo.DESCENDING),
-                                ('classification_time', pymongo.DESCENDING)],
+                                ('classification_time', pymongo.DESCENDING),
+                                ('_id', pymongo.DESCENDING)],
                                 unique=False)
 
         #*** flow_rems collection for recording flow removals:
@@ -277,6 +358,37 @@ class Flow(BaseClass):
                                 ('ip_A', pymongo.DESCENDING),
                                 ('ip_B', pymongo.DESCENDING)],
                                 unique=False)
+        #*** For finding if a flow removal is from another switch:
+        self.flow_rems.create_index([('flow_hash', pymongo.DESCENDING),
+                                ('direction', pymongo.DESCENDING)],
+                                unique=False)
+        #*** For most recent data sent and received by a flow:
+        for field in ('ip_A', 'ip_B'):
+            self.flow_rems.create_index([('flow_hash', pymongo.DESCENDING),
+                                (field, pymongo.ASCENDING),
+                                ('removal_time', pymongo.DESCENDING)],
+                                unique=False)
+        #*** For time range exports:
+        self.flow_rems.create_index([('removal_time', pymongo.DESCENDING)],
+                                unique=False)
+
+        #*** flow_rems_rollups collection:
+        self.logger.debug("Deleting flow_rems_rollups MongoDB collection...")
+        db_nmeta.flow_rems_rollups.drop()
+        #*** Not capped as records are incremented in place. MongoDB
+        #***  expires (TTL) time bucket records at their expire_time:
+        self.flow_rems_rollups = db_nmeta.create_collection(
+                                                        'flow_rems_rollups')
+        self.flow_rems_rollups.create_index([('stat', pymongo.ASCENDING),
+                                ('period', pymongo.ASCENDING),
+                                ('bucket', pymongo.ASCENDING),
+                                ('ip', pymongo.ASCENDING)],
+                                unique=True)
+        #*** For top talkers without sorting (see FLOW_REMS_ROLLUP_SORT):
+        self.flow_rems_rollups.create_index(FLOW_REMS_ROLLUP_SORT,
+                                unique=False)
+        self.flow_rems_rollups.create_index([('expire_time',
+                                pymongo.ASCENDING)], expireAfterSeconds=0)
 
         #*** flow_mods collection:
         self.logger.debug("Deleting flow_mods MongoDB collection...")
@@ -293,13 +405,42 @@ class Flow(BaseClass):
                                 ('standdown', pymongo.DESCENDING)],
                                 unique=False)
 
+        #*** flow_summary collection:
+        self.logger.debug("Deleting flow_summary MongoDB collection...")
+        db_nmeta.flow_summary.drop()
+        #*** Not capped as records are updated in place. MongoDB expires
+        #***  (TTL) records that haven't been updated within time limit:
+        self.flow_summary = db_nmeta.create_collection('flow_summary')
+        self.flow_summary.create_index([('flow_hash', pymongo.DESCENDING)],
+                                unique=True)
+        #*** For most recently started flows first, with flow_hash to
+        #***  break ties for cursor pagination (see FLOW_SUMMARY_SORT):
+        self.flow_summary.create_index(FLOW_SUMMARY_SORT, unique=False)
+        #*** For filtering flows on addresses and protocols:
+        for field in ('ip_src', 'ip_dst', 'eth_src', 'eth_dst'):
+            self.flow_summary.create_index([(field, pymongo.ASCENDING)],
+                                unique=False)
+        self.flow_summary.create_index([('eth_type', pymongo.ASCENDING),
+                                ('proto', pymongo.ASCENDING)],
+                                unique=False)
+        self.flow_summary.create_index([('expire_time', pymongo.ASCENDING)],
+                                expireAfterSeconds=flow_summary_time_limit)
+
     class Packet(object):
         """
         An object that represents the current packet
         """
+        #*** Fixed attributes, so no per-instance __dict__:
+        __slots__ = ('flow_hash', 'packet_hash', 'dpid', 'in_port',
+                     'timestamp', 'length', 'eth_src', 'eth_dst', 'eth_type',
+                     'ip_src', 'ip_dst', 'proto', 'tp_src', 'tp_dst',
+                     'tp_flags', 'tp_seq_src', 'tp_seq_dst', 'payload',
+                     'duplicate')
+
         def __init__(self):
             #*** Initialise packet variables:
             self.flow_hash = 0
+            self.packet_hash = 0
             self.dpid = 0
             self.in_port = 0
             self.timestamp = 0
@@ -316,6 +457,7 @@ class Flow(BaseClass):
             self.tp_seq_src = 0
             self.tp_seq_dst = 0
             self.payload = ""
+            self.duplicate = False
 
         def dbdict(self):
             """
@@ -394,13 +536,17 @@ class Flow(BaseClass):
         """
         An object that represents an individual traffic classification
         """
-        def __init__(self, flow_hash, clsfn, time_limit, logger):
+        def __init__(self, flow_hash, clsfn, time_limit, logger,
+                                                            summary=None):
             """
             Retrieve classification data from MongoDB collection for a
             particular flow hash within a time range.
             time range is from current time backwards by number of seconds
             defined in config for classification_time_limit
 
+            If passed the flow_summary collection, commits also update
+            the summary of the flow
+
             Setting test returns database query execution statistics
             """
             #*** Initialise classification variables:
@@ -409,7 +555,10 @@ class Flow(BaseClass):
             self.classification_tag = ""
             self.classification_time = 0
             self.actions = {}
+            #*** Custom classifier that finalises from flow stats (if any):
+            self.flowstats_classifier = ""
             self.clsfn = clsfn
+            self.summary = summary
             self.time_limit = time_limit
             self.logger = logger
 
@@ -420,7 +569,7 @@ class Flow(BaseClass):
             db_data['classification_time'] = {'$gte': datetime.datetime.now()-
                                                                self.time_limit}
             #*** Run db search:
-            result = self.clsfn.find(db_data).sort('classification_time', -1) \
+            result = self.clsfn.find(db_data).sort(CLASSIFICATION_SORT) \
                                                                       .limit(1)
             self.logger.debug("result.count=%s", result.count())
             if result.count():
@@ -435,6 +584,9 @@ class Flow(BaseClass):
                     self.classification_time = result0['classification_time']
                 if 'actions' in result0:
                     self.actions = result0['actions']
+                if 'flowstats_classifier' in result0:
+                    self.flowstats_classifier = \
+                                             result0['flowstats_classifier']
 
         def test_query(self):
             """
@@ -445,7 +597,7 @@ class Flow(BaseClass):
             db_data['classification_time'] = {'$gte': datetime.datetime.now()-
                                                                self.time_limit}
             #*** Run db search with explain:
-            return self.clsfn.find(db_data).sort('classification_time', -1) \
+            return self.clsfn.find(db_data).sort(CLASSIFICATION_SORT) \
                                                     .limit(1).explain()
 
         def dbdict(self):
@@ -458,18 +610,26 @@ class Flow(BaseClass):
             dbdictresult['classified'] = self.classified
             dbdictresult['classification_tag'] = self.classification_tag
             dbdictresult['classification_time'] = self.classification_time
-            dbdictresult['actions'] = self.actions
+            dbdictresult['actions'] = dict(self.actions)
+            dbdictresult['flowstats_classifier'] = self.flowstats_classifier
             return dbdictresult
 
         def commit(self):
             """
             Record current state of flow classification into MongoDB
-            classifications collection.
+            classifications collection, and into the flow summary
             """
             self.classification_time = datetime.datetime.now()
             db_dict = self.dbdict()
             #*** Write classification to database collection:
             self.clsfn.insert_one(db_dict)
+            if self.summary is not None:
+                self.summary.update_one({'flow_hash': self.flow_hash},
+                        {'$set': {'classified': self.classified,
+                            'classification_tag': self.classification_tag,
+                            'classification_time': self.classification_time,
+                            'actions': dict(self.actions),
+                            'expire_time': datetime.datetime.utcnow()}})
 
     class RemovedFlow(object):
         """
@@ -477,6 +637,14 @@ class Flow(BaseClass):
         This is a flow that a switch has informed us it has
         removed from its flow table because of an idle timeout
         """
+        #*** Fixed attributes, so no per-instance __dict__:
+        __slots__ = ('offset', 'logger', 'flow_rems', 'dpid', 'removal_time',
+                     'cookie', 'priority', 'reason', 'table_id',
+                     'duration_sec', 'idle_timeout', 'hard_timeout',
+                     'packet_count', 'byte_count', 'eth_A', 'eth_B',
+                     'eth_type', 'ip_A', 'ip_B', 'ip_proto', 'tp_A', 'tp_B',
+                     'flow_hash', 'direction')
+
         def __init__(self, logger, flow_rems, msg, offset):
             """
             Initialise the class with logger and flow_rems db
@@ -582,42 +750,190 @@ class Flow(BaseClass):
             #*** Write to database collection:
             self.flow_rems.insert_one(self.dbdict())
 
+    def reclassify(self, flow_hash, classification_tag, actions):
+        """
+        Finalise the classification of a flow that is not necessarily
+        the flow in current packet context (i.e. from flow stats).
+        Passed a flow_hash, classification tag and actions to merge
+        into the existing classification. Records the classification
+        to the classifications database collection and returns
+        the Classification object
+        """
+        classification = self.Classification(flow_hash,
+                                                self.classifications,
+                                                self.classification_time_limit,
+                                                self.logger, self.flow_summary)
+        classification.classified = True
+        classification.classification_tag = classification_tag
+        classification.actions.update(actions)
+        classification.flowstats_classifier = ""
+        classification.commit()
+        return classification
+
+    def invalidate(self, flow_hash):
+        """
+        Invalidate the classification of a flow (i.e. after a policy
+        change) by recording it as unclassified, so that policy is
+        checked again on the next packet-in for the flow
+        """
+        classification = self.Classification(flow_hash,
+                                                self.classifications,
+                                                self.classification_time_limit,
+                                                self.logger, self.flow_summary)
+        classification.classified = False
+        classification.classification_tag = ""
+        classification.actions = {}
+        classification.flowstats_classifier = ""
+        classification.commit()
+        return classification
+
+    def suppressions(self, flow_hash):
+        """
+        Return a list of flow_mods records of suppression and drop
+        flow entries that have been installed on switches for a flow
+        (excluding stand-downs and flows that weren't suppressed)
+        """
+        db_data = {'flow_hash': flow_hash,
+                    'suppress_type': {'$in': ['suppress', 'drop']},
+                    'standdown': 0,
+                    'match_type': {'$ne': 'ignore'}}
+        return list(self.flow_mods.find(db_data))
+
+    def aggregated_flows(self):
+        """
+        Return a list of the flow_hashes of flows that have been
+        suppressed with aggregated flow entries (that also cover
+        other flows)
+        """
+        db_data = {'suppress_type': {'$in': ['suppress', 'drop']},
+                    'standdown': 0,
+                    'match_type': 'aggregate'}
+        return self.flow_mods.distinct('flow_hash', db_data)
+
     def record_removal(self, msg):
         """
         Record an idle-timeout flow removal message.
         Passed a Ryu message object for the flow removal.
-        Record entry in the flow_rems database collection
+        Record entry in the flow_rems database collection, data
+        transfer in the flow summary, and (if the flow hasn't already
+        been removed from another switch) in the flow_rems_rollups
+        statistics
         """
         #*** Instantiate class to hold removed flow record:
         remf = self.RemovedFlow(self.logger, self.flow_rems, msg, self.offset)
         #*** Decide what to record based on the match:
         match = msg.match
         if 'ip_proto' in match:
+            #*** Flows crossing multiple switches are removed from each:
+            duplicate = self.flow_rems.find_one({'flow_hash': remf.flow_hash,
+                                        'direction': remf.direction},
+                                        {'_id': 1}) is not None
             if match['ip_proto'] == 6:
                 #*** TCP. Write record to database:
                 self.logger.debug("Removed flow was TCP, dbdict=%s",
                                                              remf.dbdict())
                 remf.commit()
-                return 1
+                self.summarise_removal(remf)
             else:
                 #*** Non-TCP IP flow
                 self.logger.debug("Removed flow was non-TCP, dbdict=%s",
                                                              remf.dbdict())
                 remf.commit()
-                return 1
+            if not duplicate:
+                self.rollup_removal(remf)
+            return 1
         else:
             self.logger.warning("Removed flow was unhandled eth_type")
             return 0
 
-    def ingest_packet(self, dpid, in_port, packet, timestamp):
+    def rollup_removal(self, remf):
+        """
+        Passed a RemovedFlow object. Increment bytes, packets and
+        flows of the session source and destination IP addresses
+        in the flow_rems_rollups database collection, for the total
+        since nmeta started and for the minute and hour time buckets
+        that the flow was removed in.
+
+        Stats are src_sent, src_received, dst_sent and dst_received,
+        where source is the IP address that started the session
+        """
+        now = datetime.datetime.utcnow()
+        #*** (period, start of time bucket, expire_time). Totals don't expire:
+        buckets = [('total', None, None),
+                   ('minute', remf.removal_time.replace(second=0,
+                                microsecond=0),
+                                now + self.rollup_time_limits['minute']),
+                   ('hour', remf.removal_time.replace(minute=0, second=0,
+                                microsecond=0),
+                                now + self.rollup_time_limits['hour'])]
+        for stat, ip_attr in FLOW_REMS_ROLLUP_STATS[remf.direction]:
+            for period, bucket, expire_time in buckets:
+                update = {'$inc': {'bytes': remf.byte_count,
+                                    'packets': remf.packet_count,
+                                    'flows': 1}}
+                if expire_time:
+                    update['$set'] = {'expire_time': expire_time}
+                self.flow_rems_rollups.update_one({'stat': stat,
+                                        'period': period,
+                                        'bucket': bucket,
+                                        'ip': getattr(remf, ip_attr)},
+                                        update, upsert=True)
+
+    def summarise_removal(self, remf):
+        """
+        Passed a RemovedFlow object for a TCP flow. Record its byte
+        and packet counts in the flow summary as data sent (tx) if
+        it was in the direction of the first packet of the flow,
+        otherwise as data received (rx)
         """
-        Ingest a packet into the packet_ins collection and put the flow object
-        into the context of the packet.
+        expire_time = datetime.datetime.utcnow()
+        self.flow_summary.update_one({'flow_hash': remf.flow_hash,
+                                        'ip_src': remf.ip_A},
+                                {'$set': {'tx_found': 1,
+                                        'tx_bytes': remf.byte_count,
+                                        'tx_pkts': remf.packet_count,
+                                        'expire_time': expire_time}})
+        self.flow_summary.update_one({'flow_hash': remf.flow_hash,
+                                        'ip_src': remf.ip_B},
+                                {'$set': {'rx_found': 1,
+                                        'rx_bytes': remf.byte_count,
+                                        'rx_pkts': remf.packet_count,
+                                        'expire_time': expire_time}})
+
+    def summarise_packet(self, pkt):
+        """
+        Passed a Packet object and upsert the summary of its flow in
+        the flow_summary database collection. The first packet of a
+        flow sets the (normalised) direction of the summary
+        """
+        first = {'eth_src': pkt.eth_src, 'eth_dst': pkt.eth_dst,
+                    'eth_type': pkt.eth_type, 'ip_src': pkt.ip_src,
+                    'ip_dst': pkt.ip_dst, 'proto': pkt.proto,
+                    'tp_src': pkt.tp_src, 'tp_dst': pkt.tp_dst,
+                    'first_timestamp': pkt.timestamp, 'classified': 0,
+                    'classification_tag': '', 'actions': {},
+                    'suppress_type': '', 'tx_found': 0, 'rx_found': 0}
+        self.flow_summary.update_one({'flow_hash': pkt.flow_hash},
+                                {'$setOnInsert': first,
+                                '$set': {'timestamp': pkt.timestamp,
+                                    'expire_time': datetime.datetime.utcnow()},
+                                '$inc': {'packet_count': 1}},
+                                upsert=True)
+
+    def ingest_packet(self, dpid, in_port, packet, timestamp, shed=False):
+        """
+        Ingest a packet into the packet_ins collection and return a
+        FlowContext for the packet. The flow object is also put
+        into the context of the packet, for callers that process one
+        packet at a time.
+        If shed is set (admission control shedding load), the
+        packet is only written to the packet_ins collection if it is
+        in an unclassified TCP flow, as custom classifiers may later
+        need the flow's packets.
         Note that timestamp MUST be in datetime format
         """
         #*** Instantiate an instance of Packet class:
-        self.packet = self.Packet()
-        pkt = self.packet
+        pkt = self.Packet()
 
         #*** DPID of the switch that sent the Packet-In message:
         pkt.dpid = dpid
@@ -683,29 +999,329 @@ class Flow(BaseClass):
 
         #*** Generate a flow_hash unique to flow for pkts in either direction:
         if pkt.proto == 6:
-            self.packet.flow_hash = nethash.hash_flow((pkt.ip_src, pkt.ip_dst,
+            pkt.flow_hash = nethash.hash_flow((pkt.ip_src, pkt.ip_dst,
                                           pkt.tp_src, pkt.tp_dst,
                                           pkt.proto))
         else:
-            self.packet.flow_hash = nethash.hash_flow((pkt.eth_src, pkt.eth_dst,
+            pkt.flow_hash = nethash.hash_flow((pkt.eth_src, pkt.eth_dst,
                                           dpid, pkt.timestamp,
                                           pkt.proto))
-        self.flow_hash = self.packet.flow_hash
 
         #*** Generate a packet_hash unique to the packet:
-        self.packet.packet_hash = nethash.hash_packet(self.packet)
+        pkt.packet_hash = nethash.hash_packet(pkt)
+
+        #*** Check if same packet already received from another switch:
+        pkt.duplicate = self.dedup_packet(pkt.packet_hash, dpid, timestamp)
 
         #*** Instantiate classification data for this flow in context:
-        self.classification = self.Classification(self.flow_hash,
+        classification = self.Classification(pkt.flow_hash,
                                                 self.classifications,
                                                 self.classification_time_limit,
-                                                self.logger)
-        self.logger.debug("clasfn=%s", self.classification.dbdict())
-        db_dict = self.packet.dbdict()
+                                                self.logger, self.flow_summary)
+        self.logger.debug("clasfn=%s", classification.dbdict())
+        db_dict = pkt.dbdict()
         self.logger.debug("packet_in=%s", db_dict)
 
         #*** Write packet-in metadata to database collection:
-        self.packet_ins.insert_one(db_dict)
+        if not shed or (pkt.proto == 6 and not classification.classified):
+            self.packet_ins.insert_one(db_dict)
+        #*** Packets already received from another switch aren't counted:
+        if not pkt.duplicate:
+            self.summarise_packet(pkt)
+
+        context = FlowContext(self, pkt, classification)
+        #*** Current flow context:
+        self.context = context
+        self.packet = pkt
+        self.flow_hash = pkt.flow_hash
+        self.classification = classification
+        return context
+
+    def dedup_packet(self, packet_hash, dpid, timestamp):
+        """
+        Passed a packet_hash, DPID and timestamp (datetime) for
+        a packet-in. Return True if the same packet has been
+        received from a different switch within the packet dedup
+        window, otherwise record it and return False.
+
+        Note that only TCP packet hashes are independent of the
+        switch, so other packets are never duplicates
+        """
+        self.packets_ingested += 1
+        #*** Expire old entries from front of the time-ordered dict:
+        expiry = timestamp - self.packet_dedup_window
+        while self.packet_hashes:
+            oldest = next(iter(self.packet_hashes))
+            if self.packet_hashes[oldest][1] >= expiry:
+                break
+            del self.packet_hashes[oldest]
+        if packet_hash in self.packet_hashes:
+            if self.packet_hashes[packet_hash][0] != dpid:
+                self.packets_duplicate += 1
+                return True
+            #*** Same switch, so a retransmission, keep the first sighting:
+            return False
+        self.packet_hashes[packet_hash] = (dpid, timestamp)
+        return False
+
+    def dedup_ratio(self):
+        """
+        Return the ratio of packet-ins that were recognised as
+        duplicates of a packet already received from another switch
+        """
+        if not self.packets_ingested:
+            return 0
+        return float(self.packets_duplicate) / self.packets_ingested
+
+    def flow_origin(self, flow_hash):
+        """
+        Passed a flow_hash and return a tuple of the source IP and
+        DPID of the first packet seen for the flow within the time
+        limit (if known, otherwise (0, 0)).
+
+        The result is cached until that packet is older than the
+        time limit, as it is needed by most flow features
+        """
+        time_limit = datetime.datetime.now() - self.flow_time_limit
+        #*** Expire old entries from front of the ordered dict:
+        while self.origins:
+            oldest = next(iter(self.origins))
+            if self.origins[oldest][2] >= time_limit:
+                break
+            del self.origins[oldest]
+        origin = self.origins.get(flow_hash)
+        if origin and origin[2] >= time_limit:
+            return origin[0:2]
+        db_data = {'flow_hash': flow_hash, 'timestamp': {'$gte': time_limit}}
+        packets = self.packet_ins.find(db_data).sort('timestamp', 1).limit(1)
+        if packets.count():
+            packet = list(packets)[0]
+            self.origins.pop(flow_hash, None)
+            self.origins[flow_hash] = (packet['ip_src'], packet['dpid'],
+                                                        packet['timestamp'])
+            return (packet['ip_src'], packet['dpid'])
+        else:
+            self.logger.warning("no packets found")
+            return (0, 0)
+
+    def packet_count(self, test=0):
+        """
+        Return packet_count() of the current flow context
+        (see FlowContext)
+        """
+        return self.context.packet_count(test)
+
+    def packet_direction(self):
+        """
+        Return packet_direction() of the current flow context
+        (see FlowContext)
+        """
+        return self.context.packet_direction()
+
+    def packet_directions(self, test=0):
+        """
+        Return packet_directions() of the current flow context
+        (see FlowContext)
+        """
+        return self.context.packet_directions(test)
+
+    def packet_sizes(self, test=0):
+        """
+        Return packet_sizes() of the current flow context
+        (see FlowContext)
+        """
+        return self.context.packet_sizes(test)
+
+    def client(self):
+        """
+        Return client() of the current flow context
+        (see FlowContext)
+        """
+        return self.context.client()
+
+    def origin(self):
+        """
+        Return origin() of the current flow context
+        (see FlowContext)
+        """
+        return self.context.origin()
+
+    def server(self):
+        """
+        Return server() of the current flow context
+        (see FlowContext)
+        """
+        return self.context.server()
+
+    def max_packet_size(self):
+        """
+        Return max_packet_size() of the current flow context
+        (see FlowContext)
+        """
+        return self.context.max_packet_size()
+
+    def max_interpacket_interval(self):
+        """
+        Return max_interpacket_interval() of the current flow context
+        (see FlowContext)
+        """
+        return self.context.max_interpacket_interval()
+
+    def min_interpacket_interval(self):
+        """
+        Return min_interpacket_interval() of the current flow context
+        (see FlowContext)
+        """
+        return self.context.min_interpacket_interval()
+
+    def not_suppressed(self, dpid, suppress_type, flow_hash=0):
+        """
+        Check flow_mods to see if current flow context (or flow_hash
+        if passed) is already suppressed within suppression stand-down
+        time for that switch, and if it is then return False,
+        otherwise True
+
+        The stand-down time is to reduce risk of overloading switch
+        with duplicate suppression events.
+
+        Called from nmeta.py
+        """
+        if not flow_hash:
+            flow_hash = self.packet.flow_hash
+        #*** Database lookup for whole flow:
+        db_data = {'flow_hash': flow_hash,
+                    'dpid': dpid,
+                    'timestamp': {'$gte': datetime.datetime.now() - \
+                                                FLOW_SUPPRESSION_STANDDOWN},
+                    'suppress_type': suppress_type,
+                    'standdown': 0}
+
+        #*** Check if already suppressed with-in stand-down time period:
+        if self.flow_mods.find_one(db_data):
+            #*** There has been a suppression for this flow_hash within
+            #*** Stand down period
+            self.logger.debug("flow=%s already recorded as suppressed on "
+                                "dpid=%s", flow_hash, dpid)
+            return False
+        else:
+            return True
+
+    class FlowMod(object):
+        """
+        An object that represents an individual Flow Modification,
+        used for recording the circumstances into the
+        flow_mods MongoDB collection
+        """
+        def __init__(self, flow_mods, flow_hash, dpid, _type, standdown):
+            #*** Initialise variables:
+            self.flow_mods = flow_mods
+            self.flow_hash = flow_hash
+            #*** Timestamp of when flow mod made:
+            self.timestamp = datetime.datetime.now()
+            self.dpid = dpid
+            #*** suppress_type is 'suppress' or 'drop':
+            self.suppress_type = _type
+            #*** If set, flow_mod was not sent due to stand down period:
+            self.standdown = standdown
+            #*** Match type set by switches module (ignore|single|dual|
+            #***  aggregate) ignore means no mod, dual had forward and
+            #***  reverse mods, aggregate matched only some fields:
+            self.match_type = ''
+            #*** Cookie for forward flow mod:
+            self.forward_cookie = 0
+            #*** Match dict set by switches module for forward flow:
+            self.forward_match = {}
+            #*** Cookie for reverse flow mod:
+            self.reverse_cookie = 0
+            #*** Match dict set by switches module for reverse flow:
+            self.reverse_match = {}
+            #*** Client IP to help ascertain session direction (0 if unknown):
+            self.client_ip = ''
+
+        def dbdict(self):
+            """
+            Return a dictionary object of specific FlowMod
+            parameters for storing in the database
+            """
+            dbdictresult = {}
+            dbdictresult['flow_hash'] = self.flow_hash
+            dbdictresult['timestamp'] = self.timestamp
+            dbdictresult['dpid'] = self.dpid
+            dbdictresult['suppress_type'] = self.suppress_type
+            dbdictresult['standdown'] = self.standdown
+            dbdictresult['match_type'] = self.match_type
+            dbdictresult['forward_cookie'] = self.forward_cookie
+            dbdictresult['forward_match'] = self.forward_match
+            dbdictresult['reverse_cookie'] = self.reverse_cookie
+            dbdictresult['reverse_match'] = self.reverse_match
+            dbdictresult['client_ip'] = self.client_ip
+            return dbdictresult
+
+        def commit(self):
+            """
+            Record removed mod into MongoDB
+            flow_mods collection.
+            """
+            #*** Write to database collection:
+            self.flow_mods.insert_one(self.dbdict())
+
+    def record_suppression(self, dpid, suppress_type, result, standdown=0,
+                                                                flow_hash=0):
+        """
+        Record that the flow (current flow context, or flow_hash if
+        passed) is being suppressed on a particular switch in the
+        flow_mods database collection and flow summary, so that
+        information is available to API consumers, such as the WebUI
+        """
+        if not flow_hash:
+            flow_hash = self.packet.flow_hash
+        #*** Instantiate a new instance of FlowMod class:
+        flow_mod_record = self.FlowMod(self.flow_mods, flow_hash,
+                                dpid, suppress_type, standdown)
+        if not standdown:
+            #*** Add values from switches module suppress or drop flow result:
+            flow_mod_record.match_type = result['match_type']
+            flow_mod_record.forward_cookie = result['forward_cookie']
+            flow_mod_record.forward_match = result['forward_match']
+            flow_mod_record.reverse_cookie = result['reverse_cookie']
+            flow_mod_record.reverse_match = result['reverse_match']
+            flow_mod_record.client_ip = result['client_ip']
+            self.flow_summary.update_one({'flow_hash': flow_hash},
+                            {'$set': {'suppress_type': suppress_type,
+                                'match_type': result['match_type'],
+                                'suppress_time': flow_mod_record.timestamp,
+                                'expire_time': datetime.datetime.utcnow()}})
+
+        self.logger.debug("Recording suppression of flow=%s on "
+                                "dpid=%s", flow_hash, dpid)
+        flow_mod_record.commit()
+
+class FlowContext(object):
+    """
+    An immutable per-event view of a flow, holding the packet in
+    context, its flow_hash and classification, with accessors for
+    features of the whole flow. Returned by Flow.ingest_packet and
+    passed to policy and classifiers, so that more than one
+    packet-in can be in flight at a time without sharing state.
+
+    Attributes (packet, flow_hash, classification) can't be
+    reassigned, although the classification itself is updated
+    by policy
+    """
+    __slots__ = ('packet', 'flow_hash', 'classification', '_store')
+
+    def __init__(self, store, packet, classification):
+        """
+        Passed the Flow (store) that the packet was ingested into,
+        the Packet object and the Classification object
+        """
+        object.__setattr__(self, '_store', store)
+        object.__setattr__(self, 'packet', packet)
+        object.__setattr__(self, 'flow_hash', packet.flow_hash)
+        object.__setattr__(self, 'classification', classification)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("FlowContext is immutable, can't set %s" % name)
 
     def packet_count(self, test=0):
         """
@@ -720,19 +1336,22 @@ class Flow(BaseClass):
 
         Setting test=1 returns database query execution statistics
         """
-        time_limit = datetime.datetime.now() - self.flow_time_limit
+        time_limit = datetime.datetime.now() - self._store.flow_time_limit
         #*** Get DPID of first switch to report flow:
         first_dpid = self.origin()[1]
 
         #*** Main search:
-        db_data = {'flow_hash': self.packet.flow_hash,
+        db_data = {'flow_hash': self.flow_hash,
               'timestamp': {'$gte': time_limit},
               'dpid': first_dpid}
         if not test:
-            packet_cursor = self.packet_ins.find(db_data).sort('timestamp', -1)
+            packet_cursor = self._store.packet_ins.find(db_data).sort(
+                                                              'timestamp', -1)
         else:
-            return self.packet_ins.find(db_data).sort('timestamp', -1).explain()
-        self.logger.debug("packet_cursor.count()=%s", packet_cursor.count())
+            return self._store.packet_ins.find(db_data).sort(
+                                                    'timestamp', -1).explain()
+        self._store.logger.debug("packet_cursor.count()=%s",
+                                                        packet_cursor.count())
         return packet_cursor.count()
 
     def packet_direction(self):
@@ -755,17 +1374,19 @@ class Flow(BaseClass):
         left most position and newest on the right
         """
         result = []
-        time_limit = datetime.datetime.now() - self.flow_time_limit
+        time_limit = datetime.datetime.now() - self._store.flow_time_limit
         #*** Get Client IP and DPID of first switch to report flow:
         (flow_client, first_dpid) = self.origin()
         #*** Main search:
-        db_data = {'flow_hash': self.packet.flow_hash,
+        db_data = {'flow_hash': self.flow_hash,
               'timestamp': {'$gte': time_limit},
               'dpid': first_dpid}
         if not test:
-            packet_cursor = self.packet_ins.find(db_data).sort('timestamp', 1)
+            packet_cursor = self._store.packet_ins.find(db_data).sort(
+                                                               'timestamp', 1)
         else:
-            return self.packet_ins.find(db_data).sort('timestamp', 1).explain()
+            return self._store.packet_ins.find(db_data).sort(
+                                                     'timestamp', 1).explain()
         #*** Iterate the packet cursor:
         for packet in packet_cursor:
             if packet['ip_src'] == flow_client:
@@ -782,17 +1403,19 @@ class Flow(BaseClass):
         left most position and newest on the right
         """
         result = []
-        time_limit = datetime.datetime.now() - self.flow_time_limit
+        time_limit = datetime.datetime.now() - self._store.flow_time_limit
         #*** Get DPID of first switch to report flow:
         first_dpid = self.origin()[1]
         #*** Main search:
-        db_data = {'flow_hash': self.packet.flow_hash,
+        db_data = {'flow_hash': self.flow_hash,
               'timestamp': {'$gte': time_limit},
               'dpid': first_dpid}
         if not test:
-            packet_cursor = self.packet_ins.find(db_data).sort('timestamp', 1)
+            packet_cursor = self._store.packet_ins.find(db_data).sort(
+                                                               'timestamp', 1)
         else:
-            return self.packet_ins.find(db_data).sort('timestamp', 1).explain()
+            return self._store.packet_ins.find(db_data).sort(
+                                                     'timestamp', 1).explain()
         #*** Iterate the packet cursor:
         for packet in packet_cursor:
             result.append(packet['length'])
@@ -806,14 +1429,15 @@ class Flow(BaseClass):
         Finds first packet seen for the flow_hash within the time limit
         and returns a the source IP
         """
-        db_data = {'flow_hash': self.packet.flow_hash,
+        db_data = {'flow_hash': self.flow_hash,
               'timestamp': {'$gte': datetime.datetime.now() - \
-                                                self.flow_time_limit}}
-        packets = self.packet_ins.find(db_data).sort('timestamp', 1).limit(1)
+                                                self._store.flow_time_limit}}
+        packets = self._store.packet_ins.find(db_data).sort(
+                                                      'timestamp', 1).limit(1)
         if packets.count():
             return list(packets)[0]['ip_src']
         else:
-            self.logger.warning("no packets found")
+            self._store.logger.warning("no packets found")
             return 0
 
     def origin(self):
@@ -822,18 +1446,10 @@ class Flow(BaseClass):
         otherwise 0)
 
         Finds first packet seen for the flow_hash within the time limit
-        and returns a tuple of the source IP and the dpid
+        and returns a tuple of the source IP and the dpid. Cached
+        per flow_hash by the Flow, so it is queried once per flow
         """
-        db_data = {'flow_hash': self.packet.flow_hash,
-              'timestamp': {'$gte': datetime.datetime.now() - \
-                                                self.flow_time_limit}}
-        packets = self.packet_ins.find(db_data).sort('timestamp', 1).limit(1)
-        if packets.count():
-            packet = list(packets)[0]
-            return (packet['ip_src'], packet['dpid'])
-        else:
-            self.logger.warning("no packets found")
-            return (0, 0)
+        return self._store.flow_origin(self.flow_hash)
 
     def server(self):
         """
@@ -843,14 +1459,15 @@ class Flow(BaseClass):
         Finds first packet seen for the hash within the time limit
         and returns the destination IP
         """
-        db_data = {'flow_hash': self.packet.flow_hash,
+        db_data = {'flow_hash': self.flow_hash,
               'timestamp': {'$gte': datetime.datetime.now() - \
-                                                self.flow_time_limit}}
-        packets = self.packet_ins.find(db_data).sort('timestamp', 1).limit(1)
+                                                self._store.flow_time_limit}}
+        packets = self._store.packet_ins.find(db_data).sort(
+                                                      'timestamp', 1).limit(1)
         if packets.count():
             return list(packets)[0]['ip_dst']
         else:
-            self.logger.warning("no packets found")
+            self._store.logger.warning("no packets found")
             return 0
 
     def max_packet_size(self):
@@ -858,10 +1475,11 @@ class Flow(BaseClass):
         Return the size of the largest packet in the flow (in either direction)
         """
         max_packet_size = 0
-        db_data = {'flow_hash': self.packet.flow_hash,
+        db_data = {'flow_hash': self.flow_hash,
               'timestamp': {'$gte': datetime.datetime.now() - \
-                                                self.flow_time_limit}}
-        packet_cursor = self.packet_ins.find(db_data).sort('timestamp', -1)
+                                                self._store.flow_time_limit}}
+        packet_cursor = self._store.packet_ins.find(db_data).sort(
+                                                              'timestamp', -1)
         if packet_cursor.count():
             for pkt in packet_cursor:
                 if pkt['length'] > max_packet_size:
@@ -890,11 +1508,12 @@ class Flow(BaseClass):
         #*** Get Client IP and DPID of first switch to report flow:
         (flow_client, first_dpid) = self.origin()
         #*** Database lookup for whole flow:
-        db_data = {'flow_hash': self.packet.flow_hash,
+        db_data = {'flow_hash': self.flow_hash,
                 'timestamp': {'$gte': datetime.datetime.now() - \
-                                                self.flow_time_limit},
+                                                self._store.flow_time_limit},
                 'dpid': first_dpid}
-        packet_cursor = self.packet_ins.find(db_data).sort('timestamp', 1)
+        packet_cursor = self._store.packet_ins.find(db_data).sort(
+                                                               'timestamp', 1)
         #*** Iterate forward through packets in flow:
         if packet_cursor.count():
             for pkt in packet_cursor:
@@ -945,11 +1564,12 @@ class Flow(BaseClass):
         #*** Get Client IP and DPID of first switch to report flow:
         (flow_client, first_dpid) = self.origin()
         #*** Database lookup for whole flow:
-        db_data = {'flow_hash': self.packet.flow_hash,
+        db_data = {'flow_hash': self.flow_hash,
                 'timestamp': {'$gte': datetime.datetime.now() - \
-                                                self.flow_time_limit},
+                                                self._store.flow_time_limit},
                 'dpid': first_dpid}
-        packet_cursor = self.packet_ins.find(db_data).sort('timestamp', 1)
+        packet_cursor = self._store.packet_ins.find(db_data).sort(
+                                                               'timestamp', 1)
         #*** Iterate forward through packets in flow:
         if packet_cursor.count():
             for pkt in packet_cursor:
@@ -982,114 +1602,6 @@ class Flow(BaseClass):
         else:
             return min_s2c.total_seconds()
 
-    def not_suppressed(self, dpid, suppress_type):
-        """
-        Check flow_mods to see if current flow context is already
-        suppressed within suppression stand-down time for that switch,
-        and if it is then return False, otherwise True
-
-        The stand-down time is to reduce risk of overloading switch
-        with duplicate suppression events.
-
-        Called from nmeta.py
-        """
-        #*** Database lookup for whole flow:
-        db_data = {'flow_hash': self.packet.flow_hash,
-                    'dpid': dpid,
-                    'timestamp': {'$gte': datetime.datetime.now() - \
-                                                FLOW_SUPPRESSION_STANDDOWN},
-                    'suppress_type': suppress_type,
-                    'standdown': 0}
-
-        #*** Check if already suppressed with-in stand-down time period:
-        if self.flow_mods.find_one(db_data):
-            #*** There has been a suppression for this flow_hash within
-            #*** Stand down period
-            self.logger.debug("flow=%s already recorded as suppressed on "
-                                "dpid=%s", self.packet.flow_hash, dpid)
-            return False
-        else:
-            return True
-
-    class FlowMod(object):
-        """
-        An object that represents an individual Flow Modification,
-        used for recording the circumstances into the
-        flow_mods MongoDB collection
-        """
-        def __init__(self, flow_mods, flow_hash, dpid, _type, standdown):
-            #*** Initialise variables:
-            self.flow_mods = flow_mods
-            self.flow_hash = flow_hash
-            #*** Timestamp of when flow mod made:
-            self.timestamp = datetime.datetime.now()
-            self.dpid = dpid
-            #*** suppress_type is 'suppress' or 'drop':
-            self.suppress_type = _type
-            #*** If set, flow_mod was not sent due to stand down period:
-            self.standdown = standdown
-            #*** Match type set by switches module (ignore|single|dual)
-            #***  ignore means no mod, dual had forward and reverse mods:
-            self.match_type = ''
-            #*** Cookie for forward flow mod:
-            self.forward_cookie = 0
-            #*** Match dict set by switches module for forward flow:
-            self.forward_match = {}
-            #*** Cookie for reverse flow mod:
-            self.reverse_cookie = 0
-            #*** Match dict set by switches module for reverse flow:
-            self.reverse_match = {}
-            #*** Client IP to help ascertain session direction (0 if unknown):
-            self.client_ip = ''
-
-        def dbdict(self):
-            """
-            Return a dictionary object of specific FlowMod
-            parameters for storing in the database
-            """
-            dbdictresult = {}
-            dbdictresult['flow_hash'] = self.flow_hash
-            dbdictresult['timestamp'] = self.timestamp
-            dbdictresult['dpid'] = self.dpid
-            dbdictresult['suppress_type'] = self.suppress_type
-            dbdictresult['standdown'] = self.standdown
-            dbdictresult['match_type'] = self.match_type
-            dbdictresult['forward_cookie'] = self.forward_cookie
-            dbdictresult['forward_match'] = self.forward_match
-            dbdictresult['reverse_cookie'] = self.reverse_cookie
-            dbdictresult['reverse_match'] = self.reverse_match
-            dbdictresult['client_ip'] = self.client_ip
-            return dbdictresult
-
-        def commit(self):
-            """
-            Record removed mod into MongoDB
-            flow_mods collection.
-            """
-            #*** Write to database collection:
-            self.flow_mods.insert_one(self.dbdict())
-
-    def record_suppression(self, dpid, suppress_type, result, standdown=0):
-        """
-        Record that the flow is being suppressed on a particular
-        switch in the flow_mods database collection, so that information
-        is available to API consumers, such as the WebUI
-        """
-        #*** Instantiate a new instance of FlowMod class:
-        flow_mod_record = self.FlowMod(self.flow_mods, self.packet.flow_hash,
-                                dpid, suppress_type, standdown)
-        if not standdown:
-            #*** Add values from switches module suppress or drop flow result:
-            flow_mod_record.match_type = result['match_type']
-            flow_mod_record.forward_cookie = result['forward_cookie']
-            flow_mod_record.forward_match = result['forward_match']
-            flow_mod_record.reverse_cookie = result['reverse_cookie']
-            flow_mod_record.reverse_match = result['reverse_match']
-            flow_mod_record.client_ip = result['client_ip']
-
-        self.logger.debug("Recording suppression of flow=%s on "
-                                "dpid=%s", self.packet.flow_hash, dpid)
-        flow_mod_record.commit()
 
 #================== PRIVATE FUNCTIONS ==================
 
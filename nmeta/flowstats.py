@@ -0,0 +1,396 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+The flowstats module is part of the nmeta suite
+
+It provides live byte and packet counters for flows that have
+suppression entries installed on switches, so that data transfer
+of long-lived flows is visible before the flow idles out.
+
+Each switch is polled with one cookie-filtered OpenFlow flow stats
+request per poll cycle (not one request per flow). Poll times are
+jittered per switch so that large numbers of switches are not
+polled in lockstep.
+
+Replies are applied incrementally to an in-memory table of active
+flows, keyed by (dpid, cookie), from which per-flow rates are
+available.
+"""
+
+#*** For timestamps:
+import datetime
+import time
+
+#*** For poll jitter:
+import random
+
+#*** For logging configuration:
+from baseclass import BaseClass
+
+#*** nmeta imports:
+import nethash
+
+class FlowStats(BaseClass):
+    """
+    An object that holds live flow statistics polled from switches
+
+    Main methods (assumes class instantiated as an object called
+    'flowstats'):
+
+        flowstats.add_switch(dpid)
+          Schedule polling of a switch (first poll at random offset
+          within the poll interval)
+
+        flowstats.delete_switch(dpid)
+          Stop polling a switch and forget its active flows
+
+        flowstats.due()
+          Return list of DPIDs that are due to be polled now, and
+          reschedule them
+
+        flowstats.stats_reply(msg)
+          Apply a Ryu OFPFlowStatsReply message to the active flow table
+
+        flowstats.record_removal(dpid, cookie)
+          Remove an active flow as the switch has removed the flow entry
+
+        flowstats.flow_rates(flow_hash)
+          Return live rates for a flow (see method docstring)
+
+        flowstats.add_pending(flow_hash, classifier)
+          Register a flow as awaiting classification from its flow
+          stats counters by a named custom classifier
+
+        flowstats.pending()
+          Return list of (flow_hash, classifier, rates) for pending
+          flows that have been seen in flow stats replies
+    """
+    def __init__(self, config):
+        """
+        Initialise an instance of the FlowStats class
+        """
+        #*** Required for BaseClass:
+        self.config = config
+        #*** Set up Logging with inherited base class method:
+        self.configure_logging(__name__, "flowstats_logging_level_s",
+                                       "flowstats_logging_level_c")
+        #*** Get parameters from config:
+        self.enabled = config.get_value("flowstats_enabled")
+        self.interval = config.get_value("flowstats_interval")
+        self.jitter = config.get_value("flowstats_jitter")
+        self.cookie = config.get_value("flowstats_cookie")
+        self.cookie_mask = config.get_value("flowstats_cookie_mask")
+        #*** Flow mod cookie value offset indicates flow session direction:
+        self.offset = config.get_value("flow_mod_cookie_reverse_offset")
+        #*** Active flows, keyed by (dpid, cookie):
+        self.active_flows = {}
+        #*** Index of flow_hash to set of active_flows keys:
+        self.flow_index = {}
+        #*** Next poll due time (epoch seconds) keyed by DPID:
+        self.next_poll = {}
+        #*** Keys seen so far in current (possibly multipart) reply by DPID:
+        self._seen = {}
+        #*** Flows awaiting classification from flow stats counters,
+        #***  flow_hash: (custom classifier name, time added):
+        self.pending_flows = {}
+        #*** Give up on pending flows that never appear in stats after:
+        self.pending_timeout = config.get_value("flowstats_pending_timeout")
+
+    class ActiveFlow(object):
+        """
+        An object that represents an individual flow entry on a
+        switch, with counters from the most recent flow stats reply
+        and deltas/rates from the reply before that
+        """
+        def __init__(self, dpid, stat, offset):
+            """
+            Initialise from a DPID and a Ryu OFPFlowStats object
+            """
+            match = stat.match
+            self.dpid = dpid
+            self.cookie = stat.cookie
+            self.priority = stat.priority
+            self.table_id = stat.table_id
+            self.first_seen = datetime.datetime.now()
+            self.last_seen = self.first_seen
+            self.duration = 0
+            self.byte_count = 0
+            self.packet_count = 0
+            self.byte_delta = 0
+            self.packet_delta = 0
+            self.byte_rate = 0
+            self.packet_rate = 0
+            self.eth_type = ""
+            self.ip_A = ""
+            self.ip_B = ""
+            self.ip_proto = ""
+            self.tp_A = ""
+            self.tp_B = ""
+            self.out_port = 0
+            #*** Set values from the match where they exist:
+            if 'eth_type' in match:
+                self.eth_type = match['eth_type']
+            if 'ipv4_src' in match:
+                self.ip_A = match['ipv4_src']
+            if 'ipv4_dst' in match:
+                self.ip_B = match['ipv4_dst']
+            if 'ipv6_src' in match:
+                self.ip_A = match['ipv6_src']
+            if 'ipv6_dst' in match:
+                self.ip_B = match['ipv6_dst']
+            if 'ip_proto' in match:
+                self.ip_proto = match['ip_proto']
+            if 'tcp_src' in match:
+                self.tp_A = match['tcp_src']
+            if 'tcp_dst' in match:
+                self.tp_B = match['tcp_dst']
+            #*** Set flow hash (same derivation as Flow.RemovedFlow):
+            if self.ip_proto == 6:
+                self.flow_hash = nethash.hash_flow((self.ip_A, self.ip_B,
+                                          self.tp_A, self.tp_B,
+                                          self.ip_proto))
+            else:
+                self.flow_hash = nethash.hash_flow((self.ip_A, self.ip_B,
+                                          dpid, self.cookie,
+                                          self.ip_proto))
+            #*** Output port from the apply actions instruction (if any):
+            for instruction in stat.instructions or []:
+                for action in getattr(instruction, 'actions', []):
+                    if hasattr(action, 'port'):
+                        self.out_port = action.port
+            #*** Session direction (forward|reverse):
+            if self.cookie < offset:
+                self.direction = 'forward'
+            else:
+                self.direction = 'reverse'
+
+        def update(self, stat):
+            """
+            Passed a Ryu OFPFlowStats object for this flow entry.
+            Update counters, and calculate deltas and rates against
+            the previous sample, using the switch-reported duration
+            as the time base
+            """
+            duration = stat.duration_sec + stat.duration_nsec / 1e9
+            byte_delta = stat.byte_count - self.byte_count
+            packet_delta = stat.packet_count - self.packet_count
+            elapsed = duration - self.duration
+            if byte_delta < 0 or packet_delta < 0 or elapsed < 0:
+                #*** Counters went backwards, entry has been reinstalled:
+                byte_delta = stat.byte_count
+                packet_delta = stat.packet_count
+                elapsed = duration
+            self.byte_delta = byte_delta
+            self.packet_delta = packet_delta
+            if elapsed > 0:
+                self.byte_rate = byte_delta / elapsed
+                self.packet_rate = packet_delta / elapsed
+            self.duration = duration
+            self.byte_count = stat.byte_count
+            self.packet_count = stat.packet_count
+            self.last_seen = datetime.datetime.now()
+
+        def dbdict(self):
+            """
+            Return a dictionary object of active flow
+            parameters for storing or responding
+            """
+            dbdictresult = {}
+            dbdictresult['dpid'] = self.dpid
+            dbdictresult['cookie'] = self.cookie
+            dbdictresult['flow_hash'] = self.flow_hash
+            dbdictresult['direction'] = self.direction
+            dbdictresult['first_seen'] = self.first_seen
+            dbdictresult['last_seen'] = self.last_seen
+            dbdictresult['duration'] = self.duration
+            dbdictresult['byte_count'] = self.byte_count
+            dbdictresult['packet_count'] = self.packet_count
+            dbdictresult['byte_delta'] = self.byte_delta
+            dbdictresult['packet_delta'] = self.packet_delta
+            dbdictresult['byte_rate'] = self.byte_rate
+            dbdictresult['packet_rate'] = self.packet_rate
+            dbdictresult['ip_A'] = self.ip_A
+            dbdictresult['ip_B'] = self.ip_B
+            dbdictresult['ip_proto'] = self.ip_proto
+            dbdictresult['tp_A'] = self.tp_A
+            dbdictresult['tp_B'] = self.tp_B
+            dbdictresult['out_port'] = self.out_port
+            return dbdictresult
+
+    def add_switch(self, dpid):
+        """
+        Schedule polling of a switch. First poll is at a random
+        offset within the poll interval to spread load
+        """
+        self.next_poll[dpid] = time.time() + \
+                                        random.uniform(0, self.interval)
+        self._seen[dpid] = set()
+
+    def delete_switch(self, dpid):
+        """
+        Stop polling a switch and remove its active flows
+        """
+        if dpid in self.next_poll:
+            del self.next_poll[dpid]
+        if dpid in self._seen:
+            del self._seen[dpid]
+        for key in [key for key in self.active_flows if key[0] == dpid]:
+            self._remove(key)
+
+    def due(self, now=0):
+        """
+        Return a list of DPIDs that are due to be polled, and
+        schedule their next poll at the interval plus or minus
+        a random jitter
+        """
+        if not now:
+            now = time.time()
+        result = []
+        for dpid, next_poll in self.next_poll.items():
+            if next_poll <= now:
+                result.append(dpid)
+                self.next_poll[dpid] = now + max(self.interval +
+                                random.uniform(-self.jitter, self.jitter), 1)
+        return result
+
+    def stats_reply(self, msg):
+        """
+        Passed a Ryu OFPFlowStatsReply message. Apply each flow stats
+        entry to the active flow table. When the final part of a
+        (possibly multipart) reply is received, age out active
+        flows for the switch that were not in the reply.
+
+        Entries with cookie 0 (i.e. table-miss) are ignored.
+        """
+        dpid = msg.datapath.id
+        ofproto = msg.datapath.ofproto
+        seen = self._seen.setdefault(dpid, set())
+        for stat in msg.body:
+            if not stat.cookie:
+                continue
+            key = (dpid, stat.cookie)
+            if key in self.active_flows:
+                active_flow = self.active_flows[key]
+            else:
+                active_flow = self.ActiveFlow(dpid, stat, self.offset)
+                self.active_flows[key] = active_flow
+                self.flow_index.setdefault(active_flow.flow_hash,
+                                                             set()).add(key)
+            active_flow.update(stat)
+            seen.add(key)
+        if msg.flags & ofproto.OFPMPF_REPLY_MORE:
+            #*** More parts of this reply to come:
+            return 1
+        #*** Final part, age out flows that weren't reported:
+        for key in [key for key in self.active_flows if key[0] == dpid
+                                                        and key not in seen]:
+            self._remove(key)
+        self.logger.debug("dpid=%s active_flows=%s", dpid, len(seen))
+        self._seen[dpid] = set()
+        return 1
+
+    def record_removal(self, dpid, cookie):
+        """
+        Remove an active flow as the switch has told us the
+        flow entry has been removed
+        """
+        key = (dpid, cookie)
+        if key in self.active_flows:
+            self._remove(key)
+            return 1
+        return 0
+
+    def flow_rates(self, flow_hash):
+        """
+        Passed a flow_hash and return a dictionary of live counters
+        and rates for the flow, summed over forward and reverse
+        directions, or an empty dictionary if the flow is not active.
+
+        Flows crossing multiple switches are deduplicated by only
+        using entries from the switch that reported the flow first
+        """
+        if flow_hash not in self.flow_index:
+            return {}
+        keys = self.flow_index[flow_hash]
+        first = min(keys, key=lambda key: self.active_flows[key].first_seen)
+        result = {'flow_hash': flow_hash, 'dpid': first[0],
+                    'byte_count': 0, 'packet_count': 0,
+                    'byte_delta': 0, 'packet_delta': 0,
+                    'byte_rate': 0, 'packet_rate': 0}
+        for key in keys:
+            if key[0] != first[0]:
+                continue
+            active_flow = self.active_flows[key]
+            result['byte_count'] += active_flow.byte_count
+            result['packet_count'] += active_flow.packet_count
+            result['byte_delta'] += active_flow.byte_delta
+            result['packet_delta'] += active_flow.packet_delta
+            result['byte_rate'] += active_flow.byte_rate
+            result['packet_rate'] += active_flow.packet_rate
+        return result
+
+    def entries(self, flow_hash):
+        """
+        Passed a flow_hash and return a list of ActiveFlow objects
+        for all switch flow entries of the flow (all switches, both
+        directions)
+        """
+        return [self.active_flows[key]
+                            for key in self.flow_index.get(flow_hash, ())]
+
+    def add_pending(self, flow_hash, classifier):
+        """
+        Register a flow as awaiting classification by the named
+        custom classifier once flow stats counters are available
+        """
+        self.pending_flows[flow_hash] = (classifier, time.time())
+
+    def clear_pending(self, flow_hash):
+        """
+        Remove a flow from those awaiting classification
+        """
+        if flow_hash in self.pending_flows:
+            del self.pending_flows[flow_hash]
+            return 1
+        return 0
+
+    def pending(self, now=0):
+        """
+        Return a list of (flow_hash, classifier, rates) tuples for
+        flows awaiting classification that have active entries.
+        Pending flows with no active entries that are older than
+        the pending timeout are dropped
+        """
+        if not now:
+            now = time.time()
+        result = []
+        for flow_hash, (classifier, added) in self.pending_flows.items():
+            rates = self.flow_rates(flow_hash)
+            if rates:
+                result.append((flow_hash, classifier, rates))
+            elif now - added > self.pending_timeout:
+                self.logger.debug("pending flow_hash=%s timed out", flow_hash)
+                del self.pending_flows[flow_hash]
+        return result
+
+    def _remove(self, key):
+        """
+        Remove an active flow entry and its flow_hash index entry
+        """
+        active_flow = self.active_flows.pop(key)
+        keys = self.flow_index.get(active_flow.flow_hash)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.flow_index[active_flow.flow_hash]
@@ -89,3 +89,19 @@ class Forwarding(BaseClass):
                                    eth_src, eth_dst, dpid, ofproto.OFPP_FLOOD)
             out_port = ofproto.OFPP_FLOOD
         return out_port
+
+    def path_ports(self, eth_src, eth_dst):
+        """
+        Passed source and destination MAC addresses and return a
+        list of (dpid, in_port, out_port) tuples for every switch
+        that has learnt both MAC addresses on different ports, i.e.
+        the switches that will forward traffic between them
+        """
+        result = []
+        for dpid, mac_table in self.mac_to_port.items():
+            if eth_src in mac_table and eth_dst in mac_table:
+                in_port = mac_table[eth_src]
+                out_port = mac_table[eth_dst]
+                if in_port != out_port:
+                    result.append((dpid, in_port, out_port))
+        return result
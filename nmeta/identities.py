@@ -51,6 +51,10 @@ import hashlib
 ARP_CACHE_TIME = 14400
 #*** DHCP lease time to use if none present (in seconds):
 DHCP_DEFAULT_LEASE_TIME = 3600
+#*** Sort for most recently harvested current identity first. Identities
+#***  can share a harvest_time, so break ties by id_hash (unique):
+IDENTITIES_CURRENT_SORT = [('harvest_time', pymongo.DESCENDING),
+                           ('id_hash', pymongo.DESCENDING)]
 
 class Identities(BaseClass):
     """
@@ -83,12 +87,20 @@ class Identities(BaseClass):
                 harvest_type=     Specify what type of harvest (i.e. DNS_A)
                 ip_address=       Look for specific IP address
 
+    The most recently harvested identity for each id_hash is kept in
+    the identities_current database collection, with the IP address
+    of DNS CNAME records resolved from DNS A records, for API
+    consumers such as the WebUI
+
     See function docstrings for more information
     """
 
-    def __init__(self, config, policy):
+    def __init__(self, config, policy, attach=0):
         """
-        Initialise an instance of the Identities class
+        Initialise an instance of the Identities class.
+        Set attach=1 to use database collections already set up by
+        another instance (i.e. in a worker process) rather than
+        recreating them
         """
         self.policy = policy
         #*** Required for BaseClass:
@@ -118,6 +130,12 @@ class Identities(BaseClass):
         #*** Connect to MongoDB nmeta database:
         db_nmeta = mongo_client[mongo_dbname]
 
+        if attach:
+            self.identities = db_nmeta.identities
+            self.identities_current = db_nmeta.identities_current
+            self.dhcp_messages = db_nmeta.dhcp_messages
+            return
+
         #*** Delete (drop) previous identities collection if it exists:
         self.logger.debug("Deleting previous identities MongoDB collection...")
         db_nmeta.identities.drop()
@@ -147,6 +165,33 @@ class Identities(BaseClass):
         self.identities.create_index([('service_name', pymongo.ASCENDING),
                              ('valid_from', pymongo.DESCENDING)], unique=False)
 
+        #*** Indexes to improve IP address and service alias look-up
+        #*** performance (i.e. for enriching flows with identities):
+        self.identities.create_index([('ip_address', pymongo.ASCENDING),
+                             ('valid_from', pymongo.DESCENDING)], unique=False)
+        self.identities.create_index([('service_alias', pymongo.ASCENDING),
+                             ('valid_from', pymongo.DESCENDING)], unique=False)
+
+        #*** Delete (drop) previous identities_current collection if exists:
+        self.logger.debug("Deleting previous identities_current MongoDB "
+                                                               "collection...")
+        db_nmeta.identities_current.drop()
+        #*** Not capped as records are replaced in place. MongoDB expires
+        #***  (TTL) identities that haven't been harvested within time limit:
+        self.identities_current = db_nmeta.create_collection(
+                                                        'identities_current')
+        self.identities_current.create_index([('id_hash', pymongo.ASCENDING)],
+                                        unique=True)
+        self.identities_current.create_index(IDENTITIES_CURRENT_SORT,
+                                        unique=False)
+        #*** For resolving IP addresses of DNS CNAME records:
+        self.identities_current.create_index([('service_alias',
+                                        pymongo.ASCENDING)], unique=False)
+        self.identities_current.create_index([('expire_time',
+                                        pymongo.ASCENDING)],
+                                        expireAfterSeconds=config.get_value
+                                        ("identity_time_limit"))
+
         #*** Delete (drop) previous dhcp_messages collection if it exists:
         self.logger.debug("Deleting previous dhcp_messages MongoDB "
                                                                "collection...")
@@ -168,6 +213,13 @@ class Identities(BaseClass):
         """
         An object that represents an individual Identity Indicator
         """
+        #*** Fixed attributes, so no per-instance __dict__:
+        __slots__ = ('dpid', 'in_port', 'mac_address', 'ip_address',
+                     'harvest_type', 'harvest_time', 'host_name', 'host_type',
+                     'host_os', 'host_desc', 'service_name', 'service_alias',
+                     'user_id', 'valid_from', 'valid_to', 'id_hash',
+                     'location_logical', 'location_physical')
+
         def __init__(self):
             #*** Initialise identity variables:
             self.dpid = 0
@@ -191,16 +243,42 @@ class Identities(BaseClass):
 
         def dbdict(self):
             """
-            Return a dictionary object of identity metadata
-            parameters for storing in the database
+            Return a new dictionary object of identity metadata
+            parameters for storing in the database (the database
+            driver adds _id to it, so it must not be shared)
             """
-            return self.__dict__
+            dbdictresult = {}
+            dbdictresult['dpid'] = self.dpid
+            dbdictresult['in_port'] = self.in_port
+            dbdictresult['mac_address'] = self.mac_address
+            dbdictresult['ip_address'] = self.ip_address
+            dbdictresult['harvest_type'] = self.harvest_type
+            dbdictresult['harvest_time'] = self.harvest_time
+            dbdictresult['host_name'] = self.host_name
+            dbdictresult['host_type'] = self.host_type
+            dbdictresult['host_os'] = self.host_os
+            dbdictresult['host_desc'] = self.host_desc
+            dbdictresult['service_name'] = self.service_name
+            dbdictresult['service_alias'] = self.service_alias
+            dbdictresult['user_id'] = self.user_id
+            dbdictresult['valid_from'] = self.valid_from
+            dbdictresult['valid_to'] = self.valid_to
+            dbdictresult['id_hash'] = self.id_hash
+            dbdictresult['location_logical'] = self.location_logical
+            dbdictresult['location_physical'] = self.location_physical
+            return dbdictresult
 
     class DHCPMessage(object):
         """
         An object that represents an individual DHCP message.
         Used for storing DHCP state by recording DHCP events
         """
+        #*** Fixed attributes, so no per-instance __dict__:
+        __slots__ = ('dpid', 'in_port', 'ingest_time', 'eth_src', 'eth_dst',
+                     'ip_src', 'ip_dst', 'tp_src', 'tp_dst', 'transaction_id',
+                     'message_type', 'host_name', 'ip_assigned',
+                     'ip_dhcp_server', 'lease_time')
+
         def __init__(self):
             #*** Initialise identity variables:
             self.dpid = 0
@@ -221,10 +299,27 @@ class Identities(BaseClass):
 
         def dbdict(self):
             """
-            Return a dictionary object of dhcp message
-            parameters for storing in the database
+            Return a new dictionary object of dhcp message
+            parameters for storing in the database (the database
+            driver adds _id to it, so it must not be shared)
             """
-            return self.__dict__
+            dbdictresult = {}
+            dbdictresult['dpid'] = self.dpid
+            dbdictresult['in_port'] = self.in_port
+            dbdictresult['ingest_time'] = self.ingest_time
+            dbdictresult['eth_src'] = self.eth_src
+            dbdictresult['eth_dst'] = self.eth_dst
+            dbdictresult['ip_src'] = self.ip_src
+            dbdictresult['ip_dst'] = self.ip_dst
+            dbdictresult['tp_src'] = self.tp_src
+            dbdictresult['tp_dst'] = self.tp_dst
+            dbdictresult['transaction_id'] = self.transaction_id
+            dbdictresult['message_type'] = self.message_type
+            dbdictresult['host_name'] = self.host_name
+            dbdictresult['ip_assigned'] = self.ip_assigned
+            dbdictresult['ip_dhcp_server'] = self.ip_dhcp_server
+            dbdictresult['lease_time'] = self.lease_time
+            return dbdictresult
 
     def harvest(self, pkt, flow_pkt):
         """
@@ -253,6 +348,7 @@ class Identities(BaseClass):
         else:
             #*** Not an identity indicator
             return 0
+        return 1
 
     def harvest_arp(self, pkt, flow_pkt):
         """
@@ -285,7 +381,7 @@ class Identities(BaseClass):
                 db_dict = ident.dbdict()
                 #*** Write ARP identity metadata to database collection:
                 self.logger.debug("writing db_dict=%s", db_dict)
-                self.identities.insert_one(db_dict)
+                self.insert_identity(db_dict)
         return 1
 
     def harvest_dhcp(self, flow_pkt):
@@ -414,7 +510,7 @@ class Identities(BaseClass):
                 db_dict = ident.dbdict()
                 #*** Write DHCP identity metadata to db collection:
                 self.logger.debug("writing db_dict=%s", db_dict)
-                self.identities.insert_one(db_dict)
+                self.insert_identity(db_dict)
                 return 1
             else:
                 self.logger.debug("Prev DHCP host_name not found")
@@ -478,7 +574,7 @@ class Identities(BaseClass):
         #*** Write LLDP identity metadata to db collection:
         db_dict = ident.dbdict()
         self.logger.debug("writing db_dict=%s", db_dict)
-        self.identities.insert_one(db_dict)
+        self.insert_identity(db_dict)
         return 1
 
     def harvest_dns(self, flow_pkt):
@@ -518,7 +614,7 @@ class Identities(BaseClass):
                 db_dict = ident.dbdict()
                 #*** Write DNS identity metadata to database collection:
                 self.logger.debug("writing db_dict=%s", db_dict)
-                self.identities.insert_one(db_dict)
+                self.insert_identity(db_dict)
             elif answer.type == 5:
                 #*** DNS CNAME Record:
                 ident = self.Identity()
@@ -537,11 +633,50 @@ class Identities(BaseClass):
                 db_dict = ident.dbdict()
                 #*** Write DNS identity metadata to database collection:
                 self.logger.debug("writing db_dict=%s", db_dict)
-                self.identities.insert_one(db_dict)
+                self.insert_identity(db_dict)
             else:
                 #*** Not a type that we handle yet
                 self.logger.debug("Unhandled DNS answer type=%s", answer.type)
 
+    def insert_identity(self, db_dict):
+        """
+        Passed a dictionary of identity metadata. Write it to the
+        identities database collection and update the current
+        identities
+        """
+        self.identities.insert_one(db_dict)
+        self.update_current(db_dict)
+
+    def update_current(self, record):
+        """
+        Passed an identities record that has just been harvested (or
+        restored). Make it the current identity for its id_hash in
+        the identities_current database collection.
+
+        DNS CNAME records get the IP address of the most recent
+        identity for their alias, and a record with a service name
+        updates the IP address of current DNS CNAME records that
+        are an alias for it
+        """
+        current = dict(record)
+        current.pop('_id', None)
+        current['expire_time'] = datetime.datetime.utcnow()
+        if current['harvest_type'] == 'DNS_CNAME':
+            result = self.identities.find_one(
+                                {'service_name': current['service_alias']},
+                                sort=[('valid_from', pymongo.DESCENDING)])
+            if result:
+                current['ip_address'] = result['ip_address']
+            else:
+                current['ip_address'] = ""
+        if current['service_name']:
+            self.identities_current.update_many(
+                                {'service_alias': current['service_name']},
+                                {'$set': {'ip_address':
+                                                    current['ip_address']}})
+        self.identities_current.replace_one({'id_hash': current['id_hash']},
+                                                        current, upsert=True)
+
     def findbymac(self, mac_addr, test=0):
         """
         Passed a MAC address and reverse search identities collection
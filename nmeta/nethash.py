@@ -100,6 +100,13 @@ def hash_packet(packet):
                     packet.timestamp)
     return hash_tuple(packet_tuple)
 
+def hash_frame(frame):
+    """
+    Generate a hash of a raw frame (bytes) for use in deduplication
+    where the same broadcast frame is received from multiple switches
+    """
+    return hashlib.md5(frame).hexdigest()
+
 def hash_tuple(hash_tuple):
     """
     Simple function to hash a tuple with MD5.
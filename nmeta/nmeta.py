@@ -28,6 +28,7 @@ import struct
 import time
 import datetime
 import os, sys
+import signal
 
 #*** Ryu Imports:
 from ryu import utils
@@ -38,6 +39,7 @@ from ryu.controller.handler import HANDSHAKE_DISPATCHER, DEAD_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
 from ryu.lib import addrconv
+from ryu.lib import hub
 from ryu.lib.packet import packet
 from ryu.lib.packet import ethernet
 
@@ -48,6 +50,15 @@ import switches
 import forwarding
 import flows
 import identities
+import flowstats
+import floodcontrol
+import admission
+import scheduler
+import workers
+import policy_reload
+import warmstart
+import telemetry
+import state_snapshot
 import of_error_decode
 
 #*** For logging configuration:
@@ -60,6 +71,9 @@ from pymongo import MongoClient
 #*** Number of preceding seconds that events are averaged over:
 EVENT_RATE_INTERVAL = 60
 
+#*** Seconds between checks for switches that are due a flow stats poll:
+FLOWSTATS_POLL_TICK = 1
+
 class NMeta(app_manager.RyuApp, BaseClass):
     """
     This is the main class used to run nmeta
@@ -93,6 +107,39 @@ class NMeta(app_manager.RyuApp, BaseClass):
         self.flow = flows.Flow(self.config)
         #*** Instantiate an identity object for participant metadata:
         self.ident = identities.Identities(self.config, self.policy)
+        #*** Instantiate a flowstats object for live flow counters:
+        self.flowstats = flowstats.FlowStats(self.config)
+        #*** Instantiate a floodcontrol object for broadcast packet-ins:
+        self.floodcontrol = floodcontrol.FloodControl(self.config)
+        #*** Instantiate an admission object for overload shedding:
+        self.admission = admission.Admission(self.config)
+        #*** Instantiate a telemetry object for live WebUI telemetry:
+        self.telemetry = telemetry.Telemetry(self.config)
+        #*** Instantiate a state snapshot object for sharing in-memory
+        #***  state with the External API:
+        self.state_snapshot = state_snapshot.StateSnapshot(self.config)
+        #*** Instantiate a scheduler object for prioritising packet-ins:
+        self.scheduler = scheduler.Scheduler(self.config)
+        self.scheduler_ready = hub.Event()
+        #*** Instantiate a pool of worker processes (if configured):
+        self.worker_pool = workers.WorkerPool(self.config)
+        #*** Packet-ins being processed by workers, keyed by sequence:
+        self.worker_seq = 0
+        self.worker_pending = {}
+        #*** Instantiate a policy reload object for reloading policy
+        #***  on signal or API request without restarting:
+        self.policy_reload = policy_reload.PolicyReload(self.config,
+                                                                self.flow)
+        try:
+            signal.signal(signal.SIGHUP, self.policy_reload.request)
+        except ValueError:
+            #*** Signal handlers can only be set from the main thread:
+            self.logger.warning("Not in main thread, policy reload on "
+                                    "SIGHUP not available")
+        #*** Install suppression on all switches on path of a flow:
+        self.suppress_path_wide = self.config.get_value("suppress_path_wide")
+        #*** Aggregate suppression of flows that policy treats the same:
+        self.suppress_aggregate = self.config.get_value("suppress_aggregate")
 
         #*** Set up database collection for packet-in processing time:
         mongo_addr = self.config.get_value("mongo_addr")
@@ -116,6 +163,247 @@ class NMeta(app_manager.RyuApp, BaseClass):
         self.pi_time.create_index([('outcome', pymongo.DESCENDING),
                               ('timestamp', pymongo.DESCENDING)], unique=False)
 
+        #*** Restore state saved before a restart (if warm start enabled):
+        self.warmstart = warmstart.WarmStart(self.config)
+        if self.warmstart.enabled:
+            self.warmstart.restore(self.flow, self.ident, self.forwarding,
+                                                                self.switches)
+            self.threads.append(hub.spawn(self._warmstart_snapshotter))
+
+        #*** Start green thread that polls switches for flow stats:
+        if self.flowstats.enabled:
+            self.threads.append(hub.spawn(self._flowstats_poller))
+        #*** Start worker processes and green thread that reads results:
+        if self.worker_pool.workers:
+            self.worker_pool.start()
+            self.threads.append(hub.spawn(self._worker_results))
+        #*** Start green thread that processes scheduled packet-ins:
+        if self.scheduler.enabled:
+            self.threads.append(hub.spawn(self._scheduler_worker))
+        #*** Start green thread that checks for policy reload requests:
+        self.threads.append(hub.spawn(self._policy_reloader))
+        #*** Start green thread that publishes telemetry:
+        self.threads.append(hub.spawn(self._telemetry_publisher))
+        #*** Start green thread that publishes state snapshots:
+        if self.state_snapshot.enabled:
+            self.threads.append(hub.spawn(self._state_snapshot_publisher))
+
+    def _scheduler_worker(self):
+        """
+        Run forever as a green thread, processing queued packet-in
+        events in scheduled order
+        """
+        while True:
+            item = self.scheduler.dequeue()
+            if not item:
+                #*** Nothing queued, wait for packet_in to queue an event:
+                self.scheduler_ready.clear()
+                self.scheduler_ready.wait()
+                continue
+            event, sched_class, sched_wait = item
+            dpid = event.msg.datapath.id
+            if not self.switches[dpid]:
+                #*** Switch disconnected while the event was queued:
+                self.logger.debug("Dropping scheduled packet-in from "
+                                    "disconnected dpid=%s", dpid)
+                continue
+            try:
+                self.process_packet_in(event, sched_class, sched_wait)
+            except Exception:
+                #*** Keep processing, as this thread isn't guarded by Ryu:
+                self.logger.exception("Failed to process scheduled "
+                                        "packet-in dpid=%s", dpid)
+            #*** Yield so that Ryu can deliver and queue more events:
+            hub.sleep(0)
+
+    def _flowstats_poller(self):
+        """
+        Run forever as a green thread, sending one flow stats request
+        to each switch that is due to be polled
+        """
+        while True:
+            for dpid in self.flowstats.due():
+                switch = self.switches[dpid]
+                if switch:
+                    switch.request_flow_stats(self.flowstats.cookie,
+                                                self.flowstats.cookie_mask)
+            hub.sleep(FLOWSTATS_POLL_TICK)
+
+    def _warmstart_snapshotter(self):
+        """
+        Run forever as a green thread, saving a warm start snapshot
+        of controller state at intervals
+        """
+        while True:
+            hub.sleep(self.warmstart.interval)
+            try:
+                #*** Yield while reading database so as not to hold up
+                #***  packet-in processing:
+                self.warmstart.snapshot(self.flow, self.ident,
+                                self.forwarding, self.switches,
+                                pause=lambda: hub.sleep(0))
+            except Exception:
+                self.logger.exception("Failed to save warm start snapshot")
+
+    def close(self):
+        """
+        Called by Ryu when nmeta is shutting down. Save a warm start
+        snapshot (if enabled)
+        """
+        if self.warmstart.enabled:
+            self.warmstart.snapshot(self.flow, self.ident, self.forwarding,
+                                                                self.switches)
+
+    def _policy_reloader(self):
+        """
+        Run forever as a green thread, reloading policy when a reload
+        has been requested by signal or API
+        """
+        while True:
+            if self.policy_reload.pending():
+                self.reload_policy()
+            hub.sleep(self.policy_reload.interval)
+
+    def _telemetry_publisher(self):
+        """
+        Run forever as a green thread, publishing aggregated telemetry
+        for the WebUI at intervals
+        """
+        while True:
+            hub.sleep(self.telemetry.interval)
+            try:
+                self.telemetry.publish(len(self.switches.switches),
+                                                        self.admission.mode)
+                if self.admission.enabled:
+                    #*** Keep smoothed queue delay current for the API:
+                    self.admission.record()
+            except Exception:
+                #*** Keep publishing, as this thread isn't guarded by Ryu:
+                self.logger.exception("Failed to publish telemetry")
+
+    def _state_snapshot_publisher(self):
+        """
+        Run forever as a green thread, publishing a snapshot of
+        in-memory state for the External API at intervals
+        """
+        while True:
+            hub.sleep(self.state_snapshot.interval)
+            try:
+                self.state_snapshot.publish(self.controller_state())
+            except Exception:
+                #*** Keep publishing, as this thread isn't guarded by Ryu:
+                self.logger.exception("Failed to publish state snapshot")
+
+    def controller_state(self):
+        """
+        Return a dictionary of in-memory controller state for the
+        state snapshot: connected switches (with the number of MACs
+        learnt on each, as full MAC tables are too big to encode every
+        interval on a large network), latest telemetry, admission
+        control, scheduler metrics, flood control counters and flow
+        counts
+        """
+        mac_to_port = self.forwarding.mac_to_port
+        state = {'timestamp': datetime.datetime.now()}
+        state['switches'] = []
+        for dpid, switch in self.switches.switches.items():
+            ip_address, port = switch.datapath.address
+            state['switches'].append({'dpid': dpid,
+                                'ip_address': ip_address,
+                                'port': port,
+                                'mfr_desc': switch.mfr_desc,
+                                'hw_desc': switch.hw_desc,
+                                'sw_desc': switch.sw_desc,
+                                'serial_num': switch.serial_num,
+                                'dp_desc': switch.dp_desc,
+                                'macs': len(mac_to_port.get(dpid, {}))})
+        state['telemetry'] = self.telemetry.latest
+        state['admission'] = {'mode': self.admission.mode,
+                              'queue_delay': self.admission.queue_delay}
+        state['scheduler'] = self.scheduler.metrics()
+        state['flood_control'] = self.floodcontrol.stats()
+        #*** Flows known to be classified, and live flow stats counters:
+        active_flows = self.flowstats.active_flows.values()
+        state['flows'] = {'known': len(self.scheduler.known_flows),
+                'active': len(active_flows),
+                'pending_classification': len(self.flowstats.pending_flows),
+                'byte_rate': sum(active.byte_rate for active in active_flows),
+                'packet_rate': sum(active.packet_rate
+                                                for active in active_flows)}
+        return state
+
+    def reload_policy(self):
+        """
+        Reload policy from file without restarting. The new policy is
+        validated and compared with the current policy before it is
+        swapped in, in one step, for use by subsequent packet-ins.
+        Then only flows whose classification would change are
+        invalidated, and their suppression flow entries revoked so
+        that the next packet is classified against the new policy.
+        Flows where only the QoS queue changes have their flow
+        entries updated in place where flow stats know the output
+        port, otherwise revoked. Returns 1 if policy was reloaded,
+        otherwise 0
+        """
+        request_ids = self.policy_reload.start()
+        new_policy = self.policy_reload.load()
+        if not new_policy:
+            self.policy_reload.finish(request_ids, 'failed')
+            return 0
+        changed, requeue = self.policy_reload.diff(self.policy, new_policy,
+                                                                self.ident)
+        #*** Swap in new policy:
+        self.policy = new_policy
+        self.ident.policy = new_policy
+        if self.worker_pool.workers:
+            self.worker_pool.reload(new_policy.policy_text)
+        counts = {'flows_changed': len(changed),
+                  'flows_requeued': len(requeue),
+                  'suppressions_revoked': 0,
+                  'suppressions_updated': 0}
+        for flow_hash in changed:
+            self.flow.invalidate(flow_hash)
+            self.flowstats.clear_pending(flow_hash)
+            counts['suppressions_revoked'] += \
+                                        self._revoke_suppressions(flow_hash)
+        for flow_hash, out_queue in requeue.items():
+            updated = set()
+            for active_flow in self.flowstats.entries(flow_hash):
+                switch = self.switches[active_flow.dpid]
+                if switch and active_flow.out_port:
+                    switch.flowtables.update_flow_queue(active_flow.cookie,
+                                            active_flow.out_port, out_queue)
+                    updated.add((active_flow.dpid, active_flow.cookie))
+            counts['suppressions_updated'] += len(updated)
+            counts['suppressions_revoked'] += \
+                            self._revoke_suppressions(flow_hash, updated)
+        self.policy_reload.finish(request_ids, 'done', counts)
+        return 1
+
+    def _revoke_suppressions(self, flow_hash, exclude=()):
+        """
+        Delete the suppression and drop flow entries installed on
+        switches for a flow, except for any (dpid, cookie) in
+        exclude, and record the revocations in flow_mods.
+        Returns the number of flow entries revoked
+        """
+        revoked = set()
+        for flow_mod in self.flow.suppressions(flow_hash):
+            dpid = flow_mod['dpid']
+            switch = self.switches[dpid]
+            if not switch:
+                continue
+            cookies = [cookie for cookie in (flow_mod['forward_cookie'],
+                                            flow_mod['reverse_cookie'])
+                        if cookie and (dpid, cookie) not in exclude
+                        and (dpid, cookie) not in revoked]
+            for cookie in cookies:
+                switch.flowtables.delete_flow(cookie)
+                revoked.add((dpid, cookie))
+            if cookies:
+                self.flow.record_suppression(dpid, 'revoke', flow_mod,
+                                                        flow_hash=flow_hash)
+        return len(revoked)
 
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def switch_connection_handler(self, event):
@@ -127,6 +415,7 @@ class NMeta(app_manager.RyuApp, BaseClass):
         switch description
         """
         self.switches.add(event.msg.datapath)
+        self.flowstats.add_switch(event.msg.datapath.id)
 
     @set_ev_cls(ofp_event.EventOFPDescStatsReply, MAIN_DISPATCHER)
     def desc_stats_reply_handler(self, event):
@@ -136,17 +425,91 @@ class NMeta(app_manager.RyuApp, BaseClass):
         """
         self.switches.stats_reply(event.msg)
 
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def flow_stats_reply_handler(self, event):
+        """
+        Receive a reply from a switch to a flow statistics request
+        and apply it to the live flow stats
+        """
+        self.flowstats.stats_reply(event.msg)
+        if self.flowstats.pending_flows:
+            self._flowstats_classify()
+
+    def _flowstats_classify(self):
+        """
+        Run custom classifiers that finalise classification from
+        flow stats counters for flows awaiting them. When a
+        classifier decides, record the classification and update
+        the QoS queue of the flow's existing switch flow entries
+        in place (by cookie) so that counters are preserved
+        """
+        for flow_hash, classifier, rates in self.flowstats.pending():
+            classifier_result = policy.TCClassifierResult('custom',
+                                                                classifier)
+            if not self.policy.custom.check_custom_flowstats(
+                                                    classifier_result, rates):
+                continue
+            self.flowstats.clear_pending(flow_hash)
+            classification = self.flow.reclassify(flow_hash,
+                                        classifier_result.classification_tag,
+                                        classifier_result.actions)
+            self.logger.debug("flowstats clasfn=%s", classification.dbdict())
+            actions = classification.actions
+            if 'qos_treatment' not in actions:
+                continue
+            out_queue = self.policy.qos(actions['qos_treatment'])
+            for active_flow in self.flowstats.entries(flow_hash):
+                switch = self.switches[active_flow.dpid]
+                if switch and active_flow.out_port:
+                    switch.flowtables.update_flow_queue(active_flow.cookie,
+                                            active_flow.out_port, out_queue)
+
     @set_ev_cls(ofp_event.EventOFPStateChange, DEAD_DISPATCHER)
     def switch_down_handler(self, event):
         """
         OpenFlow state has gone down for a given DPID
         """
         self.switches.delete(event.datapath)
+        self.flowstats.delete_switch(event.datapath.id)
 
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def packet_in(self, event):
         """
         This method is called for every Packet-In event from a Switch.
+        If scheduling is enabled, the event is queued by class to be
+        processed in priority order, otherwise it is processed now.
+        If the queue for its class is full, the packet is only forwarded
+        """
+        if self.scheduler.enabled:
+            if self.scheduler.enqueue(event):
+                self.scheduler_ready.set()
+            else:
+                self._forward_queue_full(event)
+            return
+        self.process_packet_in(event)
+
+    def _forward_queue_full(self, event):
+        """
+        Passed a packet-in event that could not be queued as the
+        scheduler queue for its class is full. Forward the packet
+        without classification so that it isn't silently lost
+        """
+        telemetry = PITelemetry(time.time(), event, self.logger,
+                                                self.pi_time, self.telemetry)
+        #*** Under pressure, so only aggregate in memory, not to database:
+        telemetry.record = False
+        msg = event.msg
+        switch = self.switches[msg.datapath.id]
+        if not switch:
+            return
+        in_port = msg.match['in_port']
+        eth = packet.Packet(msg.data).get_protocol(ethernet.ethernet)
+        self._forward_only(event, msg, in_port, switch, eth, telemetry,
+                                                        reason='queue_full')
+
+    def process_packet_in(self, event, sched_class='', sched_wait=0):
+        """
+        Process a Packet-In event from a Switch.
         We receive a copy of the Packet-In event, pass it to the
         traffic classification area for analysis, work out the forwarding,
         update flow metadata, then add a flow entry to the switch (when
@@ -156,47 +519,203 @@ class NMeta(app_manager.RyuApp, BaseClass):
         """
         #*** Set up performance telemetry capture:
         start_time = time.time()
-        telemetry = PITelemetry(start_time, event, self.logger, self.pi_time)
+        telemetry = PITelemetry(start_time, event, self.logger, self.pi_time,
+                                                        self.telemetry)
+        telemetry.sched_class = sched_class
+        telemetry.sched_wait = sched_wait
         #*** Extract parameters:
         msg = event.msg
         datapath = msg.datapath
         dpid = datapath.id
         switch = self.switches[dpid]
         flowtables = switch.flowtables
-        ofproto = datapath.ofproto
         in_port = msg.match['in_port']
         pkt = packet.Packet(msg.data)
         eth = pkt.get_protocol(ethernet.ethernet)
         flow = self.flow
         ident = self.ident
 
+        #*** Flood control of broadcast/multicast (not reserved) packets:
+        if self.floodcontrol.enabled and int(eth.dst[0:2], 16) & 1 and \
+                            str(eth.dst)[0:16] != '01:80:c2:00:00:0':
+            verdict = self.floodcontrol.check(dpid, in_port, eth.src,
+                                                                    msg.data)
+            if verdict == floodcontrol.LOOP:
+                self.logger.debug("Dropping looped broadcast dpid=%s "
+                                    "eth_src=%s", dpid, eth.src)
+                telemetry.record_outcome('drop_flood_loop')
+                return
+            if verdict == floodcontrol.NOISY:
+                flowtables.drop_broadcasts(eth.src,
+                                        self.floodcontrol.drop_timeout)
+            if verdict in (floodcontrol.RATE_LIMITED, floodcontrol.NOISY):
+                telemetry.record_outcome('drop_flood_rate_limited')
+                return
+            if verdict == floodcontrol.DUPLICATE:
+                #*** Already processed (from another switch or a
+                #***  retransmission), so just flood:
+                out_port = self.forwarding.basic_switch(event, in_port)
+                switch.packet_out(msg.data, in_port, out_port, out_queue=0,
+                                                                    no_queue=1)
+                telemetry.record_outcome('packet_out_flooded_duplicate')
+                return
+
+        #*** Admission control, driven by time event was queued in Ryu:
+        mode = admission.NORMAL
+        if self.admission.enabled:
+            if 'timestamp' in vars(event):
+                queue_delay = start_time - event.timestamp
+            else:
+                queue_delay = 0
+            mode = self.admission.admit(dpid, eth.src, queue_delay)
+            if mode == admission.OVERLOAD:
+                #*** Only forward the packet:
+                self._forward_only(event, msg, in_port, switch, eth,
+                                                                telemetry)
+                return
+        #*** Shed optional work (custom classifiers and telemetry):
+        shed = mode == admission.SHED
+        self.policy.custom.shed = shed
+        telemetry.record = not shed
+
         #*** Use packet-in timestamp from Ryu if available (v4.17 and higher):
         if 'timestamp' in vars(event):
-            pi_timestamp = datetime.datetime.fromtimestamp(event.timestamp)
+            pi_epoch = event.timestamp
         else:
-            pi_timestamp = datetime.datetime.now()
+            pi_epoch = time.time()
+        pi_timestamp = datetime.datetime.fromtimestamp(pi_epoch)
+
+        #*** Harvest identities unless shedding and an ARP from a source
+        #***  already known (DHCP, DNS and LLDP identities aren't keyed
+        #***  on the source MAC, so are always harvested):
+        arp = eth.ethertype == 2054
+        harvest = not (shed and arp and self.admission.harvest_known(eth.src))
+
+        if self.worker_pool.workers:
+            #*** Hand CPU heavy processing to the worker for the flow:
+            self.worker_seq += 1
+            self.worker_pending[self.worker_seq] = (event, telemetry, eth)
+            request = (dpid, in_port, msg.data, pi_epoch, shed, harvest)
+            self.worker_pool.submit(self.worker_seq,
+                                    workers.flow_key(msg.data), request)
+            return
+
+        #*** Read packet into a flow context for classifiers to work with:
+        context = flow.ingest_packet(dpid, in_port, msg.data, pi_timestamp,
+                                                                        shed)
+        classification = context.classification
 
-        #*** Read packet into flow object for classifiers to work with:
-        flow.ingest_packet(dpid, in_port, msg.data, pi_timestamp)
+        #*** Same packet already processed from another switch on its path,
+        #***  so skip harvesting and policy, but still forward it:
+        telemetry.duplicate = context.packet.duplicate
 
         #*** Harvest any identity metadata:
-        ident.harvest(msg.data, self.flow.packet)
+        if not context.packet.duplicate and harvest:
+            if ident.harvest(msg.data, context.packet) and arp:
+                self.admission.harvested(eth.src)
 
         #*** Traffic Classification if not already classified.
         #*** Check traffic classification policy to see if packet matches
-        #*** against policy and if it does update flow.classified.*:
-        if not flow.classification.classified:
-            self.policy.check_policy(flow, ident)
-            self.logger.debug("clasfn=%s", flow.classification.dbdict())
+        #*** against policy and if it does update classification:
+        if not classification.classified and not context.packet.duplicate:
+            self.policy.check_policy(context, ident)
+            self.logger.debug("clasfn=%s", classification.dbdict())
             #*** Write classification result to classifications collection:
-            flow.classification.commit()
+            classification.commit()
+        self._classified(context.flow_hash, context.packet.proto,
+                                classification.classified,
+                                classification.flowstats_classifier)
+        aggregate = None
+        if self.suppress_aggregate and classification.classified and \
+                                not classification.flowstats_classifier:
+            aggregate = self.policy.aggregate_fields(context.packet,
+                                                    classification.actions)
+        self.forward_packet_in(event, telemetry, eth, context.flow_hash,
+                                classification.classified,
+                                classification.actions, aggregate)
+
+    def _worker_results(self):
+        """
+        Run forever as a green thread, forwarding packet-ins that
+        worker processes have finished processing
+        """
+        while True:
+            ready = self.worker_pool.results()
+            for seq, result in ready:
+                try:
+                    self._worker_result(seq, result)
+                except Exception:
+                    #*** Keep forwarding, as this thread isn't guarded
+                    #***  by Ryu:
+                    self.logger.exception("Failed to forward packet-in "
+                                            "from worker seq=%s", seq)
+            if ready:
+                hub.sleep(0)
+            else:
+                hub.sleep(self.worker_pool.poll_interval)
+
+    def _worker_result(self, seq, result):
+        """
+        Passed a sequence number and result from a worker process
+        and forward the packet-in, unless the switch has disconnected
+        while it was being processed
+        """
+        event, telemetry, eth = self.worker_pending.pop(seq)
+        dpid = event.msg.datapath.id
+        if not self.switches[dpid]:
+            self.logger.debug("Dropping packet-in from worker for "
+                                "disconnected dpid=%s", dpid)
+            return
+        telemetry.duplicate = result['duplicate']
+        if result['harvested'] and eth.ethertype == 2054:
+            self.admission.harvested(eth.src)
+        self._classified(result['flow_hash'], result['proto'],
+                            result['classified'],
+                            result['flowstats_classifier'])
+        self.forward_packet_in(event, telemetry, eth, result['flow_hash'],
+                            result['classified'], result['actions'],
+                            result['aggregate'])
+
+    def _classified(self, flow_hash, proto, classified, flowstats_classifier):
+        """
+        Update in-memory state that depends on a flow's classification
+        """
+        if flowstats_classifier and self.flowstats.enabled and \
+                            flow_hash not in self.flowstats.pending_flows:
+            #*** Classifier will finalise from flow stats counters (only
+            #***  removed on stats replies, so not added unless polling):
+            self.flowstats.add_pending(flow_hash, flowstats_classifier)
+        #*** Schedule further packets in classified TCP flows as known:
+        if classified and proto == 6:
+            self.scheduler.mark_known(flow_hash)
+
+    def forward_packet_in(self, event, telemetry, eth, flow_hash, classified,
+                                                    actions, aggregate=None):
+        """
+        Forward a Packet-In event that has been processed, passed the
+        flow_hash, whether the flow is classified, the actions for
+        the flow and any fields to aggregate suppression on (see
+        Policy.aggregate_fields). Work out the forwarding, add a flow
+        entry to the switch (when appropriate) to suppress receiving
+        further packets on this flow, then send the packet out the
+        switch port(s) via a Packet-Out message, with appropriate QoS
+        queue set.
+        """
+        flow = self.flow
+        msg = event.msg
+        datapath = msg.datapath
+        dpid = datapath.id
+        switch = self.switches[dpid]
+        flowtables = switch.flowtables
+        ofproto = datapath.ofproto
+        in_port = msg.match['in_port']
 
         #*** Call Forwarding module to determine output port:
         out_port = self.forwarding.basic_switch(event, in_port)
         if out_port == in_port:
             #*** Sending out same port prohibited by IEEE 802.1D-2004 7.7.1c:
             self.logger.warning("Dropping packet flow_hash=%s as out_port="
-                                    "in_port=%s", flow.flow_hash, in_port)
+                                    "in_port=%s", flow_hash, in_port)
             telemetry.record_outcome('drop_same_port')
             return
         #*** Don't forward reserved MACs, as per IEEE 802.1D-2004 table 7-10:
@@ -205,7 +724,6 @@ class NMeta(app_manager.RyuApp, BaseClass):
             telemetry.record_outcome('drop_reserved_mac')
             return
 
-        actions = flow.classification.actions
         #*** Set QoS queue based on any QoS actions:
         if 'qos_treatment' in actions:
             out_queue = self.policy.qos(actions['qos_treatment'])
@@ -214,13 +732,15 @@ class NMeta(app_manager.RyuApp, BaseClass):
             out_queue = 0
         #*** Check for drop action:
         if 'drop' in actions:
-            self.logger.debug("Action drop flow_hash=%s", flow.flow_hash)
+            self.logger.debug("Action drop flow_hash=%s", flow_hash)
             if actions['drop'] == 'at_controller_and_switch':
-                if flow.not_suppressed(dpid, 'drop'):
-                    result = flowtables.drop_flow(msg)
-                    flow.record_suppression(dpid, 'drop', result)
+                if flow.not_suppressed(dpid, 'drop', flow_hash=flow_hash):
+                    result = flowtables.drop_flow(msg, aggregate)
+                    flow.record_suppression(dpid, 'drop', result,
+                                                        flow_hash=flow_hash)
                 else:
-                    flow.record_suppression(dpid, 'drop', {}, standdown=1)
+                    flow.record_suppression(dpid, 'drop', {}, standdown=1,
+                                                        flow_hash=flow_hash)
             telemetry.record_outcome('drop_action')
             return
 
@@ -228,16 +748,22 @@ class NMeta(app_manager.RyuApp, BaseClass):
             #*** Do some add flow magic, but only if not a flooded packet and
             #*** has been classified.
             #*** Prefer to do fine-grained match where possible:
-            if flow.classification.classified:
-                if flow.not_suppressed(dpid, 'suppress'):
+            if classified:
+                if flow.not_suppressed(dpid, 'suppress', flow_hash=flow_hash):
                     result = flowtables.suppress_flow(msg, in_port, out_port,
-                                                                     out_queue)
-                    flow.record_suppression(dpid, 'suppress', result=result)
+                                                        out_queue, aggregate)
+                    flow.record_suppression(dpid, 'suppress', result=result,
+                                                        flow_hash=flow_hash)
+                    if self.suppress_path_wide and \
+                                            result['match_type'] != 'ignore':
+                        self._suppress_path(msg, eth, dpid, flow_hash,
+                                                        out_queue, aggregate)
                 else:
-                    flow.record_suppression(dpid, 'suppress', {}, standdown=1)
+                    flow.record_suppression(dpid, 'suppress', {}, standdown=1,
+                                                        flow_hash=flow_hash)
             else:
                 self.logger.debug("Flow entry for flow_hash=%s not added as "
-                                     "not classified yet", flow.flow_hash)
+                                     "not classified yet", flow_hash)
             #*** Send Packet Out:
             switch.packet_out(msg.data, in_port, out_port, out_queue)
             telemetry.record_outcome('packet_out')
@@ -248,6 +774,52 @@ class NMeta(app_manager.RyuApp, BaseClass):
                                                                     no_queue=1)
             telemetry.record_outcome('packet_out_flooded')
 
+    def _forward_only(self, event, msg, in_port, switch, eth, telemetry,
+                                                        reason='overload'):
+        """
+        Forward a packet without any other processing, for when
+        the controller is overloaded or the scheduler queue is full.
+        Flow entries are not added as the flow has not been classified.
+        The reason is appended to the recorded outcome
+        """
+        out_port = self.forwarding.basic_switch(event, in_port)
+        if out_port == in_port or str(eth.dst)[0:16] == '01:80:c2:00:00:0':
+            telemetry.record_outcome('drop_' + reason)
+            return
+        #*** QoS treatment is unknown, so send without queue:
+        switch.packet_out(msg.data, in_port, out_port, out_queue=0,
+                                                                    no_queue=1)
+        telemetry.record_outcome('packet_out_' + reason)
+
+    def _suppress_path(self, msg, eth, dpid, flow_hash, out_queue,
+                                                            aggregate=None):
+        """
+        Proactively install suppression flow entries for the flow
+        on the other switches that have learnt both the source and
+        destination MACs, so that they don't each send a packet-in
+        for the flow. Entries are installed as one batch of flow
+        mods per switch
+        """
+        flow = self.flow
+        if aggregate and 'in_port' in aggregate['forward']:
+            #*** Policy depends on ingress port of the first switch:
+            aggregate = None
+        for path_dpid, in_port, out_port in \
+                            self.forwarding.path_ports(eth.src, eth.dst):
+            if path_dpid == dpid:
+                continue
+            switch = self.switches[path_dpid]
+            if not switch:
+                continue
+            if flow.not_suppressed(path_dpid, 'suppress',
+                                                        flow_hash=flow_hash):
+                self.logger.debug("Path suppress flow_hash=%s dpid=%s",
+                                                flow_hash, path_dpid)
+                result = switch.flowtables.suppress_flow(msg, in_port,
+                                            out_port, out_queue, aggregate)
+                flow.record_suppression(path_dpid, 'suppress', result=result,
+                                                        flow_hash=flow_hash)
+
     @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
     def flow_removed_handler(self, event):
         """
@@ -276,6 +848,8 @@ class NMeta(app_manager.RyuApp, BaseClass):
                               msg.table_id, msg.duration_sec,
                               msg.idle_timeout, msg.hard_timeout,
                               msg.packet_count, msg.byte_count, msg.match)
+        #*** Flow entry no longer active so remove from live flow stats:
+        self.flowstats.record_removal(datapath.id, msg.cookie)
         if reason == 'IDLE TIMEOUT':
             #*** Record flow removal into the flow_rems database collection:
             self.flow.record_removal(msg)
@@ -320,12 +894,22 @@ class PITelemetry(object):
     """
     Telemetry data for a single Packet-In (PI) event
     """
-    def __init__(self, pi_start_time, event, logger, pi_time_col):
+    def __init__(self, pi_start_time, event, logger, pi_time_col,
+                                                            aggregator):
         """ Initialise the PITelemetry Class """
         self.pi_start_time = pi_start_time
         self.event = event
         self.logger = logger
         self.pi_time_col = pi_time_col
+        #*** Telemetry object that aggregates for live WebUI telemetry:
+        self.aggregator = aggregator
+        #*** Packet already received from another switch:
+        self.duplicate = False
+        #*** Set to False to not write to database (shedding load):
+        self.record = True
+        #*** Scheduling class and time spent in scheduler queue:
+        self.sched_class = ''
+        self.sched_wait = 0
 
     def record_outcome(self, outcome):
         """
@@ -336,8 +920,20 @@ class PITelemetry(object):
         - drop_reserved_mac
         - drop_action
         - packet_out_flooded
+        - packet_out_flooded_duplicate
         - packet_out
-        Additionally, record time taken queueing event in Ryu (if available).
+        - drop_flood_loop
+        - drop_flood_rate_limited
+        - packet_out_overload
+        - drop_overload
+        - packet_out_queue_full
+        - drop_queue_full
+        Additionally, record time taken queueing event in Ryu (if available),
+        whether the packet was a cross-switch duplicate, and the
+        scheduling class and time queued in the scheduler.
+
+        Times are always aggregated in memory for live telemetry,
+        even when not written to database (shedding load)
         """
         #*** Retrieve Ryu controller timestamp, if it exists:
         if 'timestamp' in vars(self.event):
@@ -346,10 +942,16 @@ class PITelemetry(object):
             ryu_delta = 0
         #*** Calculate and log packet-in processing time:
         pi_delta = time.time() - self.pi_start_time
+        self.aggregator.record(ryu_delta, pi_delta, self.duplicate)
+        if not self.record:
+            return
         #*** Write results to database collection:
         self.pi_time_col.insert({'ryu_delta': ryu_delta,
                              'pi_delta': pi_delta,
                              'outcome': outcome,
+                             'duplicate': self.duplicate,
+                             'sched_class': self.sched_class,
+                             'sched_wait': self.sched_wait,
                              'timestamp': datetime.datetime.now()})
 
 #*** Borrowed from rest_router.py code:
@@ -374,6 +374,19 @@ LOCATION_SCHEMA = Schema({
                             [{'port_set': str}],
                         })
 
+#*** Packet fields that each static classifier depends on (classifiers
+#***  not listed depend on more than the packet, i.e. time of day):
+STATIC_FIELDS = {'location_src': ('in_port',),
+                 'eth_src': ('eth_src',),
+                 'eth_dst': ('eth_dst',),
+                 'eth_type': ('eth_type',),
+                 'ip_src': ('ip_src',),
+                 'ip_dst': ('ip_dst',),
+                 'tcp_src': ('proto', 'tp_src'),
+                 'tcp_dst': ('proto', 'tp_dst'),
+                 'udp_src': ('proto', 'tp_src'),
+                 'udp_dst': ('proto', 'tp_dst')}
+
 #*** Default policy file location parameters:
 POL_DIR_DEFAULT = "config"
 POL_DIR_USER = "config/user"
@@ -394,9 +407,13 @@ class Policy(BaseClass):
     Main Methods and Variables:
     - check_policy(flow, ident)   # Check a packet against policy
     - qos(qos_treatment)          # Map qos_treatment string to queue number
+    - aggregate_fields(pkt, actions) # Packet fields policy outcome
+                                      depends on, for aggregated
+                                      suppression
     - main_policy                 # main policy YAML object. Read-only,
                                       no verbs. Use methods instead where
                                       possible.
+    - policy_text                 # main policy YAML text, as read
 
     TC Methods and Variables:
     - tc_rules.rules_list         # List of TC rules
@@ -406,8 +423,12 @@ class Policy(BaseClass):
     """
     def __init__(self, config, pol_dir_default=POL_DIR_DEFAULT,
                     pol_dir_user=POL_DIR_USER,
-                    pol_filename=POL_FILENAME):
-        """ Initialise the Policy Class """
+                    pol_filename=POL_FILENAME, policy_text=None):
+        """
+        Initialise the Policy Class. Optionally pass policy_text,
+        the policy YAML already read from file, to use instead of
+        reading the policy file
+        """
         #*** Required for BaseClass:
         self.config = config
         #*** Set up Logging with inherited base class method:
@@ -432,15 +453,19 @@ class Policy(BaseClass):
                                          self.policy_filename)
             self.logger.info("Opening default policy file=%s",
                                                             self.fullpathname)
-        #*** Ingest the policy file:
-        try:
-            with open(self.fullpathname, 'r') as filename:
-                self.main_policy = yaml.safe_load(filename)
-        except (IOError, OSError) as exception:
-            self.logger.error("Failed to open policy "
-                              "file=%s exception=%s",
-                              self.fullpathname, exception)
-            sys.exit("Exiting nmeta. Please create policy file")
+        #*** Ingest the policy file (text kept so that the same policy
+        #***  can be passed to other processes):
+        if policy_text is None:
+            try:
+                with open(self.fullpathname, 'r') as filename:
+                    policy_text = filename.read()
+            except (IOError, OSError) as exception:
+                self.logger.error("Failed to open policy "
+                                  "file=%s exception=%s",
+                                  self.fullpathname, exception)
+                sys.exit("Exiting nmeta. Please create policy file")
+        self.policy_text = policy_text
+        self.main_policy = yaml.safe_load(policy_text)
 
         #*** Instantiate Classes:
         self.static = tc_static.StaticInspect(config, self)
@@ -461,16 +486,23 @@ class Policy(BaseClass):
 
     def check_policy(self, flow, ident):
         """
-        Passed a flows object, set in context of current packet-in event,
-        and an identities object.
+        Passed a flow context (a FlowContext object for the packet-in
+        event, or a flows object set in context of it) and an
+        identities object.
         Check if packet matches against any policy
         rules and if it does, update the classifications portion of
         the flows object to reflect details of the classification.
         """
+        self.custom.skipped = False
         #*** Check against TC policy:
         for tc_rule in self.tc_rules.rules_list:
             #*** Check the rule:
             tc_rule_result = tc_rule.check_tc_rule(flow, ident)
+            if self.custom.skipped and not tc_rule_result.match:
+                #*** Custom classifier was shed so can't tell if rule would
+                #***  have matched. Leave unclassified to check again later:
+                flow.classification.classified = False
+                return 0
             if tc_rule_result.match:
                 self.logger.debug("Matched policy rule=%s", tc_rule.__dict__)
                 #*** Only set 'classified' if continue_to_inspect not set:
@@ -482,6 +514,9 @@ class Policy(BaseClass):
                                               tc_rule_result.classification_tag
                 flow.classification.classification_time = \
                                                         datetime.datetime.now()
+                #*** Custom classifier to finalise from flow stats (if any):
+                flow.classification.flowstats_classifier = \
+                                            tc_rule_result.flowstats_classifier
                 #*** Accumulate any actions:
                 flow.classification.actions.update(tc_rule_result.actions)
                 self.logger.debug("flow.classification.actions=%s",
@@ -492,6 +527,62 @@ class Policy(BaseClass):
         flow.classification.classified = True
         return 0
 
+    def check_policy_batch(self, columns, ident=None, flow_list=None):
+        """
+        Passed columns of flow attributes (see policy_batch module),
+        an identities object and optionally a list of flow contexts
+        (one per row, required if policy has custom classifiers).
+        Classify all the flows at once, with the same results as
+        check_policy, and return a dictionary of per-flow results
+        """
+        #*** Import here so NumPy is only needed for batch evaluation:
+        import policy_batch
+        return policy_batch.BatchPolicy(self).check(columns, ident,
+                                                                flow_list)
+
+    def aggregate_fields(self, pkt, actions):
+        """
+        Passed a Packet object and the actions of its flow's
+        classification. Work out the packet fields that the policy
+        outcome for the packet depends on, so that one suppression
+        flow entry matching only those fields can cover all flows that
+        policy treats the same. Return a dictionary with lists of
+        fields for the 'forward' and 'reverse' directions (reverse is
+        None if it can't be aggregated), or None if the packet's
+        outcome doesn't depend on packet fields alone
+        """
+        forward = self._outcome_fields(pkt, actions)
+        if forward is None:
+            return None
+        reverse = self._outcome_fields(ReversePacket(pkt), actions)
+        if reverse is not None and 'in_port' in reverse:
+            #*** Ingress port of the reverse direction isn't known:
+            reverse = None
+        return {'forward': sorted(forward),
+                'reverse': None if reverse is None else sorted(reverse)}
+
+    def _outcome_fields(self, pkt, actions):
+        """
+        Return the set of packet fields that decide which rule (if
+        any) matches the packet, if the outcome has the passed actions,
+        otherwise None. Rules before the matching rule are included, as
+        they must not match either
+        """
+        fields = set()
+        for tc_rule in self.tc_rules.rules_list:
+            result = tc_rule.match_fields(pkt)
+            if result is None:
+                return None
+            match, rule_fields = result
+            fields.update(rule_fields)
+            if match:
+                if tc_rule.actions != actions:
+                    return None
+                return fields
+        if actions:
+            return None
+        return fields
+
     def qos(self, qos_treatment):
         """
         Passed a QoS treatment string and return the relevant
@@ -561,6 +652,9 @@ class TCRule(object):
         for condition in self.yaml['conditions_list']:
             self.conditions_list.append(TCCondition(tc_rules,
                             policy, condition))
+        #*** Rule has custom classifiers (worth pre-checking statically):
+        self.custom = any(condition.custom
+                                    for condition in self.conditions_list)
 
     def check_tc_rule(self, flow, ident):
         """
@@ -570,6 +664,11 @@ class TCRule(object):
         """
         #*** Instantiate object to hold results for checks:
         result = TCRuleResult(self.actions)
+        if self.custom and self.static_verdict(flow.packet) is False:
+            #*** Static classifiers rule out a match whatever custom
+            #***  classifiers return, so don't run them:
+            self.logger.debug("no_match_static, rule=%s", self.yaml)
+            return result
         #*** Iterate through the conditions list:
         for condition in self.conditions_list:
             condition_result = condition.check_tc_condition(flow, ident)
@@ -620,6 +719,62 @@ class TCRule(object):
             result.match = False
             return result
 
+    def static_verdict(self, pkt):
+        """
+        Passed a Packet object and decide whether the rule matches
+        using only its static classifiers, following the same match
+        type logic as check_tc_rule. Return True or False if decided
+        whatever identity and custom classifiers return, otherwise
+        None (undecided)
+        """
+        verdicts = [condition.static_verdict(pkt)
+                                    for condition in self.conditions_list]
+        if self.match_type == "any":
+            if True in verdicts:
+                return True
+            if None in verdicts:
+                return None
+            return False
+        elif self.match_type == "all":
+            #*** As check_tc_rule, 'all' is decided on first condition:
+            return False
+        elif self.match_type == "none":
+            #*** As check_tc_rule, 'none' is decided on last condition:
+            if verdicts[-1] is None:
+                return None
+            return not verdicts[-1]
+        return False
+
+    def match_fields(self, pkt):
+        """
+        Passed a Packet object and decide whether the rule matches
+        it, following the same match type logic as check_tc_rule, and
+        which packet fields decide that. Return a tuple of (match, set
+        of fields), or None if the rule depends on more than packet
+        fields (identity, custom or time of day classifiers)
+        """
+        if self.match_type == "all":
+            #*** As check_tc_rule, 'all' never matches:
+            return (False, set())
+        results = []
+        for condition in self.conditions_list:
+            result = condition.match_fields(pkt)
+            if result is None:
+                return None
+            results.append(result)
+        if self.match_type == "any":
+            fields = set()
+            for match, condition_fields in results:
+                if match:
+                    return (True, condition_fields)
+                fields.update(condition_fields)
+            return (False, fields)
+        elif self.match_type == "none":
+            #*** As check_tc_rule, 'none' is decided on last condition:
+            match, condition_fields = results[-1]
+            return (not match, condition_fields)
+        return None
+
 class TCRuleResult(object):
     """
     An object that represents a traffic classification
@@ -633,6 +788,7 @@ class TCRuleResult(object):
         self.continue_to_inspect = 0
         self.classification_tag = ""
         self.actions = {}
+        self.flowstats_classifier = ""
         #*** Actions defined in policy for this rule:
         self.rule_actions = rule_actions
 
@@ -645,6 +801,9 @@ class TCRuleResult(object):
             self.match = True
             if condition_result.continue_to_inspect:
                 self.continue_to_inspect = True
+            if condition_result.flowstats_classifier:
+                self.flowstats_classifier = \
+                                         condition_result.flowstats_classifier
             if self.rule_actions['set_desc'] == 'classifier_return':
                 self.classification_tag = condition_result.classification_tag
             else:
@@ -696,6 +855,12 @@ class TCCondition(object):
                     custlist.append(classifier['custom'])
 
         self.match_type = self.yaml['match_type']
+        #*** Condition has custom classifiers:
+        self.custom = any('custom' in classifier
+                                        for classifier in self.classifiers)
+        #*** Condition depends only on packet fields:
+        self.packet_only = all(next(iter(classifier)) in STATIC_FIELDS
+                                        for classifier in self.classifiers)
 
     def check_tc_condition(self, flow, ident):
         """
@@ -761,6 +926,61 @@ class TCCondition(object):
             result.match = False
             return result
 
+    def static_verdict(self, pkt):
+        """
+        Passed a Packet object and decide whether the condition
+        matches using only its static classifiers, following the
+        same match type logic as check_tc_condition. Identity and
+        custom classifiers are unknown. Return True or False if
+        decided, otherwise None (undecided)
+        """
+        undecided = False
+        for classifier in self.classifiers:
+            policy_attr = next(iter(classifier))
+            classifier_result = TCClassifierResult(policy_attr,
+                                                    classifier[policy_attr])
+            if policy_attr == "custom" or \
+                            classifier_result.policy_attr_type == "identity":
+                undecided = True
+                continue
+            self.policy.static.check_static(classifier_result, pkt)
+            if classifier_result.match and self.match_type == "any":
+                return True
+            elif not classifier_result.match and self.match_type == "all":
+                return False
+            elif classifier_result.match and self.match_type == "none":
+                return False
+        if undecided:
+            return None
+        #*** All classifiers static and none decided it in the loop:
+        return self.match_type != "any"
+
+    def match_fields(self, pkt):
+        """
+        Passed a Packet object and decide whether the condition
+        matches it, following the same match type logic as
+        check_tc_condition, and which packet fields decide that.
+        Return a tuple of (match, set of fields), or None if the
+        condition depends on more than packet fields
+        """
+        if not self.packet_only:
+            return None
+        fields = set()
+        for classifier in self.classifiers:
+            policy_attr = next(iter(classifier))
+            classifier_result = TCClassifierResult(policy_attr,
+                                                    classifier[policy_attr])
+            self.policy.static.check_static(classifier_result, pkt)
+            #*** A classifier that decides the condition is enough:
+            if classifier_result.match and self.match_type == "any":
+                return (True, set(STATIC_FIELDS[policy_attr]))
+            elif not classifier_result.match and self.match_type == "all":
+                return (False, set(STATIC_FIELDS[policy_attr]))
+            elif classifier_result.match and self.match_type == "none":
+                return (False, set(STATIC_FIELDS[policy_attr]))
+            fields.update(STATIC_FIELDS[policy_attr])
+        return (self.match_type != "any", fields)
+
 class TCConditionResult(object):
     """
     An object that represents a traffic classification condition
@@ -774,6 +994,7 @@ class TCConditionResult(object):
         self.continue_to_inspect = False
         self.classification_tag = ""
         self.actions = {}
+        self.flowstats_classifier = ""
 
     def accumulate(self, classifier_result):
         """
@@ -784,6 +1005,9 @@ class TCConditionResult(object):
             self.match = True
             if classifier_result.continue_to_inspect:
                 self.continue_to_inspect = True
+            if classifier_result.flowstats_classifier:
+                self.flowstats_classifier = \
+                                        classifier_result.flowstats_classifier
             self.actions.update(classifier_result.actions)
             self.classification_tag += classifier_result.classification_tag
 
@@ -804,6 +1028,30 @@ class TCClassifierResult(object):
         self.policy_value = policy_value
         self.classification_tag = ""
         self.actions = {}
+        #*** Name of custom classifier that will finalise the
+        #***  classification from flow stats counters (if any):
+        self.flowstats_classifier = ""
+
+class ReversePacket(object):
+    """
+    A view of a Packet object as if it were travelling in the
+    reverse direction (source and destination swapped), for
+    checking static classifiers against the reverse direction
+    of a flow. The ingress port is not known
+    """
+    #*** Attributes that are swapped, others are passed through:
+    SWAP = {'eth_src': 'eth_dst', 'eth_dst': 'eth_src',
+            'ip_src': 'ip_dst', 'ip_dst': 'ip_src',
+            'tp_src': 'tp_dst', 'tp_dst': 'tp_src'}
+
+    def __init__(self, pkt):
+        """ Initialise the ReversePacket Class """
+        self._pkt = pkt
+
+    def __getattr__(self, name):
+        if name == 'in_port':
+            return None
+        return getattr(self._pkt, self.SWAP.get(name, name))
 
 class QoSTreatment(object):
     """
@@ -0,0 +1,363 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+The policy_batch module is part of the nmeta suite
+
+It provides evaluation of traffic classification policy against
+many flows at once, for replay, backfill after a policy change and
+offline evaluation.
+
+Flow attributes are passed as columns (a NumPy array per attribute,
+one element per flow, with IP and MAC addresses as integers).
+Rules made up of static classifiers are evaluated with vectorised
+comparisons across all flows. Rules that contain identity or
+custom classifiers fall back to checking each flow that is not
+yet classified, with the same code as Policy.check_policy.
+
+Results agree with Policy.check_policy for each flow, including
+its handling of rule and condition match types.
+"""
+
+#*** For converting addresses to integers:
+import socket
+import struct
+
+#*** Vectorised comparisons:
+import numpy as np
+
+#*** Import netaddr for MAC and IP address conversion:
+from netaddr import IPAddress
+from netaddr import IPNetwork
+from netaddr import EUI
+
+#*** nmeta imports:
+import flows
+
+#*** Columns of flow attributes, with NumPy types:
+COLUMNS = (('dpid', np.uint64),
+           ('in_port', np.uint32),
+           ('eth_src', np.uint64),
+           ('eth_dst', np.uint64),
+           ('eth_type', np.uint32),
+           ('ip_src', np.uint32),
+           ('ip_dst', np.uint32),
+           ('proto', np.uint32),
+           ('tp_src', np.uint32),
+           ('tp_dst', np.uint32))
+
+def columns(packets):
+    """
+    Passed an iterable of packet records (Flow.Packet objects or
+    packet_ins database documents) and return a dictionary of NumPy
+    arrays, one per column in COLUMNS. MAC and IPv4 addresses are
+    converted to integers, with 0 for non-IPv4 packets (which are
+    told apart from 0.0.0.0 by eth_type)
+    """
+    values = dict((name, []) for name, _ in COLUMNS)
+    for record in packets:
+        if not isinstance(record, dict):
+            record = record.dbdict()
+        for name, _ in COLUMNS:
+            value = record[name]
+            if name in ('eth_src', 'eth_dst'):
+                value = mac_int(value)
+            elif name in ('ip_src', 'ip_dst'):
+                value = ip_int(value)
+            values[name].append(value or 0)
+    return dict((name, np.array(values[name], dtype=_type))
+                                                for name, _type in COLUMNS)
+
+def ip_int(ip_addr):
+    """
+    Return an IPv4 address string as an integer, or 0 if it is
+    empty or not IPv4
+    """
+    try:
+        return struct.unpack('!I', socket.inet_aton(ip_addr))[0]
+    except (socket.error, TypeError):
+        return 0
+
+def mac_int(mac_addr):
+    """
+    Return a MAC address string (xx:xx:xx:xx:xx:xx) as an integer,
+    or 0 if it is empty
+    """
+    if not mac_addr:
+        return 0
+    return int(str(mac_addr).replace(':', ''), 16)
+
+class BatchPolicy(object):
+    """
+    An object that classifies many flows at once against a Policy
+
+    Main methods (assumes class instantiated as an object called
+    'batch'):
+
+        batch.check(columns, ident, flow_list)
+          Return a dictionary of per-flow classification results:
+          - classified: NumPy boolean array
+          - rule: NumPy integer array of index of matched rule (-1
+            if no rule matched)
+          - classification_tag: list of strings
+          - actions: list of dictionaries
+          - flowstats_classifier: list of strings
+    """
+    def __init__(self, policy):
+        """
+        Initialise an instance of the BatchPolicy class, passed a
+        Policy class instance
+        """
+        self.policy = policy
+        self.logger = policy.logger
+        #*** Rules that need checking per row, with any custom classifier:
+        self.row_rules = {}
+        for idx, tc_rule in enumerate(policy.tc_rules.rules_list):
+            for condition in tc_rule.conditions_list:
+                for classifier in condition.classifiers:
+                    policy_attr = next(iter(classifier))
+                    if policy_attr == 'custom':
+                        self.row_rules[idx] = True
+                    elif policy_attr.split("_")[0] == 'identity':
+                        self.row_rules.setdefault(idx, False)
+
+    def check(self, cols, ident=None, flow_list=None):
+        """
+        Passed a dictionary of columns (see COLUMNS, and optionally a
+        'location' column of location names), an Identities object
+        (needed for identity classifiers) and optionally a list of a
+        flow context per row (needed for custom classifiers, which
+        use flow features). Return per-flow classification results
+        (see class docstring)
+        """
+        rows = len(cols['dpid'])
+        if flow_list is None and True in self.row_rules.values():
+            raise ValueError("flow_list must be passed for policy with "
+                                                        "custom classifiers")
+        cache = {}
+        classified = np.zeros(rows, dtype=bool)
+        rule = np.full(rows, -1, dtype=int)
+        tags = [""] * rows
+        actions = [{} for _ in range(rows)]
+        flowstats_classifiers = [""] * rows
+        #*** Rows still to be checked against later rules:
+        pending = np.ones(rows, dtype=bool)
+        #*** Rows where a custom classifier was shed:
+        skipped = np.zeros(rows, dtype=bool)
+        for idx, tc_rule in enumerate(self.policy.tc_rules.rules_list):
+            if not pending.any():
+                break
+            if idx in self.row_rules:
+                #*** Identity or custom classifiers, so check per row:
+                for row in np.flatnonzero(pending):
+                    if flow_list is not None:
+                        flow = flow_list[row]
+                    else:
+                        flow = self._row_flow(cols, row)
+                    self.policy.custom.skipped = bool(skipped[row])
+                    result = tc_rule.check_tc_rule(flow, ident)
+                    skipped[row] = self.policy.custom.skipped
+                    if result.match:
+                        classified[row] = not result.continue_to_inspect
+                        rule[row] = idx
+                        tags[row] = result.classification_tag
+                        actions[row] = result.actions
+                        flowstats_classifiers[row] = \
+                                                result.flowstats_classifier
+                        pending[row] = False
+                    elif skipped[row]:
+                        #*** Leave unclassified to check again later:
+                        pending[row] = False
+                continue
+            match = pending & self._check_rule(tc_rule, cols, pending, cache)
+            if tc_rule.match_type != 'none' and \
+                            tc_rule.actions['set_desc'] != 'classifier_return':
+                tag = tc_rule.actions['set_desc']
+            else:
+                #*** As TCRuleResult, no tag from static classifiers:
+                tag = ""
+            for row in np.flatnonzero(match):
+                tags[row] = tag
+                actions[row] = dict(tc_rule.actions)
+            classified |= match
+            rule[match] = idx
+            #*** Shed custom classifier and no match leaves unclassified:
+            pending &= ~match & ~skipped
+        #*** No matches. Mark as classified so we don't process again:
+        classified |= pending
+        return {'classified': classified,
+                'rule': rule,
+                'classification_tag': tags,
+                'actions': actions,
+                'flowstats_classifier': flowstats_classifiers}
+
+    def _check_rule(self, tc_rule, cols, rows, cache):
+        """
+        Return boolean array of which rows match a TC rule, following
+        the same match type logic as TCRule.check_tc_rule
+        """
+        match = np.zeros(len(rows), dtype=bool)
+        done = ~rows
+        last = np.zeros(len(rows), dtype=bool)
+        for condition in tc_rule.conditions_list:
+            active = ~done
+            if not active.any():
+                break
+            condition_match = self._check_condition(condition, cols, active,
+                                                                        cache)
+            if tc_rule.match_type == "any":
+                hit = active & condition_match
+                match |= hit
+                done |= hit
+            elif tc_rule.match_type == "all":
+                #*** As check_tc_rule, 'all' is decided on first condition:
+                done |= active & ~match
+            last[active] = condition_match[active]
+        active = ~done
+        if tc_rule.match_type == "all":
+            match |= active & last
+        elif tc_rule.match_type == "none":
+            match |= active & ~last
+        return match
+
+    def _check_condition(self, condition, cols, rows, cache):
+        """
+        Return boolean array of which rows match a TC condition,
+        following the same match type logic as
+        TCCondition.check_tc_condition
+        """
+        match = np.zeros(len(rows), dtype=bool)
+        done = ~rows
+        last = np.zeros(len(rows), dtype=bool)
+        for classifier in condition.classifiers:
+            active = ~done
+            if not active.any():
+                break
+            classifier_match = self._check_static(classifier, cols, cache)
+            if condition.match_type == "any":
+                hit = active & classifier_match
+                match |= hit
+                done |= hit
+            elif condition.match_type == "all":
+                done |= active & ~classifier_match
+            elif condition.match_type == "none":
+                done |= active & classifier_match
+            last[active] = classifier_match[active]
+        active = ~done
+        if condition.match_type == "all":
+            match |= active & last
+        elif condition.match_type == "none":
+            match |= active & ~last
+        return match
+
+    def _check_static(self, classifier, cols, cache):
+        """
+        Return boolean array of which rows match a static classifier,
+        with the same results as StaticInspect.check_static
+        """
+        policy_attr = next(iter(classifier))
+        policy_value = classifier[policy_attr]
+        rows = len(cols['dpid'])
+        if policy_attr == 'location_src':
+            return self._locations(cols, cache) == policy_value
+        elif policy_attr == 'time_of_day':
+            return np.full(rows, bool(self.policy.static.is_match_time_of_day(
+                                                policy_value)), dtype=bool)
+        elif policy_attr in ('eth_src', 'eth_dst'):
+            return cols[policy_attr] == int(EUI(policy_value))
+        elif policy_attr == 'eth_type':
+            if str(policy_value)[:2] == '0x':
+                return cols['eth_type'] == int(policy_value, 16)
+            return cols['eth_type'] == int(policy_value)
+        elif policy_attr in ('ip_src', 'ip_dst'):
+            return self._ip_space(cols, policy_attr, policy_value)
+        elif policy_attr in ('tcp_src', 'udp_src'):
+            proto = 6 if policy_attr == 'tcp_src' else 17
+            return (cols['proto'] == proto) & (cols['tp_src'] == policy_value)
+        elif policy_attr in ('tcp_dst', 'udp_dst'):
+            proto = 6 if policy_attr == 'tcp_dst' else 17
+            return (cols['proto'] == proto) & (cols['tp_dst'] == policy_value)
+        self.logger.error("Unsupported static classifier policy_attr=%s",
+                                                                policy_attr)
+        return np.zeros(rows, dtype=bool)
+
+    def _ip_space(self, cols, policy_attr, ip_space):
+        """
+        Return boolean array of which rows have an IPv4 address in
+        column policy_attr that is in an IP space (CIDR network,
+        range or single address, as per policy)
+        """
+        ip_addrs = cols[policy_attr]
+        if "/" in ip_space:
+            network = IPNetwork(ip_space)
+            version, first, last = network.version, network.first, \
+                                                                network.last
+        elif "-" in ip_space:
+            ip_range = ip_space.split("-")
+            first, last = IPAddress(ip_range[0]), IPAddress(ip_range[1])
+            version, first, last = first.version, int(first), int(last)
+        else:
+            ip_addr = IPAddress(ip_space)
+            version, first, last = ip_addr.version, int(ip_addr), int(ip_addr)
+        if version != 4:
+            #*** Columns are IPv4 only:
+            return np.zeros(len(ip_addrs), dtype=bool)
+        return (cols['eth_type'] == 2048) & (ip_addrs >= first) & \
+                                                        (ip_addrs <= last)
+
+    def _locations(self, cols, cache):
+        """
+        Return array of location names per row, from the 'location'
+        column if passed, otherwise looked up once per distinct
+        DPID and in_port
+        """
+        if 'location' in cols:
+            return np.asarray(cols['location'], dtype=object)
+        if 'location' not in cache:
+            pairs = np.column_stack((cols['dpid'].astype(np.uint64),
+                                     cols['in_port'].astype(np.uint64)))
+            if not len(pairs):
+                return np.array([], dtype=object)
+            unique, inverse = np.unique(pairs, axis=0, return_inverse=True)
+            names = np.array([self.policy.locations.get_location(int(dpid),
+                        int(in_port)) for dpid, in_port in unique],
+                        dtype=object)
+            cache['location'] = names[inverse]
+        return cache['location']
+
+    def _row_flow(self, cols, row):
+        """
+        Return a flow context for a row, built from the columns, for
+        checking identity classifiers (which only use the packet)
+        """
+        pkt = flows.Flow.Packet()
+        for name, _ in COLUMNS:
+            setattr(pkt, name, int(cols[name][row]))
+        pkt.eth_src = _mac_str(pkt.eth_src)
+        pkt.eth_dst = _mac_str(pkt.eth_dst)
+        if pkt.eth_type == 2048:
+            pkt.ip_src = socket.inet_ntoa(struct.pack('!I', pkt.ip_src))
+            pkt.ip_dst = socket.inet_ntoa(struct.pack('!I', pkt.ip_dst))
+        else:
+            pkt.ip_src = ''
+            pkt.ip_dst = ''
+        return flows.FlowContext(None, pkt, None)
+
+#================== PRIVATE FUNCTIONS ==================
+
+def _mac_str(mac_addr):
+    """
+    Return an integer MAC address as a string (xx:xx:xx:xx:xx:xx)
+    """
+    mac_hex = '%012x' % mac_addr
+    return ':'.join(mac_hex[i:i+2] for i in range(0, 12, 2))
@@ -0,0 +1,281 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+The policy_reload module is part of the nmeta suite
+
+It supports reloading main_policy.yaml without restarting nmeta.
+A reload is requested by sending the nmeta process a SIGHUP signal
+or by a POST to the policy reloads API resource.
+
+The new policy is loaded and validated before it is used, and if it
+fails validation the current policy is kept. The new policy is then
+compared to the current one against recently classified flows, so
+that only classifications whose outcome changes are invalidated,
+and only the suppression flow entries of those flows are revoked
+(or updated in place, where only the QoS queue has changed).
+"""
+
+#*** For timestamps:
+import datetime
+
+#*** mongodb Database Import:
+from pymongo import MongoClient
+
+#*** For logging configuration:
+from baseclass import BaseClass
+
+#*** nmeta imports:
+import policy
+import flows
+
+class PolicyReload(BaseClass):
+    """
+    An object that handles requests to reload policy, and works
+    out which flows are affected by a new policy
+
+    Main methods (assumes class instantiated as an object called
+    'reload'):
+
+        reload.request()
+          Request a reload (also used as signal handler)
+
+        reload.start()
+          Return the ids of pending reload requests (if any), and
+          mark them as running
+
+        reload.load()
+          Return a new Policy object, or None if it fails validation
+
+        reload.diff(old_policy, new_policy, ident)
+          Return flows whose classification would change and flows
+          whose QoS queue would change
+
+        reload.finish(request_ids, status, counts)
+          Record the outcome of the reload
+    """
+    def __init__(self, config, flow):
+        """
+        Initialise an instance of the PolicyReload class, passed
+        a Flow class instance for access to flow metadata
+        """
+        #*** Required for BaseClass:
+        self.config = config
+        #*** Set up Logging with inherited base class method:
+        self.configure_logging(__name__, "policy_reload_logging_level_s",
+                                       "policy_reload_logging_level_c")
+        self.flow = flow
+        #*** Get parameters from config:
+        self.interval = config.get_value("policy_reload_interval")
+        self.classification_time_limit = datetime.timedelta \
+                        (seconds=config.get_value("classification_time_limit"))
+        #*** Set by signal handler:
+        self.requested = False
+
+        #*** Set up database collection for reload requests and outcomes:
+        mongo_addr = config.get_value("mongo_addr")
+        mongo_port = config.get_value("mongo_port")
+        mongo_dbname = config.get_value("mongo_dbname")
+        self.logger.info("Connecting to MongoDB database...")
+        mongo_client = MongoClient(mongo_addr, mongo_port)
+        db_nmeta = mongo_client[mongo_dbname]
+        #*** Delete (drop) previous policy_reloads collection if it exists:
+        self.logger.debug("Deleting policy_reloads MongoDB collection...")
+        db_nmeta.policy_reloads.drop()
+        #*** Not capped as records are updated with the reload outcome:
+        self.policy_reloads = db_nmeta.create_collection('policy_reloads')
+
+    def request(self, *args):
+        """
+        Request a policy reload. Accepts (and ignores) signal handler
+        arguments so that it can be registered for SIGHUP
+        """
+        self.requested = True
+
+    def pending(self):
+        """
+        Return True if a policy reload has been requested by signal
+        or API, otherwise False
+        """
+        if self.requested:
+            return True
+        return bool(self.policy_reloads.find_one({'status': 'requested'}))
+
+    def start(self):
+        """
+        Return a list of ids of pending reload request records, and
+        mark them as running. A signal request is recorded first, so
+        that every reload has a record. Concurrent requests are
+        coalesced into one reload
+        """
+        if self.requested:
+            self.requested = False
+            self.policy_reloads.insert_one({'status': 'requested',
+                                            'source': 'signal'})
+        request_ids = [record['_id'] for record in
+                            self.policy_reloads.find({'status': 'requested'})]
+        self.policy_reloads.update_many({'_id': {'$in': request_ids}},
+                                        {'$set': {'status': 'running'}})
+        return request_ids
+
+    def finish(self, request_ids, status, counts=None):
+        """
+        Record the status (done|failed) and any counts of a reload
+        against its request records
+        """
+        result = {'status': status, 'timestamp': datetime.datetime.now()}
+        if counts:
+            result.update(counts)
+        self.policy_reloads.update_many({'_id': {'$in': request_ids}},
+                                        {'$set': result})
+        self.logger.info("Policy reload status=%s counts=%s", status, counts)
+
+    def load(self, pol_dir_default=policy.POL_DIR_DEFAULT,
+                    pol_dir_user=policy.POL_DIR_USER,
+                    pol_filename=policy.POL_FILENAME):
+        """
+        Load and validate policy from file, without affecting the
+        current policy. Return a Policy object, or None if the policy
+        could not be loaded or is not valid
+        """
+        try:
+            return policy.Policy(self.config, pol_dir_default, pol_dir_user,
+                                                                pol_filename)
+        except SystemExit, exception:
+            #*** Policy validation exits on errors, which were logged:
+            self.logger.error("New policy is not valid, keeping current "
+                                "policy. Reason=%s", exception)
+        except Exception, exception:
+            self.logger.error("Failed to load new policy, keeping current "
+                                "policy. Exception=%s", exception)
+        return None
+
+    def diff(self, old_policy, new_policy, ident):
+        """
+        Passed the current and new Policy objects and an Identities
+        object. Re-evaluate recently classified flows against both
+        policies and return a tuple of:
+         - list of flow_hashes whose classification would change
+         - dictionary of flow_hash: new QoS queue for flows whose
+           classification would not change but whose QoS queue would
+
+        Flows that can't be re-evaluated (first packet has aged out,
+        custom classifiers in policy or NumPy not installed) are
+        treated as changed if the rules have changed, as are flows
+        suppressed by aggregated flow entries, as those also cover
+        flows that were never classified
+        """
+        rules_changed = _rules_changed(old_policy, new_policy)
+        changed = []
+        if rules_changed:
+            changed = self.flow.aggregated_flows()
+        recent = self.recent_classifications()
+        if not recent:
+            return changed, {}
+        if rules_changed:
+            changed += [flow_hash for flow_hash in
+                        self._changed_flows(old_policy, new_policy, ident,
+                                                                    recent)
+                        if flow_hash not in changed]
+        requeue = {}
+        for flow_hash, actions in recent.items():
+            if flow_hash in changed or 'qos_treatment' not in actions:
+                continue
+            qos_treatment = actions['qos_treatment']
+            out_queue = new_policy.qos(qos_treatment)
+            if out_queue != old_policy.qos(qos_treatment):
+                requeue[flow_hash] = out_queue
+        self.logger.info("Policy diff flows_checked=%s changed=%s "
+                        "requeue=%s", len(recent), len(changed), len(requeue))
+        return changed, requeue
+
+    def recent_classifications(self):
+        """
+        Return a dictionary of flow_hash: actions for flows whose
+        most recent classification, within the classification time
+        limit, is classified
+        """
+        db_data = {'classification_time': {'$gte': datetime.datetime.now() -
+                                            self.classification_time_limit}}
+        latest = {}
+        for record in self.flow.classifications.find(db_data) \
+                                            .sort(flows.CLASSIFICATION_SORT):
+            if record['flow_hash'] not in latest:
+                latest[record['flow_hash']] = record
+        return dict((flow_hash, record.get('actions', {}))
+                            for flow_hash, record in latest.items()
+                            if record.get('classified'))
+
+    def first_packets(self, flow_hashes):
+        """
+        Passed a list of flow_hashes and return a dictionary of
+        flow_hash: packet_ins record of the first packet of each
+        flow that still has packets in the packet_ins collection
+        """
+        first = {}
+        for record in self.flow.packet_ins.find(
+                            {'flow_hash': {'$in': flow_hashes}}) \
+                            .sort('timestamp', 1):
+            if record['flow_hash'] not in first:
+                first[record['flow_hash']] = record
+        return first
+
+    def _changed_flows(self, old_policy, new_policy, ident, recent):
+        """
+        Return a list of the flow_hashes of flows in recent whose
+        classification outcome differs between the old and new policy
+        """
+        flow_hashes = list(recent)
+        if old_policy.tc_rules.custom_classifiers or \
+                                    new_policy.tc_rules.custom_classifiers:
+            #*** Custom classifiers use live flow features, can't replay:
+            return flow_hashes
+        try:
+            #*** Import here so NumPy is only needed for policy reload:
+            import policy_batch
+        except ImportError:
+            self.logger.warning("NumPy not installed, invalidating all "
+                                    "recent classifications")
+            return flow_hashes
+        first = self.first_packets(flow_hashes)
+        #*** Flows with no packets left can't be checked, so invalidate:
+        changed = [flow_hash for flow_hash in flow_hashes
+                                                if flow_hash not in first]
+        checked = [flow_hash for flow_hash in flow_hashes
+                                                    if flow_hash in first]
+        if not checked:
+            return changed
+        cols = policy_batch.columns([first[flow_hash]
+                                                for flow_hash in checked])
+        old = policy_batch.BatchPolicy(old_policy).check(cols, ident)
+        new = policy_batch.BatchPolicy(new_policy).check(cols, ident)
+        for row, flow_hash in enumerate(checked):
+            if old['classified'][row] != new['classified'][row] or \
+                    old['classification_tag'][row] != \
+                                        new['classification_tag'][row] or \
+                    old['actions'][row] != new['actions'][row] or \
+                    old['flowstats_classifier'][row] != \
+                                        new['flowstats_classifier'][row]:
+                changed.append(flow_hash)
+        return changed
+
+def _rules_changed(old_policy, new_policy):
+    """
+    Return True if anything that traffic classification depends on
+    differs between two policies (rules and the port sets and
+    locations that rules refer to)
+    """
+    for key in ('tc_rules', 'port_sets', 'locations'):
+        if old_policy.main_policy.get(key) != new_policy.main_policy.get(key):
+            return True
+    return False
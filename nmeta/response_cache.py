@@ -0,0 +1,133 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+The response_cache module is part of the nmeta suite
+
+It provides a cache of External API responses, so that dashboards
+polling the same endpoint share responses (and ETags) rather than
+each running the full computation
+"""
+
+#*** For cache entry expiry:
+import time
+
+#*** For single-flight locks:
+import threading
+
+#*** For ETags:
+import hashlib
+import json
+
+class ResponseCache(object):
+    """
+    This class provides a cache of responses, keyed by a hashable
+    key (i.e. endpoint and query arguments), that expire after a
+    time to live (TTL) in seconds.
+
+    Computation of a response is single-flight: concurrent requests
+    for the same key wait for one computation and share its result.
+
+    Each response has an ETag (hash of the response) for conditional
+    GET requests
+    """
+    def __init__(self):
+        """
+        Initialise the ResponseCache class
+        """
+        #*** Cache entries, key: (expiry time, response, etag):
+        self._entries = {}
+        #*** Per key locks, so only one computation runs per key:
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        #*** Counters:
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, ttl, compute):
+        """
+        Passed a key, TTL in seconds and a function that computes
+        the response for the key. Return a tuple of the response
+        and its ETag, from the cache if it is less than TTL seconds
+        old, otherwise from calling compute (once, no matter how
+        many requests for the key are waiting).
+
+        Responses are shared, so must not be modified by callers
+        """
+        entry = self._fresh(key)
+        if entry:
+            self.hits += 1
+            return entry[1], entry[2]
+        with self._lock(key):
+            #*** May have been computed while waiting for the lock:
+            entry = self._fresh(key)
+            if entry:
+                self.hits += 1
+                return entry[1], entry[2]
+            self.misses += 1
+            response = compute()
+            etag = make_etag(response)
+            self._purge()
+            self._entries[key] = (time.time() + ttl, response, etag)
+        return response, etag
+
+    def etag(self, key):
+        """
+        Passed a key and return the ETag of its cached response
+        if it hasn't expired, otherwise None
+        """
+        entry = self._fresh(key)
+        if entry:
+            return entry[2]
+        return None
+
+    def _fresh(self, key):
+        """
+        Return the cache entry for a key if it hasn't expired,
+        otherwise None
+        """
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.time():
+            return entry
+        return None
+
+    def _lock(self, key):
+        """
+        Return the lock for a key, creating it if required
+        """
+        with self._locks_lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _purge(self):
+        """
+        Remove expired entries, and locks that aren't in use for
+        keys without entries, so that the cache doesn't grow with
+        keys that are no longer requested
+        """
+        now = time.time()
+        for key, entry in self._entries.items():
+            if entry[0] <= now:
+                del self._entries[key]
+        with self._locks_lock:
+            for key, lock in self._locks.items():
+                if key not in self._entries and lock.acquire(False):
+                    del self._locks[key]
+                    lock.release()
+
+def make_etag(response):
+    """
+    Passed a response (JSON serialisable, except that values such as
+    datetimes are converted to strings) and return an ETag for it
+    """
+    return hashlib.md5(json.dumps(response, sort_keys=True,
+                                        default=str)).hexdigest()
@@ -0,0 +1,217 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+The scheduler module is part of the nmeta suite
+
+It provides priority scheduling of packet-in work, so that
+control and identity traffic (LLDP, ARP, DHCP, DNS) and packets
+of already-classified flows are not stuck behind bursts of
+brand new flows.
+
+Packet-in events are cheaply classified into one of three classes
+and queued. Queues are serviced weighted round robin, skipping
+empty queues so that no capacity is wasted.
+
+Each class has its own queue depth and wait time metrics.
+"""
+
+#*** For timestamps:
+import time
+
+#*** For queues and bounded known flows set:
+from collections import deque, OrderedDict
+
+#*** Ryu imports:
+from ryu.lib.packet import packet
+from ryu.lib.packet import ethernet
+from ryu.lib.packet import ipv4
+from ryu.lib.packet import tcp
+from ryu.lib.packet import udp
+
+#*** For logging configuration:
+from baseclass import BaseClass
+
+#*** nmeta imports:
+import nethash
+
+#*** Packet-in classes, in order of priority:
+CONTROL = 'control'
+KNOWN = 'known'
+NEW = 'new'
+CLASSES = [CONTROL, KNOWN, NEW]
+
+#*** Ethernet types that are control/identity traffic (ARP, LLDP):
+CONTROL_ETH_TYPES = (0x0806, 0x88cc)
+
+#*** UDP/TCP ports that are control/identity traffic (DNS, DHCP):
+CONTROL_PORTS = (53, 67, 68)
+
+class Scheduler(BaseClass):
+    """
+    An object that queues packet-in events by class and returns
+    them in weighted fair order
+
+    Main methods (assumes class instantiated as an object called
+    'scheduler'):
+
+        scheduler.enqueue(event)
+          Classify and queue a packet-in event. Returns the class,
+          or 0 if the queue for the class is full
+
+        scheduler.dequeue()
+          Return next (event, class, wait time) tuple, or 0 if
+          all queues are empty
+
+        scheduler.mark_known(flow_hash)
+          Record that a flow has been classified, so that further
+          packets in the flow are scheduled as known
+
+        scheduler.metrics()
+          Return queue depth and wait time metrics per class
+    """
+    def __init__(self, config):
+        """
+        Initialise an instance of the Scheduler class
+        """
+        #*** Required for BaseClass:
+        self.config = config
+        #*** Set up Logging with inherited base class method:
+        self.configure_logging(__name__, "scheduler_logging_level_s",
+                                       "scheduler_logging_level_c")
+        #*** Get parameters from config:
+        self.enabled = config.get_value("scheduler_enabled")
+        self.max_depth = config.get_value("scheduler_max_depth")
+        self.known_max = config.get_value("scheduler_known_max")
+        weights = {CONTROL: config.get_value("scheduler_weight_control"),
+                   KNOWN: config.get_value("scheduler_weight_known"),
+                   NEW: config.get_value("scheduler_weight_new")}
+        #*** Round robin schedule, each class repeated per its weight:
+        self.schedule = []
+        for _class in CLASSES:
+            self.schedule.extend([_class] * max(weights[_class], 1))
+        self.position = 0
+        #*** Queues of (event, enqueue time) per class:
+        self.queues = dict((_class, deque()) for _class in CLASSES)
+        #*** Flow hashes of classified flows, oldest first:
+        self.known_flows = OrderedDict()
+        #*** Metrics per class:
+        self.stats = dict((_class, {'depth_max': 0, 'enqueued': 0,
+                            'dropped': 0, 'dequeued': 0, 'wait_total': 0.0,
+                            'wait_max': 0.0}) for _class in CLASSES)
+
+    def classify(self, data):
+        """
+        Passed raw packet data and return the scheduling class
+        """
+        pkt = packet.Packet(data)
+        eth = pkt.get_protocol(ethernet.ethernet)
+        if eth.ethertype in CONTROL_ETH_TYPES:
+            return CONTROL
+        pkt_tcp = pkt.get_protocol(tcp.tcp)
+        pkt_udp = pkt.get_protocol(udp.udp)
+        transport = pkt_tcp or pkt_udp
+        if transport and (transport.src_port in CONTROL_PORTS or
+                                        transport.dst_port in CONTROL_PORTS):
+            return CONTROL
+        pkt_ip4 = pkt.get_protocol(ipv4.ipv4)
+        if pkt_tcp and pkt_ip4:
+            #*** Same derivation as flow_hash in flows module:
+            flow_hash = nethash.hash_flow((pkt_ip4.src, pkt_ip4.dst,
+                                    pkt_tcp.src_port, pkt_tcp.dst_port, 6))
+            if flow_hash in self.known_flows:
+                return KNOWN
+        return NEW
+
+    def enqueue(self, event, now=0):
+        """
+        Passed a packet-in event. Classify it and add it to the
+        queue for its class. Returns the class, or 0 if the queue
+        is full and the event has not been queued (the caller
+        is then responsible for forwarding it)
+        """
+        if not now:
+            now = time.time()
+        _class = self.classify(event.msg.data)
+        queue = self.queues[_class]
+        stats = self.stats[_class]
+        if len(queue) >= self.max_depth:
+            stats['dropped'] += 1
+            self.logger.debug("Queue full, not queueing class=%s", _class)
+            return 0
+        queue.append((event, now))
+        stats['enqueued'] += 1
+        if len(queue) > stats['depth_max']:
+            stats['depth_max'] = len(queue)
+        return _class
+
+    def dequeue(self, now=0):
+        """
+        Return the next (event, class, wait time) tuple in weighted
+        round robin order, skipping empty queues, or 0 if all
+        queues are empty
+        """
+        if not now:
+            now = time.time()
+        for _ in range(len(self.schedule)):
+            _class = self.schedule[self.position]
+            self.position = (self.position + 1) % len(self.schedule)
+            queue = self.queues[_class]
+            if queue:
+                event, enqueued = queue.popleft()
+                wait = now - enqueued
+                stats = self.stats[_class]
+                stats['dequeued'] += 1
+                stats['wait_total'] += wait
+                if wait > stats['wait_max']:
+                    stats['wait_max'] = wait
+                return (event, _class, wait)
+        return 0
+
+    def pending(self):
+        """
+        Return total number of queued events
+        """
+        return sum(len(queue) for queue in self.queues.values())
+
+    def mark_known(self, flow_hash):
+        """
+        Record that a flow has been classified, so that further packets
+        in the flow are scheduled ahead of new flows. Oldest flows are
+        forgotten when the maximum is reached
+        """
+        if flow_hash in self.known_flows:
+            return
+        self.known_flows[flow_hash] = 1
+        if len(self.known_flows) > self.known_max:
+            self.known_flows.popitem(last=False)
+
+    def metrics(self):
+        """
+        Return a dictionary, keyed by class, of queue depth (current
+        and maximum), counts and wait times (average and maximum)
+        """
+        result = {}
+        for _class in CLASSES:
+            stats = self.stats[_class]
+            result[_class] = {'depth': len(self.queues[_class]),
+                    'depth_max': stats['depth_max'],
+                    'enqueued': stats['enqueued'],
+                    'dropped': stats['dropped'],
+                    'dequeued': stats['dequeued'],
+                    'wait_max': stats['wait_max'],
+                    'wait_avg': 0}
+            if stats['dequeued']:
+                result[_class]['wait_avg'] = \
+                                    stats['wait_total'] / stats['dequeued']
+        return result
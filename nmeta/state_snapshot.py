@@ -0,0 +1,219 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+The state_snapshot module is part of the nmeta suite
+
+It shares a snapshot of controller in-memory state (connected
+switches, live telemetry, admission control, scheduler, flood
+control and flow counts) from nmeta with the External API process, through
+a memory-mapped file, so that the API can serve it without
+database queries and consistent with what the controller holds.
+
+nmeta publishes the snapshot at intervals. The file has a fixed
+size header then the snapshot as JSON:
+
+    magic (4 bytes), format (uint32), started (double),
+    version (uint64), length (uint64), JSON snapshot
+
+The version is odd while the snapshot is being written and even once
+it is complete (a sequence lock), so readers don't take locks: they
+read the version, the snapshot and then the version again, and retry
+if the version changed or was odd.
+
+The file is created afresh (new inode) when nmeta starts publishing,
+and with double the size when a snapshot doesn't fit, so readers
+re-map it when it is replaced. started is the time nmeta started, so
+that versions from different runs aren't confused.
+"""
+
+#*** General imports:
+import os
+import mmap
+import struct
+import time
+
+#*** JSON imports:
+import json
+
+#*** For logging configuration:
+from baseclass import BaseClass
+
+#*** File header, see module docstring:
+HEADER = struct.Struct('<4sIdQQ')
+MAGIC = 'NMSS'
+FORMAT = 1
+#*** Offsets of version and length in header:
+VERSION_OFFSET = 16
+LENGTH_OFFSET = 24
+UINT64 = struct.Struct('<Q')
+
+#*** Times to retry reading a snapshot that is being written:
+READ_RETRIES = 10
+
+class StateSnapshot(BaseClass):
+    """
+    An object that publishes snapshots of controller state to a
+    memory-mapped file
+
+    Main methods (assumes class instantiated as an object called
+    'snapshot'):
+
+        snapshot.publish(state)
+          Write a dictionary of state to the file as a new version
+    """
+    def __init__(self, config):
+        """
+        Initialise an instance of the StateSnapshot class
+        """
+        #*** Required for BaseClass:
+        self.config = config
+        #*** Set up Logging with inherited base class method:
+        self.configure_logging(__name__, "state_snapshot_logging_level_s",
+                                       "state_snapshot_logging_level_c")
+        #*** Get parameters from config:
+        self.enabled = config.get_value("state_snapshot")
+        self.filename = config.get_value("state_snapshot_file")
+        self.interval = config.get_value("state_snapshot_interval")
+        #*** Bytes available for the snapshot, grown as needed:
+        self.max_bytes = config.get_value("state_snapshot_bytes")
+        self.started = time.time()
+        self.version = 0
+        #*** Memory map of the file, created on first publish:
+        self.map = None
+
+    def _create(self, data):
+        """
+        Create the snapshot file holding a snapshot (JSON) as the next
+        version, replacing any previous file (readers of which keep
+        their mapping of it until they re-map)
+        """
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'wb') as snapshot_file:
+            snapshot_file.truncate(HEADER.size + self.max_bytes)
+        with open(tmp_filename, 'r+b') as snapshot_file:
+            self.map = mmap.mmap(snapshot_file.fileno(), 0)
+        self.version += 2
+        self.map[HEADER.size:HEADER.size + len(data)] = data
+        HEADER.pack_into(self.map, 0, MAGIC, FORMAT, self.started,
+                                                    self.version, len(data))
+        os.rename(tmp_filename, self.filename)
+        self.logger.info("Created state snapshot file=%s bytes=%s",
+                                            self.filename, self.max_bytes)
+
+    def publish(self, state):
+        """
+        Passed a dictionary of state (JSON serialisable, except that
+        values such as datetimes are converted to strings) and write
+        it to the snapshot file as a new version, with keys added for
+        the version and the time of publishing (epoch). If the snapshot
+        doesn't fit, the file is replaced with one double the size.
+        Returns the version
+        """
+        state['version'] = self.version + 2
+        state['epoch'] = time.time()
+        data = json.dumps(state, default=str)
+        if not self.map or len(data) > self.max_bytes:
+            while len(data) > self.max_bytes:
+                self.max_bytes *= 2
+            self._create(data)
+            return self.version
+        #*** Odd version while writing, new version written last:
+        UINT64.pack_into(self.map, VERSION_OFFSET, self.version + 1)
+        self.map[HEADER.size:HEADER.size + len(data)] = data
+        UINT64.pack_into(self.map, LENGTH_OFFSET, len(data))
+        self.version += 2
+        UINT64.pack_into(self.map, VERSION_OFFSET, self.version)
+        return self.version
+
+class StateSnapshotReader(object):
+    """
+    An object that reads snapshots of controller state published to
+    a memory-mapped file by nmeta, without locks. The decoded snapshot
+    is kept until a new version is published, so repeated reads don't
+    decode it again
+
+    Main methods (assumes class instantiated as an object called
+    'reader'):
+
+        reader.read()
+          Return the current snapshot, or None if there isn't one
+          or it is older than the stale time
+    """
+    def __init__(self, filename, stale_time, logger):
+        """
+        Passed the snapshot filename, seconds after which a snapshot
+        is stale (i.e. nmeta not running) and a logger
+        """
+        self.filename = filename
+        self.stale_time = stale_time
+        self.logger = logger
+        self.map = None
+        self.inode = None
+        #*** Decoded snapshot and its (started, version):
+        self.state = None
+        self.key = None
+
+    def read(self):
+        """
+        Return the current snapshot as a dictionary, or None if there
+        isn't one or it is stale
+        """
+        if not self._map():
+            return None
+        for _ in range(READ_RETRIES):
+            magic, _format, started, version, length = \
+                                            HEADER.unpack_from(self.map, 0)
+            if magic != MAGIC or _format != FORMAT or not version:
+                return None
+            if version % 2:
+                #*** Being written:
+                time.sleep(0)
+                continue
+            if (started, version) != self.key:
+                data = self.map[HEADER.size:HEADER.size + length]
+                if UINT64.unpack_from(self.map, VERSION_OFFSET)[0] != \
+                                                                    version:
+                    #*** Written while reading:
+                    continue
+                self.state = json.loads(data)
+                self.key = (started, version)
+            if time.time() - self.state['epoch'] > self.stale_time:
+                return None
+            return self.state
+        self.logger.debug("State snapshot being written, retries=%s",
+                                                                READ_RETRIES)
+        return None
+
+    def _map(self):
+        """
+        Memory-map the snapshot file if it isn't mapped or has been
+        replaced. Returns True if it is mapped
+        """
+        try:
+            inode = os.stat(self.filename).st_ino
+        except OSError:
+            return False
+        if inode != self.inode:
+            try:
+                with open(self.filename, 'rb') as snapshot_file:
+                    self.map = mmap.mmap(snapshot_file.fileno(), 0,
+                                                    access=mmap.ACCESS_READ)
+            except (IOError, ValueError, mmap.error) as exception:
+                self.logger.warning("Can't map state snapshot file=%s "
+                                "exception=%s", self.filename, exception)
+                return False
+            self.inode = inode
+            self.state = None
+            self.key = None
+        return True
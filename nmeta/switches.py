@@ -30,6 +30,7 @@ import datetime
 from ryu.lib import addrconv
 from ryu.ofproto import ofproto_v1_3
 from ryu.lib.packet import packet
+from ryu.lib.packet import ethernet
 from ryu.lib.packet import ipv4, ipv6
 from ryu.lib.packet import tcp
 from ryu.lib.packet import udp
@@ -44,6 +45,21 @@ from pymongo import MongoClient
 #*** Constant to use for a port not found value:
 PORT_NOT_FOUND = 999999999
 
+#*** Meter ID used to rate limit table-miss packet-ins:
+TABLE_MISS_METER_ID = 1
+
+#*** Identity harvest packets to send to the controller ahead of aggregated
+#***  suppression entries, as (eth_type, ip_proto, match field, port):
+HARVEST_EXCEPTIONS = [(eth_type, ip_proto, field, 53)
+                            for eth_type in (0x0800, 0x86DD)
+                            for ip_proto, fields in ((6, ('tcp_src', 'tcp_dst')),
+                                                (17, ('udp_src', 'udp_dst')))
+                            for field in fields] + \
+                     [(0x0800, 17, 'udp_dst', 67), (0x0800, 17, 'udp_dst', 68)]
+
+#*** Maximum aggregated matches to remember cookies of:
+AGGREGATE_COOKIES_MAX = 10000
+
 #*** Supports OpenFlow version 1.3:
 OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
 
@@ -107,6 +123,9 @@ class Switches(BaseClass):
         #*** Dictionary of the instances of the Switch class,
         #***  key is the switch DPID which is assumed to be unique:
         self.switches = {}
+        #*** Flow mod cookie counters [forward, reverse] to resume from
+        #***  when a switch connects, keyed by DPID (set by warm start):
+        self.cookies = {}
 
     def add(self, datapath):
         """
@@ -116,6 +135,11 @@ class Switches(BaseClass):
         self.logger.info("Adding switch dpid=%s", dpid)
         switch = Switch(self.config, datapath, self.offset)
         switch.dpid = dpid
+        if dpid in self.cookies:
+            #*** Don't reuse cookies of flow entries from before restart:
+            switch.flowtables.flow_mod_cookie_forward, \
+                switch.flowtables.flow_mod_cookie_reverse = \
+                                                    self.cookies.pop(dpid)
         (ip_address, port) = datapath.address
         #*** Record class instance into dictionary to make it accessible:
         self.switches[datapath.id] = switch
@@ -246,6 +270,22 @@ class Switch(BaseClass):
                             self.datapath.id)
         self.datapath.send_msg(req)
 
+    def request_flow_stats(self, cookie=0, cookie_mask=0):
+        """
+        Send a single OpenFlow flow stats request to the switch
+        covering all flow entries in all tables whose cookie matches
+        cookie under cookie_mask (so one request per switch per poll,
+        not one per flow)
+        """
+        ofproto = self.datapath.ofproto
+        parser = self.datapath.ofproto_parser
+        req = parser.OFPFlowStatsRequest(self.datapath, 0, ofproto.OFPTT_ALL,
+                                        ofproto.OFPP_ANY, ofproto.OFPG_ANY,
+                                        cookie, cookie_mask, parser.OFPMatch())
+        self.logger.debug("Sending flow stats request to dpid=%s",
+                            self.datapath.id)
+        self.datapath.send_msg(req)
+
     def set_switch_config(self, config_flags, miss_send_len):
         """
         Set config on a switch including config flags that
@@ -322,6 +362,27 @@ class Switch(BaseClass):
                                                                 miss_send_len)]
         inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS,
                                                  actions)]
+        meter_rate = self.config.get_value("admission_meter_rate")
+        if meter_rate:
+            #*** Rate limit packet-ins with a meter on the table-miss entry:
+            self.logger.info("Setting table-miss meter on switch dpid=%s "
+                                        "rate=%s pps", dpid, meter_rate)
+            bands = [parser.OFPMeterBandDrop(rate=meter_rate,
+                                                burst_size=meter_rate)]
+            #*** Delete any meter left from a previous connection, as
+            #***  adding a meter that exists fails with METER_EXISTS:
+            meter = parser.OFPMeterMod(datapath=self.datapath,
+                                command=ofproto.OFPMC_DELETE,
+                                meter_id=TABLE_MISS_METER_ID)
+            self.datapath.send_msg(meter)
+            self.datapath.send_msg(parser.OFPBarrierRequest(self.datapath))
+            meter = parser.OFPMeterMod(datapath=self.datapath,
+                                command=ofproto.OFPMC_ADD,
+                                flags=ofproto.OFPMF_PKTPS | ofproto.OFPMF_BURST,
+                                meter_id=TABLE_MISS_METER_ID, bands=bands)
+            self.datapath.send_msg(meter)
+            inst.insert(0, parser.OFPInstructionMeter(TABLE_MISS_METER_ID,
+                                                      ofproto.OFPIT_METER))
         mod = parser.OFPFlowMod(datapath=self.datapath, priority=0,
                                                 match=match, instructions=inst)
         self.datapath.send_msg(mod)
@@ -348,11 +409,18 @@ class FlowTables(BaseClass):
         self.drop_idle_timeout = config.get_value('drop_idle_timeout')
         self.drop_hard_timeout = config.get_value('drop_hard_timeout')
         self.drop_priority = config.get_value('drop_priority')
+        self.aggregate_priority = \
+                            config.get_value('suppress_aggregate_priority')
+        #*** Cookies of installed aggregated matches, so that reinstalling
+        #***  one replaces the flow entry without changing its cookie:
+        self.aggregate_cookies = {}
+        self.harvest_exceptions_installed = False
         #*** Unique value counters for Flow Mod cookies:
         self.flow_mod_cookie_forward = 1
         self.flow_mod_cookie_reverse = offset
 
-    def suppress_flow(self, msg, in_port, out_port, out_queue):
+    def suppress_flow(self, msg, in_port, out_port, out_queue,
+                                                            aggregate=None):
         """
         Add flow entries to a switch to suppress further packet-in
         events while the flow is active.
@@ -360,6 +428,12 @@ class FlowTables(BaseClass):
         Prefer to do fine-grained match where possible.
         Install reverse matches as well for TCP flows.
 
+        If passed aggregate fields (see Policy.aggregate_fields) then
+        match only on those fields (plus destination MAC, which
+        forwarding depends on), at a lower priority than fine-grained
+        entries, so that one flow entry covers all flows that policy
+        treats the same.
+
         Do not install suppression for these types of flow:
         - DNS (want to harvest identity)
         - ARP (want to harvest identity)
@@ -387,6 +461,9 @@ class FlowTables(BaseClass):
                 return result
             #*** Install two flow entries for TCP so that return traffic
             #*** is also suppressed:
+            if aggregate and (pkt_ip4 or pkt_ip6):
+                return self._suppress_aggregate(pkt, in_port, out_port,
+                                                        out_queue, aggregate)
             if pkt_ip4:
                 forward_match = self.match_ipv4_tcp(pkt_ip4.src, pkt_ip4.dst,
                                             pkt_tcp.src_port, pkt_tcp.dst_port)
@@ -445,6 +522,9 @@ class FlowTables(BaseClass):
                 if (pkt_udp.src_port == 53 or pkt_udp.dst_port == 53 or
                              pkt_udp.src_port == 67 or pkt_udp.dst_port == 67):
                     return result
+            if aggregate and (pkt_ip4 or pkt_ip6):
+                return self._suppress_aggregate(pkt, in_port, out_port,
+                                                        out_queue, aggregate)
             if pkt_ip4:
                 #*** Match IPv4 packet
                 match = self.match_ipv4(pkt_ip4.src, pkt_ip4.dst,
@@ -477,7 +557,101 @@ class FlowTables(BaseClass):
             self.flow_mod_cookie_forward += 1
             return result
 
-    def drop_flow(self, msg):
+    def _suppress_aggregate(self, pkt, in_port, out_port, out_queue,
+                                                                    aggregate):
+        """
+        Add aggregated flow entries to a switch to suppress further
+        packet-in events for all flows that match the aggregate fields
+        of the packet. The reverse direction is aggregated too if its
+        fields are known, otherwise it gets a fine-grained match
+        """
+        result = {'match_type': 'aggregate', 'forward_cookie': 0,
+                 'forward_match': '', 'reverse_cookie': 0, 'reverse_match': '',
+                 'client_ip': ''}
+        self.install_harvest_exceptions()
+        values = _packet_values(pkt, in_port)
+        forward_match = self.match_aggregate(values, aggregate['forward'])
+        result['forward_cookie'] = self._add_aggregate(forward_match,
+                        self.actions(out_port, out_queue),
+                        self.suppress_idle_timeout, self.suppress_hard_timeout)
+        result['forward_match'] = _stored_match(forward_match, values)
+        if values['proto'] == 6:
+            #*** Reverse values, ingress port is the forward egress port:
+            reverse_values = _packet_values(pkt, out_port, reverse=True)
+            if aggregate['reverse'] is not None:
+                reverse_match = self.match_aggregate(reverse_values,
+                                                        aggregate['reverse'])
+                reverse_cookie = self._add_aggregate(reverse_match,
+                        self.actions(in_port, out_queue),
+                        self.suppress_idle_timeout, self.suppress_hard_timeout,
+                        reverse=True)
+            else:
+                reverse_match = self.match_aggregate(reverse_values,
+                            ('ip_src', 'ip_dst', 'proto', 'tp_src', 'tp_dst'))
+                reverse_cookie = self.flow_mod_cookie_reverse
+                self.flow_mod_cookie_reverse += 1
+                self.add_flow(reverse_match, self.actions(in_port, out_queue),
+                                 priority=self.suppress_priority,
+                                 idle_timeout=self.suppress_idle_timeout,
+                                 hard_timeout=self.suppress_hard_timeout,
+                                 cookie=reverse_cookie)
+            result['reverse_cookie'] = reverse_cookie
+            result['reverse_match'] = _stored_match(reverse_match,
+                                                            reverse_values)
+        result['client_ip'] = str(values['ip_src'])
+        return result
+
+    def _add_aggregate(self, match, actions, idle_timeout, hard_timeout,
+                                                                reverse=False):
+        """
+        Install an aggregated flow entry and return its cookie (a
+        reverse cookie if reverse is set). The cookie of an aggregated
+        match that has been installed before is reused, so that the
+        replaced entry keeps the same cookie
+        """
+        key = tuple(sorted(match.items()))
+        if key in self.aggregate_cookies:
+            cookie = self.aggregate_cookies[key]
+        else:
+            if len(self.aggregate_cookies) >= AGGREGATE_COOKIES_MAX:
+                self.aggregate_cookies = {}
+            if reverse:
+                cookie = self.flow_mod_cookie_reverse
+                self.flow_mod_cookie_reverse += 1
+            else:
+                cookie = self.flow_mod_cookie_forward
+                #*** Increment flow mod cookie ready for next use:
+                if self.flow_mod_cookie_forward < self.offset:
+                    self.flow_mod_cookie_forward += 1
+                else:
+                    self.logger.info("flow_mod_cookie_forward rolled")
+                    self.flow_mod_cookie_forward = 1
+            self.aggregate_cookies[key] = cookie
+        self.add_flow(match, actions, priority=self.aggregate_priority,
+                                 idle_timeout=idle_timeout,
+                                 hard_timeout=hard_timeout,
+                                 cookie=cookie)
+        return cookie
+
+    def install_harvest_exceptions(self):
+        """
+        Add flow entries (once) that send DNS and DHCP packets to the
+        controller at a higher priority than aggregated suppression
+        entries, so that identities are still harvested from packets
+        that an aggregated entry would otherwise match
+        """
+        if self.harvest_exceptions_installed:
+            return
+        ofproto = self.datapath.ofproto
+        actions = [self.parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
+                                                    ofproto.OFPCML_NO_BUFFER)]
+        for eth_type, ip_proto, field, port in HARVEST_EXCEPTIONS:
+            match = {'eth_type': eth_type, 'ip_proto': ip_proto, field: port}
+            self.add_flow(match, actions, priority=self.aggregate_priority + 1,
+                                 idle_timeout=0, hard_timeout=0, cookie=0)
+        self.harvest_exceptions_installed = True
+
+    def drop_flow(self, msg, aggregate=None):
         """
         Add flow entry to a switch to suppress further packet-in
         events for a particular flow.
@@ -485,6 +659,9 @@ class FlowTables(BaseClass):
         Prefer to do fine-grained match where possible.
 
         TCP or UDP source ports are not matched as ephemeral
+
+        If passed aggregate fields (see Policy.aggregate_fields) then
+        install an aggregated drop entry instead (see suppress_flow)
         """
         #*** Extract parameters:
         pkt = packet.Packet(msg.data)
@@ -502,6 +679,16 @@ class FlowTables(BaseClass):
         self.logger.debug("event=drop_flow")
         #*** Drop action is the implicit in setting no actions:
         drop_action = 0
+        if aggregate and (pkt_ip4 or pkt_ip6):
+            self.install_harvest_exceptions()
+            values = _packet_values(pkt, msg.match['in_port'])
+            drop_match = self.match_aggregate(values, aggregate['forward'])
+            result['match_type'] = 'aggregate'
+            result['forward_cookie'] = self._add_aggregate(drop_match,
+                                drop_action, idle_timeout, hard_timeout)
+            result['forward_match'] = _stored_match(drop_match, values)
+            result['client_ip'] = str(values['ip_src'])
+            return result
         #*** Install flow entry based on type of flow:
         if pkt_tcp:
             if pkt_ip4:
@@ -557,6 +744,21 @@ class FlowTables(BaseClass):
         self.flow_mod_cookie_forward += 1
         return result
 
+    def drop_broadcasts(self, eth_src, hard_timeout):
+        """
+        Add a temporary flow entry to a switch to drop broadcast
+        and multicast frames from a source MAC address, so that they
+        don't raise packet-in events
+        """
+        self.logger.debug("event=drop_broadcasts eth_src=%s", eth_src)
+        #*** Match on the multicast bit, which is also set for broadcast:
+        match = dict(eth_src=eth_src, eth_dst=('01:00:00:00:00:00',
+                                                        '01:00:00:00:00:00'))
+        #*** Drop action is the implicit in setting no actions:
+        self.add_flow(match, 0, priority=self.drop_priority, idle_timeout=0,
+                        hard_timeout=hard_timeout, cookie=0)
+        return 1
+
     def add_flow(self, match_d, actions, priority, idle_timeout, hard_timeout,
                     cookie):
         """
@@ -583,6 +785,46 @@ class FlowTables(BaseClass):
                                     self.dpid, match)
         self.datapath.send_msg(mod)
 
+    def update_flow_queue(self, cookie, out_port, out_queue):
+        """
+        Modify the actions of an existing flow entry, identified by
+        its (unique) cookie, to output on a different QoS queue.
+        Counters and timeouts of the flow entry are preserved
+        """
+        ofproto = self.datapath.ofproto
+        parser = self.datapath.ofproto_parser
+        inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS,
+                                        self.actions(out_port, out_queue))]
+        mod = parser.OFPFlowMod(datapath=self.datapath,
+                                cookie=cookie,
+                                cookie_mask=0xffffffffffffffff,
+                                table_id=0,
+                                command=ofproto.OFPFC_MODIFY,
+                                match=parser.OFPMatch(),
+                                instructions=inst)
+        self.logger.debug("Modifying Flow Entry on dpid=%s cookie=%s "
+                            "out_queue=%s", self.dpid, cookie, out_queue)
+        self.datapath.send_msg(mod)
+
+    def delete_flow(self, cookie):
+        """
+        Delete an existing flow entry, identified by its (unique)
+        cookie, from the switch
+        """
+        ofproto = self.datapath.ofproto
+        parser = self.datapath.ofproto_parser
+        mod = parser.OFPFlowMod(datapath=self.datapath,
+                                cookie=cookie,
+                                cookie_mask=0xffffffffffffffff,
+                                table_id=0,
+                                command=ofproto.OFPFC_DELETE,
+                                out_port=ofproto.OFPP_ANY,
+                                out_group=ofproto.OFPG_ANY,
+                                match=parser.OFPMatch())
+        self.logger.debug("Deleting Flow Entry on dpid=%s cookie=%s",
+                                                        self.dpid, cookie)
+        self.datapath.send_msg(mod)
+
     def actions(self, out_port, out_queue, no_queue=0):
         """
         Create actions for a switch flow entry. Specify the out port
@@ -676,6 +918,41 @@ class FlowTables(BaseClass):
                     ip_proto=17,
                     udp_dst=udp_dst)
 
+    def match_aggregate(self, values, fields):
+        """
+        Match an aggregate of IPv4 or IPv6 flows on a switch. Passed
+        a dictionary of packet values (see _packet_values) and the
+        fields to match on, and return an OpenFlow match object.
+        Destination MAC is always matched as forwarding depends on it,
+        and EtherType and IP protocol are always matched as they
+        are prerequisites of the other fields
+        """
+        match = dict(eth_type=values['eth_type'],
+                    eth_dst=values['eth_dst'],
+                    ip_proto=values['proto'])
+        if 'in_port' in fields:
+            match['in_port'] = values['in_port']
+        if 'eth_src' in fields:
+            match['eth_src'] = values['eth_src']
+        if values['eth_type'] == 0x0800:
+            if 'ip_src' in fields:
+                match['ipv4_src'] = _ipv4_t2i(str(values['ip_src']))
+            if 'ip_dst' in fields:
+                match['ipv4_dst'] = _ipv4_t2i(str(values['ip_dst']))
+        else:
+            if 'ip_src' in fields:
+                match['ipv6_src'] = values['ip_src']
+            if 'ip_dst' in fields:
+                match['ipv6_dst'] = values['ip_dst']
+        #*** Ports only exist for TCP and UDP:
+        if values['proto'] in (6, 17):
+            l4_name = 'tcp' if values['proto'] == 6 else 'udp'
+            if 'tp_src' in fields:
+                match[l4_name + '_src'] = values['tp_src']
+            if 'tp_dst' in fields:
+                match[l4_name + '_dst'] = values['tp_dst']
+        return match
+
     def match_ipv4(self, ipv4_src, ipv4_dst, ip_proto):
         """
         Match an IPv4 flow on a switch.
@@ -699,6 +976,48 @@ class FlowTables(BaseClass):
 
 #=============== Private functions:
 
+def _packet_values(pkt, in_port, reverse=False):
+    """
+    Passed a Ryu packet (IPv4 or IPv6) and the ingress port and
+    return a dictionary of the values that aggregated matches can
+    use, with source and destination swapped if reverse is set
+    """
+    eth = pkt.get_protocol(ethernet.ethernet)
+    pkt_ip4 = pkt.get_protocol(ipv4.ipv4)
+    pkt_ip6 = pkt.get_protocol(ipv6.ipv6)
+    pkt_tcp = pkt.get_protocol(tcp.tcp)
+    pkt_udp = pkt.get_protocol(udp.udp)
+    if pkt_ip4:
+        values = {'eth_type': 0x0800, 'ip_src': pkt_ip4.src,
+                    'ip_dst': pkt_ip4.dst, 'proto': pkt_ip4.proto}
+    else:
+        values = {'eth_type': 0x86DD, 'ip_src': pkt_ip6.src,
+                    'ip_dst': pkt_ip6.dst, 'proto': pkt_ip6.nxt}
+    values['in_port'] = in_port
+    values['eth_src'] = eth.src
+    values['eth_dst'] = eth.dst
+    l4 = pkt_tcp or pkt_udp
+    values['tp_src'] = l4.src_port if l4 else 0
+    values['tp_dst'] = l4.dst_port if l4 else 0
+    if reverse:
+        for src, dst in (('eth_src', 'eth_dst'), ('ip_src', 'ip_dst'),
+                                                    ('tp_src', 'tp_dst')):
+            values[src], values[dst] = values[dst], values[src]
+    return values
+
+def _stored_match(match, values):
+    """
+    Passed an OpenFlow match dictionary and the packet values it was
+    made from, and return a copy for storing, with any IPv4 addresses
+    converted back to dotted decimal
+    """
+    stored = dict(match)
+    if 'ipv4_src' in stored:
+        stored['ipv4_src'] = values['ip_src']
+    if 'ipv4_dst' in stored:
+        stored['ipv4_dst'] = values['ip_dst']
+    return stored
+
 def _ipv4_t2i(ip_text):
     """
     Turns an IPv4 address in text format into an integer.
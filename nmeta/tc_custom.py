@@ -42,6 +42,10 @@ class CustomInspect(BaseClass):
                                        "tc_custom_logging_level_c")
         #*** Dictionary to hold dynamically loaded custom classifiers:
         self.custom_classifiers = {}
+        #*** Set when custom classifiers are shed due to overload:
+        self.shed = False
+        #*** Set if a custom classifier was skipped as shed:
+        self.skipped = False
 
     def check_custom(self, classifier_result, flow, ident):
         """
@@ -50,10 +54,41 @@ class CustomInspect(BaseClass):
         can update the classifier_result match as appropriate.
         """
         classifier = classifier_result.policy_value
+        if self.shed:
+            #*** Overloaded, so don't run custom classifiers:
+            self.logger.debug("Shedding classifier=%s", classifier)
+            self.skipped = True
+            classifier_result.match = False
+            classifier_result.continue_to_inspect = True
+            return 0
         if classifier in self.custom_classifiers:
             custom = self.custom_classifiers[classifier]
             #*** Run the custom classifier:
             custom.classifier(classifier_result, flow, ident)
+            if getattr(custom, 'flowstats', 0) and classifier_result.match \
+                               and not classifier_result.continue_to_inspect:
+                #*** Classifier finalises from flow stats counters later:
+                classifier_result.flowstats_classifier = classifier
+            return 1
+        else:
+            self.logger.error("Failed to find classifier=%s", classifier)
+            return 0
+
+    def check_custom_flowstats(self, classifier_result, rates):
+        """
+        Passed TCClassifierResult and a dictionary of live flow rates
+        (see FlowStats.flow_rates). Call the named custom classifier
+        flowstats_classifier method so that it can update the
+        classifier_result from the flow stats counters.
+
+        Returns 1 if the classifier has reached a decision, otherwise 0
+        """
+        classifier = classifier_result.policy_value
+        if classifier in self.custom_classifiers:
+            custom = self.custom_classifiers[classifier]
+            custom.flowstats_classifier(classifier_result, rates)
+            if classifier_result.continue_to_inspect:
+                return 0
             return 1
         else:
             self.logger.error("Failed to find classifier=%s", classifier)
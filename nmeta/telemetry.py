@@ -0,0 +1,405 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+The telemetry module is part of the nmeta suite
+
+It provides live controller telemetry (packet-in rate, packet-in
+processing times, connected switches and admission control mode)
+for the WebUI, without the charts each polling the External API
+and recomputing from the database.
+
+nmeta aggregates packet-in telemetry in memory as packet-ins are
+processed, and once per interval publishes one pre-aggregated record
+to the telemetry capped database collection.
+
+Each interval's accumulators (count, sum, min and max of processing
+times, and a quantile sketch) are also written to the pi_time_stats
+capped database collection, so that the External API gets processing
+time stats (including percentiles) for a period by merging a handful
+of records, rather than reading a record per packet-in.
+
+Quantile sketches are histograms with logarithmically sized bins
+(relative accuracy SKETCH_ACCURACY), keyed by bin index as a string,
+so they merge by adding counts.
+
+The External API tails the telemetry collection once per process and
+fans each record out to all connected stream (Server-Sent Events)
+clients, so that the work done depends on the publish interval and
+not on the number of clients.
+"""
+
+#*** For timestamps:
+import datetime
+import time
+
+#*** For quantile sketch bins:
+import math
+
+#*** For per interval buckets:
+from collections import deque
+
+#*** For fanning records out to stream clients:
+import threading
+import Queue
+
+#*** mongodb Database Import:
+import pymongo
+from pymongo import MongoClient
+from pymongo.cursor import CursorType
+from pymongo.errors import PyMongoError
+
+#*** For logging configuration:
+from baseclass import BaseClass
+
+#*** Seconds that packet-in processing times are aggregated over, as per
+#*** the api_external module PACKET_TIME_PERIOD:
+TELEMETRY_PERIOD = 10
+
+#*** Max records queued for a stream client before the oldest are dropped
+#*** (i.e. a slow client only gets the latest records):
+STREAM_QUEUE_DEPTH = 10
+
+#*** Seconds to wait before re-querying the telemetry collection when
+#*** tailing fails or there is nothing to tail:
+TAIL_RETRY_INTERVAL = 1
+
+#*** Relative accuracy of quantiles from sketches, and the bin growth
+#*** factor that gives it:
+SKETCH_ACCURACY = 0.01
+SKETCH_GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+SKETCH_LOG_GAMMA = math.log(SKETCH_GAMMA)
+#*** Values (seconds) at or below this are counted in the zero bin:
+SKETCH_MIN_VALUE = 1e-9
+SKETCH_ZERO = 'z'
+
+#*** Percentiles of processing times returned in stats (i.e. keys
+#*** pi_time_p50, ryu_time_p99):
+PERCENTILES = (50, 95, 99)
+
+class Telemetry(BaseClass):
+    """
+    An object that aggregates packet-in telemetry and publishes it
+    at intervals
+
+    Main methods (assumes class instantiated as an object called
+    'telemetry'):
+
+        telemetry.record(ryu_delta, pi_delta, duplicate)
+          Add the queueing time in Ryu and processing time in nmeta
+          of a packet-in to the current interval
+
+        telemetry.publish(connected_switches, admission_mode)
+          Close the current interval, writing it to the pi_time_stats
+          database collection, and write a record aggregated over the
+          last TELEMETRY_PERIOD seconds to the telemetry database
+          collection
+    """
+    def __init__(self, config):
+        """
+        Initialise an instance of the Telemetry class
+        """
+        #*** Required for BaseClass:
+        self.config = config
+        #*** Set up Logging with inherited base class method:
+        self.configure_logging(__name__, "telemetry_logging_level_s",
+                                       "telemetry_logging_level_c")
+        #*** Get parameters from config:
+        self.interval = config.get_value("telemetry_interval")
+        telemetry_max_bytes = config.get_value("telemetry_max_bytes")
+        pi_time_stats_max_bytes = config.get_value("pi_time_stats_max_bytes")
+        #*** Closed intervals covering the last TELEMETRY_PERIOD seconds:
+        self.buckets = deque(maxlen=max(1,
+                                int(round(TELEMETRY_PERIOD / self.interval))))
+        self.bucket = new_bucket()
+        #*** Sequence number of published records, and latest record:
+        self.seq = 0
+        self.latest = {}
+
+        #*** Set up database collection for telemetry:
+        mongo_addr = config.get_value("mongo_addr")
+        mongo_port = config.get_value("mongo_port")
+        mongo_dbname = config.get_value("mongo_dbname")
+        #*** Start mongodb:
+        self.logger.info("Connecting to MongoDB database...")
+        mongo_client = MongoClient(mongo_addr, mongo_port)
+        #*** Connect to MongoDB nmeta database:
+        db_nmeta = mongo_client[mongo_dbname]
+        #*** Delete (drop) previous telemetry collection if it exists:
+        self.logger.debug("Deleting previous telemetry MongoDB collection...")
+        db_nmeta.telemetry.drop()
+        #*** Create the telemetry collection (capped, so can be tailed):
+        self.telemetry = db_nmeta.create_collection('telemetry', capped=True,
+                                            size=telemetry_max_bytes)
+        #*** Delete (drop) previous pi_time_stats collection if it exists:
+        self.logger.debug("Deleting previous pi_time_stats MongoDB "
+                                                            "collection...")
+        db_nmeta.pi_time_stats.drop()
+        #*** Create the pi_time_stats collection (one record per interval):
+        self.pi_time_stats = db_nmeta.create_collection('pi_time_stats',
+                                capped=True, size=pi_time_stats_max_bytes)
+        self.pi_time_stats.create_index([('timestamp', pymongo.DESCENDING)],
+                                                                unique=False)
+
+    def record(self, ryu_delta, pi_delta, duplicate):
+        """
+        Passed the time in seconds a packet-in was queued in Ryu, the
+        time nmeta took to process it, and whether it was a duplicate
+        of a packet-in from another switch. Add it to the current
+        interval
+        """
+        bucket = self.bucket
+        if not bucket['records']:
+            bucket['ryu_min'] = bucket['ryu_max'] = ryu_delta
+            bucket['pi_min'] = bucket['pi_max'] = pi_delta
+        else:
+            bucket['ryu_min'] = min(bucket['ryu_min'], ryu_delta)
+            bucket['ryu_max'] = max(bucket['ryu_max'], ryu_delta)
+            bucket['pi_min'] = min(bucket['pi_min'], pi_delta)
+            bucket['pi_max'] = max(bucket['pi_max'], pi_delta)
+        bucket['records'] += 1
+        bucket['ryu_sum'] += ryu_delta
+        bucket['pi_sum'] += pi_delta
+        sketch_add(bucket['ryu_sketch'], ryu_delta)
+        sketch_add(bucket['pi_sketch'], pi_delta)
+        if duplicate:
+            bucket['duplicates'] += 1
+
+    def publish(self, connected_switches, admission_mode):
+        """
+        Passed the number of connected switches and the admission
+        control mode. Close the current interval, writing it to the
+        pi_time_stats database collection if it has packet-ins, then
+        write a record aggregated over the last TELEMETRY_PERIOD seconds
+        to the telemetry database collection. Returns the record.
+        Database errors are logged, and the record is still kept in
+        memory as the latest
+
+        Record keys are as per the External API controller_summary,
+        pi_rate, pi_time and connected_switches responses
+        """
+        now = datetime.datetime.now()
+        if self.bucket['records']:
+            stats = dict(self.bucket)
+            stats['timestamp'] = now
+            try:
+                self.pi_time_stats.insert_one(stats)
+            except PyMongoError as exception:
+                self.logger.warning("Failed to write pi_time_stats "
+                                    "exception=%s", exception)
+        self.buckets.append(self.bucket)
+        self.bucket = new_bucket()
+        self.seq += 1
+        result = aggregate_buckets(self.buckets)
+        result['seq'] = self.seq
+        result['timestamp'] = now.strftime("%H:%M:%S")
+        result['connected_switches'] = connected_switches
+        result['admission_mode'] = admission_mode
+        try:
+            self.telemetry.insert_one(result)
+        except PyMongoError as exception:
+            self.logger.warning("Failed to write telemetry seq=%s "
+                                "exception=%s", self.seq, exception)
+        #*** Don't return the database _id:
+        result.pop('_id', None)
+        self.latest = result
+        return result
+
+class TelemetryFeed(object):
+    """
+    An object that tails the telemetry database collection and fans
+    each published record out to subscribers (i.e. External API
+    Server-Sent Events clients), so that the collection is read once
+    per process no matter how many clients there are
+
+    Main methods (assumes class instantiated as an object called
+    'feed'):
+
+        feed.subscribe()
+          Return a queue that gets published records, starting with
+          the latest record (if any)
+
+        feed.unsubscribe(queue)
+          Stop putting records on the queue
+    """
+    def __init__(self, telemetry_col, logger):
+        """
+        Passed the telemetry database collection and a logger
+        """
+        self.telemetry = telemetry_col
+        self.logger = logger
+        self.subscribers = set()
+        self.latest = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self):
+        """
+        Return a queue of published records for a new subscriber,
+        starting the tailing thread if it isn't running
+        """
+        queue = Queue.Queue(STREAM_QUEUE_DEPTH)
+        with self._lock:
+            if self.latest:
+                queue.put(self.latest)
+            self.subscribers.add(queue)
+            if not self._thread:
+                self._thread = threading.Thread(target=self._tail,
+                                                name='telemetry_feed')
+                self._thread.daemon = True
+                self._thread.start()
+        return queue
+
+    def unsubscribe(self, queue):
+        """
+        Passed a queue from subscribe and stop putting records on it
+        """
+        with self._lock:
+            self.subscribers.discard(queue)
+
+    def dispatch(self, record):
+        """
+        Passed a published record and put it on all subscriber queues.
+        Queues that are full (slow subscribers) have their oldest
+        record dropped
+        """
+        with self._lock:
+            self.latest = record
+            for queue in self.subscribers:
+                while True:
+                    try:
+                        queue.put_nowait(record)
+                        break
+                    except Queue.Full:
+                        try:
+                            queue.get_nowait()
+                        except Queue.Empty:
+                            pass
+
+    def _tail(self):
+        """
+        Run forever as a thread, dispatching records as they are
+        published to the telemetry capped collection. Starts from
+        the latest record
+        """
+        last_id = None
+        while True:
+            try:
+                if not last_id:
+                    latest = list(self.telemetry.find().sort('$natural',
+                                                pymongo.DESCENDING).limit(1))
+                    if not latest:
+                        time.sleep(TAIL_RETRY_INTERVAL)
+                        continue
+                    last_id = latest[0].pop('_id')
+                    self.dispatch(latest[0])
+                cursor = self.telemetry.find({'_id': {'$gt': last_id}},
+                                    cursor_type=CursorType.TAILABLE_AWAIT)
+                while cursor.alive:
+                    for record in cursor:
+                        last_id = record.pop('_id')
+                        self.dispatch(record)
+            except PyMongoError as exception:
+                #*** i.e. collection dropped and recreated by nmeta restart:
+                self.logger.warning("Telemetry tail failed, exception=%s",
+                                                                    exception)
+                last_id = None
+            time.sleep(TAIL_RETRY_INTERVAL)
+
+def new_bucket():
+    """
+    Return accumulators for an interval of packet-in telemetry
+    """
+    return {'records': 0, 'duplicates': 0,
+            'ryu_sum': 0, 'ryu_min': 0, 'ryu_max': 0, 'ryu_sketch': {},
+            'pi_sum': 0, 'pi_min': 0, 'pi_max': 0, 'pi_sketch': {}}
+
+def aggregate_buckets(buckets):
+    """
+    Passed intervals of packet-in telemetry (as per new_bucket, or
+    pi_time_stats database records) and return packet-in rate and
+    processing time stats, including percentiles, over them
+    """
+    result = dict.fromkeys(['ryu_time_max', 'ryu_time_min', 'ryu_time_avg',
+                    'ryu_time_records', 'pi_time_max', 'pi_time_min',
+                    'pi_time_avg', 'pi_time_records', 'pi_dedup_ratio'], 0)
+    for percentile in PERCENTILES:
+        result['ryu_time_p%s' % percentile] = 0
+        result['pi_time_p%s' % percentile] = 0
+    result['ryu_time_period'] = TELEMETRY_PERIOD
+    result['pi_time_period'] = TELEMETRY_PERIOD
+    records = sum(bucket['records'] for bucket in buckets)
+    result['pi_rate'] = float(records) / TELEMETRY_PERIOD
+    if records:
+        recorded = [bucket for bucket in buckets if bucket['records']]
+        result['ryu_time_max'] = max(bucket['ryu_max'] for bucket in recorded)
+        result['ryu_time_min'] = min(bucket['ryu_min'] for bucket in recorded)
+        result['ryu_time_avg'] = sum(bucket['ryu_sum']
+                                            for bucket in recorded) / records
+        result['ryu_time_records'] = records
+        result['pi_time_max'] = max(bucket['pi_max'] for bucket in recorded)
+        result['pi_time_min'] = min(bucket['pi_min'] for bucket in recorded)
+        result['pi_time_avg'] = sum(bucket['pi_sum']
+                                            for bucket in recorded) / records
+        result['pi_time_records'] = records
+        result['pi_dedup_ratio'] = float(sum(bucket['duplicates']
+                                            for bucket in recorded)) / records
+        for prefix, key in (('ryu_time', 'ryu_sketch'),
+                            ('pi_time', 'pi_sketch')):
+            sketch = {}
+            for bucket in recorded:
+                sketch_merge(sketch, bucket[key])
+            for percentile in PERCENTILES:
+                result['%s_p%s' % (prefix, percentile)] = \
+                                sketch_quantile(sketch, percentile / 100.0)
+    return result
+
+def sketch_add(sketch, value):
+    """
+    Passed a quantile sketch and a value, and add the value to the
+    sketch
+    """
+    if value <= SKETCH_MIN_VALUE:
+        key = SKETCH_ZERO
+    else:
+        key = str(int(math.ceil(math.log(value) / SKETCH_LOG_GAMMA)))
+    sketch[key] = sketch.get(key, 0) + 1
+
+def sketch_merge(sketch, other):
+    """
+    Passed a quantile sketch and another quantile sketch, and add the
+    counts of the other sketch to the first
+    """
+    for key, count in other.items():
+        sketch[key] = sketch.get(key, 0) + count
+
+def sketch_quantile(sketch, quantile):
+    """
+    Passed a quantile sketch and a quantile (between 0 and 1) and
+    return an estimate of the value at that quantile (rank quantile *
+    (count - 1), rounded down), within SKETCH_ACCURACY of the actual
+    value. Returns 0 for an empty sketch
+    """
+    count = sum(sketch.values())
+    if not count:
+        return 0
+    rank = quantile * (count - 1)
+    seen = sketch.get(SKETCH_ZERO, 0)
+    if seen > rank:
+        return 0
+    for index in sorted(int(key) for key in sketch if key != SKETCH_ZERO):
+        seen += sketch[str(index)]
+        if seen > rank:
+            break
+    #*** Middle of the bin, by relative error:
+    return 2 * SKETCH_GAMMA ** index / (SKETCH_GAMMA + 1)
@@ -0,0 +1,255 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+The warmstart module is part of the nmeta suite
+
+It provides an optional warm start mode. Controller state that takes
+time to rebuild (MAC learning, harvested identities and DHCP messages,
+flow classifications, flow suppressions and switch flow mod cookie
+counters) is saved to a local snapshot file at intervals and on
+shutdown, and restored at startup, so that flows don't all need to be
+inspected again and identities don't need to be harvested again.
+
+The snapshot is compressed BSON, so that datetimes and other database
+types round trip unchanged. Records that have expired by the time of
+restore (according to the same time limits used for look-ups) are
+not restored. Flow suppressions are only restored for flows whose
+classification is restored (others are classified and suppressed
+afresh) and, where switches remove suppression flow entries after a
+hard timeout, only if made within it.
+
+The database collections read for a snapshot are capped, and a
+function can be passed that is called every SNAPSHOT_BATCH records
+read, so that the snapshot can yield to other green threads.
+"""
+
+#*** General imports:
+import os
+import zlib
+import time
+
+#*** For timestamps:
+import datetime
+
+#*** BSON encoding (part of pymongo):
+import bson
+
+#*** For logging configuration:
+from baseclass import BaseClass
+
+#*** nmeta imports:
+import flows
+
+#*** Version of snapshot format, snapshots of other versions are ignored:
+SNAPSHOT_VERSION = 1
+
+#*** Records read from database between calls to pause function:
+SNAPSHOT_BATCH = 500
+
+class WarmStart(BaseClass):
+    """
+    An object that saves controller state to a snapshot file and
+    restores it at startup
+
+    Main methods (assumes class instantiated as an object called
+    'warmstart'):
+
+        warmstart.snapshot(flow, ident, forwarding, switches, pause)
+          Save state to the snapshot file, optionally calling pause
+          periodically to yield
+
+        warmstart.restore(flow, ident, forwarding, switches)
+          Restore unexpired state from the snapshot file (if any)
+    """
+    def __init__(self, config):
+        """
+        Initialise an instance of the WarmStart class
+        """
+        #*** Required for BaseClass:
+        self.config = config
+        #*** Set up Logging with inherited base class method:
+        self.configure_logging(__name__, "warmstart_logging_level_s",
+                                       "warmstart_logging_level_c")
+        #*** Get parameters from config:
+        self.enabled = config.get_value("warm_start")
+        self.filename = config.get_value("warm_start_file")
+        self.interval = config.get_value("warm_start_interval")
+        self.classification_time_limit = datetime.timedelta \
+                        (seconds=config.get_value("classification_time_limit"))
+        self.dhcp_messages_time_limit = datetime.timedelta \
+                         (seconds=config.get_value("dhcp_messages_time_limit"))
+        #*** Hard timeouts of flow entries by suppress type (0 is none):
+        self.hard_timeouts = {
+                    'suppress': config.get_value("suppress_hard_timeout"),
+                    'drop': config.get_value("drop_hard_timeout")}
+
+    def snapshot(self, flow, ident, forwarding, switches, pause=None):
+        """
+        Save controller state to the snapshot file. The file is
+        written to a temporary file and renamed, so that a crash
+        while writing leaves the previous snapshot in place.
+        Optionally pass a function to call every SNAPSHOT_BATCH
+        records read from the database (i.e. to yield).
+        Returns the number of bytes written
+        """
+        start = time.time()
+        now = datetime.datetime.now()
+        state = {'version': SNAPSHOT_VERSION, 'timestamp': now}
+        #*** MAC learning, with DPID keys as strings for BSON:
+        state['mac_to_port'] = dict((str(dpid), mac_table)
+                        for dpid, mac_table in forwarding.mac_to_port.items())
+        #*** Flow mod cookie counters so cookies aren't reused:
+        cookies = dict((str(dpid), cookie)
+                                for dpid, cookie in switches.cookies.items())
+        for dpid, switch in switches.switches.items():
+            cookies[str(dpid)] = [
+                            switch.flowtables.flow_mod_cookie_forward,
+                            switch.flowtables.flow_mod_cookie_reverse]
+        state['cookies'] = cookies
+        state['identities'] = _strip_ids(ident.identities.find(
+                                        {'valid_to': {'$gte': now}}), pause)
+        state['dhcp_messages'] = _strip_ids(ident.dhcp_messages.find(
+                {'ingest_time': {'$gte': now - self.dhcp_messages_time_limit}}),
+                pause)
+        #*** Only the latest classification of a flow is used, so only
+        #***  keep that:
+        latest = {}
+        for record in _strip_ids(flow.classifications.find(
+                        {'classification_time':
+                        {'$gte': now - self.classification_time_limit}})
+                        .sort(flows.CLASSIFICATION_SORT), pause):
+            if record['flow_hash'] not in latest:
+                latest[record['flow_hash']] = record
+        state['classifications'] = sorted(latest.values(),
+                        key=lambda record: record['classification_time'])
+        state['flow_mods'] = [record for record in _strip_ids(
+                        flow.flow_mods.find({'standdown': 0}), pause)
+                        if record['flow_hash'] in latest and
+                        self._suppression_current(record, now)]
+        data = zlib.compress(bson.BSON.encode(state))
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'wb') as snapshot_file:
+            snapshot_file.write(data)
+        os.rename(tmp_filename, self.filename)
+        self.logger.info("Saved warm start snapshot file=%s bytes=%s "
+                        "identities=%s classifications=%s flow_mods=%s "
+                        "seconds=%.3f", self.filename, len(data),
+                        len(state['identities']),
+                        len(state['classifications']),
+                        len(state['flow_mods']), time.time() - start)
+        return len(data)
+
+    def restore(self, flow, ident, forwarding, switches):
+        """
+        Restore controller state from the snapshot file, skipping
+        records that have expired. Call after the database collections
+        have been created. Returns a dictionary of counts of restored
+        records, or an empty dictionary if there was no usable snapshot
+        """
+        start = time.time()
+        state = self.load()
+        if not state:
+            return {}
+        now = datetime.datetime.now()
+        for dpid, mac_table in state['mac_to_port'].items():
+            forwarding.mac_to_port[int(dpid)] = dict(mac_table)
+        for dpid, cookie in state['cookies'].items():
+            switches.cookies[int(dpid)] = list(cookie)
+        counts = {'switches': len(state['mac_to_port'])}
+        restored = [record for record in state['identities']
+                                                if record['valid_to'] >= now]
+        counts['identities'] = _insert(ident.identities, restored)
+        #*** Rebuild current identities in order of harvest:
+        for record in restored:
+            ident.update_current(record)
+        counts['dhcp_messages'] = _insert(ident.dhcp_messages,
+                            [record for record in state['dhcp_messages']
+                            if record['ingest_time'] >=
+                                        now - self.dhcp_messages_time_limit])
+        classifications = [record for record in state['classifications']
+                            if record['classification_time'] >=
+                                        now - self.classification_time_limit]
+        counts['classifications'] = _insert(flow.classifications,
+                                                            classifications)
+        #*** Suppressions of flows whose classification wasn't restored
+        #***  aren't needed, as those flows will be suppressed afresh:
+        flow_hashes = set(record['flow_hash'] for record in classifications)
+        counts['flow_mods'] = _insert(flow.flow_mods,
+                            [record for record in state['flow_mods']
+                            if record['flow_hash'] in flow_hashes and
+                            self._suppression_current(record, now)])
+        self.logger.info("Restored warm start snapshot from=%s counts=%s "
+                        "seconds=%.3f", state['timestamp'], counts,
+                        time.time() - start)
+        return counts
+
+    def _suppression_current(self, record, now):
+        """
+        Passed a flow_mods record and return False if its flow entries
+        have been removed from switches by their hard timeout,
+        otherwise True
+        """
+        hard_timeout = self.hard_timeouts.get(record['suppress_type'], 0)
+        if not hard_timeout:
+            return True
+        return now - record['timestamp'] < \
+                                    datetime.timedelta(seconds=hard_timeout)
+
+    def load(self):
+        """
+        Read and decode the snapshot file. Return the state dictionary,
+        or None if there is no snapshot or it can't be used
+        """
+        if not os.path.isfile(self.filename):
+            self.logger.info("No warm start snapshot file=%s, cold start",
+                                                                self.filename)
+            return None
+        try:
+            with open(self.filename, 'rb') as snapshot_file:
+                state = bson.BSON(zlib.decompress(snapshot_file.read())) \
+                                                                    .decode()
+        except (IOError, OSError, zlib.error, bson.errors.BSONError), \
+                                                                    exception:
+            self.logger.error("Failed to read warm start snapshot file=%s "
+                            "exception=%s, cold start", self.filename,
+                            exception)
+            return None
+        if state.get('version') != SNAPSHOT_VERSION:
+            self.logger.warning("Ignoring warm start snapshot version=%s, "
+                                "cold start", state.get('version'))
+            return None
+        return state
+
+def _strip_ids(records_in, pause=None):
+    """
+    Return a list of records (i.e. from a database cursor) without
+    their _id (so that they get new ids when restored). Optionally
+    pass a function to call every SNAPSHOT_BATCH records
+    """
+    records = []
+    for record in records_in:
+        record.pop('_id', None)
+        records.append(record)
+        if pause and not len(records) % SNAPSHOT_BATCH:
+            pause()
+    return records
+
+def _insert(collection, records):
+    """
+    Insert records into a database collection in order, returning
+    the number inserted
+    """
+    if records:
+        collection.insert_many(records)
+    return len(records)
@@ -4,6 +4,7 @@ nmeta.ControllerPIRateChartModel = Backbone.Model.extend({
 
     // Polling for changes
     polling : true,
+    streaming : false,
     intervalSeconds : 5,
     
     // Number of data points to hold for chart series:
@@ -24,18 +25,42 @@ nmeta.ControllerPIRateChartModel = Backbone.Model.extend({
         }
     },
 
-    // Start polling for new API data:
+    // Start polling for new API data. Subscribes to the telemetry stream
+    // instead where available:
     startPolling : function(intervalSeconds){
         this.polling = true;
         if( intervalSeconds ){
           this.intervalSeconds = intervalSeconds;
         }
+        if( !this.streaming &&
+                nmeta.telemetryStream.subscribe(this.onTelemetry, this) ){
+            this.streaming = true;
+            this.listenToOnce(nmeta.telemetryStream, 'closed', this.onStreamClosed);
+            return;
+        }
         this.executePolling();
     },
 
     // Stop polling for new API data:
     stopPolling : function(){
         this.polling = false;
+        this.stopStreaming();
+    },
+
+    stopStreaming : function(){
+        if( this.streaming ){
+            this.streaming = false;
+            this.stopListening(nmeta.telemetryStream);
+            nmeta.telemetryStream.unsubscribe(this.onTelemetry, this);
+        }
+    },
+
+    // Telemetry stream not available, so fall back to polling:
+    onStreamClosed : function(){
+        this.stopStreaming();
+        if( this.polling ){
+          this.executePolling();
+        }
     },
 
     // Set callback for completion of API fetch to run onFetch function:
@@ -43,8 +68,24 @@ nmeta.ControllerPIRateChartModel = Backbone.Model.extend({
         this.fetch({success : this.onFetch});
     },
 
+    // Runs when telemetry is pushed by the stream:
+    onTelemetry : function (data) {
+        this.set({timestamp: data.timestamp,
+                  pi_rate: data.pi_rate});
+        this.addDataPoint();
+    },
+
     // Runs after API has returned successfully:
     onFetch : function () {
+        this.addDataPoint();
+        if( this.polling && !this.streaming ){
+          // Set another polling callback:
+          setTimeout(this.executePolling, 1000 * this.intervalSeconds);
+        }
+    },
+
+    // Add latest data to chart series:
+    addDataPoint : function () {
         // Add timestamp to labels array:
         this.pi_rate_x_labels.push(this.get("timestamp"));
         if (this.pi_rate_x_labels.length > this.CHART_INTERVALS) {
@@ -57,9 +98,5 @@ nmeta.ControllerPIRateChartModel = Backbone.Model.extend({
         }
         // Event to trigger render in view:
         this.trigger('event_controller_pirate_data');
-        if( this.polling ){
-          // Set another polling callback:
-          setTimeout(this.executePolling, 1000 * this.intervalSeconds);
-        }
     },
 });
@@ -1,7 +1,42 @@
 //-------- Model for an individual controller summary:
 nmeta.ControllerSummaryModel = Backbone.Model.extend({
-    urlRoot:'/v1/infrastructure/controllers/summary'
-    });
+    urlRoot:'/v1/infrastructure/controllers/summary',
 
+    streaming : false,
 
+    // Number of decimal places to round seconds to, as per API:
+    PLACES : 3,
 
+    initialize : function(){
+        _.bindAll.apply(_, [this].concat(_.functions(this)));
+    },
+
+    // Keep up to date from the telemetry stream where available:
+    startStreaming : function(){
+        if( !this.streaming &&
+                nmeta.telemetryStream.subscribe(this.onTelemetry, this) ){
+            this.streaming = true;
+        }
+    },
+
+    stopStreaming : function(){
+        if( this.streaming ){
+            this.streaming = false;
+            nmeta.telemetryStream.unsubscribe(this.onTelemetry, this);
+        }
+    },
+
+    // Runs when telemetry is pushed by the stream:
+    onTelemetry : function (data) {
+        var places = this.PLACES;
+        this.set({
+            timestamp: data.timestamp,
+            pi_rate: data.pi_rate,
+            pi_time_min: Number(data.pi_time_min.toFixed(places)),
+            pi_time_avg: Number(data.pi_time_avg.toFixed(places)),
+            pi_time_max: Number(data.pi_time_max.toFixed(places)),
+            pi_dedup_ratio: Number(data.pi_dedup_ratio.toFixed(places)),
+            admission_mode: data.admission_mode
+        });
+    }
+});
@@ -4,30 +4,60 @@ nmeta.SwitchCountModel = Backbone.Model.extend({
 
     // Polling for changes:
     polling : false,
+    streaming : false,
     intervalSeconds : 5,
 
     initialize : function(){
         _.bindAll.apply(_, [this].concat(_.functions(this)));
     },
 
+    // Poll, or subscribe to the telemetry stream where available:
     startPolling : function(intervalSeconds){
         this.polling = true;
         if( intervalSeconds ){
           this.intervalSeconds = intervalSeconds;
         }
+        if( !this.streaming &&
+                nmeta.telemetryStream.subscribe(this.onTelemetry, this) ){
+            this.streaming = true;
+            this.listenToOnce(nmeta.telemetryStream, 'closed', this.onStreamClosed);
+            return;
+        }
         this.executePolling();
     },
 
     stopPolling : function(){
         this.polling = false;
+        this.stopStreaming();
+    },
+
+    stopStreaming : function(){
+        if( this.streaming ){
+            this.streaming = false;
+            this.stopListening(nmeta.telemetryStream);
+            nmeta.telemetryStream.unsubscribe(this.onTelemetry, this);
+        }
+    },
+
+    // Telemetry stream not available, so fall back to polling:
+    onStreamClosed : function(){
+        this.stopStreaming();
+        if( this.polling ){
+          this.executePolling();
+        }
     },
 
     executePolling : function(){
         this.fetch({success : this.onFetch});
     },
 
+    // Runs when telemetry is pushed by the stream:
+    onTelemetry : function (data) {
+        this.set({connected_switches: data.connected_switches});
+    },
+
     onFetch : function () {
-        if( this.polling ){
+        if( this.polling && !this.streaming ){
             console.log('switch_count_model setting setTimeout for polling');
             setTimeout(this.executePolling, 1000 * this.intervalSeconds);
         }
@@ -0,0 +1,55 @@
+//-------- Stream of controller telemetry pushed by the API (Server-Sent Events):
+// One connection per page is shared by all subscribed models, rather than
+// each model polling the API. Triggers 'telemetry' events with the data
+// (keys as per controller summary, pi_rate, pi_time and connected_switches)
+// and a 'closed' event if the stream is not available, so that models can
+// fall back to polling.
+nmeta.TelemetryStream = function(){
+    _.extend(this, Backbone.Events);
+    this.url = '/v1/infrastructure/controllers/telemetry/stream';
+    this.source = null;
+};
+
+_.extend(nmeta.TelemetryStream.prototype, {
+
+    // Subscribe a callback to telemetry, opening the stream if required.
+    // Returns false if the browser doesn't support streaming:
+    subscribe : function(callback, context){
+        if( !window.EventSource ){
+            return false;
+        }
+        this.on('telemetry', callback, context);
+        if( !this.source ){
+            this.open();
+        }
+        return true;
+    },
+
+    // Unsubscribe a callback, closing the stream if no subscribers left:
+    unsubscribe : function(callback, context){
+        this.off('telemetry', callback, context);
+        if( this.source && !(this._events && this._events.telemetry) ){
+            this.source.close();
+            this.source = null;
+        }
+    },
+
+    open : function(){
+        var self = this;
+        console.log('opening telemetry stream');
+        this.source = new EventSource(this.url);
+        this.source.addEventListener('telemetry', function(event){
+            self.trigger('telemetry', JSON.parse(event.data));
+        });
+        this.source.onerror = function(){
+            // Browser reconnects, unless stream is not available:
+            if( self.source && self.source.readyState === EventSource.CLOSED ){
+                console.log('telemetry stream closed');
+                self.source = null;
+                self.trigger('closed');
+            }
+        };
+    }
+});
+
+nmeta.telemetryStream = new nmeta.TelemetryStream();
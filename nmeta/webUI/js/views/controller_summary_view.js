@@ -4,6 +4,8 @@ nmeta.ControllerSummaryView = Backbone.View.extend({
         var self = this;
         this.model.on("reset", this.render, this);
         this.model.on('change', this.render, this);
+        // Update from telemetry stream (changes render):
+        this.model.startStreaming();
     },
 
     events: {
@@ -19,5 +21,11 @@ nmeta.ControllerSummaryView = Backbone.View.extend({
         this.$el.empty();
         this.$el.html(this.template(this.model.attributes));
         return this;
+    },
+
+    // Clean-up View on close:
+    onClose : function(){
+        console.log('onClose called for view=controller_summary_view');
+        this.model.stopStreaming();
     }
 });
@@ -0,0 +1,323 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+The workers module is part of the nmeta suite
+
+It provides an optional pool of worker processes that do the CPU
+heavy parts of packet-in processing (ingest parsing, identity
+harvesting, policy checking including custom classifiers), so that
+packet-in throughput is not limited to the one core that Ryu's
+event loop runs on.
+
+Packet-ins are sharded to workers by a flow key (the flow_hash for
+TCP, source MAC address otherwise), so that all packets in a flow,
+including the same packet received from different switches, go to
+the same worker and the flow's in-memory state stays local to it.
+
+OpenFlow I/O stays in the Ryu process. Requests and results are
+passed over one pipe per worker, and the Ryu process polls for
+results without blocking its event loop. Requests for a worker that
+already has the maximum in flight are queued in the Ryu process and
+sent as its results are received.
+"""
+
+#*** General imports:
+import multiprocessing
+
+#*** For queues of requests waiting for a worker to have capacity:
+from collections import deque
+
+#*** For timestamps:
+import datetime
+
+#*** Ryu imports:
+from ryu.lib.packet import packet
+from ryu.lib.packet import ethernet
+from ryu.lib.packet import ipv4
+from ryu.lib.packet import tcp
+
+#*** For logging configuration:
+from baseclass import BaseClass
+
+#*** nmeta imports:
+import nethash
+
+def flow_key(data):
+    """
+    Passed raw packet data and return the key used to shard the
+    packet to a worker. This is the flow_hash for IPv4 TCP (same
+    in both directions) otherwise the source MAC address
+    """
+    pkt = packet.Packet(data)
+    pkt_tcp = pkt.get_protocol(tcp.tcp)
+    pkt_ip4 = pkt.get_protocol(ipv4.ipv4)
+    if pkt_tcp and pkt_ip4:
+        return nethash.hash_flow((pkt_ip4.src, pkt_ip4.dst,
+                                    pkt_tcp.src_port, pkt_tcp.dst_port, 6))
+    return pkt.get_protocol(ethernet.ethernet).src
+
+class WorkerPool(BaseClass):
+    """
+    An object that runs packet-in processing in worker processes
+
+    Main methods (assumes class instantiated as an object called
+    'pool'):
+
+        pool.start()
+          Start the worker processes
+
+        pool.submit(seq, key, request)
+          Send a request to the worker for the flow key, or queue it
+          if the worker is at its maximum in flight
+
+        pool.results()
+          Return a list of results that are ready, without blocking,
+          and send queued requests to workers that now have capacity
+
+        pool.reload(policy_text)
+          Tell the workers to use a new policy
+    """
+    def __init__(self, config):
+        """
+        Initialise an instance of the WorkerPool class
+        """
+        #*** Required for BaseClass:
+        self.config = config
+        #*** Set up Logging with inherited base class method:
+        self.configure_logging(__name__, "workers_logging_level_s",
+                                       "workers_logging_level_c")
+        #*** Get parameters from config:
+        self.workers = config.get_value("workers")
+        self.max_inflight = config.get_value("worker_max_inflight")
+        self.poll_interval = config.get_value("worker_poll_interval")
+        #*** Parent ends of the pipes to each worker process:
+        self.pipes = []
+        self.processes = []
+        #*** Requests sent to each worker that have no result yet:
+        self.inflight = []
+        #*** Requests and control messages queued for each worker:
+        self.backlog = []
+
+    def start(self, target=None):
+        """
+        Start the worker processes. Optionally pass a target function
+        to run in each worker (default is worker_main)
+        """
+        if target is None:
+            target = worker_main
+        for index in range(self.workers):
+            parent_pipe, child_pipe = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=target,
+                                        args=(index, child_pipe),
+                                        name="nmeta-worker-%s" % index)
+            process.daemon = True
+            process.start()
+            self.pipes.append(parent_pipe)
+            self.processes.append(process)
+            self.inflight.append(0)
+            self.backlog.append(deque())
+        self.logger.info("Started workers=%s", self.workers)
+
+    def stop(self):
+        """
+        Stop the worker processes
+        """
+        for pipe in self.pipes:
+            pipe.send(None)
+        for process in self.processes:
+            process.join()
+        self.pipes = []
+        self.processes = []
+        self.inflight = []
+        self.backlog = []
+
+    def reload(self, policy_text):
+        """
+        Passed the policy YAML text of a new policy that has been
+        validated, and send it to the worker processes to use, so
+        that they classify with the same policy as the Ryu process
+        even if the policy file has changed since. This is queued
+        behind requests already submitted, so they are processed with
+        the policy in place when they were received
+        """
+        for index in range(len(self.pipes)):
+            self.backlog[index].append((None, ('reload', policy_text)))
+            self._send(index)
+        self.logger.info("Requested workers=%s reload policy",
+                                                            len(self.pipes))
+
+    def shard(self, key):
+        """
+        Return the index of the worker for a flow key
+        """
+        return int(nethash.hash_tuple((key,))[:8], 16) % self.workers
+
+    def submit(self, seq, key, request):
+        """
+        Send a request, identified by a sequence number, to the worker
+        for the flow key. If the worker already has the maximum
+        requests in flight, the request is queued (rather than
+        blocking Ryu's event loop waiting for the worker) and sent
+        when results() receives results from the worker
+        """
+        index = self.shard(key)
+        self.backlog[index].append((seq, request))
+        self._send(index)
+
+    def results(self):
+        """
+        Return a list of (seq, result) for all results that are
+        ready from workers, without blocking
+        """
+        ready = []
+        for index, pipe in enumerate(self.pipes):
+            while self.inflight[index] and pipe.poll():
+                ready.append(self._receive(index))
+            self._send(index)
+        return ready
+
+    def pending(self):
+        """
+        Return total number of requests in flight or queued
+        """
+        return sum(self.inflight) + sum(1 for backlog in self.backlog
+                                for seq, _ in backlog if seq is not None)
+
+    def _send(self, index):
+        """
+        Send queued requests to a worker while it has capacity.
+        Control messages (sequence None) don't count as in flight
+        """
+        backlog = self.backlog[index]
+        while backlog and (backlog[0][0] is None or
+                            self.inflight[index] < self.max_inflight):
+            seq, request = backlog.popleft()
+            self.pipes[index].send((seq, request))
+            if seq is not None:
+                self.inflight[index] += 1
+
+    def _receive(self, index):
+        """
+        Receive a result from a worker (blocking)
+        """
+        result = self.pipes[index].recv()
+        self.inflight[index] -= 1
+        return result
+
+class Worker(object):
+    """
+    An object that does packet-in processing in a worker process,
+    holding its own flow, identity and policy state
+    """
+    def __init__(self, config):
+        """
+        Initialise the worker, attaching to database collections
+        set up by the Ryu process
+        """
+        #*** Import here so that worker state is only created in workers:
+        import flows
+        import identities
+        import policy
+        self.config = config
+        self.suppress_aggregate = config.get_value("suppress_aggregate")
+        self.policy = policy.Policy(config)
+        self.flow = flows.Flow(config, attach=1)
+        self.ident = identities.Identities(config, self.policy, attach=1)
+
+    def reload(self, policy_text):
+        """
+        Passed policy YAML text sent by the Ryu process and use
+        it as the policy, keeping the current policy if it fails
+        validation (it has already been validated by the Ryu
+        process, so this is not expected)
+        """
+        import policy
+        try:
+            new_policy = policy.Policy(self.config, policy_text=policy_text)
+        except SystemExit:
+            self.policy.logger.error("Worker failed to reload policy")
+            return 0
+        self.policy = new_policy
+        self.ident.policy = new_policy
+        return 1
+
+    def process(self, request):
+        """
+        Passed a request tuple of (dpid, in_port, packet data,
+        timestamp in epoch seconds, shed, harvest). Ingest the packet,
+        harvest identities (if harvest set) and check policy (unless
+        already classified). Return a dictionary of the results that
+        the Ryu process needs to forward the packet
+        """
+        dpid, in_port, data, timestamp, shed, harvest = request
+        self.policy.custom.shed = shed
+        context = self.flow.ingest_packet(dpid, in_port, data,
+                                datetime.datetime.fromtimestamp(timestamp),
+                                shed)
+        classification = context.classification
+        harvested = 0
+        if not context.packet.duplicate and harvest:
+            harvested = self.ident.harvest(data, context.packet)
+        if not classification.classified and not context.packet.duplicate:
+            self.policy.check_policy(context, self.ident)
+            classification.commit()
+        aggregate = None
+        if self.suppress_aggregate and classification.classified and \
+                                not classification.flowstats_classifier:
+            aggregate = self.policy.aggregate_fields(context.packet,
+                                                    classification.actions)
+        return {'flow_hash': context.flow_hash,
+                'proto': context.packet.proto,
+                'duplicate': context.packet.duplicate,
+                'harvested': harvested,
+                'classified': classification.classified,
+                'actions': classification.actions,
+                'flowstats_classifier': classification.flowstats_classifier,
+                'aggregate': aggregate}
+
+def worker_main(index, pipe):
+    """
+    Run in a worker process. Process requests from the pipe until
+    sent None
+    """
+    import config
+    worker = Worker(config.Config())
+    while True:
+        item = pipe.recv()
+        if item is None:
+            break
+        seq, request = item
+        if seq is None:
+            #*** Control message, not a packet-in, so no result:
+            if request[0] == 'reload':
+                worker.reload(request[1])
+            continue
+        pipe.send((seq, process_request(worker, index, request)))
+
+def process_request(worker, index, request):
+    """
+    Passed a Worker, its index and a request, and return the result
+    of processing it. If processing fails, return a result for an
+    unclassified flow, so that the packet is still forwarded
+    """
+    try:
+        return worker.process(request)
+    except Exception, exception:
+        #*** Fail open, so that the packet is still forwarded:
+        worker.policy.logger.error("Worker=%s failed to process "
+                                    "packet-in, exception=%s", index,
+                                    exception)
+        return {'flow_hash': 0, 'proto': 0, 'duplicate': False,
+                    'harvested': 0, 'classified': False, 'actions': {},
+                    'flowstats_classifier': '', 'aggregate': None}
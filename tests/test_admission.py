@@ -0,0 +1,117 @@
+"""
+nmeta admission.py Unit Tests
+"""
+
+#*** Handle tests being in different directory branch to app code:
+import sys
+
+sys.path.insert(0, '../nmeta')
+
+import logging
+
+#*** nmeta imports:
+import config
+import admission as admission_module
+
+#*** Instantiate Config class:
+config = config.Config()
+
+logger = logging.getLogger(__name__)
+
+#*** Test DPIDs:
+DPID1 = 1
+DPID2 = 2
+
+#*** Test MAC addresses:
+MAC1 = '08:00:27:2a:d6:dd'
+MAC2 = '08:00:27:c8:db:91'
+
+#======================== admission.py Unit Tests ============================
+
+def test_admit_queue_delay():
+    """
+    Test mode changes driven by smoothed queue delay, with hysteresis
+    """
+    admission = admission_module.Admission(config)
+    now = 1000
+    assert admission.admit(DPID1, MAC1, 0, now) == admission_module.NORMAL
+    #*** Sustained delay over shed threshold:
+    for _ in range(20):
+        mode = admission.admit(DPID1, MAC1, admission.delay_shed * 2, now)
+    assert mode == admission_module.SHED
+    #*** Sustained delay over overload threshold:
+    for _ in range(20):
+        mode = admission.admit(DPID1, MAC1, admission.delay_overload * 2,
+                                                                        now)
+    assert mode == admission_module.OVERLOAD
+    assert admission.mode == admission_module.OVERLOAD
+    #*** No delay returns to normal via shed:
+    modes = []
+    for _ in range(40):
+        modes.append(admission.admit(DPID1, MAC1, 0, now))
+    assert admission_module.SHED in modes
+    assert modes[-1] == admission_module.NORMAL
+    assert admission.admission_col.find_one()['mode'] == \
+                                                    admission_module.NORMAL
+
+def test_admit_rates():
+    """
+    Test shedding optional work for busy switches and sources
+    """
+    admission = admission_module.Admission(config)
+    now = 1000
+    for _ in range(admission.source_rate_shed):
+        assert admission.admit(DPID1, MAC1, 0, now) == admission_module.NORMAL
+    #*** Source is over rate:
+    assert admission.admit(DPID1, MAC1, 0, now) == admission_module.SHED
+    #*** Other sources aren't:
+    assert admission.admit(DPID1, MAC2, 0, now) == admission_module.NORMAL
+    #*** Next second:
+    assert admission.admit(DPID1, MAC1, 0, now + 1) == \
+                                                    admission_module.NORMAL
+    #*** Switch is over rate:
+    for seq in range(admission.switch_rate_shed):
+        admission.admit(DPID2, seq, 0, now + 1)
+    assert admission.admit(DPID2, MAC2, 0, now + 1) == admission_module.SHED
+    #*** Controller-wide mode is unaffected:
+    assert admission.mode == admission_module.NORMAL
+
+def test_harvest_known():
+    """
+    Test recording sources that identities have been harvested from
+    """
+    admission = admission_module.Admission(config)
+    now = 1000
+    assert admission.harvest_known(MAC1, now) == False
+    admission.harvested(MAC1, now)
+    assert admission.harvest_known(MAC1, now + 1) == True
+    assert admission.harvest_known(MAC1, now + admission.known_time + 1) \
+                                                                    == False
+
+def test_prune_known():
+    """
+    Test that sources harvested longer ago than the known time
+    are pruned when identities are next harvested
+    """
+    admission = admission_module.Admission(config)
+    now = 1000
+    admission.harvested(MAC1, now)
+    admission.harvested(MAC2, now + admission.known_time - 1)
+    assert len(admission.known) == 2
+    #*** Prune is due, MAC1 has expired but MAC2 hasn't:
+    admission.harvested(MAC2, now + admission.known_time)
+    assert admission.known == {MAC2: now + admission.known_time}
+    assert admission.last_prune == now + admission.known_time
+
+def test_record():
+    """
+    Test recording the smoothed queue delay when the mode is unchanged
+    """
+    admission = admission_module.Admission(config)
+    admission.admit(DPID1, MAC1, admission.delay_shed / 2, 1000)
+    assert admission.mode == admission_module.NORMAL
+    assert admission.admission_col.find_one()['queue_delay'] == 0
+    admission.record()
+    assert admission.admission_col.find_one()['queue_delay'] == \
+                                                        admission.queue_delay
+    assert admission.queue_delay > 0
@@ -18,6 +18,7 @@ sys.path.insert(0, '../nmeta')
 import logging
 
 import time
+import os
 
 #*** JSON imports:
 import json
@@ -35,6 +36,8 @@ import identities as identities_module
 import api_external
 import policy as policy_module
 import tc_identity
+import state_snapshot as state_snapshot_module
+import telemetry as telemetry_module
 
 #*** nmeta test packet imports:
 import packets_ipv4_http as pkts
@@ -60,6 +63,12 @@ import requests
 #*** Multiprocessing:
 import multiprocessing
 
+#*** For state snapshot files:
+import tempfile
+
+#*** For compressed exports:
+import zlib
+
 #*** Instantiate Config class:
 config = config.Config()
 
@@ -389,6 +398,217 @@ def test_response_flows_removed_FLOWDIR_bytes_TXRX():
     #*** Stop api_external sub-process:
     api_ps.terminate()
 
+def test_top_talkers():
+    """
+    Test top talkers of removed flow stats from the flow_rems_rollups
+    database collection, since nmeta started and over a time window
+    """
+    #*** Supports OpenFlow version 1.3:
+    OFP_VERSION = ofproto_v1_3.OFP_VERSION
+
+    #*** Instantiate Flow class:
+    flow = flows_module.Flow(config)
+
+    #*** Record flow removals of 3 flows from 2 switches:
+    for dpid in (1, 2):
+        datapath = ofproto_protocol.ProtocolDesc(version=OFP_VERSION)
+        datapath.id = dpid
+        for index in range(1, 7):
+            with open('OFPMsgs/OFPFlowRemoved_%s.json' % index, 'r') \
+                                                                as json_file:
+                json_dict = json.loads(json_file.read())
+            flow.record_removal(ofproto_parser.ofp_msg_from_jsondict(datapath,
+                                                                json_dict))
+
+    #*** Totals, largest first:
+    result = [talker[:2] for talker in api.top_talkers_total('src_sent', 0)]
+    assert result == [('10.1.0.2', 12345), ('10.1.0.1', 5533)]
+    result = [talker[:2] for talker in api.top_talkers_total('dst_sent', 0)]
+    assert result == [('10.1.0.2', 8628), ('10.1.0.1', 543)]
+    result = api.top_talkers_total('src_received', 1)
+    assert [talker[:2] for talker in result] == [('10.1.0.1', 8628)]
+
+    #*** Over a time window, from per minute and per hour buckets:
+    for window in (300, 86400):
+        result = api.top_talkers_window('dst_received', 0, window)
+        assert [talker[:2] for talker in result] == [('10.1.0.1', 12345),
+                                                    ('10.1.0.2', 5533)]
+        result = api.top_talkers_window('dst_received', 1, window)
+        assert [talker[:2] for talker in result] == [('10.1.0.1', 12345)]
+
+def test_response_cache():
+    """
+    Test that polled resources are served from the response cache,
+    with ETags for conditional GET
+    """
+    #*** Instantiate Flow class so that database collections exist:
+    flow = flows_module.Flow(config)
+
+    #*** Set up Eve app without running a server:
+    api_cached = api_external.ExternalAPI(config)
+    api_cached.setup_app()
+    client = api_cached.app.test_client()
+    url = '/v1/flows_removed/stats/src_bytes_sent'
+
+    response = client.get(url)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert api_cached.response_cache.misses == 1
+    #*** Conditional GET with current ETag:
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    #*** From cache:
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers['ETag'] == etag
+    assert api_cached.response_cache.misses == 1
+    #*** Different URL parameters are cached separately:
+    response = client.get(url + '?top=1')
+    assert response.status_code == 200
+    assert api_cached.response_cache.misses == 2
+    #*** Resources that aren't polled aren't cached:
+    response = client.get('/v1/flows/ui')
+    assert response.status_code == 200
+    assert 'ETag' not in response.headers
+
+def test_controller_state():
+    """
+    Test that controller state is served from the state snapshot
+    when current, otherwise from the database
+    """
+    #*** Set up Eve app without running a server:
+    api_state = api_external.ExternalAPI(config)
+    api_state.setup_app()
+    api_state.state_snapshot.filename = tempfile.mktemp()
+    client = api_state.app.test_client()
+    url = '/v1/infrastructure/controllers/state'
+
+    #*** No snapshot:
+    response = client.get(url)
+    assert response.status_code == 503
+    items = {}
+    api_state.response_switches_count(items)
+    assert items['connected_switches'] == api_state.switches_col.count()
+
+    #*** Snapshot published by nmeta:
+    snapshot = state_snapshot_module.StateSnapshot(config)
+    snapshot.filename = api_state.state_snapshot.filename
+    snapshot.publish({'switches': [{'dpid': 1}, {'dpid': 2}],
+                      'admission': {'mode': 'shed', 'queue_delay': 0.2}})
+    response = client.get(url)
+    assert response.status_code == 200
+    state = json.loads(response.data)
+    assert state['switches'] == [{'dpid': 1}, {'dpid': 2}]
+    assert state['version'] == 2
+    items = {}
+    api_state.response_switches_count(items)
+    assert items['connected_switches'] == 2
+    assert api_state.get_admission_mode() == 'shed'
+    os.remove(snapshot.filename)
+
+def test_export():
+    """
+    Test streamed NDJSON exports of records in a time range
+    """
+    #*** Instantiate Flow class:
+    flow = flows_module.Flow(config)
+    #*** Ingest packets, one of them older than the default window:
+    old_time = datetime.datetime.now() - datetime.timedelta(
+                                    seconds=api_external.EXPORT_WINDOW + 60)
+    flow.ingest_packet(DPID1, INPORT1, pkts.RAW[0], old_time)
+    for raw in pkts.RAW[1:]:
+        flow.ingest_packet(DPID1, INPORT1, raw, datetime.datetime.now())
+
+    #*** Set up Eve app without running a server:
+    api_export = api_external.ExternalAPI(config)
+    api_export.setup_app()
+    client = api_export.app.test_client()
+
+    #*** Default time window:
+    response = client.get('/v1/export/flows')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    records = [json.loads(line) for line in response.data.splitlines()]
+    assert len(records) == len(pkts.RAW) - 1
+    assert '_id' not in records[0]
+    assert records[0]['flow_hash'] == flow.packet.flow_hash
+    #*** In time order, times in ISO 8601 format:
+    timestamps = [record['timestamp'] for record in records]
+    assert timestamps == sorted(timestamps)
+    datetime.datetime.strptime(timestamps[0], '%Y-%m-%dT%H:%M:%S.%f')
+
+    #*** Time range and fields:
+    start = (old_time - datetime.timedelta(seconds=1)).strftime(
+                                            api_external.EXPORT_TIME_FORMAT)
+    end = (old_time + datetime.timedelta(seconds=1)).strftime(
+                                            api_external.EXPORT_TIME_FORMAT)
+    response = client.get('/v1/export/flows?start=' + start + '&end=' + end +
+                                            '&fields=flow_hash,length')
+    records = [json.loads(line) for line in response.data.splitlines()]
+    assert len(records) == 1
+    assert sorted(records[0].keys()) == ['flow_hash', 'length']
+
+    #*** Compressed:
+    response = client.get('/v1/export/flows',
+                                headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    data = zlib.decompress(response.data, 16 + zlib.MAX_WBITS)
+    assert len(data.splitlines()) == len(pkts.RAW) - 1
+
+    #*** Errors:
+    assert client.get('/v1/export/foo').status_code == 404
+    assert client.get('/v1/export/flows?start=yesterday').status_code == 400
+
+    #*** Records are sent in chunks:
+    chunk_size = api_external.EXPORT_CHUNK_SIZE
+    api_external.EXPORT_CHUNK_SIZE = 10
+    chunks = list(api_external.export_chunks([{'a': 1}, {'a': 2}, {'a': 3}]))
+    api_external.EXPORT_CHUNK_SIZE = chunk_size
+    assert chunks == ['{"a":1}\n{"a":2}\n', '{"a":3}\n']
+
+def test_get_pi_time():
+    """
+    Test packet processing time stats are merged from per interval
+    records in the pi_time_stats database collection
+    """
+    telemetry = telemetry_module.Telemetry(config)
+    #*** No packet-ins:
+    result = api.get_pi_time()
+    assert result['pi_time_records'] == 0
+    assert result['pi_time_p99'] == 0
+    assert result['pi_time_period'] == api_external.PACKET_TIME_PERIOD
+
+    #*** Two intervals with packet-ins, and one without:
+    for index in range(1, 51):
+        telemetry.record(0.001, index * 0.001, False)
+    telemetry.publish(1, 'normal')
+    for index in range(51, 101):
+        telemetry.record(0.003, index * 0.001, index % 2)
+    telemetry.publish(1, 'normal')
+    telemetry.publish(1, 'normal')
+    assert telemetry.pi_time_stats.count() == 2
+    result = api.get_pi_time()
+    assert result['pi_time_records'] == 100
+    assert result['pi_time_min'] == 0.001
+    assert result['pi_time_max'] == 0.1
+    assert round(result['pi_time_avg'], 6) == 0.0505
+    assert result['ryu_time_min'] == 0.001
+    assert result['ryu_time_max'] == 0.003
+    assert round(result['ryu_time_avg'], 6) == 0.002
+    assert result['pi_dedup_ratio'] == 0.25
+    for key, value in (('pi_time_p50', 0.05), ('pi_time_p95', 0.095),
+                       ('pi_time_p99', 0.099), ('ryu_time_p50', 0.001)):
+        assert abs(result[key] - value) <= \
+                                value * telemetry_module.SKETCH_ACCURACY
+    assert 'pi_rate' not in result
+
+    #*** In API response:
+    items = {}
+    api.response_pi_time(items)
+    assert items['pi_time_p95'] == result['pi_time_p95']
+    assert items['ryu_time_records'] == 100
+
 def test_response_pi_rate():
     """
     Test ingesting packets from an IPv4 HTTP flow, and check packet-in rate
@@ -841,6 +1061,116 @@ def test_flow_match():
     assert api.flow_match(flow, flows_filterlogicselector_excludes,
                                 flows_filtertypeselector, filter_string_sv1) == 0
 
+def test_flow_augment_record():
+    """
+    Test creating a FlowUI record from a flow summary record
+    """
+    #*** Instantiate flow, policy and identities (no identities) objects:
+    flow = flows_module.Flow(config)
+    policy = policy_module.Policy(config)
+    identities = identities_module.Identities(config, policy)
+    #*** Ingest client then server packets:
+    flow.ingest_packet(DPID1, INPORT1, pkts.RAW[0], datetime.datetime.now())
+    flow.ingest_packet(DPID1, INPORT2, pkts.RAW[1], datetime.datetime.now())
+    flow.reclassify(flow.packet.flow_hash, 'Web', {'qos_treatment':
+                                                            'high_priority'})
+    record = flow.flow_summary.find_one({'flow_hash': flow.packet.flow_hash})
+    id_cache = {}
+    flow_ui = api.flow_augment_record(record, id_cache)
+    #*** Normalised to the direction of the first packet:
+    assert flow_ui.src == '10.1.0.1'
+    assert flow_ui.dst == '10.1.0.2'
+    assert flow_ui.tp_src == 43297
+    assert flow_ui.proto == 'TCP'
+    assert flow_ui.classification == 'Web'
+    assert flow_ui.actions == 'qos_treatment=high_priority '
+    assert flow_ui.data_sent == ''
+    #*** Identity lookups are cached:
+    assert id_cache['10.1.0.1'] == '10.1.0.1'
+    assert pkts.ETH_SRC[0] in id_cache
+
+def test_flow_filter_query():
+    """
+    Test translating flows/ui filters into flow_summary queries
+    """
+    #*** Instantiate flow, policy and identities objects:
+    flow = flows_module.Flow(config)
+    policy = policy_module.Policy(config)
+    identities = identities_module.Identities(config, policy)
+
+    #*** Harvest host name pc1.example.com for 10.1.0.1 from ARP and LLDP:
+    flow.ingest_packet(DPID1, INPORT1, pkts_arp.RAW[3], datetime.datetime.now())
+    identities.harvest(pkts_arp.RAW[3], flow.packet)
+    flow.ingest_packet(DPID1, INPORT1, pkts_lldp.RAW[0], datetime.datetime.now())
+    identities.harvest(pkts_lldp.RAW[0], flow.packet)
+    lldp_hash = flow.packet.flow_hash
+
+    #*** TCP flow from 10.1.0.1 to 10.1.0.2:
+    flow.ingest_packet(DPID1, INPORT1, pkts.RAW[0], datetime.datetime.now())
+    flow.ingest_packet(DPID1, INPORT2, pkts.RAW[1], datetime.datetime.now())
+    tcp_hash = flow.packet.flow_hash
+
+    def filtered(logic, filter_type, filter_string):
+        db_data = api.flow_filter_query(logic, filter_type, filter_string)
+        return [record['flow_hash'] for record in
+                                            flow.flow_summary.find(db_data)]
+
+    #*** Host name, IP address and protocol matches:
+    assert tcp_hash in filtered('includes', 'any', 'pc1.example')
+    assert tcp_hash not in filtered('includes', 'dst', 'pc1.example')
+    assert tcp_hash in filtered('', 'dst', '10.1.0.2')
+    assert tcp_hash not in filtered('', 'src', '10.1.0.2')
+    assert filtered('', 'any', 'TCP') == [tcp_hash]
+    assert filtered('', 'any', 'LLDP') == [lldp_hash]
+    assert lldp_hash not in filtered('', 'src_or_dst', 'LLDP')
+
+    #*** Excludes:
+    assert tcp_hash not in filtered('excludes', 'any', '10.1.0.1')
+    assert lldp_hash in filtered('excludes', 'any', '10.1.0.1')
+
+    #*** Filters that could match hover text aren't pushed down:
+    assert api.flow_filter_query('', 'any', 'IP') == {}
+    assert api.flow_filter_query('', 'any', '') == {}
+
+    #*** Filters that can't match anything:
+    assert api.flow_filter_query('excludes', 'any', '') is None
+    assert api.flow_filter_query('', 'foo', 'TCP') is None
+
+def test_flow_cursor():
+    """
+    Test pagination cursors, with flows/ui records
+    """
+    #*** Instantiate Flow class and ingest packets of 3 flows:
+    flow = flows_module.Flow(config)
+    flow.ingest_packet(DPID1, INPORT1, pkts.RAW[0], datetime.datetime.now())
+    flow.ingest_packet(DPID1, INPORT1, pkts_lldp.RAW[0],
+                                                    datetime.datetime.now())
+    flow.ingest_packet(DPID1, INPORT1, pkts_arp.RAW[3], datetime.datetime.now())
+    records = list(flow.flow_summary.find()
+                                .sort(api_external.FLOW_SUMMARY_SORT))
+    assert len(records) == 3
+
+    #*** Each page continues after the last record of the previous page:
+    sort = api_external.FLOW_SUMMARY_SORT
+    token = api_external.cursor_token(records[0], sort)
+    after = list(flow.flow_summary.find(api_external.cursor_query(token,
+                                                        sort)).sort(sort))
+    assert after == records[1:]
+    token = api_external.cursor_token(records[2], sort)
+    assert not list(flow.flow_summary.find(api_external.cursor_query(token,
+                                                                    sort)))
+
+    #*** Pages are stable when flows see new packets:
+    flow.ingest_packet(DPID1, INPORT2, pkts.RAW[1], datetime.datetime.now())
+    token = api_external.cursor_token(records[0], sort)
+    after = list(flow.flow_summary.find(api_external.cursor_query(token,
+                                                        sort)).sort(sort))
+    assert [record['flow_hash'] for record in after] == \
+                        [record['flow_hash'] for record in records[1:]]
+
+    #*** Invalid cursor:
+    assert api_external.cursor_query('foo', sort) is None
+
 def test_flow_mods():
     """
     Test flow_mods API
@@ -0,0 +1,132 @@
+"""
+nmeta floodcontrol.py Unit Tests
+"""
+
+#*** Handle tests being in different directory branch to app code:
+import sys
+
+sys.path.insert(0, '../nmeta')
+
+import logging
+
+#*** nmeta imports:
+import config
+import floodcontrol as floodcontrol_module
+
+#*** nmeta test packet imports:
+import packets_ipv4_ARP as pkts_arp
+
+#*** Instantiate Config class:
+config = config.Config()
+
+logger = logging.getLogger(__name__)
+
+#*** Test DPIDs:
+DPID1 = 1
+DPID2 = 2
+
+#*** Test ports:
+PORT1 = 1
+PORT2 = 2
+
+#*** Test MAC address:
+MAC1 = '08:00:27:2a:d6:dd'
+
+#====================== floodcontrol.py Unit Tests ===========================
+
+def test_check_dedup():
+    """
+    Test recognising the same broadcast from another switch
+    (duplicate), from the same switch on another port (loop) and
+    from the same switch on the same port (retransmission, treated
+    as duplicate)
+    """
+    floodcontrol = floodcontrol_module.FloodControl(config)
+    frame = pkts_arp.RAW[0]
+    now = 1000
+    assert floodcontrol.check(DPID1, PORT1, MAC1, frame, now) == \
+                                                    floodcontrol_module.FLOOD
+    assert floodcontrol.check(DPID2, PORT1, MAC1, frame, now + 0.1) == \
+                                                floodcontrol_module.DUPLICATE
+    assert floodcontrol.check(DPID1, PORT2, MAC1, frame, now + 0.2) == \
+                                                    floodcontrol_module.LOOP
+    assert floodcontrol.check(DPID2, PORT2, MAC1, frame, now + 0.3) == \
+                                                    floodcontrol_module.LOOP
+    #*** Retransmission by the source, arriving on the first port again:
+    assert floodcontrol.check(DPID1, PORT1, MAC1, frame, now + 0.4) == \
+                                                floodcontrol_module.DUPLICATE
+    assert floodcontrol.check(DPID2, PORT1, MAC1, frame, now + 0.4) == \
+                                                floodcontrol_module.DUPLICATE
+    #*** Outside the dedup window is a new broadcast:
+    assert floodcontrol.check(DPID1, PORT1, MAC1, frame,
+                        now + floodcontrol.dedup_window + 1) == \
+                                                    floodcontrol_module.FLOOD
+    assert floodcontrol.avoided() == 5
+
+def test_check_rate_limit():
+    """
+    Test per source rate limiting of new broadcasts, and
+    recognising noisy sources
+    """
+    floodcontrol = floodcontrol_module.FloodControl(config)
+    floodcontrol.drop_enabled = 1
+    floodcontrol.drop_threshold = 3
+    now = 1000
+    #*** Burst of distinct broadcasts is allowed up to burst size:
+    for seq in range(floodcontrol.burst):
+        assert floodcontrol.check(DPID1, PORT1, MAC1, str(seq), now) == \
+                                                    floodcontrol_module.FLOOD
+    assert floodcontrol.check(DPID1, PORT1, MAC1, 'a', now) == \
+                                            floodcontrol_module.RATE_LIMITED
+    assert floodcontrol.check(DPID1, PORT1, MAC1, 'b', now) == \
+                                            floodcontrol_module.RATE_LIMITED
+    assert floodcontrol.check(DPID1, PORT1, MAC1, 'c', now) == \
+                                                    floodcontrol_module.NOISY
+    #*** Tokens are refilled at the configured rate:
+    assert floodcontrol.check(DPID1, PORT1, MAC1, 'd',
+                        now + 2.0 / floodcontrol.rate) == \
+                                                    floodcontrol_module.FLOOD
+
+def test_prune_stats():
+    """
+    Test pruning of idle broadcast sources, and counters
+    """
+    floodcontrol = floodcontrol_module.FloodControl(config)
+    now = 1000
+    for seq in range(10):
+        mac = '08:00:27:2a:d6:%02x' % seq
+        assert floodcontrol.check(DPID1, PORT1, mac, str(seq), now) == \
+                                                    floodcontrol_module.FLOOD
+    assert len(floodcontrol.buckets) == 10
+    #*** Sources still within the refill time aren't pruned:
+    floodcontrol.check(DPID1, PORT1, MAC1, 'a', now + floodcontrol.idle_time / 2)
+    assert len(floodcontrol.buckets) == 11
+    #*** Idle sources are pruned:
+    floodcontrol.check(DPID1, PORT1, MAC1, 'b', now + floodcontrol.idle_time + 1)
+    assert floodcontrol.buckets.keys() == [MAC1]
+    assert floodcontrol.rate_limited == {}
+    floodcontrol.check(DPID1, PORT1, MAC1, 'b', now + floodcontrol.idle_time + 1)
+    stats = floodcontrol.stats()
+    assert stats[floodcontrol_module.FLOOD] == 12
+    assert stats[floodcontrol_module.DUPLICATE] == 1
+    assert stats['avoided'] == 1
+    assert stats['sources'] == 1
+
+def test_check_retransmission_rate_limit():
+    """
+    Test that retransmissions on the same port count against
+    the source broadcast rate
+    """
+    floodcontrol = floodcontrol_module.FloodControl(config)
+    frame = pkts_arp.RAW[0]
+    now = 1000
+    assert floodcontrol.check(DPID1, PORT1, MAC1, frame, now) == \
+                                                    floodcontrol_module.FLOOD
+    for _ in range(floodcontrol.burst - 1):
+        assert floodcontrol.check(DPID1, PORT1, MAC1, frame, now) == \
+                                                floodcontrol_module.DUPLICATE
+    assert floodcontrol.check(DPID1, PORT1, MAC1, frame, now) == \
+                                            floodcontrol_module.RATE_LIMITED
+    #*** Copies from other switches aren't rate limited:
+    assert floodcontrol.check(DPID2, PORT1, MAC1, frame, now) == \
+                                                floodcontrol_module.DUPLICATE
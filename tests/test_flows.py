@@ -393,6 +393,55 @@ def test_record_removal():
     assert result_tx['cookie'] == 1000000023
     assert result_tx['direction'] == 'reverse'
 
+def test_flow_rems_rollups():
+    """
+    Test that flow removals are rolled up into bytes, packets and
+    flows by IP address in the flow_rems_rollups database collection,
+    and that removals of the same flow from other switches aren't
+    counted again
+    """
+    #*** Supports OpenFlow version 1.3:
+    OFP_VERSION = ofproto_v1_3.OFP_VERSION
+
+    #*** Instantiate Flow class:
+    flow = flows_module.Flow(config)
+
+    #*** Remove forward and reverse flow entries from two switches:
+    for dpid in (1, 2):
+        datapath = ofproto_protocol.ProtocolDesc(version=OFP_VERSION)
+        datapath.id = dpid
+        for filename in ('OFPMsgs/OFPFlowRemoved_1.json',
+                                            'OFPMsgs/OFPFlowRemoved_2.json'):
+            with open(filename, 'r') as json_file:
+                json_dict = json.loads(json_file.read())
+            flow.record_removal(ofproto_parser.ofp_msg_from_jsondict(datapath,
+                                                                json_dict))
+    assert flow.flow_rems.count() == 4
+
+    #*** Totals, deduplicated for the second switch:
+    def total(stat, ip_addr):
+        return flow.flow_rems_rollups.find_one({'stat': stat,
+                                    'period': 'total', 'ip': ip_addr})
+    result = total('src_sent', '10.1.0.1')
+    assert result['bytes'] == 744
+    assert result['packets'] == 10
+    assert result['flows'] == 1
+    assert total('dst_received', '10.1.0.2')['bytes'] == 744
+    assert total('dst_sent', '10.1.0.2')['bytes'] == 6644
+    assert total('src_received', '10.1.0.1')['bytes'] == 6644
+    assert total('src_sent', '10.1.0.2') is None
+
+    #*** Time buckets, which expire:
+    for period in ('minute', 'hour'):
+        results = list(flow.flow_rems_rollups.find({'stat': 'src_sent',
+                                                    'period': period}))
+        assert len(results) == 1
+        assert results[0]['bytes'] == 744
+        assert results[0]['bucket'] <= datetime.datetime.now()
+        assert results[0]['expire_time'] > datetime.datetime.utcnow()
+    assert flow.flow_rems_rollups.count({'period': 'minute'}) == 4
+    assert flow.flow_rems_rollups.count({'period': 'hour'}) == 4
+
 def test_classification_identity():
     """
     Test that classification returns correct information for an identity
@@ -609,6 +658,205 @@ def test_record_suppression():
     #*** Note: don't need further tests as it gets worked out by 
     #***  test_api_external in test_flow_mods
 
+def test_invalidate_suppressions():
+    """
+    Test invalidating a classification and finding the flow entries
+    installed for a flow
+    """
+    #*** Instantiate Flow class:
+    flow = flows_module.Flow(config)
+    result = {'match_type': 'dual', 'forward_cookie': 1,
+                 'forward_match': {}, 'reverse_cookie': 1001,
+                 'reverse_match': {}, 'client_ip': '10.1.0.1'}
+    context = flow.ingest_packet(DPID1, INPORT1, pkts.RAW[0],
+                                                    datetime.datetime.now())
+    flow_hash = context.flow_hash
+    flow.reclassify(flow_hash, 'Constrained Bandwidth Traffic',
+                                    {'qos_treatment': 'constrained_bw'})
+    flow.record_suppression(DPID1, 'suppress', result)
+    flow.record_suppression(DPID2, 'suppress', {}, standdown=1,
+                                                        flow_hash=flow_hash)
+    suppressions = flow.suppressions(flow_hash)
+    assert len(suppressions) == 1
+    assert suppressions[0]['dpid'] == DPID1
+    assert suppressions[0]['reverse_cookie'] == 1001
+
+    #*** Invalidate, so next packet-in is checked against policy:
+    flow.invalidate(flow_hash)
+    context = flow.ingest_packet(DPID1, INPORT1, pkts.RAW[1],
+                                                    datetime.datetime.now())
+    assert context.classification.classified == 0
+    assert context.classification.actions == {}
+
+def test_flow_summary():
+    """
+    Test that the flow summary is kept up to date as packets are
+    ingested and the flow is classified, suppressed and removed
+    """
+    #*** Instantiate Flow class:
+    flow = flows_module.Flow(config)
+    #*** Client SYN, then server SYN ACK, then client ACK from 2 switches:
+    context = flow.ingest_packet(DPID1, INPORT1, pkts.RAW[0],
+                                                    datetime.datetime.now())
+    flow.ingest_packet(DPID1, INPORT2, pkts.RAW[1], datetime.datetime.now())
+    flow.ingest_packet(DPID1, INPORT1, pkts.RAW[2], datetime.datetime.now())
+    flow.ingest_packet(DPID2, INPORT1, pkts.RAW[2], datetime.datetime.now())
+    flow_hash = context.flow_hash
+    assert flow.flow_summary.count() == 1
+    summary = flow.flow_summary.find_one({'flow_hash': flow_hash})
+    #*** Direction is normalised to the first packet, duplicate not counted:
+    assert summary['ip_src'] == '10.1.0.1'
+    assert summary['ip_dst'] == '10.1.0.2'
+    assert summary['tp_src'] == 43297
+    assert summary['tp_dst'] == 80
+    assert summary['packet_count'] == 3
+    assert summary['classified'] == 0
+    assert summary['timestamp'] > summary['first_timestamp']
+
+    #*** Classify, as per nmeta after policy check:
+    context.classification.classified = True
+    context.classification.classification_tag = 'Web'
+    context.classification.actions = {'qos_treatment': 'high_priority'}
+    context.classification.commit()
+    summary = flow.flow_summary.find_one({'flow_hash': flow_hash})
+    assert summary['classified'] == 1
+    assert summary['classification_tag'] == 'Web'
+    assert summary['actions'] == {'qos_treatment': 'high_priority'}
+
+    #*** Suppress:
+    result = {'match_type': 'dual', 'forward_cookie': 1,
+                 'forward_match': {}, 'reverse_cookie': 1001,
+                 'reverse_match': {}, 'client_ip': '10.1.0.1'}
+    flow.record_suppression(DPID1, 'suppress', result, flow_hash=flow_hash)
+    summary = flow.flow_summary.find_one({'flow_hash': flow_hash})
+    assert summary['suppress_type'] == 'suppress'
+    assert summary['match_type'] == 'dual'
+
+    #*** Remove forward and reverse flow entries:
+    datapath = ofproto_protocol.ProtocolDesc(
+                                        version=ofproto_v1_3.OFP_VERSION)
+    datapath.id = 1
+    for filename in ('OFPMsgs/OFPFlowRemoved_1.json',
+                                            'OFPMsgs/OFPFlowRemoved_2.json'):
+        with open(filename, 'r') as json_file:
+            json_dict = json.loads(json_file.read())
+        flow.record_removal(ofproto_parser.ofp_msg_from_jsondict(datapath,
+                                                                json_dict))
+    summary = flow.flow_summary.find_one({'flow_hash': flow_hash})
+    assert summary['tx_found'] == 1
+    assert summary['tx_pkts'] == 10
+    assert summary['rx_found'] == 1
+    assert summary['rx_pkts'] == 9
+
+    #*** Invalidate:
+    flow.invalidate(flow_hash)
+    summary = flow.flow_summary.find_one({'flow_hash': flow_hash})
+    assert summary['classified'] == 0
+    assert summary['actions'] == {}
+
+def test_dedup_packet():
+    """
+    Test recognising the same packet received from multiple switches
+    within the packet dedup window
+    """
+    #*** Instantiate a flow object:
+    flow = flows_module.Flow(config)
+    time_1 = datetime.datetime.now()
+    time_2 = time_1 + datetime.timedelta(milliseconds=10)
+    time_3 = time_1 + flow.packet_dedup_window * 2
+
+    #*** First sighting of packet is not a duplicate:
+    flow.ingest_packet(DPID1, INPORT1, pkts.RAW[0], time_1)
+    assert flow.packet.duplicate == False
+    #*** Same packet from another switch is a duplicate:
+    flow.ingest_packet(DPID2, INPORT1, pkts.RAW[0], time_2)
+    assert flow.packet.duplicate == True
+    #*** Retransmission from the same switch is not a duplicate:
+    flow.ingest_packet(DPID1, INPORT1, pkts.RAW[0], time_2)
+    assert flow.packet.duplicate == False
+    #*** Outside the dedup window is not a duplicate:
+    flow.ingest_packet(DPID2, INPORT1, pkts.RAW[0], time_3)
+    assert flow.packet.duplicate == False
+    assert flow.dedup_ratio() == 0.25
+
+def test_ingest_shed():
+    """
+    Test that when shedding load, packets are only written to the
+    packet_ins collection if in an unclassified TCP flow
+    """
+    #*** Instantiate a flow object:
+    flow = flows_module.Flow(config)
+    context = flow.ingest_packet(DPID1, INPORT1, pkts.RAW[0],
+                                            datetime.datetime.now(), True)
+    assert flow.packet_ins.count() == 1
+    context.classification.classified = True
+    context.classification.commit()
+    flow.ingest_packet(DPID1, INPORT2, pkts.RAW[1], datetime.datetime.now(),
+                                                                        True)
+    assert flow.packet_ins.count() == 1
+    #*** Non-TCP:
+    flow.ingest_packet(DPID1, INPORT1, pkts_lldp.RAW[0],
+                                            datetime.datetime.now(), True)
+    assert flow.packet_ins.count() == 1
+    #*** Not shedding:
+    flow.ingest_packet(DPID1, INPORT1, pkts_lldp.RAW[0],
+                                            datetime.datetime.now())
+    assert flow.packet_ins.count() == 2
+
+def test_flow_context():
+    """
+    Test that flow contexts returned by ingest_packet are independent
+    of each other and of later packets, and are immutable
+    """
+    #*** Instantiate a flow object:
+    flow = flows_module.Flow(config)
+
+    #*** Interleave packets from two flows:
+    context_1 = flow.ingest_packet(DPID1, INPORT1, pkts.RAW[0],
+                                                    datetime.datetime.now())
+    context_2 = flow.ingest_packet(DPID1, INPORT1, pkts2.RAW[0],
+                                                    datetime.datetime.now())
+    context_3 = flow.ingest_packet(DPID1, INPORT2, pkts.RAW[1],
+                                                    datetime.datetime.now())
+    assert context_1.flow_hash == context_3.flow_hash
+    assert context_1.flow_hash != context_2.flow_hash
+    assert context_1.packet.ip_src == pkts.IP_SRC[0]
+    assert context_2.packet.ip_src == pkts2.IP_SRC[0]
+    assert context_1.classification is not context_2.classification
+    #*** Flow features are for the context's flow, not the latest packet:
+    assert context_1.packet_count() == 2
+    assert context_2.packet_count() == 1
+    assert context_1.client() == pkts.IP_SRC[0]
+    assert context_3.packet_direction() == 's2c'
+    #*** Flow object is in context of the most recent packet:
+    assert flow.context is context_3
+    assert flow.packet_count() == 2
+
+    #*** Context attributes can't be reassigned:
+    try:
+        context_1.packet = context_2.packet
+        assert False
+    except AttributeError:
+        pass
+    assert context_1.packet.ip_src == pkts.IP_SRC[0]
+
+def test_packet_dbdict():
+    """
+    Test that Packet objects have fixed slots and that database
+    documents do not alias live objects
+    """
+    #*** Instantiate a flow object:
+    flow = flows_module.Flow(config)
+    context = flow.ingest_packet(DPID1, INPORT1, pkts.RAW[0],
+                                                    datetime.datetime.now())
+    assert not hasattr(context.packet, '__dict__')
+    db_dict = context.packet.dbdict()
+    db_dict['_id'] = 1
+    assert '_id' not in context.packet.dbdict()
+    #*** Classification actions are copied into the document:
+    context.classification.dbdict()['actions']['drop'] = 1
+    assert context.classification.actions == {}
+
 def test_origin():
     """
     Test origin method that returns tuple of client IP and first DPID
@@ -633,6 +881,30 @@ def test_origin():
     assert flow.origin()[0] == pkts2.IP_SRC[0]
     assert flow.origin()[1] == DPID1
 
+def test_origin_cache():
+    """
+    Test that the origin of a flow is cached, so it is only queried
+    from the database once per flow, until it is older than the
+    flow time limit
+    """
+    flow = flows_module.Flow(config)
+    context = flow.ingest_packet(DPID1, INPORT1, pkts2.RAW[0],
+                                                    datetime.datetime.now())
+    assert context.origin() == (pkts2.IP_SRC[0], DPID1)
+    assert context.flow_hash in flow.origins
+    #*** Later packets in the flow use the cached origin:
+    context = flow.ingest_packet(DPID2, INPORT1, pkts2.RAW[1],
+                                                    datetime.datetime.now())
+    flow.packet_ins.delete_many({})
+    assert context.origin() == (pkts2.IP_SRC[0], DPID1)
+    assert context.packet_count() == 0
+    #*** Expired origins are removed from the cache and queried again:
+    (ip_src, dpid, timestamp) = flow.origins[context.flow_hash]
+    flow.origins[context.flow_hash] = (ip_src, dpid,
+                                    timestamp - flow.flow_time_limit * 2)
+    assert context.origin() == (0, 0)
+    assert context.flow_hash not in flow.origins
+
 def test_max_interpacket_interval():
     """
     Test max_interpacket_interval method
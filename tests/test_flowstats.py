@@ -0,0 +1,203 @@
+"""
+nmeta flowstats.py Unit Tests
+"""
+
+#*** Handle tests being in different directory branch to app code:
+import sys
+
+sys.path.insert(0, '../nmeta')
+
+import logging
+import time
+
+#*** Testing imports:
+import mock
+import unittest
+
+#*** Ryu imports:
+from ryu.base import app_manager  # To suppress cyclic import
+from ryu.ofproto import ofproto_v1_3
+from ryu.ofproto import ofproto_v1_3_parser
+
+#*** nmeta imports:
+import config
+import flowstats as flowstats_module
+import nethash
+
+#*** Instantiate Config class:
+config = config.Config()
+
+logger = logging.getLogger(__name__)
+
+#*** Test DPIDs:
+DPID1 = 1
+DPID2 = 2
+
+#*** Flow mod cookie value offset indicates flow session direction:
+OFFSET = config.get_value("flow_mod_cookie_reverse_offset")
+
+#======================== flowstats.py Unit Tests ============================
+
+def test_due():
+    """
+    Test that switches are polled once per interval, with jitter
+    """
+    flowstats = flowstats_module.FlowStats(config)
+    flowstats.add_switch(DPID1)
+    flowstats.add_switch(DPID2)
+    now = flowstats.next_poll[DPID1]
+    #*** First poll is within one interval of adding:
+    assert set(flowstats.due(now + flowstats.interval)) == set([DPID1, DPID2])
+    #*** Not due again straight away:
+    assert flowstats.due(now + flowstats.interval) == []
+    #*** Next poll is scheduled within jitter of the interval:
+    next_poll = flowstats.next_poll[DPID1]
+    assert next_poll >= now + 2 * flowstats.interval - flowstats.jitter
+    assert next_poll <= now + 2 * flowstats.interval + flowstats.jitter
+    #*** Deleted switches are not polled:
+    flowstats.delete_switch(DPID2)
+    assert flowstats.due(next_poll + flowstats.jitter * 2 +
+                                    flowstats.interval) == [DPID1]
+
+def test_stats_reply():
+    """
+    Test applying flow stats replies to the active flow table,
+    including rate calculation, aging out and removal
+    """
+    flowstats = flowstats_module.FlowStats(config)
+    flowstats.add_switch(DPID1)
+    flow_hash = nethash.hash_flow(('10.1.0.1', '10.1.0.2', 43297, 80, 6))
+
+    #*** First poll, forward and reverse entries plus table-miss:
+    msg = stats_reply(DPID1, [stat(23, 10, 100, 10000, '10.1.0.1',
+                                    '10.1.0.2', 43297, 80),
+                              stat(OFFSET + 23, 10, 50, 2000, '10.1.0.2',
+                                    '10.1.0.1', 80, 43297),
+                              stat(0, 100, 500, 50000)])
+    assert flowstats.stats_reply(msg) == 1
+    assert len(flowstats.active_flows) == 2
+    assert flowstats.active_flows[(DPID1, 23)].direction == 'forward'
+    assert flowstats.active_flows[(DPID1, OFFSET + 23)].direction == \
+                                                                    'reverse'
+    rates = flowstats.flow_rates(flow_hash)
+    assert rates['byte_count'] == 12000
+    assert rates['packet_count'] == 150
+
+    #*** Second poll, 10 seconds later:
+    msg = stats_reply(DPID1, [stat(23, 20, 300, 40000, '10.1.0.1',
+                                    '10.1.0.2', 43297, 80),
+                              stat(OFFSET + 23, 20, 70, 3000, '10.1.0.2',
+                                    '10.1.0.1', 80, 43297)])
+    flowstats.stats_reply(msg)
+    forward = flowstats.active_flows[(DPID1, 23)]
+    assert forward.byte_delta == 30000
+    assert forward.packet_delta == 200
+    assert forward.byte_rate == 3000
+    assert forward.packet_rate == 20
+    rates = flowstats.flow_rates(flow_hash)
+    assert rates['byte_rate'] == 3100
+    assert rates['packet_rate'] == 22
+
+    #*** Third poll without reverse entry ages it out:
+    msg = stats_reply(DPID1, [stat(23, 30, 400, 50000, '10.1.0.1',
+                                    '10.1.0.2', 43297, 80)])
+    flowstats.stats_reply(msg)
+    assert (DPID1, OFFSET + 23) not in flowstats.active_flows
+    assert flowstats.flow_rates(flow_hash)['byte_count'] == 50000
+
+    #*** Flow removal removes the forward entry:
+    assert flowstats.record_removal(DPID1, 23) == 1
+    assert flowstats.record_removal(DPID1, 23) == 0
+    assert flowstats.flow_rates(flow_hash) == {}
+    assert flowstats.flow_index == {}
+
+def test_stats_reply_multipart():
+    """
+    Test that active flows are not aged out until the final part
+    of a multipart flow stats reply
+    """
+    flowstats = flowstats_module.FlowStats(config)
+    flowstats.add_switch(DPID1)
+    flowstats.stats_reply(stats_reply(DPID1, [
+                            stat(1, 1, 1, 100, '10.1.0.1', '10.1.0.2', 1, 80),
+                            stat(2, 1, 1, 100, '10.1.0.1', '10.1.0.2', 2, 80)]))
+    assert len(flowstats.active_flows) == 2
+    #*** First part reports only cookie 1, more to come:
+    flowstats.stats_reply(stats_reply(DPID1, [
+                            stat(1, 2, 2, 200, '10.1.0.1', '10.1.0.2', 1, 80)],
+                            more=1))
+    assert len(flowstats.active_flows) == 2
+    #*** Final part reports cookie 2:
+    flowstats.stats_reply(stats_reply(DPID1, [
+                            stat(2, 2, 2, 200, '10.1.0.1', '10.1.0.2', 2, 80)]))
+    assert len(flowstats.active_flows) == 2
+
+def test_pending():
+    """
+    Test flows awaiting classification from flow stats counters
+    """
+    flowstats = flowstats_module.FlowStats(config)
+    flowstats.add_switch(DPID1)
+    flow_hash = nethash.hash_flow(('10.1.0.1', '10.1.0.2', 43297, 80, 6))
+    flowstats.add_pending(flow_hash, 'statistical_qos_bandwidth_2')
+    #*** Not in a flow stats reply yet:
+    assert flowstats.pending() == []
+    assert flow_hash in flowstats.pending_flows
+    #*** Now in a flow stats reply:
+    flowstats.stats_reply(stats_reply(DPID1, [stat(23, 10, 100, 10000,
+                                '10.1.0.1', '10.1.0.2', 43297, 80, 3)]))
+    pending = flowstats.pending()
+    assert len(pending) == 1
+    assert pending[0][0] == flow_hash
+    assert pending[0][1] == 'statistical_qos_bandwidth_2'
+    assert pending[0][2]['packet_count'] == 100
+    entries = flowstats.entries(flow_hash)
+    assert len(entries) == 1
+    assert entries[0].out_port == 3
+    assert flowstats.clear_pending(flow_hash) == 1
+    assert flowstats.clear_pending(flow_hash) == 0
+    #*** Pending flows that never appear time out:
+    flowstats.add_pending('xyz', 'statistical_qos_bandwidth_2')
+    flowstats.pending(time.time() + flowstats.pending_timeout + 1)
+    assert flowstats.pending_flows == {}
+
+#================= HELPER FUNCTIONS ===========================================
+
+def stat(cookie, duration_sec, packet_count, byte_count, ip_src='',
+                    ip_dst='', tcp_src=0, tcp_dst=0, out_port=0):
+    """
+    Return a Ryu OFPFlowStats object for a TCP flow entry (or
+    empty match if no IP addresses), with an output action if
+    out_port is set
+    """
+    instructions = []
+    if out_port:
+        instructions = [ofproto_v1_3_parser.OFPInstructionActions(
+                            ofproto_v1_3.OFPIT_APPLY_ACTIONS,
+                            [ofproto_v1_3_parser.OFPActionSetQueue(0),
+                            ofproto_v1_3_parser.OFPActionOutput(out_port, 0)])]
+    if ip_src:
+        match = ofproto_v1_3_parser.OFPMatch(eth_type=0x0800,
+                    ipv4_src=ip_src, ipv4_dst=ip_dst, ip_proto=6,
+                    tcp_src=tcp_src, tcp_dst=tcp_dst)
+    else:
+        match = ofproto_v1_3_parser.OFPMatch()
+    return ofproto_v1_3_parser.OFPFlowStats(table_id=0,
+                    duration_sec=duration_sec, duration_nsec=0, priority=1,
+                    idle_timeout=30, hard_timeout=0, flags=0, cookie=cookie,
+                    packet_count=packet_count, byte_count=byte_count,
+                    match=match, instructions=instructions)
+
+def stats_reply(dpid, body, more=0):
+    """
+    Return a mock flow stats reply message from a switch
+    """
+    msg = mock.Mock()
+    msg.datapath.id = dpid
+    msg.datapath.ofproto = ofproto_v1_3
+    msg.body = body
+    if more:
+        msg.flags = ofproto_v1_3.OFPMPF_REPLY_MORE
+    else:
+        msg.flags = 0
+    return msg
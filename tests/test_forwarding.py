@@ -0,0 +1,52 @@
+"""
+nmeta forwarding.py Unit Tests
+"""
+
+#*** Handle tests being in different directory branch to app code:
+import sys
+
+sys.path.insert(0, '../nmeta')
+
+import logging
+
+#*** Ryu imports:
+from ryu.base import app_manager  # To suppress cyclic import
+
+#*** nmeta imports:
+import config
+import forwarding as forwarding_module
+
+#*** Instantiate Config class:
+config = config.Config()
+
+logger = logging.getLogger(__name__)
+
+#*** Test Constants:
+MAC1 = '00:00:00:00:00:01'
+MAC2 = '00:00:00:00:00:02'
+
+#======================== forwarding.py Unit Tests ===========================
+
+def test_path_ports():
+    """
+    Test that path_ports returns (dpid, in_port, out_port) for only
+    the switches that have learnt both MACs on different ports
+    """
+    forwarding = forwarding_module.Forwarding(config)
+    assert forwarding.path_ports(MAC1, MAC2) == []
+
+    #*** Both MACs learnt on different ports:
+    forwarding.mac_to_port[1] = {MAC1: 1, MAC2: 2}
+    #*** Both MACs learnt on the same port (i.e. not on path):
+    forwarding.mac_to_port[2] = {MAC1: 3, MAC2: 3}
+    #*** Only one of the MACs learnt:
+    forwarding.mac_to_port[3] = {MAC1: 4}
+    forwarding.mac_to_port[4] = {MAC2: 5}
+    assert forwarding.path_ports(MAC1, MAC2) == [(1, 1, 2)]
+    #*** Ports are swapped for the reverse direction:
+    assert forwarding.path_ports(MAC2, MAC1) == [(1, 2, 1)]
+
+    #*** Both MACs learnt on another switch:
+    forwarding.mac_to_port[3][MAC2] = 6
+    assert sorted(forwarding.path_ports(MAC1, MAC2)) == [(1, 1, 2),
+                                                         (3, 4, 6)]
@@ -44,6 +44,7 @@ import packets_ipv4_ARP as pkts_arp
 import packets_ipv4_DHCP_firsttime as pkts_dhcp
 import packets_lldp as pkts_lldp
 import packets_ipv4_dns as pkts_dns
+import packets_ipv4_dns_4 as pkts_dns4
 import packets_ipv4_http as pkts
 import packets_ipv4_http2 as pkts2
 
@@ -197,6 +198,59 @@ def test_harvest_DNS():
     assert result_identity['service_name'] == pkts_dns.DNS_CNAME[1]
     assert result_identity['ip_address'] == pkts_dns.DNS_IP[1]
 
+def test_identities_current():
+    """
+    Test that the current identity per id_hash is maintained, with
+    IP addresses of DNS CNAME records resolved
+    """
+    #*** Instantiate flow, policy and identities objects:
+    flow = flows_module.Flow(config)
+    policy = policy_module.Policy(config)
+    identities = identities_module.Identities(config, policy)
+
+    #*** Same ARP reply twice is one current identity:
+    for count in range(2):
+        flow.ingest_packet(DPID1, INPORT1, pkts_arp.RAW[3],
+                                                    datetime.datetime.now())
+        identities.harvest(pkts_arp.RAW[3], flow.packet)
+    assert identities.identities.count() == 2
+    assert identities.identities_current.count() == 1
+
+    #*** DNS answers CNAME then A record for the CNAME:
+    flow.ingest_packet(DPID1, INPORT1, pkts_dns.RAW[1], datetime.datetime.now())
+    identities.harvest(pkts_dns.RAW[1], flow.packet)
+    assert identities.identities_current.count() == 3
+    result = identities.identities_current.find_one({'harvest_type':
+                                                                'DNS_CNAME'})
+    assert result['service_name'] == pkts_dns.DNS_NAME[1]
+    assert result['ip_address'] == pkts_dns.DNS_IP[1]
+
+    #*** New IP address for the CNAME updates the CNAME record:
+    flow.ingest_packet(DPID1, INPORT1, pkts_dns4.RAW[1],
+                                                    datetime.datetime.now())
+    identities.harvest(pkts_dns4.RAW[1], flow.packet)
+    assert identities.identities_current.count() == 3
+    result = identities.identities_current.find_one({'harvest_type':
+                                                                'DNS_CNAME'})
+    assert result['ip_address'] == pkts_dns4.DNS_IP[1]
+
+def test_dbdict():
+    """
+    Test that Identity and DHCPMessage objects have fixed slots and
+    that their database documents do not alias the objects
+    """
+    for record in (identities_module.Identities.Identity(),
+                                identities_module.Identities.DHCPMessage()):
+        assert not hasattr(record, '__dict__')
+        db_dict = record.dbdict()
+        assert sorted(db_dict.keys()) == sorted(record.__slots__)
+        #*** Database driver adds _id to documents on insert:
+        db_dict['_id'] = 1
+        db_dict['dpid'] = 99
+        assert not hasattr(record, '_id')
+        assert record.dpid == 0
+        assert '_id' not in record.dbdict()
+
 def test_indexing():
     """
     Test indexing of identities collection
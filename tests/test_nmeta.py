@@ -0,0 +1,176 @@
+"""
+nmeta nmeta.py Unit Tests
+
+Tests NMeta packet-in handling methods on an NMeta object that has
+not been started as a Ryu application, with only the attributes
+that the methods under test use
+"""
+
+#*** Handle tests being in different directory branch to app code:
+import sys
+
+sys.path.insert(0, '../nmeta')
+
+import logging
+import time
+
+#*** Testing imports:
+import mock
+
+#*** Ryu imports:
+from ryu.base import app_manager  # To suppress cyclic import
+from ryu.ofproto import ofproto_v1_3
+
+#*** nmeta imports:
+import nmeta
+import config
+import flows as flows_module
+import forwarding
+import scheduler as scheduler_module
+
+#*** nmeta test packet imports:
+import packets_ipv4_http as pkts
+
+#*** Instantiate Config class:
+config = config.Config()
+
+logger = logging.getLogger(__name__)
+
+#*** Test Constants:
+MAC1 = '00:00:00:00:00:01'
+MAC2 = '00:00:00:00:00:02'
+
+#======================== nmeta.py Unit Tests ================================
+
+def test_packet_in_queue_full():
+    """
+    Test that a packet-in that can't be queued as its scheduler
+    class queue is full is forwarded, not silently discarded
+    """
+    switch = mock.Mock()
+    app = nmeta_app({1: switch})
+    app.scheduler.max_depth = 0
+    app.packet_in(event(pkts.RAW[0], 1, 1))
+    assert app.scheduler.metrics()['new']['dropped'] == 1
+    assert not app.scheduler_ready.set.called
+    #*** Destination not learnt so flooded, without a queue:
+    switch.packet_out.assert_called_once_with(pkts.RAW[0], 1,
+                        ofproto_v1_3.OFPP_FLOOD, out_queue=0, no_queue=1)
+    #*** Outcome aggregated in memory but not written to database:
+    assert app.telemetry.record.call_count == 1
+    assert not app.pi_time.insert.called
+
+    #*** Switch disconnected, so nothing to forward on:
+    app = nmeta_app({})
+    app.scheduler.max_depth = 0
+    app.packet_in(event(pkts.RAW[0], 1, 1))
+    assert not app.telemetry.record.called
+
+def test_packet_in_queued():
+    """
+    Test that a packet-in is queued when the scheduler has room
+    """
+    switch = mock.Mock()
+    app = nmeta_app({1: switch})
+    app.packet_in(event(pkts.RAW[0], 1, 1))
+    assert app.scheduler.pending() == 1
+    assert app.scheduler_ready.set.called
+    assert not switch.packet_out.called
+
+def test_suppress_path():
+    """
+    Test that a flow is suppressed on the other connected switches
+    on its path, skipping the switch that sent the packet-in and
+    switches where the flow is already suppressed
+    """
+    switch1 = suppress_switch()
+    switch2 = suppress_switch()
+    switch4 = suppress_switch()
+    app = nmeta_app({1: switch1, 2: switch2, 4: switch4})
+    app.flow = flows_module.Flow(config)
+    app.forwarding.mac_to_port = {1: {MAC1: 1, MAC2: 2},
+                                  2: {MAC1: 3, MAC2: 4},
+                                  3: {MAC1: 5, MAC2: 6},
+                                  4: {MAC1: 7, MAC2: 8}}
+    flow_hash = 'suppress_path_1'
+    #*** Already suppressed on switch 4:
+    app.flow.record_suppression(4, 'suppress', result=switch4.result,
+                                                        flow_hash=flow_hash)
+    msg = mock.Mock()
+    eth = mock.Mock(src=MAC1, dst=MAC2)
+    app._suppress_path(msg, eth, 1, flow_hash, 0)
+    #*** Originating switch 1 skipped, switch 3 isn't connected:
+    assert not switch1.flowtables.suppress_flow.called
+    switch2.flowtables.suppress_flow.assert_called_once_with(msg, 3, 4, 0,
+                                                                    None)
+    assert not switch4.flowtables.suppress_flow.called
+    #*** Suppression on switch 2 is recorded:
+    assert not app.flow.not_suppressed(2, 'suppress', flow_hash=flow_hash)
+    assert app.flow.not_suppressed(3, 'suppress', flow_hash=flow_hash)
+
+def test_suppress_path_aggregate():
+    """
+    Test that an aggregate is passed on to path switches unless it
+    matches on the ingress port of the originating switch
+    """
+    switch2 = suppress_switch()
+    app = nmeta_app({2: switch2})
+    app.flow = flows_module.Flow(config)
+    app.forwarding.mac_to_port = {2: {MAC1: 3, MAC2: 4}}
+    msg = mock.Mock()
+    eth = mock.Mock(src=MAC1, dst=MAC2)
+    aggregate = {'forward': {'eth_src': MAC1, 'eth_dst': MAC2}}
+    app._suppress_path(msg, eth, 1, 'suppress_path_2', 0, aggregate)
+    switch2.flowtables.suppress_flow.assert_called_once_with(msg, 3, 4, 0,
+                                                                aggregate)
+    switch2.flowtables.suppress_flow.reset_mock()
+    aggregate = {'forward': {'in_port': 1, 'eth_src': MAC1}}
+    app._suppress_path(msg, eth, 1, 'suppress_path_3', 0, aggregate)
+    switch2.flowtables.suppress_flow.assert_called_once_with(msg, 3, 4, 0,
+                                                                    None)
+
+#================= HELPER FUNCTIONS ===========================================
+
+def nmeta_app(switches):
+    """
+    Return an NMeta object without running its initialisation,
+    with attributes for packet-in handling. Passed a dictionary
+    of connected switches keyed by dpid
+    """
+    app = nmeta.NMeta.__new__(nmeta.NMeta)
+    app.logger = logger
+    app.forwarding = forwarding.Forwarding(config)
+    app.scheduler = scheduler_module.Scheduler(config)
+    app.scheduler_ready = mock.Mock()
+    app.telemetry = mock.Mock()
+    app.pi_time = mock.Mock()
+    #*** Switches returns 0 for a switch that isn't connected:
+    app.switches = mock.MagicMock()
+    app.switches.__getitem__.side_effect = lambda dpid: \
+                                                    switches.get(dpid, 0)
+    return app
+
+def suppress_switch():
+    """
+    Return a mock switch whose flow tables return a suppression
+    result, which is also available as its result attribute
+    """
+    switch = mock.Mock()
+    switch.result = {'match_type': 'single', 'forward_cookie': 1,
+                     'forward_match': {}, 'reverse_cookie': 0,
+                     'reverse_match': {}, 'client_ip': ''}
+    switch.flowtables.suppress_flow.return_value = switch.result
+    return switch
+
+def event(data, dpid, in_port):
+    """
+    Return a mock packet-in event for raw packet data received
+    on a switch port
+    """
+    _event = mock.Mock()
+    _event.timestamp = time.time()
+    _event.msg.data = data
+    _event.msg.datapath.id = dpid
+    _event.msg.datapath.ofproto = ofproto_v1_3
+    _event.msg.match = {'in_port': in_port}
+    return _event
@@ -22,6 +22,7 @@ import identities
 
 #*** nmeta test packet imports:
 import packets_ipv4_http as pkts
+import packets_ipv4_tcp_facebook as pkts_facebook
 
 #*** For timestamps:
 import datetime
@@ -289,6 +290,66 @@ def test_custom_classifiers():
                         pol_filename="main_policy_regression_statistical.yaml")
     assert policy.tc_rules.custom_classifiers == ['statistical_qos_bandwidth_1']
 
+def test_static_verdict():
+    """
+    Check that rules with custom classifiers that static classifiers
+    rule out are not checked, so custom classifiers are not run
+    """
+    policy = policy_module.Policy(config,
+                        pol_dir_default="config/tests/regression",
+                        pol_dir_user="config/tests/foo",
+                        pol_filename="main_policy_regression_early.yaml")
+    flow = flows_module.Flow(config)
+    ident = identities.Identities(config, policy)
+    rules = policy.tc_rules.rules_list
+    assert [tc_rule.custom for tc_rule in rules] == [True, True, True]
+
+    #*** Test Flow 1 Packet 1 (Client TCP SYN):
+    # 10.1.0.1 10.1.0.2 TCP 74 43297 > http [SYN]
+    flow.ingest_packet(DPID1, INPORT1, pkts.RAW[0], datetime.datetime.now())
+    #*** Needs tcp_dst 1234 and custom, so can't match:
+    assert rules[0].static_verdict(flow.packet) is False
+    #*** Could match on custom:
+    assert rules[1].static_verdict(flow.packet) is None
+    #*** 'none' rule where static tcp_dst 80 matches, so can't match:
+    assert rules[2].static_verdict(flow.packet) is False
+
+    #*** Custom classifiers are shed, so would be skipped if run:
+    policy.custom.shed = True
+    for idx, skipped in ((0, False), (2, False), (1, True)):
+        policy.custom.skipped = False
+        assert not rules[idx].check_tc_rule(flow, ident).match
+        assert policy.custom.skipped == skipped
+
+def test_aggregate_fields():
+    """
+    Check the packet fields that the policy outcome for a packet
+    depends on, for aggregating suppression flow entries
+    """
+    policy = policy_module.Policy(config,
+                        pol_dir_default="config/tests/regression",
+                        pol_dir_user="config/tests/foo",
+                        pol_filename="main_policy_regression_aggregate.yaml")
+    flow = flows_module.Flow(config)
+    web_actions = policy.tc_rules.rules_list[1].actions
+
+    #*** Test Flow 1 Packet 1 (Client TCP SYN):
+    # 10.1.0.1 10.1.0.2 TCP 74 43297 > http [SYN]
+    flow.ingest_packet(DPID1, INPORT1, pkts.RAW[0], datetime.datetime.now())
+    #*** Rule 1 must not match (ip_src), rule 2 matches on tcp_dst and in
+    #***  the reverse direction on tcp_src:
+    assert policy.aggregate_fields(flow.packet, web_actions) == \
+                            {'forward': ['ip_src', 'proto', 'tp_dst'],
+                             'reverse': ['ip_src', 'proto', 'tp_src']}
+    #*** Actions that differ from the policy outcome aren't aggregated:
+    assert policy.aggregate_fields(flow.packet, {}) is None
+
+    #*** Reaches the identity rule, so depends on more than packet fields:
+    # 10.0.2.15 179.60.193.36 TCP 41936 > https [SYN]
+    flow.ingest_packet(DPID1, INPORT1, pkts_facebook.RAW[0],
+                                                    datetime.datetime.now())
+    assert policy.aggregate_fields(flow.packet, {}) is None
+
 def test_qos():
     """
     Test the assignment of QoS queues based on a qos_treatment action
@@ -305,6 +366,17 @@ def test_qos():
     assert policy.qos('low_priority') == 3
     assert policy.qos('foo') == 0
 
+    #*** Policy passed as already read, not read from file:
+    policy_text = policy.policy_text.replace('high_priority: 2',
+                                                        'high_priority: 7')
+    assert policy_text != policy.policy_text
+    policy = policy_module.Policy(config,
+                            pol_dir_default="config/tests/regression",
+                            pol_dir_user="config/tests/foo",
+                            pol_filename="main_policy_regression_static.yaml",
+                            policy_text=policy_text)
+    assert policy.qos('high_priority') == 7
+
 def test_portsets_get_port_set():
     """
     Test that get_port_set returns correct port_set name
@@ -0,0 +1,127 @@
+"""
+nmeta policy_batch.py Unit Tests
+
+Differential tests that batch policy evaluation agrees with
+Policy.check_policy
+"""
+
+#*** Handle tests being in different directory branch to app code:
+import sys
+
+sys.path.insert(0, '../nmeta')
+
+import logging
+
+#*** For timestamps:
+import datetime
+
+#*** Ryu imports:
+from ryu.base import app_manager  # To suppress cyclic import
+
+#*** nmeta imports:
+import config
+import flows as flows_module
+import identities as identities_module
+import policy as policy_module
+import policy_batch
+
+#*** nmeta test packet imports:
+import packets_ipv4_ARP as pkts_arp
+import packets_ipv4_DHCP_firsttime as pkts_dhcp
+import packets_ipv4_dns as pkts_dns
+import packets_ipv4_http as pkts
+import packets_ipv4_http2 as pkts2
+import packets_ipv4_tcp_facebook as pkts_fb
+import packets_lldp as pkts_lldp
+
+#*** Instantiate Config class:
+config = config.Config()
+
+logger = logging.getLogger(__name__)
+
+#*** Switch DPIDs and in ports, covering policy locations:
+DPID_PORTS = [(1, 1), (1, 6), (255, 1), (255, 3), (2, 9)]
+
+#*** Regression policies to check batch evaluation against:
+POLICIES = ["main_policy_regression_batch.yaml",
+            "main_policy_regression_static_3.yaml",
+            "main_policy_regression_locations.yaml",
+            "main_policy_regression_identity.yaml"]
+
+#======================== policy_batch.py Unit Tests ========================
+
+def ingest(policy):
+    """
+    Ingest test packets from each DPID/port, harvesting identities,
+    and return identities object and list of flow contexts
+    """
+    flow = flows_module.Flow(config)
+    ident = identities_module.Identities(config, policy)
+    contexts = []
+    for dpid, in_port in DPID_PORTS:
+        for _pkts in (pkts_lldp, pkts_arp, pkts_dhcp, pkts_dns, pkts, pkts2,
+                                                                    pkts_fb):
+            for raw in _pkts.RAW:
+                context = flow.ingest_packet(dpid, in_port, raw,
+                                                    datetime.datetime.now())
+                ident.harvest(raw, context.packet)
+                contexts.append(context)
+    return ident, contexts
+
+def test_columns():
+    """
+    Test building columns from packets
+    """
+    flow = flows_module.Flow(config)
+    context = flow.ingest_packet(1, 2, pkts.RAW[0], datetime.datetime.now())
+    cols = policy_batch.columns([context.packet])
+    assert cols['ip_src'][0] == policy_batch.ip_int(pkts.IP_SRC[0])
+    assert cols['eth_src'][0] == 0x0800272ad6dd
+    assert cols['tp_dst'][0] == pkts.TP_DST[0]
+    #*** Database documents give the same columns:
+    cols_db = policy_batch.columns([context.packet.dbdict()])
+    for name, _ in policy_batch.COLUMNS:
+        assert cols_db[name][0] == cols[name][0]
+    assert policy_batch.ip_int('') == 0
+
+def test_differential():
+    """
+    Test that batch evaluation gives the same classification for
+    each flow as check_policy, for a range of policies
+    """
+    for pol_filename in POLICIES:
+        policy = policy_module.Policy(config,
+                            pol_dir_default="config/tests/regression",
+                            pol_dir_user="config/tests/foo",
+                            pol_filename=pol_filename)
+        ident, contexts = ingest(policy)
+        cols = policy_batch.columns(context.packet for context in contexts)
+        results = [policy.check_policy_batch(cols, ident, contexts),
+                   policy.check_policy_batch(cols, ident)]
+        for row, context in enumerate(contexts):
+            policy.check_policy(context, ident)
+            clasfn = context.classification
+            for result in results:
+                assert result['classified'][row] == clasfn.classified
+                assert result['classification_tag'][row] == \
+                                                    clasfn.classification_tag
+                assert result['actions'][row] == clasfn.actions
+        logger.debug("policy=%s rules matched=%s", pol_filename,
+                                                    set(results[0]['rule']))
+
+def test_batch_rules():
+    """
+    Test that the batch regression policy exercises its rules
+    """
+    policy = policy_module.Policy(config,
+                            pol_dir_default="config/tests/regression",
+                            pol_dir_user="config/tests/foo",
+                            pol_filename="main_policy_regression_batch.yaml")
+    ident, contexts = ingest(policy)
+    cols = policy_batch.columns(context.packet for context in contexts)
+    result = policy.check_policy_batch(cols, ident)
+    assert set(result['rule']) == set([0, 1, 3, 4])
+    #*** Locations column can be passed instead of DPID/port lookup:
+    cols['location'] = ['external'] * len(contexts)
+    result = policy.check_policy_batch(cols, ident)
+    assert 4 not in set(result['rule'])
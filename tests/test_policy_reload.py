@@ -0,0 +1,135 @@
+"""
+nmeta policy_reload.py Unit Tests
+"""
+
+#*** Handle tests being in different directory branch to app code:
+import sys
+
+sys.path.insert(0, '../nmeta')
+
+import logging
+
+#*** For timestamps:
+import datetime
+
+#*** Ryu imports:
+from ryu.base import app_manager  # To suppress cyclic import
+
+#*** nmeta imports:
+import config
+import flows as flows_module
+import identities as identities_module
+import policy as policy_module
+import policy_reload as policy_reload_module
+import nethash
+
+#*** nmeta test packet imports:
+import packets_ipv4_http as pkts
+import packets_ipv4_tcp_facebook as pkts_fb
+
+#*** Instantiate Config class:
+config = config.Config()
+
+logger = logging.getLogger(__name__)
+
+#*** Flow hashes of test flows:
+FLOW_HASH_HTTP = nethash.hash_flow((pkts.IP_SRC[0], pkts.IP_DST[0],
+                                    pkts.TP_SRC[0], pkts.TP_DST[0],
+                                    pkts.PROTO[0]))
+FLOW_HASH_FB = nethash.hash_flow((pkts_fb.IP_SRC[0], pkts_fb.IP_DST[0],
+                                    pkts_fb.TP_SRC[0], pkts_fb.TP_DST[0],
+                                    pkts_fb.PROTO[0]))
+
+#======================== policy_reload.py Unit Tests ========================
+
+def load_policy(pol_filename):
+    """
+    Return a Policy object for a regression test policy file
+    """
+    return policy_module.Policy(config,
+                            pol_dir_default="config/tests/regression",
+                            pol_dir_user="config/tests/foo",
+                            pol_filename=pol_filename)
+
+def classify(policy):
+    """
+    Ingest and classify the first packet of test flows against policy,
+    and return flow, identities and policy_reload objects
+    """
+    flow = flows_module.Flow(config)
+    ident = identities_module.Identities(config, policy)
+    reload = policy_reload_module.PolicyReload(config, flow)
+    for raw in (pkts.RAW[0], pkts_fb.RAW[0]):
+        context = flow.ingest_packet(1, 1, raw, datetime.datetime.now())
+        policy.check_policy(context, ident)
+        context.classification.commit()
+    return flow, ident, reload
+
+def test_load():
+    """
+    Test that a valid policy loads and an invalid one returns None
+    """
+    flow = flows_module.Flow(config)
+    reload = policy_reload_module.PolicyReload(config, flow)
+    new_policy = reload.load(pol_dir_default="config/tests/regression",
+                            pol_dir_user="config/tests/foo",
+                            pol_filename="main_policy_regression_static.yaml")
+    assert new_policy.tc_rules.rules_list
+    assert reload.load(pol_dir_default="config/tests/regression",
+                            pol_dir_user="config/tests/foo",
+                            pol_filename="no_such_policy.yaml") is None
+
+def test_requests():
+    """
+    Test that signal and API requests are coalesced and recorded
+    """
+    flow = flows_module.Flow(config)
+    reload = policy_reload_module.PolicyReload(config, flow)
+    assert not reload.pending()
+    #*** Request by signal:
+    reload.request(1, None)
+    assert reload.pending()
+    #*** Request by API:
+    reload.policy_reloads.insert_one({'status': 'requested',
+                                                        'source': 'api'})
+    request_ids = reload.start()
+    assert len(request_ids) == 2
+    assert not reload.pending()
+    reload.finish(request_ids, 'done', {'flows_changed': 1})
+    records = list(reload.policy_reloads.find())
+    assert set(record['source'] for record in records) == \
+                                                    set(['signal', 'api'])
+    for record in records:
+        assert record['status'] == 'done'
+        assert record['flows_changed'] == 1
+
+def test_diff():
+    """
+    Test that only flows whose classification changes are returned
+    """
+    old_policy = load_policy("main_policy_regression_static.yaml")
+    flow, ident, reload = classify(old_policy)
+    assert set(reload.recent_classifications()) == \
+                                        set([FLOW_HASH_HTTP, FLOW_HASH_FB])
+    #*** Same policy, nothing changes:
+    same_policy = load_policy("main_policy_regression_static.yaml")
+    assert reload.diff(old_policy, same_policy, ident) == ([], {})
+    #*** New policy matches TCP port 80, so only HTTP flow changes:
+    new_policy = load_policy("main_policy_regression_static_3.yaml")
+    assert reload.diff(old_policy, new_policy, ident) == \
+                                                    ([FLOW_HASH_HTTP], {})
+    #*** Invalidated flows are no longer recently classified:
+    flow.invalidate(FLOW_HASH_HTTP)
+    assert set(reload.recent_classifications()) == set([FLOW_HASH_FB])
+
+def test_diff_requeue():
+    """
+    Test that flows whose QoS queue changes are returned with
+    the new queue
+    """
+    old_policy = load_policy("main_policy_regression_static_3.yaml")
+    flow, ident, reload = classify(old_policy)
+    new_policy = load_policy("main_policy_regression_static_3.yaml")
+    new_policy.main_policy['qos_treatment']['constrained_bw'] = 5
+    assert reload.diff(old_policy, new_policy, ident) == \
+                                                ([], {FLOW_HASH_HTTP: 5})
@@ -0,0 +1,223 @@
+"""
+nmeta database query plan regression tests
+
+Runs the hot database queries of the flows, identities and api_external
+modules via their test=1 explain hooks (or the same queries directly, for
+paged WebUI queries) and checks that each uses an index (IXSCAN), doesn't
+need an in-memory sort or a collection scan, and examines no more
+documents than it should, so that missing or mismatched indexes are caught
+
+Note that packets + metadata are imported from local packets_* modules
+"""
+
+#*** Handle tests being in different directory branch to app code:
+import sys
+
+sys.path.insert(0, '../nmeta')
+
+import logging
+
+#*** JSON imports:
+import json
+
+#*** For timestamps:
+import datetime
+
+#*** nmeta imports:
+import config
+import flows as flows_module
+import identities as identities_module
+import api_external
+import telemetry as telemetry_module
+import policy as policy_module
+import nethash
+
+#*** nmeta test packet imports:
+import packets_ipv4_http as pkts
+import packets_ipv4_http2 as pkts2
+import packets_ipv4_ARP_2 as pkts_ARP_2
+import packets_ipv4_DHCP_firsttime as pkts_dhcp
+import packets_ipv4_dns as pkts_dns
+
+#*** Ryu imports:
+from ryu.base import app_manager  # To suppress cyclic import
+from ryu.ofproto import ofproto_v1_3
+from ryu.ofproto import ofproto_protocol
+from ryu.ofproto import ofproto_parser
+
+#*** Instantiate Config class:
+config = config.Config()
+
+logger = logging.getLogger(__name__)
+
+#*** Test DPIDs and in ports:
+DPID1 = 1
+INPORT1 = 1
+INPORT2 = 2
+
+#*** Flow hash of the pkts flow (also in the flow removal test messages):
+FLOW_HASH = nethash.hash_flow(('10.1.0.1', '10.1.0.2', 43297, 80, 6))
+
+#*** Instantiate the ExternalAPI class:
+api = api_external.ExternalAPI(config)
+
+def setup_module():
+    """
+    Populate the database collections with packets, classifications,
+    identities and flow removals from more than one flow, so that
+    queries that don't use an index examine more documents than they
+    should
+    """
+    global flow, ident, telemetry
+    #*** Initial main_policy that matches tcp-80:
+    policy = policy_module.Policy(config,
+                        pol_dir_default="config/tests/regression",
+                        pol_dir_user="config/tests/foo",
+                        pol_filename="main_policy_regression_static_3.yaml")
+    flow = flows_module.Flow(config)
+    ident = identities_module.Identities(config, policy)
+
+    #*** Packets older than the packet-in rate interval:
+    old_time = datetime.datetime.now() - datetime.timedelta(
+                        seconds=api_external.PACKET_IN_RATE_INTERVAL + 1)
+    for raw in pkts_ARP_2.RAW:
+        flow.ingest_packet(DPID1, INPORT1, raw, old_time)
+    #*** Packets of two TCP flows, classifying each packet:
+    for raw in pkts2.RAW + pkts.RAW:
+        flow.ingest_packet(DPID1, INPORT1, raw, datetime.datetime.now())
+        policy.check_policy(flow, ident)
+        flow.classification.commit()
+    #*** Identities from DHCP and DNS:
+    for raw in pkts_dhcp.RAW + pkts_dns.RAW:
+        flow.ingest_packet(DPID1, INPORT2, raw, datetime.datetime.now())
+        ident.harvest(raw, flow.packet)
+    #*** Packet-in processing time stats of intervals before and within
+    #*** PACKET_TIME_PERIOD:
+    telemetry = telemetry_module.Telemetry(config)
+    telemetry.record(0.001, 0.002, False)
+    telemetry.publish(1, 'normal')
+    telemetry.pi_time_stats.update_many({}, {'$set': {'timestamp':
+                                                            old_time}})
+    for _ in range(2):
+        telemetry.record(0.001, 0.002, False)
+        telemetry.publish(1, 'normal')
+    #*** Flow removals of 3 flows from 2 switches:
+    for dpid in (1, 2):
+        datapath = ofproto_protocol.ProtocolDesc(
+                                            version=ofproto_v1_3.OFP_VERSION)
+        datapath.id = dpid
+        for index in range(1, 7):
+            with open('OFPMsgs/OFPFlowRemoved_%s.json' % index, 'r') \
+                                                                as json_file:
+                json_dict = json.loads(json_file.read())
+            flow.record_removal(ofproto_parser.ofp_msg_from_jsondict(datapath,
+                                                                json_dict))
+
+#======================== Query Plan Tests ====================================
+
+def test_flows_queries():
+    """
+    Test query plans of the flows module
+    """
+    #*** Packets in the flow of the current packet (the last of pkts):
+    explain = flow.packet_count(test=1)
+    check_plan(explain, flow.packet_ins.count({'flow_hash':
+                                                flow.packet.flow_hash}))
+    explain = flow.classification.test_query()
+    check_plan(explain, 1)
+
+def test_identities_queries():
+    """
+    Test query plans of the identities module
+    """
+    explain = ident.findbymac(pkts_dhcp.ETH_SRC[2], test=1)
+    check_plan(explain, 1)
+    explain = ident.findbynode('pc1', test=1)
+    check_plan(explain, 1)
+    explain = ident.findbynode('pc1', harvest_type='DHCP', test=1)
+    check_plan(explain, 1)
+    explain = ident.findbyservice(pkts_dns.DNS_NAME[1], test=1)
+    check_plan(explain, 1)
+
+def test_api_external_queries():
+    """
+    Test query plans of the api_external module lookups used to
+    enrich responses
+    """
+    explain = api.get_pi_rate(test=1)
+    check_plan(explain, flow.packet_ins.count() - len(pkts_ARP_2.RAW))
+    explain = api.get_pi_time(test=1)
+    check_plan(explain, 2)
+    explain = api.get_classification(FLOW_HASH, test=1)
+    check_plan(explain, 1)
+    explain = api.get_flow_client_ip(FLOW_HASH, test=1)
+    check_plan(explain, 1)
+    for explain in api.get_flow_data_xfer({'ip_src': '10.1.0.1',
+                                            'flow_hash': FLOW_HASH}, test=1):
+        check_plan(explain, 1)
+    explain = api.get_dns_ip(pkts_dns.DNS_CNAME[1], test=1)
+    check_plan(explain, 1)
+    explain = api.get_host_by_ip('10.1.0.1', test=1)
+    check_plan(explain, ident.identities.count({'ip_address': '10.1.0.1'}))
+    explain = api.get_location_by_mac(pkts_dhcp.ETH_SRC[2], test=1)
+    check_plan(explain, ident.identities.count({'mac_address':
+                                                    pkts_dhcp.ETH_SRC[2]}))
+    explain = api.get_service_by_ip(pkts_dns.DNS_IP[1], test=1)
+    check_plan(explain, 1)
+    explain = api.get_service_by_ip(pkts_dns.DNS_IP[1], test=2)
+    check_plan(explain, 1)
+
+def test_api_external_page_queries():
+    """
+    Test query plans of paged WebUI and top talker queries, which are
+    sorted by the api_external constants that need to match indexes
+    """
+    explain = flow.flow_summary.find({}).sort(api_external.FLOW_SUMMARY_SORT) \
+                                                        .limit(2).explain()
+    check_plan(explain, 2)
+    explain = ident.identities_current.find({}).sort(
+                        api_external.IDENTITIES_CURRENT_SORT).limit(2).explain()
+    check_plan(explain, 2)
+    explain = flow.flow_rems_rollups.find({'stat': 'src_sent',
+                        'period': 'total', 'bucket': None}).sort(
+                        api_external.FLOW_REMS_ROLLUP_SORT).limit(1).explain()
+    check_plan(explain, 1)
+
+def test_api_external_export_queries():
+    """
+    Test query plans of time range exports, which need an index on
+    the time field of each exported collection
+    """
+    start = datetime.datetime.now() - datetime.timedelta(seconds=1)
+    for collection, time_field in api_external.EXPORTS.values():
+        explain = getattr(api, collection).find({time_field:
+                        {'$gte': start}}).sort(time_field, 1).limit(1) \
+                        .explain()
+        check_plan(explain, 1)
+
+#================= HELPER FUNCTIONS ===========================================
+
+def plan_stages(plan):
+    """
+    Passed a query plan and return a list of the names of its stages
+    """
+    stages = [plan['stage']]
+    if 'inputStage' in plan:
+        stages.extend(plan_stages(plan['inputStage']))
+    for input_stage in plan.get('inputStages', []):
+        stages.extend(plan_stages(input_stage))
+    return stages
+
+def check_plan(explain, max_docs):
+    """
+    Passed database query execution statistics and the maximum number
+    of documents that the query should examine. Check that the query
+    ran using an index, without an in-memory sort or collection scan
+    """
+    stages = plan_stages(explain['queryPlanner']['winningPlan'])
+    logger.debug("stages=%s", stages)
+    assert 'IXSCAN' in stages
+    assert 'COLLSCAN' not in stages
+    assert 'SORT' not in stages
+    assert explain['executionStats']['executionSuccess'] == True
+    assert explain['executionStats']['totalDocsExamined'] <= max_docs
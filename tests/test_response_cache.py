@@ -0,0 +1,80 @@
+"""
+nmeta response_cache.py Unit Tests
+"""
+
+#*** Handle tests being in different directory branch to app code:
+import sys
+
+sys.path.insert(0, '../nmeta')
+
+import logging
+
+import time
+
+#*** For concurrent requests:
+import threading
+
+#*** nmeta imports:
+import response_cache
+
+logger = logging.getLogger(__name__)
+
+def test_get():
+    """
+    Test that responses are cached per key until their TTL expires,
+    and that ETags follow the response
+    """
+    cache = response_cache.ResponseCache()
+    calls = []
+    def compute():
+        calls.append(1)
+        return {'pi_rate': len(calls)}
+
+    response, etag = cache.get('pi_rate', 0.2, compute)
+    assert response == {'pi_rate': 1}
+    assert cache.etag('pi_rate') == etag
+    #*** From cache:
+    assert cache.get('pi_rate', 0.2, compute) == (response, etag)
+    assert len(calls) == 1
+    #*** Different key:
+    response2, etag2 = cache.get('pi_time', 0.2, compute)
+    assert response2 == {'pi_rate': 2}
+    assert etag2 != etag
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    #*** Expired:
+    time.sleep(0.3)
+    assert cache.etag('pi_rate') is None
+    response, etag3 = cache.get('pi_rate', 0.2, compute)
+    assert response == {'pi_rate': 3}
+    assert etag3 != etag
+    assert len(calls) == 3
+
+    #*** Same response has same ETag:
+    assert response_cache.make_etag({'a': 1, 'b': [2]}) == \
+                                response_cache.make_etag({'b': [2], 'a': 1})
+
+def test_single_flight():
+    """
+    Test that concurrent requests for the same key share one
+    computation
+    """
+    cache = response_cache.ResponseCache()
+    calls = []
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return {'switches': 1}
+
+    results = []
+    def request():
+        results.append(cache.get('switches_count_col', 5, compute))
+    threads = [threading.Thread(target=request) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert len(results) == 10
+    assert len(set(etag for _, etag in results)) == 1
+    assert results[0][0] == {'switches': 1}
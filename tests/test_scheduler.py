@@ -0,0 +1,97 @@
+"""
+nmeta scheduler.py Unit Tests
+"""
+
+#*** Handle tests being in different directory branch to app code:
+import sys
+
+sys.path.insert(0, '../nmeta')
+
+import logging
+
+#*** Testing imports:
+import mock
+
+#*** Ryu imports:
+from ryu.base import app_manager  # To suppress cyclic import
+
+#*** nmeta imports:
+import config
+import nethash
+import scheduler as scheduler_module
+
+#*** nmeta test packet imports:
+import packets_ipv4_ARP as pkts_arp
+import packets_ipv4_dns as pkts_dns
+import packets_ipv4_http as pkts
+
+#*** Instantiate Config class:
+config = config.Config()
+
+logger = logging.getLogger(__name__)
+
+#======================== scheduler.py Unit Tests ============================
+
+def test_classify():
+    """
+    Test classifying packets into scheduling classes
+    """
+    scheduler = scheduler_module.Scheduler(config)
+    assert scheduler.classify(pkts_arp.RAW[0]) == scheduler_module.CONTROL
+    assert scheduler.classify(pkts_dns.RAW[0]) == scheduler_module.CONTROL
+    assert scheduler.classify(pkts.RAW[0]) == scheduler_module.NEW
+    #*** Once the flow is classified, packets in it (both directions)
+    #***  are known:
+    scheduler.mark_known(nethash.hash_flow((pkts.IP_SRC[0], pkts.IP_DST[0],
+                                pkts.TP_SRC[0], pkts.TP_DST[0], 6)))
+    assert scheduler.classify(pkts.RAW[1]) == scheduler_module.KNOWN
+
+def test_weighted_order():
+    """
+    Test that queues are serviced weighted round robin, skipping
+    empty queues, with per class metrics
+    """
+    scheduler = scheduler_module.Scheduler(config)
+    scheduler.schedule = [scheduler_module.CONTROL, scheduler_module.CONTROL,
+                          scheduler_module.NEW]
+    now = 1000
+    for _ in range(4):
+        scheduler.enqueue(event(pkts.RAW[0]), now)
+    for _ in range(4):
+        scheduler.enqueue(event(pkts_arp.RAW[0]), now)
+    assert scheduler.pending() == 8
+    order = []
+    while scheduler.pending():
+        order.append(scheduler.dequeue(now + 1)[1])
+    assert order == ['control', 'control', 'new', 'control', 'control',
+                     'new', 'new', 'new']
+    assert scheduler.dequeue(now + 1) == 0
+    metrics = scheduler.metrics()
+    assert metrics['control']['depth'] == 0
+    assert metrics['control']['depth_max'] == 4
+    assert metrics['new']['dequeued'] == 4
+    assert metrics['new']['wait_avg'] == 1
+    assert metrics['known']['wait_max'] == 0
+
+def test_max_depth():
+    """
+    Test that events are not queued when a class queue is full
+    """
+    scheduler = scheduler_module.Scheduler(config)
+    scheduler.max_depth = 2
+    assert scheduler.enqueue(event(pkts.RAW[0])) == scheduler_module.NEW
+    assert scheduler.enqueue(event(pkts.RAW[0])) == scheduler_module.NEW
+    assert scheduler.enqueue(event(pkts.RAW[0])) == 0
+    assert scheduler.enqueue(event(pkts_arp.RAW[0])) == \
+                                                    scheduler_module.CONTROL
+    assert scheduler.metrics()['new']['dropped'] == 1
+
+#================= HELPER FUNCTIONS ===========================================
+
+def event(data):
+    """
+    Return a mock packet-in event for raw packet data
+    """
+    _event = mock.Mock()
+    _event.msg.data = data
+    return _event
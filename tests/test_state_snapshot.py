@@ -0,0 +1,80 @@
+"""
+nmeta state_snapshot.py Unit Tests
+"""
+
+#*** Handle tests being in different directory branch to app code:
+import sys
+
+sys.path.insert(0, '../nmeta')
+
+import logging
+
+import os
+import time
+import tempfile
+
+#*** nmeta imports:
+import config
+import state_snapshot as state_snapshot_module
+
+#*** Instantiate Config class:
+config = config.Config()
+
+logger = logging.getLogger(__name__)
+
+#======================== state_snapshot.py Unit Tests =======================
+
+def test_publish_read():
+    """
+    Test that snapshots published are read, decoded once per version
+    """
+    snapshot = state_snapshot_module.StateSnapshot(config)
+    snapshot.filename = tempfile.mktemp()
+    reader = state_snapshot_module.StateSnapshotReader(snapshot.filename, 5,
+                                                                    logger)
+    #*** No file yet:
+    assert reader.read() is None
+
+    assert snapshot.publish({'switches': [{'dpid': 1}]}) == 2
+    state = reader.read()
+    assert state['switches'] == [{'dpid': 1}]
+    assert state['version'] == 2
+    #*** Same version isn't decoded again:
+    assert reader.read() is state
+
+    assert snapshot.publish({'switches': []}) == 4
+    state = reader.read()
+    assert state['switches'] == []
+    assert state['version'] == 4
+
+    #*** Snapshot being written (odd version) isn't read:
+    state_snapshot_module.UINT64.pack_into(snapshot.map,
+                                state_snapshot_module.VERSION_OFFSET, 5)
+    reader.key = None
+    assert reader.read() is None
+    state_snapshot_module.UINT64.pack_into(snapshot.map,
+                                state_snapshot_module.VERSION_OFFSET, 4)
+    assert reader.read()['version'] == 4
+
+    #*** Too big for the file, so file replaced with a bigger one:
+    max_bytes = snapshot.max_bytes
+    assert snapshot.publish({'macs': 'x' * max_bytes}) == 6
+    assert snapshot.max_bytes == max_bytes * 2
+    assert reader.read()['macs'] == 'x' * max_bytes
+    assert snapshot.publish({'switches': []}) == 8
+    assert reader.read()['version'] == 8
+
+    #*** Stale:
+    reader.stale_time = 0
+    time.sleep(0.01)
+    assert reader.read() is None
+    reader.stale_time = 5
+
+    #*** File replaced by a new run of nmeta, re-mapped by reader:
+    snapshot2 = state_snapshot_module.StateSnapshot(config)
+    snapshot2.filename = snapshot.filename
+    assert snapshot2.publish({'switches': [{'dpid': 2}]}) == 2
+    state = reader.read()
+    assert state['switches'] == [{'dpid': 2}]
+    os.remove(snapshot.filename)
+    assert reader.read() is None
@@ -19,6 +19,7 @@ import unittest
 from ryu.base import app_manager  # To suppress cyclic import
 from ryu.controller import controller
 from ryu.controller import handler
+from ryu.ofproto import ofproto_v1_3
 from ryu.ofproto import ofproto_v1_3_parser
 from ryu.ofproto import ofproto_v1_2_parser
 from ryu.ofproto import ofproto_v1_0_parser
@@ -30,13 +31,13 @@ from ryu.app.wsgi import route
 import switches
 import config
 
+#*** nmeta test packet imports:
+import packets_ipv4_http as pkts
+
 #*** Instantiate Config class:
 config = config.Config()
 
 #====================== switch_abstraction.py Unit Tests ======================
-#*** Instantiate class:
-switches = switches.Switches(config)
-
 sock_mock = mock.Mock()
 addr_mock = mock.Mock()
 
@@ -54,6 +55,8 @@ CONTEXT2 = 2
 
 #*** Test Switches and Switch classes that abstract OpenFlow switches:
 def test_switches():
+    #*** Instantiate class:
+    switches_obj = switches.Switches(config)
     with mock.patch('ryu.controller.controller.Datapath.set_state'):
         #*** Set up fake switch datapaths:
         datapath1 = controller.Datapath(sock_mock, addr_mock)
@@ -64,22 +67,85 @@ def test_switches():
         datapath2.address = ('172.16.1.11', 23456)
 
         #*** Should have 0 switches:
-        assert len(switches.switches) == 0
-        assert switches.switches_col.count() == 0
+        assert len(switches_obj.switches) == 0
+        assert switches_obj.switches_col.count() == 0
 
         #*** Add switches
-        assert switches.add(datapath1) == 1
-        assert switches.add(datapath2) == 1
+        assert switches_obj.add(datapath1) == 1
+        assert switches_obj.add(datapath2) == 1
 
         #*** Should have 2 switches:
-        assert len(switches.switches) == 2
-        assert switches.switches_col.count() == 2
+        assert len(switches_obj.switches) == 2
+        assert switches_obj.switches_col.count() == 2
 
         #*** Delete switch
-        assert switches.delete(datapath2) == 1
+        assert switches_obj.delete(datapath2) == 1
 
         #*** Should have 1 switch:
-        assert len(switches.switches) == 1
-        assert switches.switches_col.count() == 1
-
-# TBD
+        assert len(switches_obj.switches) == 1
+        assert switches_obj.switches_col.count() == 1
+
+def test_suppress_aggregate():
+    """
+    Test suppression with aggregated flow entries that match only
+    the fields that policy depends on
+    """
+    with mock.patch('ryu.controller.controller.Datapath.set_state'):
+        datapath = controller.Datapath(sock_mock, addr_mock)
+        datapath.id = 12345
+        datapath.ofproto = ofproto_v1_3
+        datapath.ofproto_parser = ofproto_v1_3_parser
+        datapath.send_msg = mock.Mock()
+        flowtables = switches.FlowTables(config, datapath, 1000)
+        msg = mock.Mock(data=pkts.RAW[0], match={'in_port': 1})
+        aggregate = {'forward': ['proto', 'tp_dst'], 'reverse': None}
+
+        # 10.1.0.1 10.1.0.2 TCP 74 43297 > http [SYN]
+        result = flowtables.suppress_flow(msg, 1, 2, 0, aggregate)
+        assert result['match_type'] == 'aggregate'
+        assert result['forward_match'] == {'eth_type': 0x0800,
+                                            'eth_dst': pkts.ETH_DST[0],
+                                            'ip_proto': 6, 'tcp_dst': 80}
+        #*** Reverse can't be aggregated so is fine-grained:
+        assert result['reverse_match']['ipv4_src'] == '10.1.0.2'
+        assert result['reverse_match']['tcp_dst'] == 43297
+        flow_mods = [call[0][0] for call in datapath.send_msg.call_args_list]
+        priorities = [flow_mod.priority for flow_mod in flow_mods]
+        #*** Harvest exceptions, then aggregated and fine-grained entries:
+        exceptions = len(switches.HARVEST_EXCEPTIONS)
+        assert priorities == [2] * exceptions + [1, 3]
+
+        #*** Same aggregate again keeps its cookie, no more exceptions:
+        datapath.send_msg.reset_mock()
+        result2 = flowtables.suppress_flow(msg, 1, 2, 0, aggregate)
+        assert result2['forward_cookie'] == result['forward_cookie']
+        assert datapath.send_msg.call_count == 2
+
+        #*** Aggregated drop:
+        result = flowtables.drop_flow(msg, {'forward': ['ip_src', 'proto'],
+                                            'reverse': None})
+        assert result['forward_match'] == {'eth_type': 0x0800,
+                                            'eth_dst': pkts.ETH_DST[0],
+                                            'ip_proto': 6,
+                                            'ipv4_src': '10.1.0.1'}
+
+def test_drop_broadcasts():
+    """
+    Test that the drop entry for a noisy source matches both
+    broadcast and multicast destinations
+    """
+    with mock.patch('ryu.controller.controller.Datapath.set_state'):
+        datapath = controller.Datapath(sock_mock, addr_mock)
+        datapath.id = 12345
+        datapath.ofproto = ofproto_v1_3
+        datapath.ofproto_parser = ofproto_v1_3_parser
+        datapath.send_msg = mock.Mock()
+        flowtables = switches.FlowTables(config, datapath, 1000)
+        datapath.send_msg.reset_mock()
+        assert flowtables.drop_broadcasts(MAC123, 30) == 1
+        flow_mod = datapath.send_msg.call_args[0][0]
+        assert flow_mod.match['eth_src'] == MAC123
+        assert flow_mod.match['eth_dst'] == ('01:00:00:00:00:00',
+                                                        '01:00:00:00:00:00')
+        assert flow_mod.hard_timeout == 30
+        assert flow_mod.instructions == []
@@ -149,3 +149,40 @@ def test_statistical_classifier():
     assert classifier_result.classification_tag == "Normal flow"
     assert classifier_result.actions == {'qos_treatment': 'default_priority'}
 
+
+def test_statistical_flowstats_classifier():
+    """
+    Test sample statistical classifier that finalises classification
+    from flow stats counters
+    """
+    #*** Instantiate custom classifiers
+    tc_cust = tc_custom.CustomInspect(config)
+    tc_cust.instantiate_classifiers(['statistical_qos_bandwidth_2'])
+
+    #*** Too few packets in flow stats so far, continue to inspect:
+    classifier_result = policy_module.TCClassifierResult('custom',
+                                                'statistical_qos_bandwidth_2')
+    rates = {'flow_hash': 'abc', 'packet_count': 10, 'byte_count': 15000,
+                                                        'byte_rate': 1500}
+    assert tc_cust.check_custom_flowstats(classifier_result, rates) == 0
+    assert classifier_result.continue_to_inspect == True
+
+    #*** Large packets at high rate is a bandwidth hog:
+    classifier_result = policy_module.TCClassifierResult('custom',
+                                                'statistical_qos_bandwidth_2')
+    rates = {'flow_hash': 'abc', 'packet_count': 2000,
+                            'byte_count': 2800000, 'byte_rate': 280000}
+    assert tc_cust.check_custom_flowstats(classifier_result, rates) == 1
+    assert classifier_result.match == True
+    assert classifier_result.continue_to_inspect == False
+    assert classifier_result.classification_tag == "Bandwidth hog flow"
+    assert classifier_result.actions == {'qos_treatment': 'constrained_bw'}
+
+    #*** Small packets is a normal flow:
+    classifier_result = policy_module.TCClassifierResult('custom',
+                                                'statistical_qos_bandwidth_2')
+    rates = {'flow_hash': 'abc', 'packet_count': 2000,
+                            'byte_count': 200000, 'byte_rate': 20000}
+    assert tc_cust.check_custom_flowstats(classifier_result, rates) == 1
+    assert classifier_result.classification_tag == "Normal flow"
+    assert classifier_result.actions == {'qos_treatment': 'default_priority'}
@@ -0,0 +1,175 @@
+"""
+nmeta telemetry.py Unit Tests
+"""
+
+#*** Handle tests being in different directory branch to app code:
+import sys
+
+sys.path.insert(0, '../nmeta')
+
+import logging
+
+#*** JSON imports:
+import json
+
+#*** nmeta imports:
+import config
+import telemetry as telemetry_module
+import api_external
+
+#*** Instantiate Config class:
+config = config.Config()
+
+logger = logging.getLogger(__name__)
+
+#======================== telemetry.py Unit Tests ============================
+
+def test_publish():
+    """
+    Test aggregation of packet-in telemetry over the last
+    TELEMETRY_PERIOD seconds of intervals
+    """
+    telemetry = telemetry_module.Telemetry(config)
+    intervals = int(telemetry_module.TELEMETRY_PERIOD / telemetry.interval)
+    #*** No packet-ins:
+    result = telemetry.publish(2, 'normal')
+    assert result['seq'] == 1
+    assert result['pi_rate'] == 0
+    assert result['pi_time_records'] == 0
+    assert result['connected_switches'] == 2
+    assert result['admission_mode'] == 'normal'
+
+    #*** Packet-ins in two intervals:
+    telemetry.record(0.01, 0.002, False)
+    telemetry.record(0.03, 0.004, True)
+    telemetry.publish(2, 'normal')
+    telemetry.record(0.02, 0.006, False)
+    telemetry.record(0.02, 0.008, False)
+    result = telemetry.publish(1, 'shed')
+    assert result['seq'] == 3
+    assert result['pi_rate'] == 4.0 / telemetry_module.TELEMETRY_PERIOD
+    assert result['ryu_time_min'] == 0.01
+    assert result['ryu_time_max'] == 0.03
+    assert round(result['ryu_time_avg'], 6) == 0.02
+    assert result['ryu_time_records'] == 4
+    assert result['pi_time_min'] == 0.002
+    assert result['pi_time_max'] == 0.008
+    assert round(result['pi_time_avg'], 6) == 0.005
+    assert result['pi_time_records'] == 4
+    assert result['pi_time_period'] == telemetry_module.TELEMETRY_PERIOD
+    assert result['pi_dedup_ratio'] == 0.25
+    assert result['connected_switches'] == 1
+    assert result['admission_mode'] == 'shed'
+    #*** Percentiles, to within sketch relative accuracy:
+    for key, value in (('pi_time_p50', 0.004), ('pi_time_p99', 0.006),
+                       ('ryu_time_p50', 0.02), ('ryu_time_p95', 0.02)):
+        assert abs(result[key] - value) <= \
+                                value * telemetry_module.SKETCH_ACCURACY
+    #*** Published to database collection:
+    assert telemetry.telemetry.count() == 3
+    assert telemetry.telemetry.find_one({'seq': 3})['pi_time_max'] == 0.008
+    #*** Intervals with packet-ins written to pi_time_stats collection:
+    stats = list(telemetry.pi_time_stats.find())
+    assert [record['records'] for record in stats] == [2, 2]
+    assert stats[1]['pi_min'] == 0.006
+    assert sum(stats[1]['pi_sketch'].values()) == 2
+    assert telemetry_module.aggregate_buckets(stats)['pi_time_max'] == 0.008
+
+    #*** First interval ages out of the period:
+    for _ in range(intervals - 2):
+        telemetry.publish(1, 'normal')
+    result = telemetry.publish(1, 'normal')
+    assert result['pi_time_records'] == 2
+    assert result['pi_time_min'] == 0.006
+    assert result['pi_dedup_ratio'] == 0
+    result = telemetry.publish(1, 'normal')
+    assert result['pi_time_records'] == 0
+    assert result['pi_rate'] == 0
+
+def test_publish_database_error():
+    """
+    Test that telemetry is still published in memory when database
+    writes fail
+    """
+    telemetry = telemetry_module.Telemetry(config)
+    def fail(record):
+        raise telemetry_module.PyMongoError('down')
+    telemetry.telemetry.insert_one = fail
+    telemetry.pi_time_stats.insert_one = fail
+    telemetry.record(0.01, 0.002, False)
+    result = telemetry.publish(1, 'normal')
+    assert result['seq'] == 1
+    assert result['pi_time_records'] == 1
+    assert '_id' not in result
+    assert telemetry.latest is result
+
+def test_sketch():
+    """
+    Test quantiles from quantile sketches are within relative accuracy,
+    including when merged
+    """
+    values = [0.0001 * index for index in range(1, 1001)]
+    sketch1 = {}
+    sketch2 = {}
+    for value in values[:500]:
+        telemetry_module.sketch_add(sketch1, value)
+    for value in values[500:]:
+        telemetry_module.sketch_add(sketch2, value)
+    sketch = {}
+    telemetry_module.sketch_merge(sketch, sketch1)
+    telemetry_module.sketch_merge(sketch, sketch2)
+    assert sum(sketch.values()) == 1000
+    for quantile in (0, 0.5, 0.95, 0.99, 1):
+        actual = values[int(quantile * 999)]
+        estimate = telemetry_module.sketch_quantile(sketch, quantile)
+        assert abs(estimate - actual) <= \
+                                actual * telemetry_module.SKETCH_ACCURACY
+    #*** Zero values:
+    sketch = {}
+    telemetry_module.sketch_add(sketch, 0)
+    telemetry_module.sketch_add(sketch, 0)
+    telemetry_module.sketch_add(sketch, 0.5)
+    assert telemetry_module.sketch_quantile(sketch, 0.5) == 0
+    assert round(telemetry_module.sketch_quantile(sketch, 1), 2) == 0.5
+    assert telemetry_module.sketch_quantile({}, 0.5) == 0
+
+def test_feed():
+    """
+    Test fan out of published telemetry to subscribers
+    """
+    feed = telemetry_module.TelemetryFeed(None, logger)
+    #*** Don't start tailing thread:
+    feed._thread = 1
+    queue1 = feed.subscribe()
+    assert queue1.empty()
+    feed.dispatch({'seq': 1})
+    #*** New subscriber starts with latest record:
+    queue2 = feed.subscribe()
+    assert queue1.get_nowait() == {'seq': 1}
+    assert queue2.get_nowait() == {'seq': 1}
+    #*** Records for all subscribers:
+    feed.dispatch({'seq': 2})
+    assert queue1.get_nowait() == {'seq': 2}
+    assert queue2.get_nowait() == {'seq': 2}
+    #*** Slow subscriber only keeps latest records:
+    for seq in range(3, 3 + telemetry_module.STREAM_QUEUE_DEPTH * 2):
+        feed.dispatch({'seq': seq})
+    assert queue1.qsize() == telemetry_module.STREAM_QUEUE_DEPTH
+    assert queue1.get_nowait() == {'seq': 3 +
+                                        telemetry_module.STREAM_QUEUE_DEPTH}
+    #*** Unsubscribed:
+    feed.unsubscribe(queue2)
+    assert feed.subscribers == set([queue1])
+
+def test_sse_event():
+    """
+    Test formatting of telemetry records as Server-Sent Events
+    """
+    event = api_external.sse_event('telemetry', {'seq': 7, 'pi_rate': 1.5})
+    lines = event.split('\n')
+    assert lines[0] == 'event: telemetry'
+    assert lines[1] == 'id: 7'
+    assert lines[2].startswith('data: ')
+    assert json.loads(lines[2][len('data: '):]) == {'seq': 7, 'pi_rate': 1.5}
+    #*** Blank line ends event:
+    assert lines[3:] == ['', '']
@@ -0,0 +1,128 @@
+"""
+nmeta warmstart.py Unit Tests
+"""
+
+#*** Handle tests being in different directory branch to app code:
+import sys
+
+sys.path.insert(0, '../nmeta')
+
+import logging
+import os
+import tempfile
+
+#*** For timestamps:
+import datetime
+
+#*** Ryu imports:
+from ryu.base import app_manager  # To suppress cyclic import
+
+#*** nmeta imports:
+import config
+import flows as flows_module
+import identities as identities_module
+import forwarding as forwarding_module
+import switches as switches_module
+import policy as policy_module
+import warmstart as warmstart_module
+
+#*** nmeta test packet imports:
+import packets_ipv4_http as pkts
+import packets_ipv4_DHCP_firsttime as pkts_dhcp
+
+#*** Instantiate Config class:
+config = config.Config()
+
+logger = logging.getLogger(__name__)
+
+#======================== warmstart.py Unit Tests ========================
+
+def start():
+    """
+    Return new flow, identities, forwarding and switches objects,
+    as at startup
+    """
+    policy = policy_module.Policy(config)
+    return (flows_module.Flow(config),
+            identities_module.Identities(config, policy),
+            forwarding_module.Forwarding(config),
+            switches_module.Switches(config))
+
+def test_snapshot_restore():
+    """
+    Test that state saved in a snapshot is restored after a restart,
+    and that expired records are not restored
+    """
+    warmstart = warmstart_module.WarmStart(config)
+    warmstart.filename = tempfile.mktemp()
+    #*** No snapshot, cold start:
+    flow, ident, forwarding, switches = start()
+    assert warmstart.restore(flow, ident, forwarding, switches) == {}
+
+    #*** Build up state:
+    for raw in pkts_dhcp.RAW:
+        context = flow.ingest_packet(1, 1, raw, datetime.datetime.now())
+        ident.harvest(raw, context.packet)
+    context = flow.ingest_packet(1, 1, pkts.RAW[0], datetime.datetime.now())
+    flow.reclassify(context.flow_hash, 'Constrained Bandwidth Traffic',
+                                    {'qos_treatment': 'constrained_bw'})
+    forwarding.mac_to_port[1] = {pkts.ETH_SRC[0]: 1, pkts.ETH_DST[0]: 2}
+    switches.cookies[1] = [10, 1010]
+    #*** Suppressions of a classified flow and of an unclassified flow:
+    result = {'match_type': 'single', 'forward_cookie': 1,
+                'forward_match': {}, 'reverse_cookie': 0,
+                'reverse_match': {}, 'client_ip': pkts.IP_SRC[0]}
+    flow.record_suppression(1, 'suppress', result,
+                                            flow_hash=context.flow_hash)
+    flow.record_suppression(1, 'suppress', result, flow_hash='unclassified')
+    identities_count = ident.identities.count()
+    assert identities_count
+    current_count = ident.identities_current.count()
+    pauses = []
+    warmstart_module.SNAPSHOT_BATCH = 1
+    assert warmstart.snapshot(flow, ident, forwarding, switches,
+                                        pause=lambda: pauses.append(1))
+    warmstart_module.SNAPSHOT_BATCH = 500
+    assert len(pauses) > identities_count
+
+    #*** Restart and restore:
+    flow, ident, forwarding, switches = start()
+    counts = warmstart.restore(flow, ident, forwarding, switches)
+    assert counts['identities'] == identities_count
+    assert counts['classifications'] == 1
+    assert counts['flow_mods'] == 1
+    assert ident.identities_current.count() == current_count
+    assert forwarding.mac_to_port == {1: {pkts.ETH_SRC[0]: 1,
+                                            pkts.ETH_DST[0]: 2}}
+    assert switches.cookies == {1: [10, 1010]}
+    context = flow.ingest_packet(1, 1, pkts.RAW[1], datetime.datetime.now())
+    assert context.classification.classified
+    assert context.classification.actions == \
+                                        {'qos_treatment': 'constrained_bw'}
+
+    #*** Classifications that have expired are not restored:
+    flow, ident, forwarding, switches = start()
+    warmstart.classification_time_limit = datetime.timedelta(seconds=0)
+    counts = warmstart.restore(flow, ident, forwarding, switches)
+    assert counts['classifications'] == 0
+    assert counts['flow_mods'] == 0
+    assert counts['identities'] == identities_count
+
+    #*** Suppressions past the hard timeout are not restored:
+    flow, ident, forwarding, switches = start()
+    warmstart.classification_time_limit = datetime.timedelta(seconds=3600)
+    warmstart.hard_timeouts['suppress'] = 1
+    state = warmstart.load()
+    for record in state['flow_mods']:
+        record['timestamp'] -= datetime.timedelta(seconds=2)
+    warmstart.load = lambda: state
+    counts = warmstart.restore(flow, ident, forwarding, switches)
+    assert counts['classifications'] == 1
+    assert counts['flow_mods'] == 0
+    del warmstart.load
+
+    #*** A corrupt snapshot is ignored:
+    with open(warmstart.filename, 'wb') as snapshot_file:
+        snapshot_file.write('not a snapshot')
+    assert warmstart.restore(flow, ident, forwarding, switches) == {}
+    os.remove(warmstart.filename)
@@ -0,0 +1,104 @@
+"""
+nmeta workers.py Unit Tests
+"""
+
+#*** Handle tests being in different directory branch to app code:
+import sys
+
+sys.path.insert(0, '../nmeta')
+
+import logging
+import time
+
+#*** Ryu imports:
+from ryu.base import app_manager  # To suppress cyclic import
+
+#*** nmeta imports:
+import config
+import workers as workers_module
+
+#*** nmeta test packet imports:
+import packets_ipv4_ARP as pkts_arp
+import packets_ipv4_http as pkts
+
+#*** Instantiate Config class:
+config = config.Config()
+
+logger = logging.getLogger(__name__)
+
+#======================== workers.py Unit Tests ============================
+
+def test_flow_key():
+    """
+    Test that packets in both directions of a TCP flow have the same
+    flow key and that non-TCP packets are keyed by source MAC
+    """
+    keys = set(workers_module.flow_key(raw) for raw in pkts.RAW)
+    assert len(keys) == 1
+    assert workers_module.flow_key(pkts_arp.RAW[0]) == pkts_arp.ETH_SRC[0]
+
+def test_shard():
+    """
+    Test that flow keys shard consistently to a worker in range
+    """
+    pool = workers_module.WorkerPool(config)
+    pool.workers = 4
+    key = workers_module.flow_key(pkts.RAW[0])
+    index = pool.shard(key)
+    assert 0 <= index < 4
+    assert pool.shard(key) == index
+    assert set(pool.shard(str(key)) for key in range(100)) == \
+                                                        set([0, 1, 2, 3])
+
+def echo_main(index, pipe):
+    """
+    Worker target that returns requests with the worker index
+    """
+    while True:
+        item = pipe.recv()
+        if item is None:
+            break
+        seq, request = item
+        pipe.send((seq, (index, request)))
+
+def test_submit_results():
+    """
+    Test requests round trip to worker processes, with a flow always
+    going to the same worker and in-flight limit applied by queueing
+    """
+    pool = workers_module.WorkerPool(config)
+    pool.workers = 2
+    pool.max_inflight = 2
+    pool.start(target=echo_main)
+    key = workers_module.flow_key(pkts.RAW[0])
+    ready = []
+    for seq in range(10):
+        pool.submit(seq, key, pkts.RAW[seq % 2])
+        assert max(pool.inflight) <= 2
+    assert pool.pending() == 10
+    while pool.pending():
+        ready.extend(pool.results())
+        assert max(pool.inflight) <= 2
+    pool.stop()
+    assert sorted(seq for seq, result in ready) == range(10)
+    assert set(result[0] for seq, result in ready) == set([pool.shard(key)])
+    assert [result[1] for seq, result in ready] == \
+                                        [pkts.RAW[seq % 2] for seq in range(10)]
+
+def test_process_request_fail_open():
+    """
+    Test that a request that fails to process returns a result with
+    the same keys as a processed request, so it can be forwarded
+    """
+    worker = workers_module.Worker(config)
+    request = (1, 1, pkts.RAW[0], time.time(), False, True)
+    result = workers_module.process_request(worker, 0, request)
+    assert result['flow_hash']
+    def fail(request):
+        raise ValueError('bad packet')
+    worker.process = fail
+    failed = workers_module.process_request(worker, 0, request)
+    assert set(failed) == set(result)
+    assert failed['classified'] == False
+    assert failed['actions'] == {}
+    assert failed['aggregate'] is None